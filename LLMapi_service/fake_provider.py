@@ -0,0 +1,129 @@
+"""
+模拟提供方
+在本地模拟带有每密钥配额的 LLM 服务，用于验证限流器在并发请求下的表现，不发送任何网络请求
+"""
+
+import time
+import random
+import asyncio
+from collections import defaultdict, deque
+from typing import List, Dict, Any
+
+try:
+    from .rate_limiter import ProviderLimiter, estimate_tokens
+except ImportError:
+    from rate_limiter import ProviderLimiter, estimate_tokens
+
+
+class FakeRateLimitError(Exception):
+    """模拟的 429 响应，字段与 aiohttp.ClientResponseError 保持一致"""
+
+    def __init__(self, key: str, retry_after: float):
+        super().__init__(f"429 Too Many Requests (key ...{key[-4:]})")
+        self.status = 429
+        self.headers = {"Retry-After": str(retry_after)}
+
+
+class FakeProvider:
+    """按滑动窗口统计每个密钥的请求数，超出配额时返回 429"""
+
+    def __init__(self, rpm_per_key: int, latency: float = 0.2, window: float = 60.0):
+        """初始化模拟提供方
+
+        Args:
+            rpm_per_key: 每个密钥在窗口内允许的请求数
+            latency: 平均响应延迟（秒）
+            window: 配额统计窗口（秒）
+        """
+        self.rpm_per_key = rpm_per_key
+        self.latency = latency
+        self.window = window
+        self._history = defaultdict(deque)
+        self.stats = {"ok": 0, "rate_limited": 0}
+
+    async def complete(self, key: str, messages: List[Dict]) -> Dict[str, Any]:
+        """模拟一次对话补全请求"""
+        now = time.monotonic()
+        history = self._history[key]
+        while history and now - history[0] > self.window:
+            history.popleft()
+        if len(history) >= self.rpm_per_key:
+            self.stats["rate_limited"] += 1
+            raise FakeRateLimitError(key, retry_after=self.window - (now - history[0]))
+        history.append(now)
+
+        await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        self.stats["ok"] += 1
+        return {
+            "role": "assistant",
+            "content": f"模拟回复: {messages[-1]['content'][:20]}",
+            "usage": {"total_tokens": estimate_tokens(messages) + 50}
+        }
+
+
+async def simulate(
+    num_requests: int = 40,
+    keys: List[str] = None,
+    rpm_per_key: int = 10,
+    window: float = 6.0,
+    use_limiter: bool = True
+) -> Dict[str, Any]:
+    """并发发送请求，比较使用和不使用限流器时的 429 数量
+
+    Args:
+        num_requests: 并发请求数
+        keys: 模拟的 API 密钥
+        rpm_per_key: 每个密钥在窗口内允许的请求数
+        window: 配额窗口（秒），缩短窗口可以加快模拟
+        use_limiter: 是否通过限流器发送请求
+
+    Returns:
+        模拟结果统计
+    """
+    keys = keys or ["fake-key-0001", "fake-key-0002", "fake-key-0003"]
+    provider = FakeProvider(rpm_per_key=rpm_per_key, window=window)
+    # 限流器使用与模拟提供方相同的配额窗口
+    limiter = ProviderLimiter("fake", keys, rpm=rpm_per_key, window=window)
+    failures = 0
+
+    async def one_request(i: int) -> None:
+        nonlocal failures
+        messages = [{"role": "user", "content": f"第 {i} 个请求"}]
+        if not use_limiter:
+            try:
+                await provider.complete(keys[i % len(keys)], messages)
+            except FakeRateLimitError:
+                failures += 1
+            return
+
+        # 429 后重新申请密钥重试，直到成功
+        while True:
+            try:
+                async with limiter.lease(estimate_tokens(messages)) as lease:
+                    response = await provider.complete(lease.key, messages)
+                    lease.record_tokens(response["usage"]["total_tokens"])
+                return
+            except FakeRateLimitError:
+                continue
+
+    start = time.monotonic()
+    await asyncio.gather(*(one_request(i) for i in range(num_requests)))
+    return {
+        "use_limiter": use_limiter,
+        "elapsed": round(time.monotonic() - start, 2),
+        "provider_ok": provider.stats["ok"],
+        "provider_429": provider.stats["rate_limited"],
+        "failed_requests": failures,
+        "limiter": limiter.get_statistics() if use_limiter else None
+    }
+
+
+async def main():
+    print("==================== 不使用限流器 ====================")
+    print(await simulate(use_limiter=False))
+    print("==================== 使用限流器 ====================")
+    print(await simulate(use_limiter=True))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
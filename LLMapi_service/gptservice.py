@@ -1,12 +1,31 @@
-import requests
+import time
+import asyncio
 import json
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Union, AsyncIterator, Callable
+
+import aiohttp
+
+try:
+    from .transport import post_json, get_json, stream_sse, get_proxy, close_sessions
+    from .llm_cache import get_cache, make_cache_key
+    from .rate_limiter import get_rate_limiter, estimate_tokens
+    from .resilience import call_with_resilience, stream_with_resilience, LLMError, LLMRequestError, LLMResponseError
+    from .metrics import metrics
+    from .logger import get_logger, log_payload
+except ImportError:
+    from transport import post_json, get_json, stream_sse, get_proxy, close_sessions
+    from llm_cache import get_cache, make_cache_key
+    from rate_limiter import get_rate_limiter, estimate_tokens
+    from resilience import call_with_resilience, stream_with_resilience, LLMError, LLMRequestError, LLMResponseError
+    from metrics import metrics
+    from logger import get_logger, log_payload
+
+logger = get_logger("llmapi.gptservice")
 
 BaseUrl = 'https://api.bianxie.ai'
 DeepseekBaseUrl = 'https://api.deepseek.com'
 GeminiBaseUrl = 'https://generativelanguage.googleapis.com/v1beta'
 
-ApiLoadCount = 0
 # Import API keys from configuration file
 try:
     from .api_keys import gemini_keys,open_ai_keys,deepseek_api_keys
@@ -40,81 +59,287 @@ def is_deepseek_model(model_name: str) -> bool:
 # 判断是否为 Gemini 模型
 def is_gemini_model(model_name: str) -> bool:
     return model_name.startswith('gemini-')
+# 获取模型所属的提供方，用于区分连接池
+def get_provider(model_name: str) -> str:
+    if is_gemini_model(model_name):
+        return 'gemini'
+    if is_deepseek_model(model_name):
+        return 'deepseek'
+    return 'bianxie'
+
+async def GPT(input, selected_model='gpt-4o-mini', use_cache=True, slot=None):
+    """调用LLM，失败时按容错策略重试、对冲并沿降级链切换模型
 
-async def GPT(input, selected_model='gpt-4o-mini'):
+    Args:
+        slot: 可选，以模型名为参数返回异步上下文管理器的函数（如并发槽位）；每次请求尝试各自进入，
+            重试的退避等待和缓存命中不占用，降级时按实际调用的模型进入
+
+    Raises:
+        LLMError: 所有尝试均失败，调用方需自行处理，错误信息不会再作为回复内容返回
+    """
     # Debug flag
     debug = False
     if debug:
         return {"role": "gpt", "content": "这是测试使用,未连接GPT。 gptservers.py 7"}
 
+    if selected_model not in models:
+        raise LLMRequestError(f"未知的模型: {selected_model}", selected_model)
+    
+    started_at = time.monotonic()
+    # 启用了全局缓存时先查缓存；需要实时结果的调用（如网络搜索）传 use_cache=False
+    cache = get_cache() if use_cache else None
+    cache_key = None
+    if cache is not None:
+        cache_key = make_cache_key(selected_model, input)
+        cached = await cache.aget(cache_key)
+        if cached is not None:
+            metrics.record(selected_model, cache="hit", latency=time.monotonic() - started_at)
+            return cached
+    
+    # 由各提供方函数填入实际使用的密钥和令牌用量
+    call_info = {}
     try:
-        if selected_model not in models:
-            raise ValueError(f"未知的模型: {selected_model}")
+        response = await call_with_resilience(lambda model: _call_provider(input, model, call_info), selected_model, slot)
+    except LLMError as error:
+        logger.warning(f"Error: {error}")
+        _record_call(selected_model, None, input, "", call_info, started_at, cache, type(error).__name__)
+        raise
+    _record_call(selected_model, response.get("model"), input, response.get("content"), call_info, started_at, cache)
+    
+    # 降级模型的结果不写入主模型的缓存
+    if cache is not None and response.get("model") == selected_model:
+        await cache.aset(cache_key, selected_model, response)
+    return response
+
+def _record_call(model, served_model, input, content, call_info, started_at, cache, status="ok", stream=False):
+    """把一次调用登记到指标中，响应没有令牌用量时按字符数估算"""
+    estimated = "prompt_tokens" not in call_info
+    metrics.record(
+        model,
+        served_model=served_model,
+        provider=call_info.get("provider"),
+        key_index=call_info.get("key_index"),
+        prompt_tokens=call_info.get("prompt_tokens", estimate_tokens(input) if status == "ok" else 0),
+        completion_tokens=call_info.get(
+            "completion_tokens", estimate_tokens([{"content": content}]) if content else 0
+        ),
+        latency=time.monotonic() - started_at,
+        cache="bypass" if cache is None else "miss",
+        status=status,
+        stream=stream,
+        estimated=estimated and status == "ok"
+    )
+
+def _note_response(provider, lease, resp_data, call_info=None):
+    """读取响应中的令牌用量：修正限流器的 TPM 统计，并记录到 call_info 供调用指标使用；开启正文日志时记录响应"""
+    log_payload(logger, f"{provider} 响应", resp_data)
+    lease.record_tokens(_total_tokens(resp_data))
+    if call_info is None:
+        return
+    call_info["provider"] = provider
+    call_info["key_index"] = lease.state.index
+    usage = resp_data.get("usage") or {}
+    usage_metadata = resp_data.get("usageMetadata") or {}
+    if usage.get("prompt_tokens") is not None:
+        call_info["prompt_tokens"] = usage["prompt_tokens"]
+        call_info["completion_tokens"] = usage.get("completion_tokens") or 0
+    elif usage_metadata.get("promptTokenCount") is not None:
+        call_info["prompt_tokens"] = usage_metadata["promptTokenCount"]
+        # 思考模型的推理令牌同样按输出计费
+        call_info["completion_tokens"] = (
+            (usage_metadata.get("candidatesTokenCount") or 0) + (usage_metadata.get("thoughtsTokenCount") or 0)
+        )
+
+async def _call_provider(input, selected_model, call_info=None):
+    """针对不同模型源使用不同的处理逻辑"""
+    if is_gemini_model(selected_model):
+        return await call_gemini_api(input, selected_model, call_info)
+    elif is_deepseek_model(selected_model):
+        return await call_deepseek_api(input, selected_model, call_info)
+    else:
+        return await call_bianxie_api(input, selected_model, call_info)
+
+async def GPT_stream(input, selected_model='gpt-4o-mini', use_cache=True, slot=None) -> AsyncIterator[Dict]:
+    """流式调用LLM，逐步产出增量
+
+    Args:
+        slot: 可选，同 GPT()，每次请求尝试在流式输出结束前一直占用
+
+    Yields:
+        {"content": 正文增量, "reasoning_content": 推理过程增量, "model": 实际使用的模型}
+
+    Raises:
+        LLMError: 所有尝试均失败，或输出中途出错
+    """
+    if selected_model not in models:
+        raise LLMRequestError(f"未知的模型: {selected_model}", selected_model)
+    
+    started_at = time.monotonic()
+    # 缓存命中时一次性输出完整内容
+    cache = get_cache() if use_cache else None
+    cache_key = None
+    if cache is not None:
+        cache_key = make_cache_key(selected_model, input)
+        cached = await cache.aget(cache_key)
+        if cached is not None:
+            metrics.record(selected_model, cache="hit", latency=time.monotonic() - started_at, stream=True)
+            yield {"content": cached.get("content", ""), "reasoning_content": "", "model": selected_model}
+            return
+    
+    content = ""
+    served_model = selected_model
+    call_info = {}
+    try:
+        async for delta in stream_with_resilience(lambda model: _stream_provider(input, model, call_info), selected_model, slot):
+            content += delta["content"]
+            served_model = delta["model"]
+            yield delta
+    except LLMError as error:
+        _record_call(selected_model, None, input, content, call_info, started_at, cache, type(error).__name__, stream=True)
+        raise
+    _record_call(selected_model, served_model, input, content, call_info, started_at, cache, stream=True)
+    
+    # 降级模型的结果不写入主模型的缓存
+    if cache is not None and content and served_model == selected_model:
+        await cache.aset(cache_key, selected_model, {"role": "assistant", "content": content})
+
+async def collect_stream(stream: AsyncIterator[Dict], on_delta: Callable[[Dict, str], None] = None) -> Dict:
+    """消费流式增量并拼接为与 GPT() 相同格式的完整回复
+
+    Args:
+        stream: GPT_stream 返回的增量迭代器
+        on_delta: 每收到一个增量时的回调，参数为增量和目前为止的正文
+
+    Returns:
+        完整回复
+    """
+    content = ""
+    reasoning_content = ""
+    model = None
+    async for delta in stream:
+        content += delta["content"]
+        reasoning_content += delta["reasoning_content"]
+        model = delta.get("model", model)
+        if on_delta:
+            on_delta(delta, content)
+    response = {"role": "assistant", "content": content, "model": model}
+    if reasoning_content:
+        response["reasoning_content"] = reasoning_content
+    return response
+
+def _stream_provider(input, selected_model, call_info=None) -> AsyncIterator[Dict]:
+    """针对不同模型源选择流式接口"""
+    if is_gemini_model(selected_model):
+        return stream_gemini_api(input, selected_model, call_info)
+    elif is_deepseek_model(selected_model):
+        return _stream_openai_compatible(
+            'deepseek', f"{DeepseekBaseUrl}/v1/chat/completions", deepseek_api_keys, input, selected_model, call_info
+        )
+    else:
+        return _stream_openai_compatible(
+            'bianxie', f"{BaseUrl}/v1/chat/completions", open_ai_keys, input, models[selected_model], call_info
+        )
+
+async def _stream_openai_compatible(provider, url, keys, input, model_id, call_info=None) -> AsyncIterator[Dict]:
+    """调用 OpenAI 兼容接口（原有API、Deepseek）的流式响应"""
+    data = {
+        "model": model_id,
+        "messages": input,
+        "stream": True,
+        # 让最后一个事件带上令牌用量
+        "stream_options": {"include_usage": True}
+    }
+    
+    async with get_rate_limiter(provider, keys).lease(estimate_tokens(input)) as lease:
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {lease.key}'
+        }
+        proxy = await get_proxy()
         
-        # 针对不同模型源使用不同的处理逻辑
-        if is_gemini_model(selected_model):
-            return await call_gemini_api(input, selected_model)
-        elif is_deepseek_model(selected_model):
-            return await call_deepseek_api(input, selected_model)
-        else:
-            return await call_bianxie_api(input, selected_model)
-            
-    except Exception as error:
-        print(f"Error: {error}")
-        return {"role": "assistant", "content": f"请求失败: {str(error)}"}
+        async for chunk in stream_sse(provider, url, data, headers=headers, proxy=proxy):
+            lease.record_first_chunk()
+            # 最后一个事件带有令牌用量
+            _note_response(provider, lease, chunk, call_info)
+            choices = chunk.get("choices") or []
+            if not choices:
+                continue
+            delta = choices[0].get("delta") or {}
+            if delta.get("content") or delta.get("reasoning_content"):
+                yield {
+                    "content": delta.get("content") or "",
+                    "reasoning_content": delta.get("reasoning_content") or ""
+                }
+
+async def stream_gemini_api(input, selected_model, call_info=None) -> AsyncIterator[Dict]:
+    """调用 Gemini 自身接口的流式响应"""
+    data = _build_gemini_request(input)
+    headers = {
+        'Content-Type': 'application/json'
+    }
+    
+    async with get_rate_limiter('gemini', gemini_keys).lease(estimate_tokens(input)) as lease:
+        proxy = await get_proxy()
+        
+        async for chunk in stream_sse(
+            'gemini',
+            f"{GeminiBaseUrl}/models/{selected_model}:streamGenerateContent?alt=sse&key={lease.key}",
+            data,
+            headers=headers,
+            proxy=proxy
+        ):
+            lease.record_first_chunk()
+            # 每个事件都带有截至目前的累计用量
+            _note_response('gemini', lease, chunk, call_info)
+            for candidate in chunk.get("candidates", [])[:1]:
+                for part in candidate.get("content", {}).get("parts", []):
+                    if not part.get("text"):
+                        continue
+                    # 思考过程的片段带有 thought 标记
+                    if part.get("thought"):
+                        yield {"content": "", "reasoning_content": part["text"]}
+                    else:
+                        yield {"content": part["text"], "reasoning_content": ""}
 
-async def call_bianxie_api(input, selected_model):
-    global ApiLoadCount
-    ApiLoadCount = ApiLoadCount + 1
-    open_ai_key = open_ai_keys[ApiLoadCount % len(open_ai_keys)]
+def _total_tokens(resp_data: Dict) -> Optional[int]:
+    """从响应中读取实际令牌用量（OpenAI 兼容格式或 Gemini 格式）"""
+    usage = resp_data.get("usage") or {}
+    if usage.get("total_tokens"):
+        return usage["total_tokens"]
+    return (resp_data.get("usageMetadata") or {}).get("totalTokenCount")
 
+async def call_bianxie_api(input, selected_model, call_info=None):
     """调用原有API"""
     data = {
         "model": models[selected_model],
         "messages": input
     }
 
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {open_ai_key}'
-    }
-    
-    # 设置代理为可选
-    proxies = None
-    try:
-        # 测试代理是否可用
-        test_response = requests.get(
-            "http://127.0.0.1:33210",
-            timeout=1
-        )
-        # 如果代理可用，则使用代理
-        proxies = {
-            "http": "http://127.0.0.1:33210",
-            "https": "http://127.0.0.1:33210"
+    # 选择剩余配额最多的密钥
+    async with get_rate_limiter('bianxie', open_ai_keys).lease(estimate_tokens(input)) as lease:
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {lease.key}'
         }
-    except:
-        print("代理不可用，使用直接连接")
+        
+        # 设置代理为可选，检测结果由传输层缓存
+        proxy = await get_proxy()
 
-    try:
-        response = requests.post(
-            f"{BaseUrl}/v1/chat/completions",
-            json=data,
-            headers=headers,
-            proxies=proxies,
-            timeout=60
-        )
-        response.raise_for_status()  # Raise HTTPError for bad responses
-        print("response:", response)
-        print("response.json:", response.json())
-        return response.json().get("choices", [{}])[0].get("message")
-    except requests.RequestException as error:
-        print(f"Request failed: {error}")
-        raise
+        try:
+            resp_data = await post_json(
+                'bianxie',
+                f"{BaseUrl}/v1/chat/completions",
+                data,
+                headers=headers,
+                proxy=proxy
+            )
+            _note_response('bianxie', lease, resp_data, call_info)
+            return resp_data.get("choices", [{}])[0].get("message")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            logger.warning(f"Request failed: {error}")
+            raise
 
-async def call_deepseek_api(input, selected_model):
-    global ApiLoadCount
-    ApiLoadCount = ApiLoadCount + 1
-    deepseek_api_key = deepseek_api_keys[ApiLoadCount % len(deepseek_api_keys)]
+async def call_deepseek_api(input, selected_model, call_info=None):
     """调用Deepseek API"""
     data = {
         "model": selected_model,
@@ -122,100 +347,58 @@ async def call_deepseek_api(input, selected_model):
         "stream": False  # 单轮对话不使用流式响应
     }
     
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {deepseek_api_key}'
-    }
-    
-    # 设置代理为可选
-    proxies = None
-    try:
-        # 测试代理是否可用
-        test_response = requests.get(
-            "http://127.0.0.1:33210",
-            timeout=1
-        )
-        # 如果代理可用，则使用代理
-        proxies = {
-            "http": "http://127.0.0.1:33210",
-            "https": "http://127.0.0.1:33210"
+    # 选择剩余配额最多的密钥
+    async with get_rate_limiter('deepseek', deepseek_api_keys).lease(estimate_tokens(input)) as lease:
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {lease.key}'
         }
-    except:
-        print("代理不可用，使用直接连接")
-
-    try:
-        response = requests.post(
-            f"{DeepseekBaseUrl}/v1/chat/completions",
-            json=data,
-            headers=headers,
-            proxies=proxies,
-            timeout=60
-        )
-        response.raise_for_status()
-        
-        print("Deepseek response:", response)
-        print("Deepseek response.json:", response.json())
         
-        # 提取响应内容并转换为与原API相同的格式
-        resp_data = response.json()
-        return {
-            "role": resp_data.get("choices", [{}])[0].get("message", {}).get("role", "assistant"),
-            "content": resp_data.get("choices", [{}])[0].get("message", {}).get("content", "")
-        }
-    except requests.RequestException as error:
-        print(f"Deepseek request failed: {error}")
-        raise
+        # 设置代理为可选，检测结果由传输层缓存
+        proxy = await get_proxy()
+
+        try:
+            resp_data = await post_json(
+                'deepseek',
+                f"{DeepseekBaseUrl}/v1/chat/completions",
+                data,
+                headers=headers,
+                proxy=proxy
+            )
+            _note_response('deepseek', lease, resp_data, call_info)
+            
+            # 提取响应内容并转换为与原API相同的格式
+            return {
+                "role": resp_data.get("choices", [{}])[0].get("message", {}).get("role", "assistant"),
+                "content": resp_data.get("choices", [{}])[0].get("message", {}).get("content", "")
+            }
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            logger.warning(f"Deepseek request failed: {error}")
+            raise
 
 
 async def gemini_mode_list():
-    global ApiLoadCount
-    ApiLoadCount = ApiLoadCount + 1
-    gemini_api_key = gemini_keys[ApiLoadCount % len(gemini_keys)]
-    
-    headers = {
-        'Authorization': f'Bearer {gemini_api_key}'
-    }
-    
-    # 设置代理为可选
-    proxies = None
-    try:
-        # 测试代理是否可用
-        test_response = requests.get(
-            "http://127.0.0.1:33210",
-            timeout=1
-        )
-        # 如果代理可用，则使用代理
-        proxies = {
-            "http": "http://127.0.0.1:33210",
-            "https": "http://127.0.0.1:33210"
-        }
-    except:
-        print("代理不可用，使用直接连接")
+    async with get_rate_limiter('gemini', gemini_keys).lease() as lease:
+        gemini_api_key = lease.key
+        
+        # 设置代理为可选，检测结果由传输层缓存；Gemini 接口的密钥在查询参数中传递
+        proxy = await get_proxy()
 
-    try:
-        response = requests.get(
-            f"{GeminiBaseUrl}/models?key={gemini_api_key}",
-            #headers=headers,
-            #proxies=proxies,
-            timeout=60
-        )
-        response.raise_for_status()        
-        print("Gemini response:", response)
-        models = json.loads(response.content)
-        print(models)
+        try:
+            models = await get_json(
+                'gemini',
+                f"{GeminiBaseUrl}/models?key={gemini_api_key}",
+                proxy=proxy
+            )
+            logger.info(models)
 
-    except requests.RequestException as error:
-        print(f"Gemini request failed: {error}")
-        raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            logger.warning(f"Gemini request failed: {error}")
+            raise
 
 
 #使用 兼容OpenAI 接口
-async def call_gemini_api2(input, selected_model):
-    global ApiLoadCount
-    ApiLoadCount = ApiLoadCount + 1
-    # 这里应填入 Gemini 的API密钥   
-    gemini_api_key = gemini_keys[ApiLoadCount % len(gemini_keys)]
-    
+async def call_gemini_api2(input, selected_model, call_info=None):
     """调用Gemini API"""
     data = {
         "model": selected_model,
@@ -223,57 +406,84 @@ async def call_gemini_api2(input, selected_model):
         "stream": False  # 单轮对话不使用流式响应
     }
     
-     
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {gemini_api_key}'
-    }
-    
-    # 设置代理为可选
-    proxies = None
-    try:
-        # 测试代理是否可用
-        test_response = requests.get(
-            "http://127.0.0.1:33210",
-            timeout=1
-        )
-        # 如果代理可用，则使用代理
-        proxies = {
-            "http": "http://127.0.0.1:33210",
-            "https": "http://127.0.0.1:33210"
+    # 选择剩余配额最多的 Gemini 密钥
+    async with get_rate_limiter('gemini', gemini_keys).lease(estimate_tokens(input)) as lease:
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {lease.key}'
         }
-    except:
-        print("代理不可用，使用直接连接")
-
-    try:
-        response = requests.post(
-            f"{GeminiBaseUrl}/openai/chat/completions",
-            json=data,
-            headers=headers,
-            proxies=proxies,
-            timeout=60
-        )
-        response.raise_for_status()
         
-        print("Gemini response:", response)
-        print("Gemini response.json:", response.json())
-        
-        # 提取响应内容并转换为与原API相同的格式
-        resp_data = response.json()
-        return {
-            "role": resp_data.get("choices", [{}])[0].get("message", {}).get("role", "assistant"),
-            "content": resp_data.get("choices", [{}])[0].get("message", {}).get("content", "")
-        }
-    except requests.RequestException as error:
-        print(f"Gemini request failed: {error}")
-        raise
+        # 设置代理为可选，检测结果由传输层缓存
+        proxy = await get_proxy()
+
+        try:
+            resp_data = await post_json(
+                'gemini',
+                f"{GeminiBaseUrl}/openai/chat/completions",
+                data,
+                headers=headers,
+                proxy=proxy
+            )
+            _note_response('gemini', lease, resp_data, call_info)
+            
+            # 提取响应内容并转换为与原API相同的格式
+            return {
+                "role": resp_data.get("choices", [{}])[0].get("message", {}).get("role", "assistant"),
+                "content": resp_data.get("choices", [{}])[0].get("message", {}).get("content", "")
+            }
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            logger.warning(f"Gemini request failed: {error}")
+            raise
 
 #使用 Gemini 自身接口
-async def call_gemini_api(input, selected_model):
-    global ApiLoadCount
-    ApiLoadCount = ApiLoadCount + 1
+async def call_gemini_api(input, selected_model, call_info=None):
     """调用Gemini API"""
+    data = _build_gemini_request(input)
+    
+    headers = {
+        'Content-Type': 'application/json'
+    }
     
+    # 选择剩余配额最多的 Gemini 密钥
+    async with get_rate_limiter('gemini', gemini_keys).lease(estimate_tokens(input)) as lease:
+        gemini_api_key = lease.key
+        
+        # 设置代理为可选，检测结果由传输层缓存
+        proxy = await get_proxy()
+
+        try:
+            resp_data = await post_json(
+                'gemini',
+                f"{GeminiBaseUrl}/models/{selected_model}:generateContent?key={gemini_api_key}",
+                data,
+                headers=headers,
+                proxy=proxy
+            )
+            _note_response('gemini', lease, resp_data, call_info)
+            
+            # Extract response content from Gemini API format 输出转换成 OpenAI 格式
+            if "candidates" in resp_data and len(resp_data["candidates"]) > 0:
+                candidate = resp_data["candidates"][0]
+                if "content" in candidate and "parts" in candidate["content"]:
+                    parts = candidate["content"]["parts"]
+                    text=''
+                    if len(parts) > 0 :
+                        for part in parts:
+                            if "text" in part:
+                                text = text + part["text"]
+                        return {
+                            "role": "assistant",
+                            "content": text
+                        }
+            
+            # Fallback if the structure is not as expected
+            raise LLMResponseError("Unable to parse Gemini response properly.", selected_model)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            logger.warning(f"Gemini request failed: {error}")
+            raise
+
+def _build_gemini_request(input) -> Dict:
+    """把 OpenAI 格式的消息转换成 Gemini 请求体"""
     # Convert OpenAI format to Gemini format 把输入转换成 Gemini 格式
     gemini_contents = []
     needSearch = False
@@ -298,64 +508,4 @@ async def call_gemini_api(input, selected_model):
             }
         ]
     
-    # 这里应填入 Gemini 的API密钥   
-    gemini_api_key = gemini_keys[ApiLoadCount % len(gemini_keys)]
-    
-    headers = {
-        'Content-Type': 'application/json'
-    }
-    
-    # 设置代理为可选
-    proxies = None
-    try:
-        # 测试代理是否可用
-        test_response = requests.get(
-            "http://127.0.0.1:33210",
-            timeout=1
-        )
-        # 如果代理可用，则使用代理
-        proxies = {
-            "http": "http://127.0.0.1:33210",
-            "https": "http://127.0.0.1:33210"
-        }
-    except:
-        print("代理不可用，使用直接连接")
-
-    try:
-        response = requests.post(
-            f"https://generativelanguage.googleapis.com/v1beta/models/{selected_model}:generateContent?key={gemini_api_key}",
-            json=data,
-            headers=headers,
-            proxies=proxies,
-            timeout=60
-        )
-        response.raise_for_status()
-        
-        print("Gemini response:", response)
-        print("Gemini response.json:", response.json())
-        
-        # Extract response content from Gemini API format 输出转换成 OpenAI 格式
-        resp_data = response.json()
-        if "candidates" in resp_data and len(resp_data["candidates"]) > 0:
-            candidate = resp_data["candidates"][0]
-            if "content" in candidate and "parts" in candidate["content"]:
-                parts = candidate["content"]["parts"]
-                text=''
-                if len(parts) > 0 :
-                    for part in parts:
-                        if "text" in part:
-                            text = text + part["text"]
-                    return {
-                        "role": "assistant",
-                        "content": text
-                    }
-        
-        # Fallback if the structure is not as expected
-        return {
-            "role": "assistant",
-            "content": "Unable to parse Gemini response properly."
-        }
-    except requests.RequestException as error:
-        print(f"Gemini request failed: {error}")
-        raise
-
+    return data
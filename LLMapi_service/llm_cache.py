@@ -0,0 +1,278 @@
+"""
+LLM 响应缓存
+以 (模型, 消息, 参数) 的哈希为键，提供内存 LRU 和 SQLite 磁盘两级缓存
+"""
+
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Iterator
+
+try:
+    from .logger import get_logger
+except ImportError:
+    from logger import get_logger
+
+logger = get_logger("llmapi.cache")
+
+# 内存缓存的默认最大条目数
+DEFAULT_MEMORY_ENTRIES = 512
+# 磁盘缓存的默认最大容量（字节）
+DEFAULT_MAX_DISK_BYTES = 256 * 1024 * 1024
+# 缓存条目的默认有效期（秒），None 表示永不过期
+DEFAULT_TTL = 7 * 24 * 3600
+
+
+def make_cache_key(model: str, messages: List[Dict], params: Dict = None) -> str:
+    """根据模型、消息和参数生成缓存键
+
+    Args:
+        model: 模型名称
+        messages: 消息列表
+        params: 其他影响输出的请求参数
+
+    Returns:
+        缓存键（SHA-256 十六进制字符串）
+    """
+    payload = json.dumps(
+        {"model": model, "messages": messages, "params": params or {}},
+        ensure_ascii=False,
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """两级 LLM 响应缓存：内存 LRU + SQLite 磁盘"""
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        max_memory_entries: int = DEFAULT_MEMORY_ENTRIES,
+        max_disk_bytes: int = DEFAULT_MAX_DISK_BYTES,
+        ttl: Optional[float] = DEFAULT_TTL
+    ):
+        """初始化缓存
+
+        Args:
+            db_path: SQLite 数据库路径，为 None 时只使用内存缓存
+            max_memory_entries: 内存缓存的最大条目数
+            max_disk_bytes: 磁盘缓存的最大容量（字节）
+            ttl: 条目有效期（秒），为 None 时永不过期
+        """
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        # web_app 在多个线程中运行研究任务，内存缓存和统计需要加锁
+        self._lock = threading.Lock()
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0
+        }
+
+        if self.db_path:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._connect() as conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS llm_cache (
+                        key TEXT PRIMARY KEY,
+                        model TEXT,
+                        response TEXT,
+                        size INTEGER,
+                        created_at REAL,
+                        accessed_at REAL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """为当前线程打开数据库连接，事务结束时提交（出错时回滚）并关闭连接"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            # sqlite3 连接自身的上下文管理器只提交或回滚，不会关闭连接
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _is_expired(self, created_at: float) -> bool:
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def _count(self, stat: str, amount: int = 1) -> None:
+        with self._lock:
+            self.stats[stat] += amount
+
+    def get(self, key: str) -> Optional[Dict]:
+        """读取缓存
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            缓存的响应，不存在或已过期时返回None
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                response, created_at = entry
+                if not self._is_expired(created_at):
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return dict(response)
+                del self._memory[key]
+
+        if self.db_path:
+            response = self._disk_get(key)
+            if response is not None:
+                self._count("disk_hits")
+                return dict(response)
+
+        self._count("misses")
+        return None
+
+    def set(self, key: str, model: str, response: Dict) -> None:
+        """写入缓存
+
+        Args:
+            key: 缓存键
+            model: 模型名称
+            response: 响应内容
+        """
+        now = time.time()
+        self._memory_set(key, dict(response), now)
+        if self.db_path:
+            self._disk_set(key, model, response, now)
+        self._count("stores")
+
+    async def aget(self, key: str) -> Optional[Dict]:
+        """异步读取缓存，磁盘读取在线程池中执行"""
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, model: str, response: Dict) -> None:
+        """异步写入缓存，磁盘写入在线程池中执行"""
+        await asyncio.to_thread(self.set, key, model, response)
+
+    def _memory_set(self, key: str, response: Dict, created_at: float) -> None:
+        with self._lock:
+            self._memory[key] = (response, created_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def _disk_get(self, key: str) -> Optional[Dict]:
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                response_text, created_at = row
+                if self._is_expired(created_at):
+                    conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    return None
+                conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            response = json.loads(response_text)
+            # 提升到内存缓存
+            self._memory_set(key, response, created_at)
+            return response
+        except (sqlite3.Error, json.JSONDecodeError) as e:
+            logger.warning(f"读取LLM磁盘缓存出错: {e}")
+            return None
+
+    def _disk_set(self, key: str, model: str, response: Dict, now: float) -> None:
+        response_text = json.dumps(response, ensure_ascii=False)
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, model, response, size, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, model, response_text, len(response_text.encode('utf-8')), now, now)
+                )
+                self._evict_disk(conn)
+        except sqlite3.Error as e:
+            logger.warning(f"写入LLM磁盘缓存出错: {e}")
+
+    def _evict_disk(self, conn: sqlite3.Connection) -> None:
+        """淘汰过期条目，并按最近访问时间淘汰超出容量的条目"""
+        evicted = 0
+        if self.ttl is not None:
+            evicted += conn.execute(
+                "DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,)
+            ).rowcount
+
+        total_size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total_size > self.max_disk_bytes:
+            rows = conn.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at ASC").fetchall()
+            stale_keys = []
+            for key, size in rows:
+                if total_size <= self.max_disk_bytes:
+                    break
+                stale_keys.append((key,))
+                total_size -= size
+            conn.executemany("DELETE FROM llm_cache WHERE key = ?", stale_keys)
+            evicted += len(stale_keys)
+
+        if evicted:
+            self._count("evictions", evicted)
+
+    def clear(self) -> None:
+        """清空内存和磁盘缓存"""
+        with self._lock:
+            self._memory.clear()
+        if self.db_path:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM llm_cache")
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """获取缓存统计信息
+
+        Returns:
+            命中、未命中、写入、淘汰次数以及命中率
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+# 全局缓存，默认关闭；设置环境变量 LLM_CACHE_PATH 或调用 configure_cache() 启用
+_cache: Optional[LLMCache] = LLMCache(db_path=os.environ['LLM_CACHE_PATH']) if os.environ.get('LLM_CACHE_PATH') else None
+
+
+def configure_cache(db_path: Optional[str] = None, enabled: bool = True, **kwargs) -> Optional[LLMCache]:
+    """启用或关闭全局LLM响应缓存
+
+    Args:
+        db_path: SQLite 数据库路径，为 None 时只使用内存缓存
+        enabled: 是否启用缓存
+        **kwargs: 传递给 LLMCache 的其他参数
+
+    Returns:
+        全局缓存实例，关闭时返回None
+    """
+    global _cache
+    _cache = LLMCache(db_path=db_path, **kwargs) if enabled else None
+    return _cache
+
+
+def get_cache() -> Optional[LLMCache]:
+    """获取全局缓存实例，未启用时返回None"""
+    return _cache
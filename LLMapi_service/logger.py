@@ -0,0 +1,213 @@
+"""
+日志模块
+deep_research 和 LLMapi_service 统一使用的分级日志：调用方只把日志记录放入内存队列，
+由后台线程写入控制台和文件，不在事件循环中做同步 I/O；低级别日志可以按比例采样，
+请求/响应正文（payload）默认不记录，需要排查问题时通过 LOG_PAYLOADS=1 或 configure_logging(payloads=True) 开启
+"""
+
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from typing import Dict, Optional, Any
+
+try:
+    from .metrics import current_tags
+except ImportError:
+    from metrics import current_tags
+
+# 默认日志级别
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+# 是否记录请求/响应正文，开启后以 DEBUG 级别输出，日志级别也需设为 DEBUG
+LOG_PAYLOADS = os.environ.get('LOG_PAYLOADS', '0') == '1'
+# 单条正文日志的最大字符数
+PAYLOAD_MAX_CHARS = 2000
+# 日志队列容量，写入跟不上时丢弃新的日志记录而不是阻塞调用方
+LOG_QUEUE_SIZE = 10000
+# 低于 WARNING 级别的日志按日志器名称前缀采样的保留比例，如进度更新日志只保留十分之一
+LOG_SAMPLE_RATES: Dict[str, float] = {
+    'deep_research.progress': 0.1
+}
+# 由本模块配置处理器的顶层日志器
+ROOT_LOGGERS = ('deep_research', 'llmapi')
+
+_TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s%(tags)s - %(message)s'
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional["NonBlockingQueueHandler"] = None
+_config_lock = threading.Lock()
+_payloads_enabled = LOG_PAYLOADS
+
+
+def get_logger(name: str) -> logging.Logger:
+    """获取日志器，名称应位于 deep_research 或 llmapi 之下，如 deep_research.agent、llmapi.gptservice"""
+    return logging.getLogger(name)
+
+
+class TagFilter(logging.Filter):
+    """把当前调用方的标签（task_id、node_id、phase）附加到日志记录上"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        tags = current_tags()
+        record.tag_values = tags
+        record.tags = " [" + " ".join(f"{key}={value}" for key, value in tags.items()) + "]" if tags else ""
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """对低于 WARNING 级别的日志按日志器名称前缀采样，按计数保留，每 1/rate 条保留一条"""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        # 较长的前缀优先匹配
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        for prefix, rate in self.rates:
+            if record.name == prefix or record.name.startswith(prefix + "."):
+                if rate >= 1:
+                    return True
+                if rate <= 0:
+                    return False
+                with self._lock:
+                    count = self._counters.get(prefix, 0)
+                    self._counters[prefix] = count + 1
+                return count % round(1 / rate) == 0
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON，标签作为独立字段，便于日志系统检索"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **getattr(record, "tag_values", {})
+        }
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃日志记录并计数，调用方永远不会被日志写入阻塞"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(
+    level: Optional[str] = None,
+    log_file: Optional[str] = None,
+    json_format: bool = False,
+    payloads: Optional[bool] = None,
+    sample_rates: Optional[Dict[str, float]] = None,
+    force: bool = False
+) -> None:
+    """配置 deep_research 和 llmapi 日志：日志记录经队列交给后台线程写入控制台和文件
+
+    重复调用时不做任何事，除非 force=True
+
+    Args:
+        level: 日志级别，默认 LOG_LEVEL
+        log_file: 日志文件路径，为 None 时只输出到控制台
+        json_format: 是否以每行一条 JSON 的格式输出
+        payloads: 是否记录请求/响应正文，默认 LOG_PAYLOADS
+        sample_rates: 按日志器名称前缀的采样比例，默认 LOG_SAMPLE_RATES
+        force: 是否替换已有配置
+    """
+    global _listener, _handler, _payloads_enabled
+    with _config_lock:
+        if _listener is not None and not force:
+            return
+        _shutdown()
+
+        formatter = JsonFormatter() if json_format else logging.Formatter(_TEXT_FORMAT)
+        handlers = [logging.StreamHandler(sys.stdout)]
+        if log_file:
+            directory = os.path.dirname(log_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            handlers.append(logging.FileHandler(log_file, encoding='utf-8'))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        _handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        # 过滤在调用方线程中执行：先采样丢弃，再读取 contextvars 中的标签
+        _handler.addFilter(SamplingFilter(LOG_SAMPLE_RATES if sample_rates is None else sample_rates))
+        _handler.addFilter(TagFilter())
+        _listener = logging.handlers.QueueListener(_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+
+        if payloads is not None:
+            _payloads_enabled = payloads
+        for name in ROOT_LOGGERS:
+            root = logging.getLogger(name)
+            root.handlers = [_handler]
+            root.setLevel((level or LOG_LEVEL).upper())
+            # 不再传给根日志器，避免与 basicConfig 等其他配置重复输出
+            root.propagate = False
+
+
+def _shutdown() -> None:
+    """停止后台写入线程，写出队列中剩余的日志，调用前需持有配置锁"""
+    global _listener, _handler
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+    _listener = None
+    _handler = None
+
+
+def shutdown_logging() -> None:
+    """停止后台写入线程并写出剩余日志，进程退出时自动调用"""
+    with _config_lock:
+        _shutdown()
+
+
+atexit.register(shutdown_logging)
+
+
+def dropped_records() -> int:
+    """因队列已满被丢弃的日志记录数"""
+    return _handler.dropped if _handler is not None else 0
+
+
+def payload_logging_enabled(logger: logging.Logger) -> bool:
+    """是否需要记录正文，未开启时调用方应跳过正文的序列化"""
+    return _payloads_enabled and logger.isEnabledFor(logging.DEBUG)
+
+
+def log_payload(logger: logging.Logger, label: str, payload: Any) -> None:
+    """以 DEBUG 级别记录请求/响应正文，未开启正文日志时不做任何序列化
+
+    Args:
+        logger: 日志器
+        label: 正文说明，如“响应”
+        payload: 字符串或可序列化为 JSON 的对象，超过 PAYLOAD_MAX_CHARS 的部分截断
+    """
+    if not payload_logging_enabled(logger):
+        return
+    text = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False, default=str)
+    if len(text) > PAYLOAD_MAX_CHARS:
+        text = text[:PAYLOAD_MAX_CHARS] + f"…（共 {len(text)} 字符）"
+    logger.debug(f"{label}: {text}")
@@ -0,0 +1,244 @@
+"""
+LLM 调用指标模块
+记录每次调用的模型、密钥序号、输入/输出令牌数、耗时、缓存命中情况以及调用方标签（task_id、node_id、phase），
+按任务汇总，并以 Prometheus 文本格式导出全局指标
+"""
+
+import time
+import threading
+import contextvars
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List
+
+# 耗时直方图的分桶上界（秒）
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 40, 80, 160)
+# 保留的最近调用记录数
+RECENT_CALLS = 1000
+# 模型单价（美元 / 百万令牌），格式为 {模型: (输入单价, 输出单价)}，未列出的模型不计算费用，
+# 例如 'deepseek-chat': (0.27, 1.10)
+MODEL_PRICES: Dict[str, tuple] = {}
+
+# 当前调用方的标签，随 asyncio 任务和 asyncio.to_thread 自动向下传递
+_tags: contextvars.ContextVar = contextvars.ContextVar("llm_metric_tags", default={})
+
+
+@contextmanager
+def metric_tags(**tags):
+    """在代码块内为发起的 LLM 调用附加标签，可以嵌套，内层覆盖外层的同名标签
+
+    Args:
+        **tags: 标签，如 task_id、node_id、phase
+    """
+    token = _tags.set({**_tags.get(), **{key: value for key, value in tags.items() if value is not None}})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+def set_metric_tags(**tags) -> None:
+    """在当前上下文中设置标签且不自动恢复，用于一个独立 asyncio 任务的全部调用，如整个研究任务的 task_id"""
+    _tags.set({**_tags.get(), **{key: value for key, value in tags.items() if value is not None}})
+
+
+def current_tags() -> Dict[str, str]:
+    """当前调用方的标签"""
+    return dict(_tags.get())
+
+
+def call_cost(model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    """按 MODEL_PRICES 计算一次调用的费用（美元），模型没有单价时返回None"""
+    prices = MODEL_PRICES.get(model)
+    if not prices:
+        return None
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1_000_000
+
+
+def escape_label_value(value: Any) -> str:
+    """按 Prometheus 文本格式转义标签值中的反斜杠、双引号和换行"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _new_summary() -> Dict[str, Any]:
+    return {
+        "calls": 0,
+        "errors": 0,
+        "cache_hits": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "latency": 0.0,
+        "cost_usd": 0.0
+    }
+
+
+def _add_to_summary(summary: Dict[str, Any], record: Dict[str, Any]) -> None:
+    summary["calls"] += 1
+    summary["errors"] += record["status"] != "ok"
+    summary["cache_hits"] += record["cache"] == "hit"
+    summary["prompt_tokens"] += record["prompt_tokens"]
+    summary["completion_tokens"] += record["completion_tokens"]
+    summary["latency"] += record["latency"]
+    summary["cost_usd"] += record["cost_usd"] or 0.0
+
+
+class MetricsRegistry:
+    """LLM 调用指标登记处，web_app 中多个线程共享"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.recent = deque(maxlen=RECENT_CALLS)
+        # (模型, 阶段, 缓存, 状态) -> 调用数
+        self._calls = defaultdict(int)
+        # (模型, 阶段) -> 输入/输出令牌数、费用
+        self._prompt_tokens = defaultdict(int)
+        self._completion_tokens = defaultdict(int)
+        self._cost = defaultdict(float)
+        # (模型, 阶段) -> [各分桶计数, 耗时总和, 调用数]
+        self._latency = defaultdict(lambda: [[0] * len(LATENCY_BUCKETS), 0.0, 0])
+        # (提供方, 密钥序号) -> 调用数
+        self._key_calls = defaultdict(int)
+        # 任务ID -> 汇总
+        self._tasks: Dict[str, Dict[str, Any]] = {}
+
+    def record(
+        self,
+        model: str,
+        served_model: Optional[str] = None,
+        provider: Optional[str] = None,
+        key_index: Optional[int] = None,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        latency: float = 0.0,
+        cache: str = "miss",
+        status: str = "ok",
+        stream: bool = False,
+        estimated: bool = False
+    ) -> Dict[str, Any]:
+        """记录一次 LLM 调用，标签取自当前的 metric_tags
+
+        Args:
+            model: 请求的模型
+            served_model: 实际提供结果的模型（降级时与 model 不同）
+            provider: 提供方
+            key_index: 使用的 API 密钥在该提供方密钥列表中的序号
+            prompt_tokens: 输入令牌数
+            completion_tokens: 输出令牌数
+            latency: 耗时（秒），包括重试和等待限流的时间
+            cache: hit（命中缓存）/ miss（未命中）/ bypass（未使用缓存）
+            status: ok 或错误类型名
+            stream: 是否为流式调用
+            estimated: 令牌数是否为估算值（响应中没有用量信息）
+
+        Returns:
+            调用记录
+        """
+        tags = current_tags()
+        served_model = served_model or model
+        phase = tags.get("phase", "other")
+        record = {
+            "timestamp": time.time(),
+            "model": model,
+            "served_model": served_model,
+            "provider": provider,
+            "key_index": key_index,
+            "prompt_tokens": int(prompt_tokens or 0),
+            "completion_tokens": int(completion_tokens or 0),
+            "latency": latency,
+            "cache": cache,
+            "status": status,
+            "stream": stream,
+            "estimated": estimated,
+            "cost_usd": None if cache == "hit" else call_cost(served_model, prompt_tokens or 0, completion_tokens or 0),
+            **tags
+        }
+
+        with self._lock:
+            self.recent.append(record)
+            series = (served_model, phase)
+            self._calls[(served_model, phase, cache, status)] += 1
+            self._prompt_tokens[series] += record["prompt_tokens"]
+            self._completion_tokens[series] += record["completion_tokens"]
+            self._cost[series] += record["cost_usd"] or 0.0
+            if cache != "hit":
+                histogram = self._latency[series]
+                for i, bound in enumerate(LATENCY_BUCKETS):
+                    if latency <= bound:
+                        histogram[0][i] += 1
+                histogram[1] += latency
+                histogram[2] += 1
+            if provider is not None and key_index is not None:
+                self._key_calls[(provider, key_index)] += 1
+
+            task_id = tags.get("task_id")
+            if task_id:
+                task = self._tasks.get(task_id)
+                if task is None:
+                    task = self._tasks[task_id] = {"total": _new_summary(), "by_phase": {}, "by_model": {}}
+                _add_to_summary(task["total"], record)
+                _add_to_summary(task["by_phase"].setdefault(phase, _new_summary()), record)
+                _add_to_summary(task["by_model"].setdefault(served_model, _new_summary()), record)
+        return record
+
+    def task_summary(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务的调用汇总，包括总计、按阶段和按模型的调用数、令牌数、耗时和费用"""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return None
+            return {
+                "total": dict(task["total"]),
+                "by_phase": {phase: dict(summary) for phase, summary in task["by_phase"].items()},
+                "by_model": {model: dict(summary) for model, summary in task["by_model"].items()}
+            }
+
+    def forget_task(self, task_id: str) -> None:
+        """任务结束后释放其汇总，全局指标不受影响"""
+        with self._lock:
+            self._tasks.pop(task_id, None)
+
+    def render_prometheus(self) -> str:
+        """以 Prometheus 文本格式导出全局指标"""
+        lines: List[str] = []
+
+        def labels(**values) -> str:
+            return "{" + ",".join(
+                f'{key}="{escape_label_value(value)}"' for key, value in values.items()
+            ) + "}"
+
+        with self._lock:
+            lines.append("# HELP llm_calls_total LLM 调用次数")
+            lines.append("# TYPE llm_calls_total counter")
+            for (model, phase, cache, status), count in sorted(self._calls.items()):
+                lines.append(f"llm_calls_total{labels(model=model, phase=phase, cache=cache, status=status)} {count}")
+
+            for name, help_text, values in (
+                ("llm_prompt_tokens_total", "LLM 输入令牌数", self._prompt_tokens),
+                ("llm_completion_tokens_total", "LLM 输出令牌数", self._completion_tokens),
+                ("llm_cost_usd_total", "LLM 调用费用（美元），只统计配置了单价的模型", self._cost),
+            ):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for (model, phase), value in sorted(values.items()):
+                    lines.append(f"{name}{labels(model=model, phase=phase)} {value}")
+
+            lines.append("# HELP llm_call_latency_seconds LLM 调用耗时，不含缓存命中")
+            lines.append("# TYPE llm_call_latency_seconds histogram")
+            for (model, phase), (buckets, total, count) in sorted(self._latency.items()):
+                for bound, bucket_count in zip(LATENCY_BUCKETS, buckets):
+                    lines.append(
+                        f"llm_call_latency_seconds_bucket{labels(model=model, phase=phase, le=bound)} {bucket_count}"
+                    )
+                lines.append(f"llm_call_latency_seconds_bucket{labels(model=model, phase=phase, le='+Inf')} {count}")
+                lines.append(f"llm_call_latency_seconds_sum{labels(model=model, phase=phase)} {total}")
+                lines.append(f"llm_call_latency_seconds_count{labels(model=model, phase=phase)} {count}")
+
+            lines.append("# HELP llm_key_calls_total 各 API 密钥承担的调用次数")
+            lines.append("# TYPE llm_key_calls_total counter")
+            for (provider, key_index), count in sorted(self._key_calls.items()):
+                lines.append(f"llm_key_calls_total{labels(provider=provider, key_index=key_index)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+# 全局指标登记处
+metrics = MetricsRegistry()
@@ -0,0 +1,376 @@
+"""
+LLM 服务限流模块
+为每个 API 密钥和每个提供方维护 RPM/TPM 令牌桶，并根据 429 和延迟信号自适应调整并发（AIMD）
+"""
+
+import math
+import time
+import random
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional
+
+# 各提供方的默认限额：rpm/tpm 为单个密钥的每分钟请求数/令牌数，
+# provider_rpm/provider_tpm 为整个提供方的限额，None 表示不限制；
+# concurrency 为整个提供方的初始并发数，平均分给各密钥后由 AIMD 调整。
+# 应与调用方的并发上限一致（如 deep_research/config.py 的 MAX_CONCURRENT_CALLS_PER_PROVIDER），
+# 初始值低于调用方上限时，调用方放行的并发请求会在这里排队，直到加性增长追上
+RATE_LIMITS = {
+    'gemini': {'rpm': 5, 'tpm': 250000, 'provider_rpm': None, 'provider_tpm': None, 'concurrency': 4},
+    'deepseek': {'rpm': 60, 'tpm': None, 'provider_rpm': None, 'provider_tpm': None, 'concurrency': 6},
+    'bianxie': {'rpm': 60, 'tpm': None, 'provider_rpm': None, 'provider_tpm': None, 'concurrency': 6},
+}
+# 收到 429 且响应未给出 Retry-After 时，密钥的默认冷却时间（秒）
+DEFAULT_COOLDOWN = 20
+# 延迟超过该值（秒）视为拥塞信号
+LATENCY_TARGET = 45
+# 提供方未配置 concurrency 时的初始并发数，与 deep_research 的全局并发上限 MAX_CONCURRENT_LLM_CALLS 一致
+DEFAULT_CONCURRENCY = 8
+# 每个密钥的最大并发数
+MAX_CONCURRENCY = 16
+# 等待可用密钥时的最长单次休眠时间（秒）
+MAX_WAIT_STEP = 5
+
+
+def estimate_tokens(messages: List[Dict]) -> int:
+    """粗略估算消息的令牌数，中文约每1-2个字符一个令牌，这里按每2个字符一个令牌估算
+
+    Args:
+        messages: 消息列表
+
+    Returns:
+        估算的令牌数
+    """
+    return sum(len(str(message.get("content") or "")) for message in messages) // 2 + 1
+
+
+class TokenBucket:
+    """令牌桶，容量为一个窗口内的限额，按限额/窗口的速率匀速补充"""
+
+    def __init__(self, limit: float, window: float = 60.0):
+        """初始化令牌桶
+
+        Args:
+            limit: 每个窗口内允许的令牌数
+            window: 窗口长度（秒），默认一分钟
+        """
+        self.rate = limit / window
+        self.capacity = float(limit)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def available(self) -> float:
+        """当前可用令牌数"""
+        self._refill()
+        return self.tokens
+
+    def remaining_ratio(self) -> float:
+        """剩余令牌占容量的比例"""
+        return max(0.0, self.available()) / self.capacity
+
+    def time_until(self, amount: float) -> float:
+        """距离可以消耗指定数量令牌还需等待的时间（秒）"""
+        amount = min(amount, self.capacity)
+        deficit = amount - self.available()
+        return max(0.0, deficit / self.rate)
+
+    def consume(self, amount: float) -> None:
+        """消耗令牌，调用前应确认令牌充足"""
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, delta: float) -> None:
+        """按实际用量修正令牌数，delta 为正表示多消耗"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class AdaptiveConcurrency:
+    """AIMD 并发控制：成功时加性增长，遇到 429 或高延迟时乘性下降"""
+
+    def __init__(
+        self,
+        initial: float = DEFAULT_CONCURRENCY,
+        min_limit: float = 1,
+        max_limit: float = MAX_CONCURRENCY,
+        latency_target: float = LATENCY_TARGET
+    ):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+
+    @property
+    def allowed(self) -> int:
+        """当前允许的并发数"""
+        return max(int(self.min_limit), int(self.limit))
+
+    def on_success(self, latency: float) -> None:
+        if latency > self.latency_target:
+            self.limit = max(self.min_limit, self.limit * 0.8)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def on_rate_limited(self) -> None:
+        self.limit = max(self.min_limit, self.limit * 0.5)
+
+
+class KeyState:
+    """单个 API 密钥的限额和并发状态"""
+
+    def __init__(
+        self,
+        key: str,
+        rpm: Optional[float],
+        tpm: Optional[float],
+        window: float = 60.0,
+        index: int = -1,
+        concurrency: float = DEFAULT_CONCURRENCY
+    ):
+        self.key = key
+        # 密钥在提供方密钥列表中的序号，用于在指标中区分密钥而不暴露密钥本身
+        self.index = index
+        self.rpm_bucket = TokenBucket(rpm, window) if rpm else None
+        self.tpm_bucket = TokenBucket(tpm, window) if tpm else None
+        self.concurrency = AdaptiveConcurrency(initial=concurrency)
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.stats = {"requests": 0, "successes": 0, "rate_limited": 0, "errors": 0}
+
+    def _buckets(self, tokens: int):
+        return [(bucket, amount) for bucket, amount in ((self.rpm_bucket, 1), (self.tpm_bucket, tokens)) if bucket]
+
+    def remaining_ratio(self) -> float:
+        """剩余预算比例，取 RPM 和 TPM 中较紧的一个"""
+        ratios = [bucket.remaining_ratio() for bucket, _ in self._buckets(0)]
+        return min(ratios) if ratios else 1.0
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        """距离该密钥可以接受请求还需等待的时间（秒），0 表示立即可用"""
+        waits = [self.cooldown_until - now]
+        waits.extend(bucket.time_until(amount) for bucket, amount in self._buckets(tokens))
+        return max(0.0, *waits)
+
+    def has_capacity(self) -> bool:
+        return self.in_flight < self.concurrency.allowed
+
+    def consume(self, tokens: int) -> None:
+        for bucket, amount in self._buckets(tokens):
+            bucket.consume(amount)
+
+
+class KeyLease:
+    """一次请求占用的密钥"""
+
+    def __init__(self, state: KeyState, estimated_tokens: int):
+        self.state = state
+        self.estimated_tokens = estimated_tokens
+        self.actual_tokens = None
+        self.started_at = time.monotonic()
+        # 流式请求收到第一个事件的时间；流式请求的总时长取决于回复长度，只用首包延迟判断拥塞
+        self.first_chunk_at = None
+
+    @property
+    def key(self) -> str:
+        return self.state.key
+
+    def record_tokens(self, total_tokens: Optional[int]) -> None:
+        """记录响应中报告的实际令牌用量，用于修正 TPM 令牌桶"""
+        if total_tokens:
+            self.actual_tokens = int(total_tokens)
+
+    def record_first_chunk(self) -> None:
+        """记录流式响应的首个事件，重复调用只保留第一次"""
+        if self.first_chunk_at is None:
+            self.first_chunk_at = time.monotonic()
+
+    @property
+    def latency(self) -> float:
+        """用于拥塞判断的延迟：流式请求为首包延迟，其余为整个请求的耗时"""
+        return (self.first_chunk_at or time.monotonic()) - self.started_at
+
+
+class ProviderLimiter:
+    """提供方限流器，在多个密钥之间选择剩余预算最多的密钥"""
+
+    def __init__(
+        self,
+        provider: str,
+        keys: List[str],
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        provider_rpm: Optional[float] = None,
+        provider_tpm: Optional[float] = None,
+        concurrency: Optional[int] = None,
+        window: float = 60.0
+    ):
+        """初始化提供方限流器
+
+        Args:
+            provider: 提供方名称
+            keys: 该提供方的 API 密钥列表
+            rpm: 单个密钥的每分钟请求数上限
+            tpm: 单个密钥的每分钟令牌数上限
+            provider_rpm: 整个提供方的每分钟请求数上限
+            provider_tpm: 整个提供方的每分钟令牌数上限
+            concurrency: 整个提供方的初始并发数，按密钥数平均分配（向上取整），默认 DEFAULT_CONCURRENCY
+            window: 限额统计窗口（秒），默认一分钟，模拟测试时可缩短
+        """
+        self.provider = provider
+        keys = keys or ['']
+        per_key = min(MAX_CONCURRENCY, max(1, math.ceil((concurrency or DEFAULT_CONCURRENCY) / len(keys))))
+        self.keys = [KeyState(key, rpm, tpm, window, index, per_key) for index, key in enumerate(keys)]
+        self.provider_state = KeyState('*', provider_rpm, provider_tpm, window)
+        # web_app 中多个事件循环在不同线程共享同一个限流器
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, tokens: int):
+        """尝试立即占用一个密钥
+
+        Returns:
+            (租约, 需要等待的时间)，成功时等待时间为0
+        """
+        now = time.monotonic()
+        with self._lock:
+            provider_wait = self.provider_state.wait_time(tokens, now)
+            if provider_wait > 0:
+                return None, provider_wait
+
+            ready = [state for state in self.keys if state.has_capacity() and state.wait_time(tokens, now) == 0]
+            if ready:
+                best = max(ready, key=lambda state: (state.remaining_ratio(), -state.in_flight))
+                best.consume(tokens)
+                self.provider_state.consume(tokens)
+                best.in_flight += 1
+                best.stats["requests"] += 1
+                return KeyLease(best, tokens), 0.0
+
+            # 并发已满的密钥没有明确的等待时间，短暂轮询
+            waits = [state.wait_time(tokens, now) if state.has_capacity() else 0.05 for state in self.keys]
+            return None, min(waits)
+
+    async def acquire(self, estimated_tokens: int = 0) -> KeyLease:
+        """等待并占用剩余预算最多的可用密钥
+
+        Args:
+            estimated_tokens: 本次请求的估算令牌数
+
+        Returns:
+            密钥租约
+        """
+        while True:
+            lease, wait = self._try_acquire(estimated_tokens)
+            if lease is not None:
+                return lease
+            # 加入少量抖动，避免大量等待者同时醒来
+            await asyncio.sleep(min(MAX_WAIT_STEP, max(0.05, wait)) + random.uniform(0, 0.05))
+
+    def release(self, lease: KeyLease, error: Optional[BaseException] = None) -> None:
+        """释放密钥并根据请求结果更新限流状态
+
+        Args:
+            lease: 密钥租约
+            error: 请求抛出的异常，成功时为None
+        """
+        state = lease.state
+        latency = lease.latency
+        status = getattr(error, "status", None)
+        with self._lock:
+            state.in_flight -= 1
+            if lease.actual_tokens is not None:
+                delta = lease.actual_tokens - lease.estimated_tokens
+                for bucket in (state.tpm_bucket, self.provider_state.tpm_bucket):
+                    if bucket:
+                        bucket.adjust(delta)
+
+            if status == 429:
+                state.stats["rate_limited"] += 1
+                state.concurrency.on_rate_limited()
+                state.cooldown_until = time.monotonic() + _retry_after(error)
+            elif error is None:
+                state.stats["successes"] += 1
+                state.concurrency.on_success(latency)
+            else:
+                state.stats["errors"] += 1
+
+    @asynccontextmanager
+    async def lease(self, estimated_tokens: int = 0):
+        """占用一个密钥执行请求，退出时自动释放并反馈结果
+
+        Args:
+            estimated_tokens: 本次请求的估算令牌数
+        """
+        lease = await self.acquire(estimated_tokens)
+        try:
+            yield lease
+        except BaseException as error:
+            self.release(lease, error)
+            raise
+        else:
+            self.release(lease)
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """获取每个密钥的限流统计，密钥只显示末尾4位"""
+        with self._lock:
+            return {
+                "provider": self.provider,
+                "keys": [
+                    {
+                        "key": f"...{state.key[-4:]}" if state.key else "",
+                        "in_flight": state.in_flight,
+                        "concurrency_limit": round(state.concurrency.limit, 2),
+                        "remaining_ratio": round(state.remaining_ratio(), 3),
+                        **state.stats
+                    }
+                    for state in self.keys
+                ]
+            }
+
+
+def _retry_after(error: Optional[BaseException]) -> float:
+    """从 429 响应中读取 Retry-After，缺失时使用默认冷却时间"""
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After", DEFAULT_COOLDOWN))
+    except (TypeError, ValueError):
+        return DEFAULT_COOLDOWN
+
+
+_limiters: Dict[str, ProviderLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str, keys: List[str]) -> ProviderLimiter:
+    """获取提供方的全局限流器，首次调用时按 RATE_LIMITS 创建
+
+    Args:
+        provider: 提供方名称
+        keys: 该提供方的 API 密钥列表
+
+    Returns:
+        提供方限流器
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            limiter = ProviderLimiter(provider, keys, **RATE_LIMITS.get(provider, {}))
+            _limiters[provider] = limiter
+        return limiter
+
+
+def configure_rate_limits(provider: str, **limits) -> None:
+    """修改提供方的限额，下次获取限流器时生效
+
+    Args:
+        provider: 提供方名称
+        **limits: rpm、tpm、provider_rpm、provider_tpm、concurrency
+    """
+    with _limiters_lock:
+        RATE_LIMITS.setdefault(provider, {}).update(limits)
+        _limiters.pop(provider, None)
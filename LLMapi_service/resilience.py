@@ -0,0 +1,361 @@
+"""
+LLM 服务容错模块
+提供类型化错误、带抖动的指数退避重试、基于延迟分位数的对冲请求以及模型降级链
+"""
+
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional, Callable, Awaitable, AsyncIterator
+
+import aiohttp
+
+try:
+    from .logger import get_logger
+except ImportError:
+    from logger import get_logger
+
+logger = get_logger("llmapi.resilience")
+
+# 单个模型的最大尝试次数（含首次请求）
+MAX_ATTEMPTS = 3
+# 指数退避的基础延迟和最大延迟（秒）
+BASE_DELAY = 1.0
+MAX_DELAY = 30.0
+# 对冲请求：请求耗时超过该模型历史延迟的指定分位数时，再发一个相同请求，取先返回的结果
+HEDGE_ENABLED = os.environ.get('LLM_HEDGE', '0') == '1'
+HEDGE_PERCENTILE = 0.9
+# 至少积累多少次延迟样本后才启用对冲
+HEDGE_MIN_SAMPLES = 20
+# 模型降级链：主模型重试后仍失败时依次尝试的备用模型
+FALLBACK_CHAINS = {
+    'gemini-2.5-pro-exp-03-25': ['deepseek-chat'],
+    'gemini-2.0-pro-latest': ['deepseek-chat'],
+}
+
+
+class LLMError(Exception):
+    """LLM 调用错误基类"""
+
+    retryable = False
+
+    def __init__(self, message: str, model: str = None, status: int = None, retry_after: float = None):
+        super().__init__(message)
+        self.model = model
+        self.status = status
+        self.retry_after = retry_after
+
+
+class LLMRateLimitError(LLMError):
+    """429 请求过多"""
+    retryable = True
+
+
+class LLMServerError(LLMError):
+    """5xx 服务端错误"""
+    retryable = True
+
+
+class LLMTimeoutError(LLMError):
+    """请求超时"""
+    retryable = True
+
+
+class LLMConnectionError(LLMError):
+    """网络连接错误"""
+    retryable = True
+
+
+class LLMResponseError(LLMError):
+    """响应为空或无法解析"""
+    retryable = True
+
+
+class LLMRequestError(LLMError):
+    """请求本身有误（4xx、未知模型等），重试无意义"""
+    retryable = False
+
+
+class LLMFallbackExhaustedError(LLMError):
+    """降级链中的所有模型均失败"""
+
+    def __init__(self, message: str, errors: List[LLMError], model: str = None):
+        super().__init__(message, model=model)
+        self.errors = errors
+
+
+def classify_error(error: BaseException, model: str) -> LLMError:
+    """将底层异常转换为类型化的 LLMError
+
+    Args:
+        error: 原始异常
+        model: 出错的模型
+
+    Returns:
+        类型化错误
+    """
+    if isinstance(error, LLMError):
+        if error.model is None:
+            error.model = model
+        return error
+    if isinstance(error, aiohttp.ClientResponseError):
+        retry_after = None
+        if error.headers and error.headers.get("Retry-After"):
+            try:
+                retry_after = float(error.headers["Retry-After"])
+            except ValueError:
+                pass
+        message = f"{model} 返回 HTTP {error.status}: {error.message}"
+        if error.status == 429:
+            return LLMRateLimitError(message, model, error.status, retry_after)
+        if error.status >= 500 or error.status == 408:
+            return LLMServerError(message, model, error.status, retry_after)
+        return LLMRequestError(message, model, error.status)
+    if isinstance(error, asyncio.TimeoutError):
+        return LLMTimeoutError(f"{model} 请求超时", model)
+    if isinstance(error, aiohttp.ClientError):
+        return LLMConnectionError(f"{model} 连接失败: {error}", model)
+    return LLMError(f"{model} 调用失败: {error}", model)
+
+
+class LatencyTracker:
+    """记录每个模型最近的成功请求延迟，用于计算对冲阈值"""
+
+    def __init__(self, window: int = 200):
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def record(self, model: str, latency: float) -> None:
+        with self._lock:
+            self._samples[model].append(latency)
+
+    def percentile(self, model: str, q: float, min_samples: int = 1) -> Optional[float]:
+        """返回指定分位数的延迟，样本不足时返回None"""
+        with self._lock:
+            samples = sorted(self._samples[model])
+        if len(samples) < min_samples or not samples:
+            return None
+        index = min(len(samples) - 1, int(q * len(samples)))
+        return samples[index]
+
+
+class ResiliencePolicy:
+    """容错策略：重试、对冲和降级的参数"""
+
+    def __init__(
+        self,
+        max_attempts: int = MAX_ATTEMPTS,
+        base_delay: float = BASE_DELAY,
+        max_delay: float = MAX_DELAY,
+        hedge_enabled: bool = HEDGE_ENABLED,
+        hedge_percentile: float = HEDGE_PERCENTILE,
+        hedge_min_samples: int = HEDGE_MIN_SAMPLES,
+        fallback_chains: Dict[str, List[str]] = None
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.fallback_chains = fallback_chains if fallback_chains is not None else dict(FALLBACK_CHAINS)
+        self.latency = LatencyTracker()
+
+    def backoff(self, attempt: int, error: LLMError) -> float:
+        """计算第 attempt 次失败后的等待时间（全抖动指数退避），优先遵守 Retry-After"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if error.retry_after:
+            delay = max(delay, min(error.retry_after, self.max_delay))
+        return delay
+
+    def model_chain(self, model: str) -> List[str]:
+        """主模型及其降级链，去除重复项"""
+        chain = [model]
+        for fallback in self.fallback_chains.get(model, []):
+            if fallback not in chain:
+                chain.append(fallback)
+        return chain
+
+
+# 全局容错策略
+policy = ResiliencePolicy()
+
+
+def configure_resilience(**kwargs) -> ResiliencePolicy:
+    """替换全局容错策略
+
+    Args:
+        **kwargs: ResiliencePolicy 的参数
+
+    Returns:
+        新的容错策略
+    """
+    global policy
+    policy = ResiliencePolicy(**kwargs)
+    return policy
+
+
+# 以模型名为参数、返回异步上下文管理器的函数，每次请求尝试在其中执行，如调用方的并发槽位
+Slot = Callable[[str], Any]
+
+
+@asynccontextmanager
+async def _no_slot(model: str):
+    yield
+
+
+async def _timed_call(call: Callable[[str], Awaitable[Dict]], model: str, slot: Slot = _no_slot) -> Dict:
+    """在槽位内执行一次调用，校验响应并记录延迟，等待槽位的时间不计入延迟"""
+    async with slot(model):
+        started_at = time.monotonic()
+        response = await call(model)
+    if not response or not response.get("content"):
+        raise LLMResponseError(f"{model} 返回了空响应", model)
+    policy.latency.record(model, time.monotonic() - started_at)
+    return response
+
+
+async def _hedged_call(call: Callable[[str], Awaitable[Dict]], model: str, slot: Slot = _no_slot) -> Dict:
+    """执行调用，耗时超过延迟分位数阈值时发出对冲请求，返回先成功的结果"""
+    threshold = None
+    if policy.hedge_enabled:
+        threshold = policy.latency.percentile(model, policy.hedge_percentile, policy.hedge_min_samples)
+    if threshold is None:
+        return await _timed_call(call, model, slot)
+
+    primary = asyncio.ensure_future(_timed_call(call, model, slot))
+    attempts = [primary]
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=threshold)
+        if done:
+            return primary.result()
+
+        logger.info(f"{model} 请求超过 {threshold:.1f}s（P{int(policy.hedge_percentile * 100)}），发出对冲请求")
+        attempts.append(asyncio.ensure_future(_timed_call(call, model, slot)))
+        pending = set(attempts)
+        last_error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                last_error = task.exception()
+        raise last_error
+    finally:
+        # 已有结果、全部失败或调用方被取消时，取消仍在进行的请求，避免继续占用密钥和并发
+        for task in attempts:
+            if not task.done():
+                task.cancel()
+
+
+async def _call_with_retries(call: Callable[[str], Awaitable[Dict]], model: str, slot: Slot = _no_slot) -> Dict:
+    """对单个模型执行带退避的重试，退避等待期间不占用槽位"""
+    for attempt in range(policy.max_attempts):
+        try:
+            return await _hedged_call(call, model, slot)
+        except Exception as exc:
+            error = classify_error(exc, model)
+            if not error.retryable or attempt == policy.max_attempts - 1:
+                raise error from exc
+            delay = policy.backoff(attempt, error)
+            logger.warning(f"{model} 第 {attempt + 1} 次请求失败（{type(error).__name__}: {error}），{delay:.1f}s 后重试")
+            await asyncio.sleep(delay)
+
+
+async def call_with_resilience(call: Callable[[str], Awaitable[Dict]], model: str, slot: Optional[Slot] = None) -> Dict:
+    """按容错策略调用LLM：重试、对冲，主模型因可重试的错误（429、5xx、超时、连接错误等）失败时沿降级链切换模型
+
+    不可重试的错误（如 LLMRequestError）直接抛出，不再降级
+
+    Args:
+        call: 以模型名为参数的调用协程函数
+        model: 主模型
+        slot: 可选，每次请求尝试（含对冲请求和降级模型）各自以实际模型名进入的槽位，退避等待期间不占用
+
+    Returns:
+        响应，"model" 字段为实际提供结果的模型
+
+    Raises:
+        LLMError: 降级链中所有模型均失败，或出现不可重试的错误
+    """
+    errors = []
+    for candidate in policy.model_chain(model):
+        if candidate != model:
+            logger.warning(f"{model} 不可用，降级到 {candidate}")
+        try:
+            response = await _call_with_retries(call, candidate, slot or _no_slot)
+            response["model"] = candidate
+            return response
+        except LLMError as error:
+            # 请求本身有误（密钥无效、未知模型、提示格式错误等）时换模型只会掩盖配置问题
+            if not error.retryable:
+                raise
+            errors.append(error)
+
+    if len(errors) == 1:
+        raise errors[0]
+    raise LLMFallbackExhaustedError(
+        f"{model} 及其降级模型均失败: " + "; ".join(str(error) for error in errors),
+        errors,
+        model=model
+    )
+
+
+async def stream_with_resilience(
+    open_stream: Callable[[str], AsyncIterator[Dict]],
+    model: str,
+    slot: Optional[Slot] = None
+) -> AsyncIterator[Dict]:
+    """按容错策略进行流式调用
+
+    只有在尚未产出任何增量时才重试或降级，已经输出部分内容后出错或错误不可重试时直接抛出
+
+    Args:
+        open_stream: 以模型名为参数、返回增量异步迭代器的函数
+        model: 主模型
+        slot: 可选，每次请求尝试各自以实际模型名进入的槽位，在流式输出结束前一直占用，退避等待期间不占用
+
+    Yields:
+        增量，"model" 字段为实际提供结果的模型
+
+    Raises:
+        LLMError: 降级链中所有模型均失败、出现不可重试的错误，或输出中途出错
+    """
+    slot = slot or _no_slot
+    errors = []
+    for candidate in policy.model_chain(model):
+        if candidate != model:
+            logger.warning(f"{model} 不可用，降级到 {candidate}")
+        for attempt in range(policy.max_attempts):
+            started = False
+            try:
+                async with slot(candidate):
+                    async for delta in open_stream(candidate):
+                        started = True
+                        delta["model"] = candidate
+                        yield delta
+                if not started:
+                    raise LLMResponseError(f"{candidate} 返回了空的流式响应", candidate)
+                return
+            except Exception as exc:
+                error = classify_error(exc, candidate)
+                if started or not error.retryable:
+                    raise error from exc
+                if attempt == policy.max_attempts - 1:
+                    errors.append(error)
+                    break
+                delay = policy.backoff(attempt, error)
+                logger.warning(f"{candidate} 第 {attempt + 1} 次流式请求失败（{type(error).__name__}: {error}），{delay:.1f}s 后重试")
+                await asyncio.sleep(delay)
+
+    if len(errors) == 1:
+        raise errors[0]
+    raise LLMFallbackExhaustedError(
+        f"{model} 及其降级模型均失败: " + "; ".join(str(error) for error in errors),
+        errors,
+        model=model
+    )
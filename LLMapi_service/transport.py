@@ -0,0 +1,260 @@
+"""
+LLM 服务异步传输层
+为每个模型提供方维护共享的 aiohttp 连接池，所有请求均不阻塞事件循环
+"""
+
+import os
+import json
+import time
+import asyncio
+from typing import Dict, Optional, Tuple, Any, AsyncIterator
+from urllib.parse import urlparse
+
+import aiohttp
+
+try:
+    from .logger import get_logger
+except ImportError:
+    from logger import get_logger
+
+logger = get_logger("llmapi.transport")
+
+# 单次请求的超时时间（秒）
+REQUEST_TIMEOUT = 60
+# 每个提供方连接池允许的最大并发连接数
+POOL_SIZE = 20
+
+# 代理默认配置，可通过环境变量 LLM_PROXY_URL / LLM_PROXY_MODE / LLM_PROXY_TTL 覆盖
+DEFAULT_PROXY_URL = 'http://127.0.0.1:33210'
+# auto: 自动检测代理是否可用；on: 始终使用代理；off: 始终直连
+DEFAULT_PROXY_MODE = 'auto'
+# 代理检测结果的缓存时间（秒），过期后在后台重新检测
+DEFAULT_PROXY_TTL = 300
+# 代理检测的连接超时时间（秒）
+PROXY_PROBE_TIMEOUT = 1
+
+# 连接池按 (提供方, 事件循环) 区分：aiohttp 的会话只能在创建它的事件循环中使用，
+# 而 web_app 会为每个研究任务创建独立的事件循环
+_sessions: Dict[Tuple[str, int], Tuple[asyncio.AbstractEventLoop, aiohttp.ClientSession]] = {}
+
+
+def _purge_closed_loops() -> None:
+    """清理已关闭事件循环遗留的会话记录"""
+    for key, (loop, session) in list(_sessions.items()):
+        if loop.is_closed() or session.closed:
+            del _sessions[key]
+
+
+def get_session(provider: str) -> aiohttp.ClientSession:
+    """获取指定提供方在当前事件循环中的共享会话
+
+    Args:
+        provider: 提供方名称，如 bianxie、deepseek、gemini
+
+    Returns:
+        共享的 aiohttp 会话
+    """
+    loop = asyncio.get_running_loop()
+    key = (provider, id(loop))
+    entry = _sessions.get(key)
+    if entry is not None and entry[0] is loop and not entry[1].closed:
+        return entry[1]
+
+    _purge_closed_loops()
+    session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=POOL_SIZE),
+        timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    )
+    _sessions[key] = (loop, session)
+    return session
+
+
+async def close_sessions() -> None:
+    """关闭当前事件循环中的所有共享会话，应在事件循环结束前调用"""
+    loop = asyncio.get_running_loop()
+    for key, (session_loop, session) in list(_sessions.items()):
+        if session_loop is loop:
+            del _sessions[key]
+            if not session.closed:
+                await session.close()
+
+
+async def post_json(provider: str, url: str, payload: Dict, headers: Dict = None, proxy: Optional[str] = None) -> Dict[str, Any]:
+    """通过共享连接池发送 POST 请求并解析 JSON 响应
+
+    Args:
+        provider: 提供方名称
+        url: 请求地址
+        payload: 请求体
+        headers: 请求头
+        proxy: 可选的代理地址
+
+    Returns:
+        解析后的 JSON 响应
+    """
+    session = get_session(provider)
+    async with session.post(url, json=payload, headers=headers, proxy=proxy) as response:
+        response.raise_for_status()
+        # 部分中转服务返回的 Content-Type 不规范，这里不校验类型
+        return await response.json(content_type=None)
+
+
+async def get_json(provider: str, url: str, headers: Dict = None, proxy: Optional[str] = None) -> Dict[str, Any]:
+    """通过共享连接池发送 GET 请求并解析 JSON 响应
+
+    Args:
+        provider: 提供方名称
+        url: 请求地址
+        headers: 请求头
+        proxy: 可选的代理地址
+
+    Returns:
+        解析后的 JSON 响应
+    """
+    session = get_session(provider)
+    async with session.get(url, headers=headers, proxy=proxy) as response:
+        response.raise_for_status()
+        return await response.json(content_type=None)
+
+
+async def stream_sse(provider: str, url: str, payload: Dict, headers: Dict = None, proxy: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+    """通过共享连接池发送 POST 请求，逐条产出 Server-Sent Events 中的 JSON 数据
+
+    流式响应可能持续数分钟，因此不限制总时长，只限制两次读取之间的间隔
+
+    Args:
+        provider: 提供方名称
+        url: 请求地址
+        payload: 请求体
+        headers: 请求头
+        proxy: 可选的代理地址
+
+    Yields:
+        每个 data 事件解析后的 JSON
+    """
+    session = get_session(provider)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=REQUEST_TIMEOUT)
+    async with session.post(url, json=payload, headers=headers, proxy=proxy, timeout=timeout) as response:
+        response.raise_for_status()
+        async for raw_line in response.content:
+            line = raw_line.decode('utf-8').strip()
+            if not line.startswith('data:'):
+                continue
+            data = line[5:].strip()
+            if data == '[DONE]':
+                break
+            try:
+                yield json.loads(data)
+            except json.JSONDecodeError:
+                continue
+
+
+async def probe_proxy(proxy_url: str, timeout: float = PROXY_PROBE_TIMEOUT) -> bool:
+    """通过建立 TCP 连接检测代理是否在监听
+
+    Args:
+        proxy_url: 代理地址
+        timeout: 检测超时时间（秒）
+
+    Returns:
+        代理是否可用
+    """
+    parsed = urlparse(proxy_url)
+    host = parsed.hostname or '127.0.0.1'
+    port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout=timeout)
+        writer.close()
+        return True
+    except (OSError, asyncio.TimeoutError):
+        return False
+
+
+class ProxyConfig:
+    """代理配置，检测结果带 TTL 缓存，过期后在后台重新检测，不再逐请求探测"""
+
+    def __init__(self, url: str = None, mode: str = None, ttl: float = None):
+        """初始化代理配置
+
+        Args:
+            url: 代理地址，默认读取环境变量 LLM_PROXY_URL
+            mode: 代理模式 auto/on/off，默认读取环境变量 LLM_PROXY_MODE
+            ttl: 检测结果缓存时间（秒），默认读取环境变量 LLM_PROXY_TTL
+        """
+        self.url = url or os.environ.get('LLM_PROXY_URL', DEFAULT_PROXY_URL)
+        self.mode = (mode or os.environ.get('LLM_PROXY_MODE', DEFAULT_PROXY_MODE)).lower()
+        self.ttl = float(ttl if ttl is not None else os.environ.get('LLM_PROXY_TTL', DEFAULT_PROXY_TTL))
+        self._available = None
+        self._checked_at = 0.0
+        # 进行中的检测任务，按事件循环区分
+        self._pending: Dict[int, asyncio.Task] = {}
+
+    async def get_proxy(self) -> Optional[str]:
+        """获取当前应使用的代理地址
+
+        Returns:
+            代理地址，直连时返回None
+        """
+        if self.mode == 'off':
+            return None
+        if self.mode == 'on':
+            return self.url
+
+        if self._available is None:
+            # 首次使用时等待检测完成，并发的首批请求共享同一次检测
+            await self._start_refresh()
+        elif time.monotonic() - self._checked_at > self.ttl:
+            # 缓存过期时先沿用旧结果，在后台重新检测
+            self._start_refresh()
+
+        return self.url if self._available else None
+
+    async def refresh(self) -> bool:
+        """立即重新检测代理是否可用
+
+        Returns:
+            代理是否可用
+        """
+        available = await probe_proxy(self.url)
+        if available != self._available:
+            logger.info(f"代理 {self.url} {'可用，通过代理连接' if available else '不可用，使用直接连接'}")
+        self._available = available
+        self._checked_at = time.monotonic()
+        return available
+
+    def _start_refresh(self) -> asyncio.Task:
+        """启动（或复用）当前事件循环中的检测任务"""
+        loop_id = id(asyncio.get_running_loop())
+        task = self._pending.get(loop_id)
+        if task is None or task.done():
+            task = asyncio.ensure_future(self.refresh())
+            self._pending[loop_id] = task
+            task.add_done_callback(
+                lambda done: self._pending.pop(loop_id, None) if self._pending.get(loop_id) is done else None
+            )
+        return task
+
+
+# 全局代理配置
+proxy_config = ProxyConfig()
+
+
+def configure_proxy(url: str = None, mode: str = None, ttl: float = None) -> ProxyConfig:
+    """替换全局代理配置
+
+    Args:
+        url: 代理地址
+        mode: 代理模式 auto/on/off
+        ttl: 检测结果缓存时间（秒）
+
+    Returns:
+        新的代理配置
+    """
+    global proxy_config
+    proxy_config = ProxyConfig(url=url, mode=mode, ttl=ttl)
+    return proxy_config
+
+
+async def get_proxy() -> Optional[str]:
+    """获取全局代理配置下当前应使用的代理地址"""
+    return await proxy_config.get_proxy()
@@ -5,6 +5,8 @@
 
 import os
 import json
+import time
+import logging
 from typing import List, Dict, Any, Optional, Union
 import asyncio
 from langchain_core.tools import BaseTool
@@ -21,14 +23,71 @@ from deep_research.tools import WebSearchTool
 # 导入自定义的LLM接口
 import sys
 sys.path.append('..')
-from LLMapi_service.gptservice import GPT
+from LLMapi_service.gptservice import GPT, GPT_stream, collect_stream
+from LLMapi_service.resilience import LLMError
+from LLMapi_service.metrics import metric_tags
+from LLMapi_service.logger import get_logger, log_payload
 
-from deep_research.config import DEFAULT_MODEL
+from deep_research.config import (
+    DEFAULT_MODEL, KB_SEARCH_TOP_K, KB_SEARCH_TOP_K_RERANKED,
+    SOLVE_CONTEXT_TOKENS, DECOMPOSE_CONTEXT_TOKENS, ASSESS_CONTEXT_TOKENS, PLANNING_MODE
+)
+from deep_research.scheduler import ConcurrencyLimiter, SubtaskScheduler
+from deep_research.decomposer import TaskDependencyResolver
+from deep_research.context_builder import build_context
+from deep_research.tracing import Tracer
+from deep_research.output_organizer import OutputOrganizer, parse_json_content
+from deep_research.report_writer import ReportWriter
+
+logger = get_logger("deep_research.agent")
 
 # 设置默认最大递归深度
 DEFAULT_MAX_RECURSION_DEPTH = 3
 # 设置任务的最小复杂度阈值
 COMPLEXITY_THRESHOLD = 0.6
+# 规划方式
+PLANNING_MODES = ("sequential", "speculative", "merged")
+
+
+def validate_subtasks(subtasks: Any) -> List[Dict]:
+    """检查子任务列表的格式，不符合时抛出 ValueError"""
+    if not isinstance(subtasks, list) or not subtasks:
+        raise ValueError("子任务应为非空数组")
+    for subtask in subtasks:
+        if not isinstance(subtask, dict):
+            raise ValueError("子任务应为对象")
+        if "id" not in subtask or "description" not in subtask:
+            raise ValueError("子任务缺少id或description字段")
+    return subtasks
+
+
+def default_subtasks(task: str) -> List[Dict]:
+    """分解失败时使用的默认子任务"""
+    return [
+        {"id": "task1", "description": f"深入研究'{task}'的背景和上下文", "requires": []},
+        {"id": "task2", "description": f"分析'{task}'的核心问题和挑战", "requires": []},
+        {"id": "task3", "description": f"提供关于'{task}'的解决方案和建议", "requires": []}
+    ]
+
+
+async def stream_llm(messages: List[Dict], model: str, stream_callback, source_id: str, label: str, slot=None) -> Dict:
+    """流式调用LLM，把增量推送给流式回调，返回与 GPT() 相同格式的完整回复
+    
+    Args:
+        messages: 提示消息列表
+        model: 使用的模型
+        stream_callback: 流式回调，参数为 {"id", "label", "delta", "text", "done"}
+        source_id: 输出来源标识，如 node:root_task1、section:intro
+        label: 显示给用户的来源说明
+        slot: 可选，每次请求尝试占用的槽位，见 GPT_stream()
+    """
+    def on_delta(delta: Dict, text: str):
+        stream_callback({"id": source_id, "label": label, "delta": delta["content"], "text": text, "done": False})
+    
+    try:
+        return await collect_stream(GPT_stream(messages, selected_model=model, slot=slot), on_delta)
+    finally:
+        stream_callback({"id": source_id, "label": label, "delta": "", "text": "", "done": True})
 
 class DeepResearchNode:
     """深度研究节点，用于递归解决复杂问题"""
@@ -43,7 +102,11 @@ class DeepResearchNode:
         knowledge_base = None,
         depth: int = 0,
         max_recursion_depth: int = DEFAULT_MAX_RECURSION_DEPTH,
-        model: str = DEFAULT_MODEL
+        model: str = DEFAULT_MODEL,
+        limiter: Optional[ConcurrencyLimiter] = None,
+        stream_callback = None,
+        tracer: Optional[Tracer] = None,
+        planning_mode: str = PLANNING_MODE
     ):
         self.llm = llm
         self.tools = tools or []
@@ -56,6 +119,18 @@ class DeepResearchNode:
         self.depth = depth  # 当前节点深度
         self.max_recursion_depth = max_recursion_depth  # 最大递归深度
         self.model = model
+        # 整棵研究树共享同一个并发限制器
+        self.limiter = limiter or ConcurrencyLimiter()
+        # 整棵研究树共享同一个链路追踪记录，节点和各阶段的 span 按研究树嵌套
+        self.tracer = tracer or Tracer()
+        if planning_mode not in PLANNING_MODES:
+            raise ValueError(f"未知的规划方式: {planning_mode}，可选 {', '.join(PLANNING_MODES)}")
+        # 检索、复杂度评估和任务分解的执行方式，见 config.PLANNING_MODE
+        self.planning_mode = planning_mode
+        # 流式输出回调，设置后直接解决任务时会实时推送生成的文本
+        self.stream_callback = stream_callback
+        # 各类提示的上下文 token 统计，键为 assess / decompose / plan / solve
+        self.context_stats = {}
         
         # 初始化WebSearchTool
         # 检查传入的tools中是否有WebSearchTool
@@ -71,12 +146,21 @@ class DeepResearchNode:
     
     async def process_task(self, task: str, context: Dict = None) -> Dict:
         """处理任务，评估复杂度，决定是否需要拆分"""
+        with self.tracer.span("node", node_id=self.node_id, depth=self.depth, task=task[:100]) as span:
+            result = await self._process_task(task, context)
+            span.set(is_complex=result["is_complex"])
+            return result
+
+    async def _process_task(self, task: str, context: Dict = None) -> Dict:
+        """处理任务的各个阶段，每个阶段记录为节点 span 下的一个子 span"""
         
         # 检查递归深度
         if self.depth >= self.max_recursion_depth:
-            print(f"达到最大递归深度 {self.max_recursion_depth}，直接解决任务: {task}")
-            solution = await self._solve_task(task, context or {})
-            await self._store_in_knowledge_base(task, "max_depth_reached", None, solution)
+            logger.info(f"达到最大递归深度 {self.max_recursion_depth}，直接解决任务: {task}")
+            with self.tracer.span("solve", phase="solve"):
+                solution = await self._solve_task(task, context or {})
+            with self.tracer.span("store", phase="store"):
+                await self._store_in_knowledge_base(task, "max_depth_reached", None, solution)
             return {
                 "task": task,
                 "is_complex": False,
@@ -92,33 +176,46 @@ class DeepResearchNode:
         if context:
             current_context.update(context)
             
-        # 1. 检索增强阶段 - 仅在深度较浅时执行以节省API调用
-        if self.depth <= 1:
-            enhanced_context = await self._enhance_with_retrieval(task, current_context)
+        # 1. 检索增强阶段（仅在深度较浅时执行以节省API调用）和 2. 评估任务复杂度
+        subtasks = None
+        if self.planning_mode == "sequential":
+            if self.depth <= 1:
+                with self.tracer.span("retrieval", phase="retrieval"):
+                    enhanced_context = await self._enhance_with_retrieval(task, current_context)
+            else:
+                enhanced_context = current_context
+            
+            with self.tracer.span("complexity", phase="assess"):
+                complexity_assessment = await self._assess_complexity(task, enhanced_context)
         else:
-            enhanced_context = current_context
+            enhanced_context, complexity_assessment, subtasks = await self._retrieve_and_plan(task, current_context)
         
-        # 2. 评估任务复杂度
-        complexity_assessment = await self._assess_complexity(task, enhanced_context)
-        
-        print(f"任务复杂度评估 [{self.node_id}] - '{task[:50]}...': {complexity_assessment}")
+        logger.info(f"任务复杂度评估 [{self.node_id}] - '{task[:50]}...': {complexity_assessment}")
         
         # 3. 根据复杂度决定是否需要拆分任务
         if complexity_assessment["is_complex"] and self.depth < self.max_recursion_depth:
-            print(f"拆分复杂任务 [{self.node_id}]: {task[:50]}...")
-            subtasks = await self._decompose_task(task, enhanced_context)
+            logger.info(f"拆分复杂任务 [{self.node_id}]: {task[:50]}...")
+            if subtasks is None:
+                with self.tracer.span("decomposition", phase="decompose") as span:
+                    subtasks = await self._decompose_task(task, enhanced_context)
+                    span.set(subtasks=len(subtasks))
             
             # 限制子任务数量，防止过度分解
             if len(subtasks) > 5:
                 subtasks = subtasks[:5]
+            # 模型可能给出重复的子任务ID，改名后每个子任务都会执行，结果也不会互相覆盖
+            subtasks = TaskDependencyResolver.deduplicate_ids(subtasks)
                 
-            results = await self._process_subtasks(subtasks, enhanced_context)
+            with self.tracer.span("children", phase="children", subtasks=len(subtasks)):
+                results = await self._process_subtasks(subtasks, enhanced_context)
             
             # 存储结果到知识库
-            await self._store_in_knowledge_base(task, "complex", subtasks, results)
+            with self.tracer.span("store", phase="store"):
+                await self._store_in_knowledge_base(task, "complex", subtasks, results)
             
             # 在结果中包含任务细节
-            solution_summary = await self._summarize_solutions(task, subtasks, results) 
+            with self.tracer.span("summarize", phase="summarize"):
+                solution_summary = await self._summarize_solutions(task, subtasks, results) 
             
             return {
                 "task": task,
@@ -130,11 +227,13 @@ class DeepResearchNode:
             }
         else:
             # 直接解决任务
-            print(f"直接解决任务 [{self.node_id}]: {task[:50]}...")
-            solution = await self._solve_task(task, enhanced_context)
+            logger.info(f"直接解决任务 [{self.node_id}]: {task[:50]}...")
+            with self.tracer.span("solve", phase="solve"):
+                solution = await self._solve_task(task, enhanced_context)
             
             # 存储结果到知识库
-            await self._store_in_knowledge_base(task, "simple", None, solution)
+            with self.tracer.span("store", phase="store"):
+                await self._store_in_knowledge_base(task, "simple", None, solution)
             
             return {
                 "task": task,
@@ -143,6 +242,39 @@ class DeepResearchNode:
                 "solution": solution
             }
     
+    def _prompt_context(self, task: str, context: Dict, budget: int, purpose: str) -> str:
+        """在 token 预算内整理提示中的上下文，并记录 token 统计
+
+        完整上下文的 token 数需要序列化整个上下文，只在开启调试日志时统计
+        """
+        debug = logger.isEnabledFor(logging.DEBUG)
+        text, stats = build_context(context, task, budget, measure_raw=debug)
+        self.context_stats[purpose] = stats
+        if debug:
+            logger.debug(
+                f"[{self.node_id}] {purpose} 上下文 {stats['tokens']}/{budget} tokens"
+                f"（完整上下文约 {stats['raw_tokens']}），检索结果 {stats['items_used']}/{stats['items']} 条"
+            )
+        return text
+    
+    async def _call_llm(self, messages: List[Dict], phase: str) -> Dict:
+        """在并发限制下调用LLM，调用指标按节点和阶段（assess / decompose / solve / summarize）归类
+
+        每次请求尝试各自占用调用槽位，重试退避期间不占用
+        """
+        with metric_tags(node_id=self.node_id, phase=phase), self.tracer.span("llm", phase=phase, model=self.model) as span:
+            return await GPT(messages, selected_model=self.model, slot=self.limiter.attempt_slot(span))
+    
+    async def _call_llm_stream(self, messages: List[Dict], label: str, phase: str) -> Dict:
+        """在并发限制下流式调用LLM，未设置流式回调时退化为普通调用"""
+        if not self.stream_callback:
+            return await self._call_llm(messages, phase)
+        with metric_tags(node_id=self.node_id, phase=phase), self.tracer.span("llm", phase=phase, model=self.model, stream=True) as span:
+            return await stream_llm(
+                messages, self.model, self.stream_callback, f"node:{self.node_id}", label,
+                slot=self.limiter.attempt_slot(span)
+            )
+    
     async def _summarize_solutions(self, task: str, subtasks: List[Dict], results: Dict) -> str:
         """总结子任务的解决方案"""
         
@@ -165,8 +297,16 @@ class DeepResearchNode:
 """}
         ]
         
-        response = await GPT(messages, selected_model=self.model)
-        return response["content"]
+        try:
+            response = await self._call_llm(messages, "summarize")
+            return response["content"]
+        except LLMError as e:
+            # 总结失败时直接拼接各子任务的结论，避免丢弃整棵子树的研究结果
+            logger.warning(f"总结子任务结果时出错: {e}")
+            return "\n\n".join(
+                f"{subtask['description']}: {self._brief_result(results[subtask['id']])}"
+                for subtask in subtasks if subtask["id"] in results
+            )
     
     async def _enhance_with_retrieval(self, task: str, context: Dict) -> Dict:
         """通过检索增强上下文"""
@@ -176,32 +316,181 @@ class DeepResearchNode:
         if self.depth <= 1:
             try:
                 # 使用实际的WebSearchTool进行网络搜索
-                web_search_results = await self._web_search(task)
+                with self.tracer.span("web_search", phase="search"):
+                    web_search_results = await self._web_search(task)
                 if web_search_results:
                     enhanced_context["web_search"] = web_search_results
                     
                 # 知识库搜索增强 
-                kb_search_results = await self._knowledge_base_search(task)
+                with self.tracer.span("kb_search", phase="kb_search"):
+                    kb_search_results = await self._knowledge_base_search(task)
                 if kb_search_results:
                     enhanced_context["kb_search"] = kb_search_results
             except Exception as e:
-                print(f"检索增强阶段出错: {e}")
+                logger.warning(f"检索增强阶段出错: {e}")
             
         return enhanced_context
     
+    async def _traced(self, name: str, phase: str, awaitable, **attributes):
+        """在独立 span 中等待协程，用于并发启动的阶段"""
+        with self.tracer.span(name, phase=phase, **attributes):
+            return await awaitable
+    
+    async def _retrieve_and_plan(self, task: str, context: Dict):
+        """并发执行检索和规划，缩短子节点开始前的关键路径
+
+        网络搜索在后台进行，知识库检索完成后即开始规划：speculative 方式同时发起复杂度评估和任务分解，
+        评估为简单任务时取消分解；merged 方式用一次调用完成评估和分解。网络搜索结果在规划完成后并入上下文
+
+        Returns:
+            (增强后的上下文, 复杂度评估, 子任务列表)，子任务列表为 None 时表示尚未分解
+        """
+        enhanced_context = context.copy()
+        web_search = None
+        if self.depth <= 1:
+            web_search = asyncio.create_task(self._traced("web_search", "search", self._web_search(task)))
+            try:
+                kb_search_results = await self._traced("kb_search", "kb_search", self._knowledge_base_search(task))
+                if kb_search_results:
+                    enhanced_context["kb_search"] = kb_search_results
+            except Exception as e:
+                logger.warning(f"知识库检索出错: {e}")
+        
+        try:
+            with self.tracer.span("planning", phase="plan", mode=self.planning_mode) as span:
+                if self.depth >= self.max_recursion_depth - 1:
+                    # 评估不调用LLM，直接视为简单任务，无需分解
+                    assessment, subtasks = await self._assess_complexity(task, enhanced_context), None
+                elif self.planning_mode == "merged":
+                    assessment, subtasks = await self._assess_and_decompose(task, enhanced_context)
+                else:
+                    assessment, subtasks = await self._speculative_plan(task, enhanced_context)
+                span.set(is_complex=bool(assessment.get("is_complex")), subtasks=len(subtasks or []))
+        except BaseException:
+            if web_search is not None:
+                web_search.cancel()
+            raise
+        
+        if web_search is not None:
+            web_search_results = await web_search
+            if web_search_results:
+                enhanced_context["web_search"] = web_search_results
+        return enhanced_context, assessment, subtasks
+    
+    async def _speculative_plan(self, task: str, context: Dict):
+        """同时发起复杂度评估和任务分解，评估为简单任务时取消分解
+
+        Returns:
+            (复杂度评估, 子任务列表)，简单任务的子任务列表为 None
+        """
+        decomposition = asyncio.create_task(
+            self._traced("decomposition", "decompose", self._decompose_task(task, context), speculative=True)
+        )
+        try:
+            assessment = await self._traced("complexity", "assess", self._assess_complexity(task, context))
+        except BaseException:
+            decomposition.cancel()
+            raise
+        
+        if assessment.get("is_complex"):
+            return assessment, await decomposition
+        
+        # 简单任务丢弃投机的分解结果；分解仍在进行时取消，避免继续占用调用槽位
+        decomposition.cancel()
+        try:
+            await decomposition
+        except asyncio.CancelledError:
+            pass
+        return assessment, None
+    
+    async def _assess_and_decompose(self, task: str, context: Dict):
+        """用一次调用评估复杂度并在复杂时给出子任务，解析失败时退回单独评估
+
+        Returns:
+            (复杂度评估, 子任务列表)，简单任务或回答中没有有效子任务时子任务列表为 None
+        """
+        messages = [
+            {"role": "system", "content": """你是一位研究任务规划专家。
+请先评估给定任务的复杂度，判断是否需要进一步分解为子任务；如果需要，再将其分解为多个更小、更具体的子任务。
+
+任务复杂度的判断标准：
+1. 是否需要多步骤解决
+2. 是否涉及多个不同领域或角度
+3. 是否需要收集和分析大量信息
+4. 是否存在多个相互关联的子问题
+
+每个子任务应该足够具体、可以独立解决，共同涵盖原始任务的所有方面，彼此之间有最小的重叠，并按照逻辑顺序排列。
+
+请以JSON格式回答：
+{
+    "is_complex": true或false,
+    "reasoning": "你的解释...",
+    "complexity_score": 0.1到1.0之间的数值（越高越复杂）,
+    "subtasks": [  // 仅在 is_complex 为 true 时给出3-5个子任务，否则为空数组
+        {
+            "id": "task1",
+            "description": "子任务的具体描述",
+            "requires": []  // 可选，依赖的其他任务ID列表
+        }
+    ]
+}
+仅输出JSON，无需额外说明。
+"""},
+            {"role": "user", "content": f"""
+任务：{task}
+当前深度：{self.depth}
+递归上限：{self.max_recursion_depth}
+
+上下文：
+{self._prompt_context(task, context, DECOMPOSE_CONTEXT_TOKENS, "plan")}
+
+请评估该任务的复杂度，并在需要时给出子任务。
+"""}
+        ]
+        
+        try:
+            with self.tracer.span("complexity", phase="plan", merged=True):
+                response = await self._call_llm(messages, "plan")
+            plan = parse_json_content(response["content"])
+            if not isinstance(plan, dict) or "is_complex" not in plan:
+                raise ValueError("规划结果缺少is_complex字段")
+        except LLMError as e:
+            logger.warning(f"规划任务时出错，改为单独评估: {e}")
+            return await self._assess_complexity(task, context), None
+        except (json.JSONDecodeError, ValueError) as e:
+            logger.warning(f"规划结果解析失败，改为单独评估: {e}")
+            log_payload(logger, "规划结果", response["content"])
+            return await self._assess_complexity(task, context), None
+        
+        subtasks = plan.pop("subtasks", None)
+        try:
+            if "complexity_score" in plan and float(plan["complexity_score"]) < COMPLEXITY_THRESHOLD:
+                plan["is_complex"] = False
+        except (TypeError, ValueError):
+            pass
+        if not plan["is_complex"]:
+            return plan, None
+        try:
+            return plan, validate_subtasks(subtasks)
+        except ValueError as e:
+            # 评估为复杂但子任务无效，由调用方再单独分解
+            logger.warning(f"规划结果中的子任务无效: {e}")
+            return plan, None
+    
     async def _web_search(self, query: str) -> List[Dict]:
         """执行网络搜索"""
         try:
-            print(f"使用WebSearchTool执行搜索: {query}")
-            # 调用WebSearchTool进行实际搜索
-            search_results_json = await self.web_search_tool._arun(query)
+            logger.info(f"使用WebSearchTool执行搜索: {query}")
+            # 调用WebSearchTool进行实际搜索，搜索同样通过LLM完成，需占用调用槽位
+            with metric_tags(node_id=self.node_id):
+                search_results_json = await self.web_search_tool._arun(query, slot=self.limiter.attempt_slot())
             # 解析JSON结果
             search_results = json.loads(search_results_json)
             
-            print(f"搜索结果: {len(search_results)} 条")
+            logger.info(f"搜索结果: {len(search_results)} 条")
             return search_results
         except Exception as e:
-            print(f"网络搜索出错: {e}")
+            logger.warning(f"网络搜索出错: {e}")
             # 出错时返回空结果
             return []
     
@@ -209,8 +498,29 @@ class DeepResearchNode:
         """在知识库中搜索相关信息"""
         if not self.knowledge_base:
             return []
+        
+        # 向量知识库：在线程池中做段落级混合检索，重排序后的结果更精确，只取更少的段落
+        if hasattr(self.knowledge_base, 'asearch'):
+            top_k = KB_SEARCH_TOP_K_RERANKED if getattr(self.knowledge_base, 'reranker', None) else KB_SEARCH_TOP_K
+            try:
+                results = await self.knowledge_base.asearch(query, top_k=top_k)
+            except Exception as e:
+                logger.warning(f"知识库检索出错: {e}")
+                return []
+            # 只把段落和来源放入上下文，不再带上整个条目
+            return [
+                {
+                    "passage": result["text"],
+                    "node_id": result["node_id"],
+                    "source_url": result["source_url"],
+                    "relevance_score": result.get("relevance_score")
+                }
+                for result in results
+                # 不检索到当前节点自身的旧结果
+                if result["entry_id"] != self.node_id
+            ]
             
-        # 简单实现关键词匹配
+        # 普通字典：简单实现关键词匹配
         results = []
         query_lower = query.lower()
         
@@ -219,7 +529,7 @@ class DeepResearchNode:
             if query_lower in entry_str:
                 results.append({"id": entry_id, "entry": entry})
                 
-        return results[:3]  # 限制结果数量
+        return results[:KB_SEARCH_TOP_K]  # 限制结果数量
     
     async def _assess_complexity(self, task: str, context: Dict) -> Dict:
         """评估任务复杂度"""
@@ -251,27 +561,19 @@ class DeepResearchNode:
 递归上限：{self.max_recursion_depth}
 
 上下文：
-{json.dumps(context, ensure_ascii=False, indent=2)}
+{self._prompt_context(task, context, ASSESS_CONTEXT_TOKENS, "assess")}
 
 请评估该任务的复杂度。
 """}
         ]
         
         try:
-            response = await GPT(messages, selected_model=self.model)
+            response = await self._call_llm(messages, "assess")
             content = response["content"]
             
             # 尝试解析JSON
             try:
-                # 如果内容被包裹在代码块中，提取JSON部分
-                if "```json" in content and "```" in content:
-                    json_part = content.split("```json")[1].split("```")[0].strip()
-                    assessment = json.loads(json_part)
-                elif "```" in content:
-                    json_part = content.split("```")[1].split("```")[0].strip()
-                    assessment = json.loads(json_part)
-                else:
-                    assessment = json.loads(content)
+                assessment = parse_json_content(content)
                 
                 # 验证评估结果
                 if "is_complex" in assessment:
@@ -280,7 +582,8 @@ class DeepResearchNode:
                         assessment["is_complex"] = False
                     return assessment
             except (json.JSONDecodeError, ValueError):
-                print(f"评估结果解析失败: {content}")
+                logger.warning("评估结果解析失败")
+                log_payload(logger, "评估结果", content)
             
             # 简单规则：如果回答中包含"复杂"或"需要分解"等关键词，则视为复杂任务
             is_complex = any(keyword in content.lower() for keyword in ["complex", "complicated", "multiple", "分解", "复杂", "多个"])
@@ -292,7 +595,7 @@ class DeepResearchNode:
                 "complexity_score": 0.7 if is_complex else 0.3
             }
         except Exception as e:
-            print(f"评估任务复杂度时出错: {e}")
+            logger.warning(f"评估任务复杂度时出错: {e}")
             # 出错时，如果在较深层级，倾向于视为简单任务
             return {
                 "is_complex": self.depth < 1,
@@ -326,106 +629,103 @@ class DeepResearchNode:
 需要分解的任务: {task}
 
 上下文信息:
-{json.dumps(context, ensure_ascii=False, indent=2)}
+{self._prompt_context(task, context, DECOMPOSE_CONTEXT_TOKENS, "decompose")}
 
 请将此任务分解为3-5个更小、更具体的子任务。
 """}
         ]
         
         try:
-            response = await GPT(messages, selected_model=self.model)
+            response = await self._call_llm(messages, "decompose")
             content = response["content"]
             
-            # 尝试解析JSON
+            # 尝试解析JSON并验证子任务
             try:
-                # 如果内容被代码块包装，提取JSON部分
-                if "```json" in content and "```" in content:
-                    json_part = content.split("```json")[1].split("```")[0].strip()
-                    subtasks = json.loads(json_part)
-                elif "```" in content:
-                    json_part = content.split("```")[1].split("```")[0].strip()
-                    subtasks = json.loads(json_part)
-                else:
-                    subtasks = json.loads(content)
-                
-                # 验证子任务
-                if not isinstance(subtasks, list):
-                    raise ValueError("子任务应为数组")
-                    
-                for task in subtasks:
-                    if not isinstance(task, dict):
-                        raise ValueError("子任务应为对象")
-                    if "id" not in task or "description" not in task:
-                        raise ValueError("子任务缺少id或description字段")
-                
-                return subtasks
+                return validate_subtasks(parse_json_content(content))
             except (json.JSONDecodeError, ValueError) as e:
-                print(f"任务分解结果解析错误: {e}")
+                logger.warning(f"任务分解结果解析错误: {e}")
                 # 尝试使用正则表达式提取
                 import re
                 matches = re.findall(r'"id":\s*"([^"]+)"[^}]*"description":\s*"([^"]+)"', content)
                 if matches:
-                    print("使用正则表达式提取子任务")
+                    logger.info("使用正则表达式提取子任务")
                     return [{"id": f"task{i+1}", "description": desc, "requires": []} 
                             for i, (_, desc) in enumerate(matches)]
                 
                 # 如果还是失败，使用简单方法创建子任务
-                print("使用简单方法创建子任务")
-                return [
-                    {"id": "task1", "description": f"深入研究'{task}'的背景和上下文", "requires": []},
-                    {"id": "task2", "description": f"分析'{task}'的核心问题和挑战", "requires": []},
-                    {"id": "task3", "description": f"提供关于'{task}'的解决方案和建议", "requires": []}
-                ]
+                logger.info("使用简单方法创建子任务")
+                return default_subtasks(task)
         except Exception as e:
-            print(f"分解任务时出错: {e}")
-            return [
-                {"id": "task1", "description": f"深入研究'{task}'的背景和上下文", "requires": []},
-                {"id": "task2", "description": f"分析'{task}'的核心问题和挑战", "requires": []},
-                {"id": "task3", "description": f"提供关于'{task}'的解决方案和建议", "requires": []}
-            ]
+            logger.warning(f"分解任务时出错: {e}")
+            return default_subtasks(task)
     
     async def _process_subtasks(self, subtasks: List[Dict], context: Dict) -> Dict:
-        """处理子任务列表"""
-        results = {}
+        """并发处理子任务列表，有依赖关系的子任务在其依赖完成后执行"""
         
-        for i, subtask in enumerate(subtasks):
-            task_id = subtask["id"]
-            task_desc = subtask["description"]
-            
-            print(f"处理子任务 {i+1}/{len(subtasks)}: {task_desc[:50]}...")
-            
-            # 创建子节点
-            child_node = DeepResearchNode(
+        # 子节点按子任务顺序创建，报告树和结果整理遍历 child_nodes 时与子任务顺序一致，而不是完成顺序
+        child_nodes = [
+            DeepResearchNode(
                 llm=self.llm,
                 tools=self.tools,  # 传递tools
                 parent_node=self,
-                node_id=f"{self.node_id}_{task_id}",
+                node_id=f"{self.node_id}_{subtask['id']}",
                 research_context=context,
                 knowledge_base=self.knowledge_base,
                 depth=self.depth + 1,
                 max_recursion_depth=self.max_recursion_depth,
-                model=self.model
+                model=self.model,
+                limiter=self.limiter,
+                stream_callback=self.stream_callback,
+                tracer=self.tracer,
+                planning_mode=self.planning_mode
             )
+            for subtask in subtasks
+        ]
+        self.child_nodes.extend(child_nodes)
+        
+        async def run_subtask(index: int, subtask: Dict, dependency_results: Dict) -> Dict:
+            task_id = subtask["id"]
+            task_desc = subtask["description"]
+            
+            logger.info(f"处理子任务 {index + 1}/{len(subtasks)}: {task_desc[:50]}...")
             
-            # 将子节点添加到当前节点的子节点列表
-            self.child_nodes.append(child_node)
+            # 将依赖任务的结论作为子任务的上下文
+            subtask_context = None
+            if dependency_results:
+                subtask_context = {
+                    "dependency_results": {
+                        dep_id: self._brief_result(result)
+                        for dep_id, result in dependency_results.items()
+                    }
+                }
             
             # 处理子任务
             try:
-                subtask_result = await child_node.process_task(task_desc)
-                results[task_id] = subtask_result
+                return await child_nodes[index].process_task(task_desc, subtask_context)
             except Exception as e:
-                print(f"处理子任务 {task_id} 时出错: {e}")
-                results[task_id] = {
+                logger.warning(f"处理子任务 {task_id} 时出错: {e}")
+                return {
                     "error": str(e),
                     "task": task_desc
                 }
         
-        return results
+        return await SubtaskScheduler().run(subtasks, run_subtask)
+    
+    @staticmethod
+    def _brief_result(result: Dict, max_length: int = 1000) -> str:
+        """提取子任务结果的简要结论"""
+        if "summary" in result:
+            text = result["summary"]
+        elif isinstance(result.get("solution"), dict):
+            text = result["solution"].get("solution", "")
+        else:
+            text = result.get("solution") or result.get("error", "")
+        text = str(text)
+        return text[:max_length] + "..." if len(text) > max_length else text
     
     async def _solve_task(self, task: str, context: Dict) -> Dict:
         """解决不需要拆分的简单任务"""
-        print(f"直接解决任务: {task[:100]}...")
+        logger.debug(f"直接解决任务: {task[:100]}...")
         
         # 调用LLM解决任务
         messages = [
@@ -445,22 +745,24 @@ class DeepResearchNode:
 任务: {task}
 
 上下文信息:
-{json.dumps(context, ensure_ascii=False, indent=2)}
+{self._prompt_context(task, context, SOLVE_CONTEXT_TOKENS, "solve")}
 
 请提供详细的解答。
 """}
         ]
         
         try:
-            response = await GPT(messages, selected_model=self.model)
+            response = await self._call_llm_stream(messages, f"研究: {task[:50]}", "solve")
             solution = {
                 "solution": response["content"],
-                "context": context
+                "context": context,
+                "context_stats": self.context_stats.get("solve")
             }
             return solution
         except Exception as e:
-            print(f"解决任务时出错: {e}")
-            return {"solution": f"解决任务时出错: {str(e)}", "context": context}
+            logger.warning(f"解决任务时出错: {e}")
+            # 错误信息单独记录，不作为研究内容进入报告
+            return {"solution": "", "error": str(e), "context": context}
     
     async def _store_in_knowledge_base(self, task: str, task_type: str, subtasks: Optional[List] = None, results: Any = None):
         """将研究结果存储到知识库"""
@@ -468,7 +770,6 @@ class DeepResearchNode:
             return
             
         try:
-            import time
             entry = {
                 "node_id": self.node_id,
                 "task": task,
@@ -479,10 +780,13 @@ class DeepResearchNode:
                 "timestamp": time.time()
             }
             
-            # 使用节点ID作为条目ID
-            self.knowledge_base[self.node_id] = entry
+            # 使用节点ID作为条目ID；向量知识库立即写入索引，之后的兄弟节点即可检索到
+            if hasattr(self.knowledge_base, 'aadd_entry'):
+                await self.knowledge_base.aadd_entry(entry, entry_id=self.node_id)
+            else:
+                self.knowledge_base[self.node_id] = entry
         except Exception as e:
-            print(f"存储知识库时出错: {e}")
+            logger.warning(f"存储知识库时出错: {e}")
 
 class DeepResearchAgent:
     """深度研究代理，管理整个研究流程"""
@@ -491,24 +795,35 @@ class DeepResearchAgent:
         self, 
         model: str = DEFAULT_MODEL,
         max_recursion_depth: int = DEFAULT_MAX_RECURSION_DEPTH,
-        knowledge_base: Dict = None
+        knowledge_base = None,
+        planning_mode: str = PLANNING_MODE
     ):
         """初始化深度研究代理
         
         Args:
             model: 使用的大语言模型名称
             max_recursion_depth: 研究的最大递归深度
+            knowledge_base: 知识库，可以是 KnowledgeBase（向量检索）或普通字典（关键词匹配）
+            planning_mode: 研究节点的规划方式（sequential / speculative / merged），见 config.PLANNING_MODE
         """
         self.model = model
+        self.planning_mode = planning_mode
         self.knowledge_base = knowledge_base or {}
         self.max_recursion_depth = max_recursion_depth
         self.root_node = None
+        # 最近一次研究的报告引擎，入口程序用它把生成的内容格式化为 Markdown / HTML
+        self.organizer = OutputOrganizer(model=model)
+        # 最近一次研究的链路追踪记录，每次 research() 重新创建
+        self.tracer = Tracer()
         # 创建工具实例
         self.tools = [
             WebSearchTool(),  # 添加网络搜索工具
         ]
         # 添加进度回调函数和当前进度状态
         self.progress_callback = None
+        self.stream_callback = None
+        # 可选的报告写入器，报告章节生成后立即写入磁盘
+        self.report_writer: Optional[ReportWriter] = None
         self.current_progress = {
             "status": "initialized",
             "progress": 0,
@@ -520,6 +835,14 @@ class DeepResearchAgent:
         """设置进度回调函数"""
         self.progress_callback = callback
     
+    def set_stream_callback(self, callback):
+        """设置流式输出回调函数，研究和报告生成过程中的文本会实时推送给它"""
+        self.stream_callback = callback
+    
+    def set_report_writer(self, writer: Optional[ReportWriter]):
+        """设置报告写入器，报告的每个章节完成后即追加到输出目录中的报告文件"""
+        self.report_writer = writer
+    
     def update_progress(self, progress: int, message: str, detail: Dict = None):
         """更新进度信息并调用回调函数"""
         self.current_progress = {
@@ -533,13 +856,19 @@ class DeepResearchAgent:
             self.progress_callback(self.current_progress)
     
     async def research(self, query: str) -> Dict:
-        """执行深度研究流程"""
+        """执行深度研究流程，整个流程的链路追踪记录在 self.tracer 中"""
+        self.tracer = Tracer()
+        with self.tracer.span("research", query=query[:100], model=self.model, max_depth=self.max_recursion_depth):
+            return await self._research(query)
+
+    async def _research(self, query: str) -> Dict:
+        """执行研究树和报告生成"""
         # 更新状态：开始研究
         self.update_progress(5, f"开始研究: {query[:50]}...", {"query": query})
         
-        print(f"开始研究: {query}")
-        print(f"使用模型: {self.model}")
-        print(f"最大递归深度: {self.max_recursion_depth}")
+        logger.info(f"开始研究: {query}")
+        logger.info(f"使用模型: {self.model}")
+        logger.info(f"最大递归深度: {self.max_recursion_depth}")
         
         # 创建根研究节点
         self.root_node = DeepResearchNode(
@@ -548,7 +877,10 @@ class DeepResearchAgent:
             depth=0,
             max_recursion_depth=self.max_recursion_depth,  # 传递最大递归深度
             tools=self.tools,  # 传递tools
-            model=self.model
+            model=self.model,
+            stream_callback=self.stream_callback,
+            tracer=self.tracer,
+            planning_mode=self.planning_mode
         )
         
         # 通知前台开始处理核心问题
@@ -562,270 +894,32 @@ class DeepResearchAgent:
                             {"completed_nodes": 1, "total_depth": research_results.get("depth", 0)})
         
         # 整理输出
-        output = await self._organize_output(query, research_results)
+        with self.tracer.span("organize"):
+            output = await self._organize_output(query, research_results)
         
-        # 更新状态：完成
-        self.update_progress(95, "研究报告生成完成", 
-                           {"sections": len(output.get("content", {}).get("sections", []))})
+        # 更新状态：完成，生成失败的章节在状态中单独列出
+        failed_sections = output.get("failed_sections", [])
+        message = f"研究报告生成完成，{len(failed_sections)} 个章节生成失败" if failed_sections else "研究报告生成完成"
+        self.update_progress(95, message,
+                           {"sections": len(output.get("content", {}).get("sections", [])),
+                            "failed_sections": failed_sections})
         
         return output
 
     async def _organize_output(self, query: str, research_results: Dict) -> Dict:
-        """整理研究结果"""
-        # 更新状态
-        self.update_progress(80, "创建研究报告大纲", {})
-        
-        print("整理研究结果...")
-        
-        # 创建大纲
-        outline = await self._create_outline(query, research_results)
-        
-        # 更新状态
-        self.update_progress(85, "根据大纲生成完整内容", 
-                           {"sections": len(outline.get("sections", []))})
-        
-        # 生成具体内容
-        content = await self._generate_content(outline, research_results)
-        
-        return {
-            "query": query,
-            "outline": outline,
-            "content": content,
-            "raw_results": research_results
-        }
-        
-    async def _create_outline(self, query: str, research_results: Dict) -> Dict:
-        """创建输出大纲"""
-        # 更新状态
-        self.update_progress(82, "分析研究结果，构建报告框架", {})
-        
-        # 调用LLM生成大纲
-        messages = [
-            {"role": "system", "content": """你是专业的研究人员，需要创建一个实际的研究报告大纲。
-请基于研究问题和研究结果，创建一个结构化的研究报告大纲，这个大纲将用于生成完整的研究报告内容。
-输出应为JSON格式，包含以下结构：
-{
-    "title": "研究报告实际标题",
-    "sections": [
-        {
-            "id": "section1",
-            "title": "章节实际标题",
-            "content_requirement": "本节实际内容方向的简要描述",
-            "subsections": [...]  // 可选，子章节结构与sections相同
-        },
-        ...
-    ]
-}
-重要：这不是写作指南，而是要生成一个会被直接用于生成实际研究报告的大纲。
-"""},
-            {"role": "user", "content": f"研究问题：{query}"}
-        ]
-        
-        # 添加简化的研究结果概述
-        if "summary" in research_results:
-            messages[1]["content"] += f"\n\n研究结果概述：{research_results['summary']}"
-        elif "solution" in research_results:
-            messages[1]["content"] += f"\n\n研究结果概述：{research_results['solution']}"
-        
-        try:
-            response = await GPT(messages, selected_model=self.model)
-            
-            # 解析JSON
-            content = response.get("content", "{}")
-            try:
-                outline = json.loads(content)
-            except json.JSONDecodeError:
-                print(f"大纲格式错误，尝试修复...")
-                # 尝试提取JSON部分
-                import re
-                json_match = re.search(r'```json\s*(.*?)\s*```', content, re.DOTALL)
-                if json_match:
-                    try:
-                        outline = json.loads(json_match.group(1))
-                    except:
-                        print("修复失败，使用默认大纲")
-                        outline = {"title": "研究报告", "sections": []}
-                else:
-                    print("无法提取JSON，使用默认大纲")
-                    outline = {"title": "研究报告", "sections": []}
-            
-            return outline
-        except Exception as e:
-            print(f"创建大纲时出错: {e}")
-            return {"title": f"关于'{query}'的研究", "sections": []}
-
-    async def _generate_content(self, outline: Dict, research_results: Dict) -> Dict:
-        """生成大纲内容"""
-        content = {
-            "title": outline["title"],
-            "sections": []
-        }
-        
-        # 处理任务依赖
-        # 创建依赖任务映射
-        task_dependencies = {}
-        task_results = {}
-        
-        if "results" in research_results and "subtasks" in research_results:
-            # 创建任务ID到任务描述的映射
-            task_map = {task["id"]: task for task in research_results.get("subtasks", [])}
-            
-            # 检查任务是否完成，如果没有完成，使用简化处理
-            for task_id, task_info in task_map.items():
-                if task_id not in research_results.get("results", {}):
-                    print(f"警告：任务 {task_id} 的依赖尚未完成，使用简化处理")
-                    # 为未完成的任务创建简化结果
-                    task_result = {
-                        "task": task_info.get("description", "未知任务"),
-                        "is_complex": False,
-                        "solution": f"此部分内容基于简化处理生成，因为原始任务 '{task_info.get('description', '未知任务')}' 尚未完成。"
-                    }
-                    research_results.setdefault("results", {})[task_id] = task_result
-        
-        # 按顺序生成每个部分的内容
-        current_section = 0
-        total_sections = len(outline.get("sections", []))
-        
-        # 生成每个章节的内容
-        for i, section in enumerate(outline["sections"]):
-            # 更新进度
-            progress = 85 + int(10 * i / max(1, total_sections))
-            self.update_progress(progress, f"生成报告章节: {section.get('title', '章节')}", 
-                                {"section": i+1, "total": total_sections})
-            
-            section_content = await self._generate_section_content(
-                section, 
-                outline,
-                research_results,
-                content["sections"],
-                i
-            )
-            content["sections"].append(section_content)
-        
-        return content
-    
-    async def _generate_section_content(self, section: Dict, full_outline: Dict, research_results: Dict, previous_sections: List, section_index: int) -> Dict:
-        """生成单个章节的内容"""
-        # 调用LLM生成章节内容
-        messages = [
-            {"role": "system", "content": """你是专业的研究人员，正在撰写一份研究报告的具体章节内容。
-请生成详实、专业、有深度的研究报告章节内容，不要包含写作指南或说明。
-请直接输出可以放入研究报告的完整章节内容，包括观点、数据、分析和结论。
-确保内容与前面章节连贯，不要重复已有内容，也不要包含如"本章将讨论..."之类的元描述。
-输出应当是可以直接用于研究报告的最终内容。
-"""}
-        ]
-        
-        # 构建用户提示，根据节点位置提供不同级别的详细信息
-        user_prompt = f"""
-请撰写以下研究报告章节的实际内容：
-
-报告标题: {full_outline['title']}
-当前章节: {section['title']}
-章节要求: {section.get('content_requirement', '详细阐述研究发现')}
-"""
-
-        # 为不同章节添加适当的研究结果信息
-        if section_index == 0:  # 第一章节（通常是背景和介绍）
-            # 提供简化的研究摘要
-            if "summary" in research_results:
-                user_prompt += f"\n研究背景: {research_results['summary'][:500]}"
-            elif "solution" in research_results and isinstance(research_results['solution'], dict):
-                user_prompt += f"\n研究背景: {research_results['solution'].get('solution', '')[:500]}"
-            elif "solution" in research_results:
-                user_prompt += f"\n研究背景: {research_results['solution'][:500]}"
-                
-        elif "results" in research_results and research_results.get("is_complex", False):
-            # 对于后续章节，提供一些相关子任务的结果 
-            relevant_results = {}
-            subtask_count = 0
-            
-            # 从research_results中寻找与本章节最相关的子任务结果
-            for task_id, task_result in research_results["results"].items():
-                # 只选取3个最相关的子任务
-                if subtask_count >= 3:
-                    break
-                    
-                subtask_desc = ""
-                for subtask in research_results.get("subtasks", []):
-                    if subtask["id"] == task_id:
-                        subtask_desc = subtask.get("description", "")
-                        break
-                
-                # 添加到相关结果中
-                if subtask_desc:
-                    result_content = task_result.get("summary", "") or (
-                        task_result.get("solution", {}).get("solution", "") 
-                        if isinstance(task_result.get("solution"), dict) 
-                        else task_result.get("solution", "")
-                    )
-                    relevant_results[subtask_desc] = result_content
-                    subtask_count += 1
-            
-            # 添加到提示中
-            if relevant_results:
-                user_prompt += "\n研究内容相关信息:"
-                for desc, result in relevant_results.items():
-                    truncated_result = result[:300] + "..." if len(result) > 300 else result
-                    user_prompt += f"\n- {desc}: {truncated_result}"
-        
-        # 添加前面章节的简要内容摘要，帮助保持连贯性
-        if previous_sections:
-            user_prompt += "\n\n前面章节简要内容摘要:"
-            for prev_section in previous_sections[-2:]:  # 最多包含前2个章节
-                prev_title = prev_section.get("title", "")
-                prev_content = prev_section.get("content", "")
-                if prev_content:
-                    # 提取前100个字符作为摘要
-                    prev_summary = prev_content[:100] + "..." if len(prev_content) > 100 else prev_content
-                    user_prompt += f"\n- {prev_title}: {prev_summary}"
-        
-        user_prompt += "\n\n请直接输出此章节的完整内容，不要包含任何写作指南、元描述或非研究内容的文本。"
-        messages.append({"role": "user", "content": user_prompt})
-        
-        try:
-            # 调用模型生成内容
-            response = await GPT(messages, selected_model=self.model)
-            
-            section_content = {
-                "id": section["id"],
-                "title": section["title"],
-                "content": response["content"]
-            }
-            
-            # 如果有子章节，递归生成子章节内容
-            if "subsections" in section and section["subsections"]:
-                section_content["subsections"] = []
-                
-                # 递归处理子章节
-                for i, subsection in enumerate(section["subsections"]):
-                    try:
-                        subsection_content = await self._generate_section_content(
-                            subsection,
-                            full_outline,
-                            research_results,
-                            section_content.get("subsections", []),
-                            i
-                        )
-                        section_content["subsections"].append(subsection_content)
-                    except Exception as e:
-                        print(f"生成子章节内容时出错: {e}")
-                        # 添加错误信息作为子章节内容
-                        section_content["subsections"].append({
-                            "id": subsection.get("id", f"error_{i}"),
-                            "title": subsection.get("title", "错误章节"),
-                            "content": f"生成此章节内容时出错: {str(e)}"
-                        })
-            
-            return section_content
-        except Exception as e:
-            print(f"生成章节内容时出错: {e}")
-            # 返回错误信息作为章节内容
-            return {
-                "id": section["id"],
-                "title": section["title"],
-                "content": f"生成此章节内容时出错: {str(e)}"
-            }
+        """整理研究结果：由报告引擎生成大纲和全部章节，入口程序直接复用其结果格式化输出"""
+        logger.info("整理研究结果...")
+        self.organizer = OutputOrganizer(
+            model=self.model,
+            stream_callback=self.stream_callback,
+            limiter=self.root_node.limiter if self.root_node else None,
+            tracer=self.tracer,
+            progress_callback=self.update_progress,
+            report_writer=self.report_writer
+        )
+        output = await self.organizer.organize(query, research_results)
+        output["raw_results"] = research_results
+        return output
 
 # 使用示例
 async def main():
@@ -0,0 +1,181 @@
+"""
+深度研究 Agent 文本分块
+把知识库条目（任务、解答、子任务结果、网络搜索摘要）切分为带来源信息的段落，按 token 数控制长度并保留重叠，
+每个段落单独建立索引，检索时返回段落而不是整个条目
+"""
+
+import re
+import json
+import math
+from typing import List, Dict, Any, Optional, Tuple
+
+# 每个段落的目标 token 数
+CHUNK_TOKENS = 256
+# 相邻段落重叠的 token 数，避免一句话的上下文被切断在两个段落之间
+CHUNK_OVERLAP_TOKENS = 32
+
+# 中日韩字符每个字约为一个 token，其他文本约四个字符一个 token
+_CJK_PATTERN = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]")
+# 句子以中英文句末标点或换行结尾
+_SENTENCE_PATTERN = re.compile(r".+?(?:[。！？!?；;]+|\n+|\.(?=\s)|$)", re.S)
+
+
+def count_tokens(text: str) -> int:
+    """估算文本的 token 数，不依赖具体模型的分词器
+
+    Args:
+        text: 文本
+
+    Returns:
+        估算的 token 数
+    """
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def _split_long(sentence: str, max_tokens: int) -> List[str]:
+    """把超过长度上限的句子按字符硬切分"""
+    pieces = []
+    start = 0
+    tokens = 0.0
+    for i, char in enumerate(sentence):
+        tokens += 1 if _CJK_PATTERN.match(char) else 0.25
+        if tokens > max_tokens:
+            pieces.append(sentence[start:i])
+            start = i
+            tokens = 1 if _CJK_PATTERN.match(char) else 0.25
+    pieces.append(sentence[start:])
+    return [piece for piece in pieces if piece]
+
+
+def split_text(text: str, chunk_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    """按句子边界把文本切分为段落
+
+    Args:
+        text: 待切分文本
+        chunk_tokens: 每个段落的最大 token 数
+        overlap_tokens: 每个段落开头重复上一段落末尾的最大 token 数
+
+    Returns:
+        段落列表
+    """
+    sentences = []
+    for sentence in _SENTENCE_PATTERN.findall(text):
+        if not sentence.strip():
+            continue
+        if count_tokens(sentence) > chunk_tokens:
+            sentences.extend(_split_long(sentence, chunk_tokens))
+        else:
+            sentences.append(sentence)
+
+    chunks = []
+    current: List[Tuple[str, int]] = []
+    current_tokens = 0
+    for sentence in sentences:
+        tokens = count_tokens(sentence)
+        if current and current_tokens + tokens > chunk_tokens:
+            chunks.append("".join(s for s, _ in current).strip())
+            # 新段落以上一段落末尾不超过 overlap_tokens 的句子开头
+            overlap = []
+            overlap_size = 0
+            for s, t in reversed(current):
+                if overlap_size + t > overlap_tokens or overlap_size + t + tokens > chunk_tokens:
+                    break
+                overlap.insert(0, (s, t))
+                overlap_size += t
+            current, current_tokens = overlap, overlap_size
+        current.append((sentence, tokens))
+        current_tokens += tokens
+    if current:
+        chunks.append("".join(s for s, _ in current).strip())
+    return [chunk for chunk in chunks if chunk]
+
+
+def _result_text(result: Any) -> str:
+    """提取解答或子任务结果中的正文"""
+    if isinstance(result, dict):
+        solution = result.get("solution")
+        if isinstance(solution, dict):
+            solution = solution.get("solution")
+        return str(solution or result.get("summary") or "")
+    return str(result or "")
+
+
+def _entry_fields(entry_id: str, entry: Any) -> List[Dict[str, Any]]:
+    """把条目拆成若干带来源信息的字段，每个字段再切分为段落"""
+    if not isinstance(entry, dict):
+        return [{"field": "entry", "text": json.dumps(entry, ensure_ascii=False), "node_id": entry_id}]
+
+    node_id = entry.get("node_id", entry_id)
+    depth = entry.get("depth")
+    fields = []
+
+    def add(field: str, text: str, source_node: str = node_id, source_depth: Optional[int] = depth, url: str = None):
+        if text and text.strip():
+            fields.append({"field": field, "text": text, "node_id": source_node, "depth": source_depth, "source_url": url})
+
+    def add_web_results(context: Any, source_node: str, source_depth: Optional[int]):
+        if not isinstance(context, dict) or not isinstance(context.get("web_search"), list):
+            return
+        for item in context["web_search"]:
+            if isinstance(item, dict):
+                text = "\n".join(part for part in (item.get("title"), item.get("snippet")) if part)
+                add("web", text, source_node, source_depth, item.get("url") or None)
+
+    if "task" in entry:
+        add("task", str(entry["task"]))
+    if "solution" in entry:
+        add("solution", _result_text({"solution": entry["solution"]}))
+    if "summary" in entry:
+        add("summary", str(entry["summary"]))
+
+    results = entry.get("results")
+    if isinstance(results, dict):
+        if "solution" in results:
+            # 简单任务：results 是该节点自己的解答
+            add("solution", _result_text(results))
+            add_web_results(results.get("context"), node_id, depth)
+        else:
+            # 复杂任务：results 是各子任务的结果，来源记为对应的子节点
+            child_depth = depth + 1 if isinstance(depth, int) else None
+            for subtask_id, result in results.items():
+                add(f"subtask:{subtask_id}", _result_text(result), f"{node_id}_{subtask_id}", child_depth)
+    elif results:
+        add("solution", str(results))
+
+    if not fields:
+        add("entry", json.dumps(entry, ensure_ascii=False))
+    return fields
+
+
+def chunk_entry(
+    entry_id: str,
+    entry: Any,
+    chunk_tokens: int = CHUNK_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS
+) -> List[Dict[str, Any]]:
+    """把知识库条目切分为段落
+
+    Args:
+        entry_id: 条目ID
+        entry: 知识库条目
+        chunk_tokens: 每个段落的最大 token 数
+        overlap_tokens: 相邻段落重叠的 token 数
+
+    Returns:
+        段落列表，每个段落包含 id（条目ID#序号）、entry_id、field（来自条目的哪个字段）、text，
+        以及来源信息 node_id、depth、source_url（网络搜索结果的链接，其他字段为None）
+    """
+    chunks = []
+    for field in _entry_fields(entry_id, entry):
+        for text in split_text(field["text"], chunk_tokens, overlap_tokens):
+            chunks.append({
+                "id": f"{entry_id}#{len(chunks)}",
+                "entry_id": entry_id,
+                "field": field["field"],
+                "text": text,
+                "node_id": field["node_id"],
+                "depth": field.get("depth"),
+                "source_url": field.get("source_url")
+            })
+    return chunks
@@ -1,2 +1,52 @@
 # 设置默认模型
 DEFAULT_MODEL = 'gemini-2.5-pro-exp-03-25'
+
+# 全局最大并发LLM调用数
+MAX_CONCURRENT_LLM_CALLS = 8
+# 每个模型提供方的最大并发LLM调用数，未列出的提供方使用全局上限；
+# LLMapi_service/rate_limiter.py 的 RATE_LIMITS 中 concurrency 为限流器的初始并发，两者应保持一致
+MAX_CONCURRENT_CALLS_PER_PROVIDER = {
+    'gemini': 4,
+    'deepseek': 6,
+    'bianxie': 6
+}
+
+# 网页应用同时运行的研究任务数
+MAX_RUNNING_RESEARCH_TASKS = 2
+# 网页应用排队等待的研究任务上限，超出后拒绝新的提交
+MAX_QUEUED_RESEARCH_TASKS = 20
+
+# 研究节点检索知识库时返回的段落数
+KB_SEARCH_TOP_K = 3
+# 知识库检索结果的交叉编码器重排序模型，为None时不重排序；中英文混合内容可使用 'BAAI/bge-reranker-base'
+KB_RERANK_MODEL = None
+# 启用重排序后结果更精确，研究节点只取更少的段落放入上下文
+KB_SEARCH_TOP_K_RERANKED = 2
+# 知识库向量索引类型（flat / hnsw / ivfpq / sq8），非 flat 类型在条目数达到训练阈值后才生效
+KB_INDEX_TYPE = 'flat'
+# 是否以内存映射方式加载知识库索引，多个工作进程打开同一知识库时共享一份数据
+KB_INDEX_MMAP = False
+# 知识库条目切分为段落建立索引，每个段落的最大 token 数和相邻段落重叠的 token 数
+KB_CHUNK_TOKENS = 256
+KB_CHUNK_OVERLAP = 32
+# 研究节点各类提示中上下文部分的 token 预算，超出时按相关度截取检索结果
+SOLVE_CONTEXT_TOKENS = 3000
+DECOMPOSE_CONTEXT_TOKENS = 1500
+ASSESS_CONTEXT_TOKENS = 800
+# 研究节点的规划方式：
+#   sequential  - 检索、复杂度评估、任务分解依次进行
+#   speculative - 网络搜索与评估并发进行，同时投机地发起任务分解，评估为简单任务时取消分解
+#   merged      - 网络搜索与规划并发进行，复杂度评估和任务分解合并为一次调用
+# 后两种方式中评估和分解看不到本节点的网络搜索结果，网络搜索结果仍用于解答和子任务；
+# speculative 对每个非叶子节点多发一次分解调用（简单任务时作废），在限流严格的提供方上会增加费用和 429，需按需开启
+PLANNING_MODE = 'sequential'
+# 报告章节并发生成后，是否再用一次调用为各章补充承上启下的过渡句
+REPORT_CONTINUITY_PASS = False
+# 报告章节的证据选择：从整棵研究树的叶子解答中为每个章节选出最相关的段落
+# 嵌入模型与知识库默认模型相同，共享嵌入服务和向量缓存
+REPORT_EMBEDDING_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+# 每个章节最多使用的段落数和证据部分的 token 预算
+REPORT_EVIDENCE_TOP_K = 6
+REPORT_EVIDENCE_TOKENS = 1200
+# 叶子解答切分为段落的最大 token 数
+REPORT_EVIDENCE_CHUNK_TOKENS = 200
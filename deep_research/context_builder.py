@@ -0,0 +1,156 @@
+"""
+深度研究 Agent 提示上下文构建
+把研究节点的上下文（祖先节点链、网络搜索结果、知识库段落、依赖任务结论）整理为紧凑文本：
+祖先节点只保留任务描述，各层重复的检索结果只保留一份，检索结果按与任务的相关度排序，在 token 预算内截取
+"""
+
+import json
+from typing import List, Dict, Any, Tuple
+
+from deep_research.chunking import count_tokens
+from deep_research.hybrid_search import tokenize
+
+# 上下文中不作为“其他信息”输出的字段
+_STRUCTURED_KEYS = {"task", "parent_context", "web_search", "kb_search", "dependency_results"}
+# 每上溯一层祖先，其检索结果的相关度乘以该系数
+ANCESTOR_DECAY = 0.8
+# 单条内容剩余预算不足该 token 数时不再截断放入，直接丢弃
+MIN_ITEM_TOKENS = 48
+# 研究路径中每个祖先任务的最大 token 数
+PATH_TASK_TOKENS = 80
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """把文本截断到不超过 max_tokens 个 token，截断时以省略号结尾"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    # 按比例估算截断位置，再逐步收缩到预算内
+    end = max(1, int(len(text) * max_tokens / count_tokens(text)))
+    while end > 1 and count_tokens(text[:end]) + 1 > max_tokens:
+        end = int(end * 0.9)
+    return text[:end] + "…"
+
+
+def _relevance(query_terms: set, text: str) -> float:
+    """查询词项在文本中出现的比例，0-1"""
+    if not query_terms:
+        return 0.0
+    return len(query_terms & set(tokenize(text))) / len(query_terms)
+
+
+def _collect(context: Dict, query_terms: set) -> Tuple[List[str], List[Dict], List[Dict], Dict]:
+    """沿 parent_context 链收集研究路径、依赖结论、检索结果和其他字段，检索结果去重并计算相关度"""
+    levels = []
+    level = context
+    while isinstance(level, dict):
+        levels.append(level)
+        level = level.get("parent_context")
+
+    # 第0层是当前节点自己的上下文，其 task 即当前任务，不放入路径
+    path = [str(level["task"]) for level in reversed(levels[1:]) if level.get("task")]
+
+    dependencies = [
+        {"id": dep_id, "text": str(text)}
+        for dep_id, text in (context.get("dependency_results") or {}).items()
+    ]
+
+    items = []
+    seen = set()
+    for distance, level in enumerate(levels):
+        decay = ANCESTOR_DECAY ** distance
+        for result in level.get("web_search") or []:
+            if not isinstance(result, dict):
+                continue
+            key = (result.get("url"), result.get("snippet"))
+            if key in seen:
+                continue
+            seen.add(key)
+            text = "\n".join(part for part in (result.get("title"), result.get("snippet")) if part)
+            label = f"[网页] {result.get('url')}" if result.get("url") else "[网页]"
+            items.append({"label": label, "text": text, "score": decay * _relevance(query_terms, text)})
+        for result in level.get("kb_search") or []:
+            if not isinstance(result, dict):
+                continue
+            text = result.get("passage") or json.dumps(result.get("entry", result), ensure_ascii=False)
+            if text in seen:
+                continue
+            seen.add(text)
+            # 知识库段落已有检索相关度，与词项重合度取较大值
+            score = max(float(result.get("relevance_score") or 0), _relevance(query_terms, text))
+            label = f"[知识库 {result.get('node_id') or result.get('id', '')}]"
+            if result.get("source_url"):
+                label += f" {result['source_url']}"
+            items.append({"label": label, "text": text, "score": decay * score})
+
+    extras = {key: value for key, value in context.items() if key not in _STRUCTURED_KEYS and value}
+    return path, dependencies, items, extras
+
+
+def build_context(context: Dict, task: str, budget: int, measure_raw: bool = False) -> Tuple[str, Dict[str, Any]]:
+    """把研究节点的上下文整理为不超过 token 预算的提示文本
+
+    依次放入研究路径（祖先任务）、依赖任务结论、其他字段，剩余预算按相关度从高到低放入检索结果，
+    放不下的内容截断，剩余预算过少时丢弃
+
+    Args:
+        context: 研究节点的上下文
+        task: 当前任务，用于计算检索结果的相关度
+        budget: token 预算
+        measure_raw: 是否统计直接序列化整个上下文的 token 数；需要序列化完整的上下文，只在调试时开启
+
+    Returns:
+        (上下文文本, 统计信息)，统计信息包括 tokens、budget、items（检索结果总数，去重后）、items_used、
+        items_truncated，measure_raw 为 True 时另含 raw_tokens
+    """
+    context = context or {}
+    path, dependencies, items, extras = _collect(context, set(tokenize(task)))
+    items.sort(key=lambda item: item["score"], reverse=True)
+
+    parts = []
+    remaining = budget
+    truncated = 0
+
+    def add(text: str) -> bool:
+        """在剩余预算内加入一段文本，必要时截断，返回是否加入"""
+        nonlocal remaining, truncated
+        tokens = count_tokens(text)
+        if tokens > remaining:
+            if remaining < MIN_ITEM_TOKENS:
+                return False
+            text = truncate_to_tokens(text, remaining)
+            tokens = count_tokens(text)
+            truncated += 1
+        parts.append(text)
+        remaining -= tokens + 1
+        return True
+
+    if path:
+        add("研究路径：\n" + "\n".join(
+            f"{i}. {truncate_to_tokens(ancestor, PATH_TASK_TOKENS)}" for i, ancestor in enumerate(path, start=1)
+        ))
+    if dependencies:
+        add("前置子任务结论：")
+        for dependency in dependencies:
+            add(f"- [{dependency['id']}] {dependency['text']}")
+    if extras:
+        add("其他信息：\n" + json.dumps(extras, ensure_ascii=False))
+
+    used = 0
+    if items:
+        add("参考资料（按相关度排序）：")
+        for item in items:
+            if not add(f"- {item['label']}\n{item['text']}"):
+                break
+            used += 1
+
+    text = "\n".join(parts) if parts else "（无）"
+    stats = {
+        "tokens": count_tokens(text),
+        "budget": budget,
+        "items": len(items),
+        "items_used": used,
+        "items_truncated": truncated
+    }
+    if measure_raw:
+        stats["raw_tokens"] = count_tokens(json.dumps(context, ensure_ascii=False))
+    return text, stats
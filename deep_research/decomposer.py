@@ -9,6 +9,11 @@ import asyncio
 import sys
 sys.path.append('..')
 from LLMapi_service.gptservice import GPT
+from LLMapi_service.resilience import LLMError
+from LLMapi_service.metrics import metric_tags
+from LLMapi_service.logger import get_logger
+
+logger = get_logger("deep_research.decomposer")
 
 class ProblemDecomposer:
     """问题分解器，用于将复杂问题分解为子任务"""
@@ -77,7 +82,12 @@ class ProblemDecomposer:
         Returns:
             分解的子任务列表
         """
-        response = await GPT(messages, selected_model=self.model)
+        try:
+            with metric_tags(phase="decompose"):
+                response = await GPT(messages, selected_model=self.model)
+        except LLMError as e:
+            logger.warning(f"问题分解调用失败，使用默认分解: {e}")
+            return self._get_default_subtasks(messages[1]["content"])
         
         try:
             # 尝试将返回内容解析为JSON
@@ -126,6 +136,60 @@ class ProblemDecomposer:
 class TaskDependencyResolver:
     """任务依赖解析器，用于排序子任务"""
     
+    @staticmethod
+    def task_id(task: Dict) -> str:
+        """任务ID，统一为字符串：模型返回的ID可能是数字，而依赖列表中可能是字符串"""
+        return str(task["id"])
+    
+    @staticmethod
+    def get_dependencies(task: Dict) -> List[str]:
+        """获取任务依赖的其他任务ID
+        
+        问题分解器使用 depends_on 字段，研究节点的分解提示使用 requires 字段，两者都支持
+        
+        Args:
+            task: 子任务
+            
+        Returns:
+            依赖的任务ID列表
+        """
+        dependencies = task.get("depends_on") or task.get("requires") or []
+        if isinstance(dependencies, str):
+            dependencies = [dependencies]
+        return [str(dep) for dep in dependencies]
+    
+    @staticmethod
+    def build_dependency_graph(tasks: List[Dict]) -> Dict[str, set]:
+        """构建任务依赖图，忽略不存在的任务ID和自身依赖
+        
+        Args:
+            tasks: 子任务列表
+            
+        Returns:
+            依赖关系图，键为任务ID（字符串），值为其依赖的任务ID集合
+        """
+        task_ids = {TaskDependencyResolver.task_id(task) for task in tasks}
+        return {
+            TaskDependencyResolver.task_id(task): {
+                dep for dep in TaskDependencyResolver.get_dependencies(task)
+                if dep in task_ids and dep != TaskDependencyResolver.task_id(task)
+            }
+            for task in tasks
+        }
+    
+    @staticmethod
+    def has_cycle(tasks: List[Dict]) -> bool:
+        """检查任务依赖中是否存在环
+        
+        Args:
+            tasks: 子任务列表
+            
+        Returns:
+            是否存在环
+        """
+        graph = TaskDependencyResolver.build_dependency_graph(tasks)
+        return TaskDependencyResolver._kahn_sort(graph) is None
+    
     @staticmethod
     def resolve_execution_order(tasks: List[Dict]) -> List[Dict]:
         """解析任务的执行顺序
@@ -136,17 +200,61 @@ class TaskDependencyResolver:
         Returns:
             按照依赖关系排序后的任务列表
         """
-        # 创建任务ID到任务的映射
-        task_map = {task["id"]: task for task in tasks}
+        return [tasks[index] for index in TaskDependencyResolver.resolve_execution_positions(tasks)]
+    
+    @staticmethod
+    def resolve_execution_positions(tasks: List[Dict]) -> List[int]:
+        """解析任务的执行顺序，返回任务在列表中的位置，ID重复的任务都会保留
+        
+        Args:
+            tasks: 子任务列表
+            
+        Returns:
+            按照依赖关系排序后的任务位置列表，同ID的任务按原顺序相邻
+        """
+        # 创建任务ID到任务位置的映射
+        positions = {}
+        for index, task in enumerate(tasks):
+            positions.setdefault(TaskDependencyResolver.task_id(task), []).append(index)
         
         # 创建任务依赖图
-        dependency_graph = {task["id"]: set(task.get("depends_on", [])) for task in tasks}
+        dependency_graph = TaskDependencyResolver.build_dependency_graph(tasks)
         
         # 拓扑排序
         sorted_ids = TaskDependencyResolver._topological_sort(dependency_graph)
         
         # 按照排序结果重新排列任务
-        return [task_map[task_id] for task_id in sorted_ids if task_id in task_map]
+        return [index for task_id in sorted_ids for index in positions.get(task_id, [])]
+    
+    @staticmethod
+    def deduplicate_ids(tasks: List[Dict]) -> List[Dict]:
+        """为重复的任务ID加上序号后缀，使每个任务都能被单独调度和引用
+        
+        依赖列表中的重复ID仍指向第一个同ID的任务
+        
+        Args:
+            tasks: 子任务列表
+            
+        Returns:
+            任务ID互不相同的子任务列表，被改名的任务为副本
+        """
+        seen = {TaskDependencyResolver.task_id(task) for task in tasks}
+        used = set()
+        result = []
+        for task in tasks:
+            task_id = TaskDependencyResolver.task_id(task)
+            if task_id in used:
+                suffix = 2
+                while f"{task_id}_{suffix}" in seen:
+                    suffix += 1
+                new_id = f"{task_id}_{suffix}"
+                logger.warning(f"子任务ID重复: {task_id}，改为 {new_id}")
+                seen.add(new_id)
+                task = dict(task, id=new_id)
+                task_id = new_id
+            used.add(task_id)
+            result.append(task)
+        return result
     
     @staticmethod
     def _topological_sort(graph: Dict[str, set]) -> List[str]:
@@ -156,17 +264,31 @@ class TaskDependencyResolver:
             graph: 依赖关系图
             
         Returns:
-            排序后的任务ID列表
+            排序后的任务ID列表，被依赖的任务排在前面
+        """
+        sorted_result = TaskDependencyResolver._kahn_sort(graph)
+        
+        # 有环，按原顺序返回
+        if sorted_result is None:
+            return list(graph.keys())
+        
+        return sorted_result
+    
+    @staticmethod
+    def _kahn_sort(graph: Dict[str, set]) -> Optional[List[str]]:
+        """Kahn 算法拓扑排序
+        
+        Args:
+            graph: 依赖关系图
+            
+        Returns:
+            排序后的任务ID列表，存在环时返回None
         """
-        # 计算入度
-        in_degree = {node: 0 for node in graph}
-        for node in graph:
-            for neighbor in graph[node]:
-                if neighbor in in_degree:
-                    in_degree[neighbor] += 1
+        # 入度为任务在图内的依赖数量
+        in_degree = {node: len([dep for dep in graph[node] if dep in graph]) for node in graph}
         
         # 初始化队列，包含所有入度为0的节点
-        queue = [node for node in in_degree if in_degree[node] == 0]
+        queue = [node for node in graph if in_degree[node] == 0]
         sorted_result = []
         
         # BFS拓扑排序
@@ -175,15 +297,14 @@ class TaskDependencyResolver:
             sorted_result.append(node)
             
             # 更新依赖于当前节点的所有节点
-            dependencies = [n for n in graph if node in graph[n]]
-            for dependency in dependencies:
-                in_degree[dependency] -= 1
-                if in_degree[dependency] == 0:
-                    queue.append(dependency)
+            dependents = [n for n in graph if node in graph[n]]
+            for dependent in dependents:
+                in_degree[dependent] -= 1
+                if in_degree[dependent] == 0:
+                    queue.append(dependent)
         
         # 检查是否存在环
         if len(sorted_result) != len(graph):
-            # 有环，按原顺序返回
-            return list(graph.keys())
+            return None
         
-        return sorted_result 
\ No newline at end of file
+        return sorted_result
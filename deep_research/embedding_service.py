@@ -0,0 +1,345 @@
+"""
+深度研究 Agent 嵌入服务
+进程内共享的嵌入模型：每个模型只加载一次，把来自多个任务、多个线程的并发嵌入请求合并成一批做一次前向计算，
+并以文本内容哈希为键在内存和 SQLite 中缓存向量，同一段文本不会重复嵌入
+"""
+
+import os
+import time
+import queue
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future
+from typing import List, Dict, Any, Optional, Tuple, Iterator
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from LLMapi_service.logger import get_logger
+
+logger = get_logger("deep_research.embedding_service")
+
+# 单次前向计算的最大文本数
+EMBEDDING_BATCH_SIZE = 64
+# 收集一批请求的最长等待时间（秒），等待期间到达的请求合并到同一批
+EMBEDDING_BATCH_WAIT = 0.01
+# 内存缓存的最大向量数
+EMBEDDING_MEMORY_ENTRIES = 10000
+
+
+def text_hash(model_name: str, text: str) -> str:
+    """生成缓存键，包含模型名称，不同模型的向量互不混用"""
+    return hashlib.sha256(f"{model_name}\n{text}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """向量缓存：内存 LRU + 可选的 SQLite 磁盘缓存，向量以 float32 字节保存"""
+
+    def __init__(self, db_path: Optional[str] = None, max_memory_entries: int = EMBEDDING_MEMORY_ENTRIES):
+        """初始化向量缓存
+
+        Args:
+            db_path: SQLite 数据库路径，为 None 时只使用内存缓存
+            max_memory_entries: 内存缓存的最大向量数
+        """
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+        if self.db_path:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._connect() as conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB, created_at REAL)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """打开数据库连接，事务结束时提交（出错时回滚）并关闭连接"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            # sqlite3 连接自身的上下文管理器只提交或回滚，不会关闭连接
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """批量读取缓存
+
+        Args:
+            keys: 缓存键列表
+
+        Returns:
+            命中的 {缓存键: 向量}
+        """
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.db_path:
+            try:
+                with self._connect() as conn:
+                    # SQLite 默认最多 999 个参数，分批查询
+                    for start in range(0, len(missing), 500):
+                        chunk = missing[start:start + 500]
+                        rows = conn.execute(
+                            f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                        ).fetchall()
+                        for key, blob in rows:
+                            found[key] = np.frombuffer(blob, dtype=np.float32)
+            except sqlite3.Error as e:
+                logger.warning(f"读取向量缓存出错: {e}")
+            self._memory_set({key: found[key] for key in missing if key in found})
+
+        with self._lock:
+            self.stats["hits"] += len(found)
+            self.stats["misses"] += len(keys) - len(found)
+        return found
+
+    def set_many(self, vectors: Dict[str, np.ndarray]) -> None:
+        """批量写入缓存"""
+        self._memory_set(vectors)
+        if self.db_path and vectors:
+            now = time.time()
+            try:
+                with self._connect() as conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO embeddings (key, vector, created_at) VALUES (?, ?, ?)",
+                        [(key, vector.astype(np.float32).tobytes(), now) for key, vector in vectors.items()]
+                    )
+            except sqlite3.Error as e:
+                logger.warning(f"写入向量缓存出错: {e}")
+
+    def _memory_set(self, vectors: Dict[str, np.ndarray]) -> None:
+        with self._lock:
+            for key, vector in vectors.items():
+                self._memory[key] = vector
+                self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """获取缓存命中统计"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+class EmbeddingService:
+    """共享嵌入服务，后台线程把并发请求合并成批次计算"""
+
+    def __init__(
+        self,
+        model_name: str,
+        cache: Optional[EmbeddingCache] = None,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        batch_wait: float = EMBEDDING_BATCH_WAIT,
+        model: Optional[Embeddings] = None
+    ):
+        """初始化嵌入服务
+
+        Args:
+            model_name: 嵌入模型名称
+            cache: 向量缓存，为 None 时只做批处理不缓存
+            batch_size: 单次前向计算的最大文本数
+            batch_wait: 收集一批请求的最长等待时间（秒）
+            model: 可选的嵌入模型对象，为 None 时在首次使用时加载 HuggingFaceEmbeddings
+        """
+        self.model_name = model_name
+        self.cache = cache
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self._model = model
+        self._model_lock = threading.Lock()
+        self._requests: "queue.Queue[Tuple[List[str], Future]]" = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self.stats = {"requests": 0, "batches": 0, "embedded_texts": 0}
+
+    @property
+    def model(self) -> Embeddings:
+        """嵌入模型，首次访问时加载"""
+        with self._model_lock:
+            if self._model is None:
+                from langchain_community.embeddings import HuggingFaceEmbeddings
+                logger.info(f"加载嵌入模型: {self.model_name}")
+                self._model = HuggingFaceEmbeddings(model_name=self.model_name)
+            return self._model
+
+    def _ensure_worker(self) -> None:
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name=f"embedding-{self.model_name}", daemon=True)
+                self._worker.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        """提交嵌入请求
+
+        Args:
+            texts: 文本列表
+
+        Returns:
+            结果为向量列表（与输入顺序一致）的 Future
+        """
+        future = Future()
+        if not texts:
+            future.set_result([])
+            return future
+        self._ensure_worker()
+        self._requests.put((list(texts), future))
+        return future
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """同步嵌入文本，阻塞到所在批次计算完成"""
+        return self.submit(texts).result()
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        """异步嵌入文本，不阻塞事件循环"""
+        return await asyncio.wrap_future(self.submit(texts))
+
+    def _collect_batch(self) -> List[Tuple[List[str], Future]]:
+        """阻塞等待第一个请求，然后在 batch_wait 内继续收集，直到凑满 batch_size 个文本"""
+        batch = [self._requests.get()]
+        count = len(batch[0][0])
+        deadline = time.monotonic() + self.batch_wait
+        while count < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            count += len(request[0])
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            # 调用方已取消的请求（如被取消的 aembed）不再计算，其余请求标记为运行中，之后不能再被取消
+            batch = [
+                (texts, future) for texts, future in self._collect_batch() if future.set_running_or_notify_cancel()
+            ]
+            if not batch:
+                continue
+            error = None
+            try:
+                vectors = self._embed_unique([text for texts, _ in batch for text in texts])
+                for texts, future in batch:
+                    future.set_result([vectors[text].tolist() for text in texts])
+            except Exception as e:
+                error = e
+            finally:
+                # 无论出现什么错误，同一批次的请求都要有结果，否则同步等待的 embed() 会永远阻塞
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error or RuntimeError("嵌入请求未完成"))
+
+    def _embed_unique(self, texts: List[str]) -> Dict[str, np.ndarray]:
+        """对一批文本去重、查缓存，只为未命中的文本做前向计算"""
+        unique = list(dict.fromkeys(texts))
+        keys = {text: text_hash(self.model_name, text) for text in unique}
+        cached = self.cache.get_many(list(keys.values())) if self.cache else {}
+
+        vectors = {text: cached[keys[text]] for text in unique if keys[text] in cached}
+        missing = [text for text in unique if text not in vectors]
+        computed = {}
+        for start in range(0, len(missing), self.batch_size):
+            chunk = missing[start:start + self.batch_size]
+            for text, vector in zip(chunk, self.model.embed_documents(chunk)):
+                computed[text] = np.asarray(vector, dtype=np.float32)
+            self.stats["batches"] += 1
+
+        if computed and self.cache:
+            self.cache.set_many({keys[text]: vector for text, vector in computed.items()})
+        self.stats["requests"] += 1
+        self.stats["embedded_texts"] += len(computed)
+        vectors.update(computed)
+        return vectors
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """获取批处理和缓存统计"""
+        stats = {"model": self.model_name, **self.stats}
+        if self.cache:
+            stats["cache"] = self.cache.get_statistics()
+        return stats
+
+
+class ServiceEmbeddings(Embeddings):
+    """把共享嵌入服务包装为 langchain 的 Embeddings 接口，供 FAISS 使用"""
+
+    def __init__(self, service: EmbeddingService):
+        self.service = service
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.service.embed(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.service.embed([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.service.aembed(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.service.aembed([text]))[0]
+
+
+# 进程内共享的嵌入服务，按模型名称区分
+_services: Dict[str, EmbeddingService] = {}
+_services_lock = threading.Lock()
+# 全局向量缓存，设置环境变量 EMBEDDING_CACHE_PATH 或调用 configure_embedding_cache() 启用磁盘缓存
+_cache = EmbeddingCache(db_path=os.environ.get('EMBEDDING_CACHE_PATH'))
+
+
+def configure_embedding_cache(db_path: Optional[str] = None, **kwargs) -> EmbeddingCache:
+    """替换全局向量缓存，已创建的嵌入服务同时切换到新缓存
+
+    Args:
+        db_path: SQLite 数据库路径，为 None 时只使用内存缓存
+        **kwargs: 传递给 EmbeddingCache 的其他参数
+
+    Returns:
+        新的向量缓存
+    """
+    global _cache
+    with _services_lock:
+        _cache = EmbeddingCache(db_path=db_path, **kwargs)
+        for service in _services.values():
+            service.cache = _cache
+    return _cache
+
+
+def get_embedding_service(model_name: str) -> EmbeddingService:
+    """获取指定模型的共享嵌入服务，首次调用时创建
+
+    Args:
+        model_name: 嵌入模型名称
+
+    Returns:
+        共享嵌入服务
+    """
+    with _services_lock:
+        service = _services.get(model_name)
+        if service is None:
+            service = EmbeddingService(model_name, cache=_cache)
+            _services[model_name] = service
+        return service
+
+
+def get_embeddings(model_name: str) -> ServiceEmbeddings:
+    """获取使用共享嵌入服务的 langchain Embeddings 对象"""
+    return ServiceEmbeddings(get_embedding_service(model_name))
@@ -0,0 +1,144 @@
+"""
+深度研究 Agent 报告证据选择
+收集整棵研究树中叶子节点的解答并切分为段落，把各章节的写作要求与全部段落一起嵌入，
+用一次矩阵乘法算出所有章节与所有段落的相似度，为每个章节在 token 预算内选出最相关的段落
+"""
+
+from typing import List, Dict, Any, Tuple
+
+import numpy as np
+
+from LLMapi_service.logger import get_logger
+
+from deep_research.chunking import count_tokens, split_text
+from deep_research.context_builder import truncate_to_tokens, MIN_ITEM_TOKENS
+from deep_research.hybrid_search import tokenize
+from deep_research.embedding_service import get_embedding_service
+
+logger = get_logger("deep_research.evidence")
+
+
+def _solution_text(result: Dict) -> str:
+    solution = result.get("solution", "")
+    if isinstance(solution, dict):
+        solution = solution.get("solution", "")
+    return str(solution or "")
+
+
+def collect_passages(research_results: Dict, chunk_tokens: int) -> List[Dict[str, Any]]:
+    """沿研究树收集所有叶子节点（简单任务）的解答，切分为段落
+
+    Args:
+        research_results: 根节点的研究结果，复杂任务的 results 为各子任务的结果
+        chunk_tokens: 每个段落的最大 token 数
+
+    Returns:
+        段落列表，每个段落包含 task（所属叶子任务）和 text，按研究树的深度优先顺序排列
+    """
+    passages = []
+
+    def visit(result: Any, task: str):
+        if not isinstance(result, dict):
+            return
+        task = result.get("task") or task
+        children = result.get("results")
+        if result.get("is_complex") and isinstance(children, dict):
+            descriptions = {
+                subtask.get("id"): subtask.get("description", "")
+                for subtask in result.get("subtasks") or [] if isinstance(subtask, dict)
+            }
+            for subtask_id, child in children.items():
+                visit(child, descriptions.get(subtask_id) or task)
+            return
+        for text in split_text(_solution_text(result), chunk_tokens, 0):
+            passages.append({"task": str(task or ""), "text": text})
+
+    visit(research_results, research_results.get("task", ""))
+    return passages
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def _lexical_vectors(texts: List[str]) -> np.ndarray:
+    """嵌入模型不可用时的替代：以词项出现与否构成的向量，余弦相似度即词项重合度"""
+    vocabulary: Dict[str, int] = {}
+    rows = [set(tokenize(text)) for text in texts]
+    for terms in rows:
+        for term in terms:
+            vocabulary.setdefault(term, len(vocabulary))
+    matrix = np.zeros((len(texts), max(1, len(vocabulary))), dtype=np.float32)
+    for i, terms in enumerate(rows):
+        matrix[i, [vocabulary[term] for term in terms]] = 1.0
+    return matrix
+
+
+class EvidenceSelector:
+    """为报告各章节选择研究证据"""
+
+    def __init__(self, embedding_model: str, top_k: int, budget: int, chunk_tokens: int):
+        """
+        Args:
+            embedding_model: 嵌入模型名称，与知识库相同时共享嵌入服务和向量缓存
+            top_k: 每个章节最多选择的段落数
+            budget: 每个章节证据部分的 token 预算
+            chunk_tokens: 叶子解答切分段落的最大 token 数
+        """
+        self.embedding_model = embedding_model
+        self.top_k = top_k
+        self.budget = budget
+        self.chunk_tokens = chunk_tokens
+
+    async def _vectors(self, texts: List[str]) -> np.ndarray:
+        try:
+            vectors = await get_embedding_service(self.embedding_model).aembed(texts)
+            return np.asarray(vectors, dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"嵌入章节和研究段落时出错，改用词项重合度选择证据: {e}")
+            return _lexical_vectors(texts)
+
+    async def select(self, queries: List[Tuple[str, str]], research_results: Dict) -> Dict[str, List[Dict[str, Any]]]:
+        """为每个章节选择最相关的段落
+
+        章节要求和全部段落在一次嵌入请求中完成，相似度为一次 (章节数 × 段落数) 的矩阵乘法
+
+        Args:
+            queries: [(章节编号, 章节标题、要求和写作要点)]
+            research_results: 根节点的研究结果
+
+        Returns:
+            {章节编号: [{"task", "text", "score"}]}，按相似度从高到低排列，总 token 数不超过预算
+        """
+        passages = collect_passages(research_results, self.chunk_tokens)
+        if not queries or not passages:
+            return {number: [] for number, _ in queries}
+
+        vectors = _normalize(await self._vectors(
+            [query for _, query in queries] + [f"{p['task']}\n{p['text']}" for p in passages]
+        ))
+        scores = vectors[:len(queries)] @ vectors[len(queries):].T
+        # 每个章节只需要前 top_k 个候选，argpartition 避免对全部段落排序
+        k = min(self.top_k, len(passages))
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+        selected = {}
+        for row, (number, _) in enumerate(queries):
+            order = candidates[row][np.argsort(-scores[row, candidates[row]])]
+            remaining = self.budget
+            chosen = []
+            for index in order:
+                passage = passages[index]
+                text = passage["text"]
+                tokens = count_tokens(text)
+                if tokens > remaining:
+                    if remaining < MIN_ITEM_TOKENS:
+                        break
+                    text = truncate_to_tokens(text, remaining)
+                    tokens = count_tokens(text)
+                chosen.append({"task": passage["task"], "text": text, "score": round(float(scores[row, index]), 4)})
+                remaining -= tokens
+            selected[number] = chosen
+        logger.debug(f"为 {len(queries)} 个章节从 {len(passages)} 个段落中选择证据")
+        return selected
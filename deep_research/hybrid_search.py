@@ -0,0 +1,238 @@
+"""
+深度研究 Agent 混合检索
+提供适用于中英文混合文本的分词、可增量更新的 BM25 倒排索引、倒数排名融合（RRF）以及可选的交叉编码器重排序
+"""
+
+import re
+import math
+import heapq
+import threading
+from collections import Counter, defaultdict
+from typing import List, Dict, Tuple, Optional, Iterable
+
+from LLMapi_service.logger import get_logger
+
+logger = get_logger("deep_research.hybrid_search")
+
+# BM25 参数
+BM25_K1 = 1.5
+BM25_B = 0.75
+# 倒数排名融合的平滑常数，越大则各路结果的排名差异影响越小
+RRF_K = 60
+# 交叉编码器单段文本的最大字符数，超出部分截断
+RERANK_MAX_CHARS = 1000
+# 交叉编码器单次计算的文本对数
+RERANK_BATCH_SIZE = 32
+
+# 连续的中日韩字符，或连续的字母数字
+_TOKEN_PATTERN = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]+|[a-z0-9]+")
+_CJK_PATTERN = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]")
+
+
+def tokenize(text: str) -> List[str]:
+    """分词：字母数字按单词切分并转小写，中日韩文本没有空格分隔，切分为相邻两字的二元组
+
+    Args:
+        text: 待分词文本
+
+    Returns:
+        词项列表
+    """
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(text.lower()):
+        if _CJK_PATTERN.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+class BM25Index:
+    """BM25 倒排索引，支持逐条添加和删除文档，不需要整体重建"""
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        # 词项 -> {文档ID: 词频}
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        # 文档ID -> 词项列表（去重），删除文档时用于清理倒排表
+        self._doc_terms: Dict[str, List[str]] = {}
+        self._doc_len: Dict[str, int] = {}
+        self._total_len = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def __getstate__(self) -> Dict:
+        # 知识库随段落快照一起保存倒排索引，锁不能序列化
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def add(self, doc_id: str, text: str) -> None:
+        """添加或替换文档"""
+        counts = Counter(tokenize(text))
+        with self._lock:
+            self._remove(doc_id)
+            for term, tf in counts.items():
+                self._postings[term][doc_id] = tf
+            self._doc_terms[doc_id] = list(counts)
+            length = sum(counts.values())
+            self._doc_len[doc_id] = length
+            self._total_len += length
+
+    def add_many(self, docs: Iterable[Tuple[str, str]]) -> None:
+        """批量添加文档，参数为 (文档ID, 文本) 序列"""
+        for doc_id, text in docs:
+            self.add(doc_id, text)
+
+    def remove(self, doc_id: str) -> None:
+        """删除文档，文档不存在时忽略"""
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id: str) -> None:
+        """删除文档，调用前需持有锁"""
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_len -= self._doc_len.pop(doc_id)
+
+    def clear(self) -> None:
+        """清空索引"""
+        with self._lock:
+            self._postings.clear()
+            self._doc_terms.clear()
+            self._doc_len.clear()
+            self._total_len = 0
+
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[str, float]]:
+        """检索与查询最相关的文档
+
+        Args:
+            query: 查询文本
+            top_k: 返回的最大结果数
+
+        Returns:
+            按得分降序排列的 (文档ID, BM25得分) 列表
+        """
+        terms = set(tokenize(query))
+        scores: Dict[str, float] = defaultdict(float)
+        with self._lock:
+            n = len(self._doc_len)
+            if not n or not terms:
+                return []
+            avg_len = self._total_len / n
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_len[doc_id] / avg_len)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[Tuple[str, float]]:
+    """倒数排名融合：每路结果中排名第 r 的文档得分 1/(k+r)，各路得分相加
+
+    只依赖排名而不依赖各路得分的尺度，适合融合向量相似度和 BM25 这类不可比的得分
+
+    Args:
+        rankings: 多路检索结果，每路为按相关性降序排列的文档ID列表
+        k: 平滑常数
+
+    Returns:
+        按融合得分降序排列的 (文档ID, 融合得分) 列表
+    """
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class CrossEncoderReranker:
+    """交叉编码器重排序，把查询和候选文本成对输入模型打分，在 CPU 上运行"""
+
+    def __init__(self, model_name: str, max_chars: int = RERANK_MAX_CHARS, batch_size: int = RERANK_BATCH_SIZE):
+        """初始化重排序器，模型在首次使用时加载
+
+        Args:
+            model_name: 交叉编码器模型名称
+            max_chars: 单段候选文本的最大字符数
+            batch_size: 单次计算的文本对数
+        """
+        self.model_name = model_name
+        self.max_chars = max_chars
+        self.batch_size = batch_size
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        """交叉编码器模型，首次访问时加载"""
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import CrossEncoder
+                logger.info(f"加载重排序模型: {self.model_name}")
+                self._model = CrossEncoder(self.model_name, device="cpu")
+            return self._model
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        """为候选文本打分
+
+        Args:
+            query: 查询文本
+            texts: 候选文本列表
+
+        Returns:
+            与候选文本一一对应的相关度，0-1；单标签模型的 predict() 默认已经过 sigmoid，这里不再重复归一化
+        """
+        if not texts:
+            return []
+        model = self.model
+        pairs = [(query, text[:self.max_chars]) for text in texts]
+        with self._lock:
+            scores = model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+        return [float(score) for score in scores]
+
+
+# 进程内共享的重排序器，按模型名称区分
+_rerankers: Dict[str, CrossEncoderReranker] = {}
+_rerankers_lock = threading.Lock()
+
+
+def get_reranker(model_name: Optional[str]) -> Optional[CrossEncoderReranker]:
+    """获取指定模型的共享重排序器，模型名称为空时返回None
+
+    Args:
+        model_name: 交叉编码器模型名称
+
+    Returns:
+        共享重排序器
+    """
+    if not model_name:
+        return None
+    with _rerankers_lock:
+        reranker = _rerankers.get(model_name)
+        if reranker is None:
+            reranker = CrossEncoderReranker(model_name)
+            _rerankers[model_name] = reranker
+        return reranker
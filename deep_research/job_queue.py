@@ -0,0 +1,233 @@
+"""
+深度研究 Agent 任务队列
+网页应用的所有研究任务在同一个后台事件循环中由固定数量的工作协程执行，
+队列有上限，支持优先级、按用户公平调度、取消和排队位置查询
+"""
+
+import asyncio
+import itertools
+import threading
+from collections import defaultdict
+from typing import Dict, Any, Optional, Callable, Awaitable, List
+
+from deep_research.config import MAX_RUNNING_RESEARCH_TASKS, MAX_QUEUED_RESEARCH_TASKS
+from LLMapi_service.logger import get_logger
+
+logger = get_logger("deep_research.job_queue")
+
+
+class QueueFullError(Exception):
+    """排队任务已达上限"""
+
+
+class Job:
+    """队列中的一个研究任务"""
+
+    def __init__(self, job_id: str, factory: Callable[[], Awaitable[Any]], user: str, priority: int, seq: int):
+        self.id = job_id
+        self.factory = factory
+        self.user = user
+        self.priority = priority
+        self.seq = seq
+        # queued / running / completed / failed / cancelled
+        self.status = 'queued'
+        self.task: Optional[asyncio.Task] = None
+        self.cancel_requested = False
+
+
+class JobQueue:
+    """研究任务队列
+
+    调度规则：优先级高的任务先执行；同一优先级内，优先执行当前运行任务最少的用户的任务，
+    其次是最久没有被调度过的用户，最后按提交顺序，避免单个用户的大量提交占满所有工作协程
+    """
+
+    def __init__(self, workers: int = MAX_RUNNING_RESEARCH_TASKS, max_queued: int = MAX_QUEUED_RESEARCH_TASKS):
+        """初始化任务队列
+
+        Args:
+            workers: 同时运行的任务数
+            max_queued: 排队任务上限
+        """
+        self.workers = workers
+        self.max_queued = max_queued
+        self._jobs: Dict[str, Job] = {}
+        self._queued: List[Job] = []
+        self._running_by_user = defaultdict(int)
+        # 每个用户最近一次被调度的序号，用于在用户之间轮转
+        self._last_served: Dict[str, int] = {}
+        self._seq = itertools.count()
+        self._next_dispatch = 0
+        # 提交和查询来自 Flask 请求线程，调度在后台事件循环线程
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[Dict[str, int]], None]] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._ready = threading.Event()
+
+    def _ensure_started(self) -> None:
+        """首次提交时启动后台事件循环线程"""
+        with self._lock:
+            if self._loop is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=self._run_loop, name="research-job-queue", daemon=True)
+            thread.start()
+        self._ready.wait()
+
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._main())
+
+    async def _main(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._ready.set()
+        await asyncio.gather(*(self._worker() for _ in range(self.workers)))
+
+    def add_listener(self, callback: Callable[[Dict[str, int]], None]) -> None:
+        """注册排队变化的回调，参数为 {任务ID: 排队位置}，位置从1开始"""
+        self._listeners.append(callback)
+
+    def _notify(self) -> None:
+        positions = self.positions()
+        for callback in self._listeners:
+            try:
+                callback(positions)
+            except Exception as e:
+                logger.warning(f"任务队列回调出错: {e}")
+
+    def _dispatch_order(self) -> List[Job]:
+        """按调度规则排出所有排队任务的执行顺序，调用前需持有锁"""
+        running = dict(self._running_by_user)
+        last_served = dict(self._last_served)
+        remaining = list(self._queued)
+        order = []
+        while remaining:
+            job = min(remaining, key=lambda job: (
+                -job.priority, running.get(job.user, 0), last_served.get(job.user, -1), job.seq
+            ))
+            remaining.remove(job)
+            running[job.user] = running.get(job.user, 0) + 1
+            last_served[job.user] = len(order) + self._next_dispatch
+            order.append(job)
+        return order
+
+    def submit(self, job_id: str, factory: Callable[[], Awaitable[Any]], user: str = '', priority: int = 0) -> int:
+        """提交研究任务
+
+        Args:
+            job_id: 任务ID
+            factory: 返回任务协程的函数，任务开始执行时才调用
+            user: 提交者标识，用于公平调度
+            priority: 优先级，数值越大越先执行
+
+        Returns:
+            排队位置，从1开始
+
+        Raises:
+            QueueFullError: 排队任务已达上限
+        """
+        self._ensure_started()
+        with self._lock:
+            if len(self._queued) >= self.max_queued:
+                raise QueueFullError(f"排队任务已达上限（{self.max_queued}），请稍后再试")
+            job = Job(job_id, factory, user, priority, next(self._seq))
+            self._jobs[job_id] = job
+            self._queued.append(job)
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+        self._notify()
+        return self.position(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """取消任务，排队中的任务直接移出队列，运行中的任务会收到 CancelledError
+
+        Returns:
+            是否取消成功，任务不存在或已结束时返回False
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            if job.status == 'queued':
+                self._queued.remove(job)
+                job.status = 'cancelled'
+                del self._jobs[job_id]
+            elif job.status == 'running':
+                # 任务协程可能还未创建，由工作协程在创建后检查该标记
+                job.cancel_requested = True
+                if job.task is not None:
+                    self._loop.call_soon_threadsafe(job.task.cancel)
+            else:
+                return False
+        self._notify()
+        return True
+
+    def status(self, job_id: str) -> Optional[str]:
+        """任务的队列状态，任务不在队列中时返回None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.status if job else None
+
+    def position(self, job_id: str) -> Optional[int]:
+        """任务的排队位置，从1开始，不在排队时返回None"""
+        return self.positions().get(job_id)
+
+    def positions(self) -> Dict[str, int]:
+        """所有排队任务的排队位置"""
+        with self._lock:
+            return {job.id: index + 1 for index, job in enumerate(self._dispatch_order())}
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """获取队列统计信息"""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queued": len(self._queued),
+                "max_queued": self.max_queued,
+                "running": sum(self._running_by_user.values()),
+                "running_by_user": {user: count for user, count in self._running_by_user.items() if count}
+            }
+
+    async def _next_job(self) -> Job:
+        """等待并取出下一个要执行的任务"""
+        while True:
+            with self._lock:
+                order = self._dispatch_order()
+                if order:
+                    job = order[0]
+                    self._queued.remove(job)
+                    job.status = 'running'
+                    self._running_by_user[job.user] += 1
+                    self._last_served[job.user] = self._next_dispatch
+                    self._next_dispatch += 1
+                    return job
+                self._wakeup.clear()
+            await self._wakeup.wait()
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._next_job()
+            self._notify()
+            with self._lock:
+                job.task = asyncio.ensure_future(job.factory())
+                if job.cancel_requested:
+                    job.task.cancel()
+            try:
+                await job.task
+                job.status = 'completed'
+            except asyncio.CancelledError:
+                job.status = 'cancelled'
+            except Exception as e:
+                job.status = 'failed'
+                logger.error(f"研究任务 {job.id} 异常结束: {e}")
+            finally:
+                with self._lock:
+                    self._running_by_user[job.user] -= 1
+                    self._jobs.pop(job.id, None)
+                # 用户的运行任务数变化会影响其他任务的排队顺序
+                self._wakeup.set()
+                self._notify()
+
+
+# 网页应用共享的任务队列
+job_queue = JobQueue()
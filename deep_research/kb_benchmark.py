@@ -0,0 +1,228 @@
+"""
+知识库写入性能基准
+比较逐条 add_entry、批量 bulk_add 和旧版"每次新增重写整个 JSON 与索引"的写入吞吐量，以及重新加载知识库的耗时。
+使用随机向量代替真实嵌入模型，只测量持久化和索引的开销。
+另外比较各类向量索引（HNSW、IVF-PQ、int8 标量量化）相对 flat 精确检索的召回率、查询延迟和索引大小
+
+用法:
+    python -m deep_research.kb_benchmark --sizes 10000 100000
+    python -m deep_research.kb_benchmark --sizes --legacy-size 0 --ann-sizes 100000 1000000
+"""
+
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from typing import List, Dict, Any
+
+import numpy as np
+import faiss
+from langchain_community.embeddings import FakeEmbeddings
+from langchain_community.vectorstores import FAISS
+
+from deep_research.knowledge_base import KnowledgeBase, INDEX_TYPES, build_faiss_index
+
+# all-MiniLM-L6-v2 的向量维度
+EMBEDDING_SIZE = 384
+
+
+def make_entries(n: int, offset: int = 0) -> List[Dict]:
+    """生成模拟的研究节点条目"""
+    return [
+        {
+            "task": f"基准测试任务 {offset + i}",
+            "task_type": "simple",
+            "solution": {"solution": f"第 {offset + i} 个任务的解答。" * 20},
+            "timestamp": time.time()
+        }
+        for i in range(n)
+    ]
+
+
+def bench_incremental(n: int, workdir: str, batch_size: int = 0) -> Dict[str, Any]:
+    """测量新版知识库的写入吞吐量和重新加载耗时
+
+    Args:
+        n: 条目数
+        workdir: 临时目录
+        batch_size: 每次 bulk_add 的条目数，为0时逐条调用 add_entry
+    """
+    embeddings = FakeEmbeddings(size=EMBEDDING_SIZE)
+    storage_path = os.path.join(workdir, "knowledge_base.json")
+    kb = KnowledgeBase(storage_path=storage_path, embeddings=embeddings)
+
+    start = time.perf_counter()
+    if batch_size:
+        for offset in range(0, n, batch_size):
+            kb.bulk_add(make_entries(min(batch_size, n - offset), offset))
+    else:
+        for entry in make_entries(n):
+            kb.add_entry(entry)
+    kb.flush()
+    elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reloaded = KnowledgeBase(storage_path=storage_path, embeddings=embeddings)
+    load_time = time.perf_counter() - start
+
+    return {
+        "mode": f"bulk_add({batch_size})" if batch_size else "add_entry",
+        "entries": n,
+        "seconds": round(elapsed, 2),
+        "entries_per_second": round(n / elapsed, 1),
+        "reload_seconds": round(load_time, 2),
+        "reloaded_entries": len(reloaded.entries)
+    }
+
+
+def bench_legacy(n: int, workdir: str) -> Dict[str, Any]:
+    """模拟旧版 add_entry：每次新增都重写整个 JSON 文件并重新保存整个索引"""
+    embeddings = FakeEmbeddings(size=EMBEDDING_SIZE)
+    storage_path = os.path.join(workdir, "knowledge_base.json")
+    vector_store_path = os.path.join(workdir, "vector_store")
+    vector_store = FAISS.from_texts(["初始化文档"], embeddings)
+    entries = {}
+
+    start = time.perf_counter()
+    for i, entry in enumerate(make_entries(n)):
+        entries[str(i)] = entry
+        with open(storage_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False, indent=2)
+        vector_store.add_texts([entry["solution"]["solution"]], metadatas=[{"id": str(i), "entry": entry}])
+        vector_store.save_local(vector_store_path)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "mode": "legacy",
+        "entries": n,
+        "seconds": round(elapsed, 2),
+        "entries_per_second": round(n / elapsed, 1)
+    }
+
+
+def make_clustered_vectors(n: int, dim: int, clusters: int = 256, latent_dim: int = 32, seed: int = 0) -> np.ndarray:
+    """生成接近真实文本嵌入分布的随机向量
+
+    真实的句向量集中在少数主题簇附近，且簇内的变化只占据少数方向（内在维度远低于向量维度）。
+    这里在 latent_dim 维空间中生成聚类点，经固定的随机投影映射到 dim 维，加上少量各向同性噪声后归一化。
+    同一 seed 生成的数据和查询来自同一分布：查询应与知识库中的段落相近，而不是远离所有数据
+    """
+    rng = np.random.default_rng(seed)
+    projection = rng.standard_normal((latent_dim, dim)).astype(np.float32)
+    centers = rng.standard_normal((clusters, latent_dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    latent = centers[labels] + 0.5 * rng.standard_normal((n, latent_dim)).astype(np.float32)
+    vectors = latent @ projection + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.ascontiguousarray(vectors, dtype=np.float32)
+
+
+def bench_ann(n: int, index_types: List[str], n_queries: int = 1000, k: int = 10, dim: int = EMBEDDING_SIZE) -> List[Dict[str, Any]]:
+    """比较各类索引相对 flat 的召回率、查询延迟和索引大小
+
+    Args:
+        n: 向量数
+        index_types: 要测试的索引类型，flat 总是作为基准
+        n_queries: 查询数
+        k: 召回率按 top-k 计算
+        dim: 向量维度
+    """
+    # 数据和查询取自同一批样本，查询不加入索引
+    samples = make_clustered_vectors(n + n_queries, dim)
+    vectors, queries = samples[:n], samples[n:]
+
+    results = []
+    ground_truth = None
+    for index_type in ['flat'] + [t for t in index_types if t != 'flat']:
+        start = time.perf_counter()
+        index = build_faiss_index(index_type, dim, vectors)
+        index.add(vectors)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i in range(n_queries):
+            _, found = index.search(queries[i:i + 1], k)
+        per_query = (time.perf_counter() - start) / n_queries
+        # 单条查询测延迟，批量查询算召回率
+        _, found = index.search(queries, k)
+        if ground_truth is None:
+            ground_truth = found
+        recall = np.mean([len(set(found[i]) & set(ground_truth[i])) / k for i in range(n_queries)])
+
+        results.append({
+            "mode": f"ann:{index_type}",
+            "entries": n,
+            "build_seconds": round(build_time, 2),
+            "query_ms": round(per_query * 1000, 3),
+            f"recall@{k}": round(float(recall), 4),
+            "index_mb": round(faiss.serialize_index(index).nbytes / 1024 / 1024, 1)
+        })
+    return results
+
+
+def run(sizes: List[int], batch_size: int, legacy_size: int, skip_single: bool) -> List[Dict[str, Any]]:
+    """依次运行各项基准，每项使用独立的临时目录"""
+    results = []
+
+    def in_tempdir(func, *args):
+        workdir = tempfile.mkdtemp(prefix="kb_benchmark_")
+        try:
+            result = func(*args[:1], workdir, *args[1:])
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        print(result)
+        results.append(result)
+
+    if legacy_size:
+        in_tempdir(bench_legacy, legacy_size)
+    for n in sizes:
+        if not skip_single:
+            in_tempdir(bench_incremental, n)
+        in_tempdir(bench_incremental, n, batch_size)
+    return results
+
+
+def print_ann_results(results: List[Dict[str, Any]]) -> None:
+    print("\n==================== 索引对比 ====================")
+    print(f"{'索引':<12}{'条目数':>10}{'构建(s)':>10}{'查询(ms)':>10}{'召回率':>10}{'大小(MB)':>10}")
+    for result in results:
+        recall = next(value for key, value in result.items() if key.startswith("recall@"))
+        print(
+            f"{result['mode']:<12}{result['entries']:>10}{result['build_seconds']:>10}"
+            f"{result['query_ms']:>10}{recall:>10}{result['index_mb']:>10}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识库写入性能基准")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[10000, 100000], help="测试的条目数，为空时跳过")
+    parser.add_argument("--batch-size", type=int, default=1000, help="bulk_add 每批的条目数")
+    parser.add_argument("--legacy-size", type=int, default=2000, help="旧版写入方式的条目数，旧版为 O(N²)，不宜过大；为0时跳过")
+    parser.add_argument("--skip-single", action="store_true", help="跳过逐条 add_entry 的测试")
+    parser.add_argument("--ann-sizes", type=int, nargs="*", default=[], help="索引对比测试的向量数，为空时跳过")
+    parser.add_argument("--ann-types", nargs="+", default=list(INDEX_TYPES[1:]), choices=INDEX_TYPES, help="参与对比的索引类型")
+    args = parser.parse_args()
+
+    for n in args.ann_sizes:
+        ann_results = bench_ann(n, args.ann_types)
+        for result in ann_results:
+            print(result)
+        print_ann_results(ann_results)
+
+    results = run(args.sizes, args.batch_size, args.legacy_size, args.skip_single)
+    if not results:
+        return
+
+    print("\n==================== 结果汇总 ====================")
+    print(f"{'方式':<16}{'条目数':>10}{'耗时(s)':>12}{'条目/秒':>12}{'重新加载(s)':>14}")
+    for result in results:
+        print(
+            f"{result['mode']:<16}{result['entries']:>10}{result['seconds']:>12}"
+            f"{result['entries_per_second']:>12}{result.get('reload_seconds', '-'):>14}"
+        )
+
+
+if __name__ == "__main__":
+    main()
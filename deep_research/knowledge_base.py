@@ -1,188 +1,704 @@
 """
 深度研究 Agent 知识库模块
 使用向量数据库存储和检索知识
+
+条目以追加写入的 JSONL 日志持久化，每次新增只追加一行；向量索引、段落和关键词索引按批次定期保存快照，
+启动时加载快照，只为快照之后的日志记录重新切分段落和补做嵌入。
+加载时仍需完整读取条目日志和反序列化快照，耗时与条目数成正比，但省去了占大部分时间的段落切分和分词。
+大型知识库可以使用近似检索或量化索引（HNSW、IVF-PQ、int8 标量量化），并以内存映射方式加载索引，
+多个工作进程共享同一份数据。
+条目切分为带来源信息的段落分别建立索引，检索返回段落而不是整个条目；
+检索时把向量检索和 BM25 关键词检索的结果做倒数排名融合，可选用交叉编码器重排序
 """
 
 import os
 import json
+import time
 import uuid
+import pickle
+import asyncio
 import hashlib
+import threading
 from typing import List, Dict, Any, Optional, Union
 import numpy as np
+import faiss
 
 # 引入向量数据库和嵌入相关库
 from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain.docstore.document import Document
 
+from deep_research.embedding_service import get_embeddings
+from deep_research.hybrid_search import BM25Index, RRF_K, reciprocal_rank_fusion, get_reranker
+from deep_research.chunking import chunk_entry, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS
+from LLMapi_service.logger import get_logger
+
+logger = get_logger("deep_research.knowledge_base")
+
+# 默认的文本嵌入模型
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# 累计多少条未保存的新增条目后保存一次向量索引快照
+INDEX_SNAPSHOT_EVERY = 1000
+# 距上次保存超过多少秒后，下一次新增时保存向量索引快照
+INDEX_SNAPSHOT_SECONDS = 60
+# 段落和关键词索引快照的文件名及格式版本，切分或分词规则改变时递增版本，旧快照将被忽略
+CHUNK_STATE_FILE = "chunks.pkl"
+CHUNK_STATE_VERSION = 1
+# 上次段落快照之后新切分的条目数达到条目总数的该比例时，保存索引快照时才一并重写段落快照：
+# 每次重写都要序列化全部段落，按比例重写使总开销与条目数成正比，加载时最多重新切分这一比例的条目
+CHUNK_STATE_TAIL_RATIO = 0.1
+# 日志中的记录数超过有效条目数的该倍数时压缩日志（去掉被覆盖和已清空的记录）
+LOG_COMPACT_RATIO = 2
+# 日志记录数低于该值时不压缩
+LOG_COMPACT_MIN_RECORDS = 1000
+
+# 可选的向量索引类型：flat 为精确检索；hnsw 为图索引近似检索；
+# ivfpq 为倒排 + 乘积量化，内存占用最小；sq8 为 int8 标量量化的精确扫描
+INDEX_TYPES = ('flat', 'hnsw', 'ivfpq', 'sq8')
+# 非 flat 索引在段落数达到该值后才从 flat 重建，需要训练的索引也用这些段落的向量训练
+ANN_MIN_TRAIN_SIZE = 10000
+# 需要训练的索引（ivfpq、sq8）在段落数增长到训练时的该倍数后重新训练
+ANN_RETRAIN_GROWTH = 2
+# 以下参数按 kb_benchmark 的结果选取（384 维、2万/10万段落，recall@10 相对 flat），详见 README：
+# HNSW 每个节点的邻居数和查询时的候选列表长度；efSearch=32 时召回率已接近1，64 留有余量
+HNSW_M = 32
+HNSW_EF_SEARCH = 64
+# IVF 查询时探查的聚类数；nprobe≥8 后召回率不再提高，瓶颈在乘积量化的精度
+IVF_NPROBE = 16
+# 乘积量化中每个子量化器负责的维度数；8 维时 recall@10 约0.76，4 维时约0.88，编码大小翻倍（384维为96字节）
+PQ_SUBVECTOR_DIM = 4
+# 训练 ivfpq、sq8 时最多使用的向量数，超过时随机抽样；训练耗时与样本数成正比，更多样本对召回率几乎没有帮助
+ANN_TRAIN_SAMPLE = 20000
+
+# 混合检索时每一路（向量、关键词）召回的候选数为 top_k 的该倍数，融合后取前 top_k 个
+SEARCH_CANDIDATE_MULTIPLIER = 4
+# 启用重排序时送入交叉编码器的融合候选数上限
+RERANK_CANDIDATES = 20
+
+
+def build_faiss_index(index_type: str, dim: int, train_vectors: Optional[np.ndarray] = None) -> faiss.Index:
+    """创建（并在需要时训练）指定类型的 FAISS 索引，统一使用 L2 距离
+    
+    Args:
+        index_type: 索引类型，见 INDEX_TYPES
+        dim: 向量维度
+        train_vectors: 训练向量，ivfpq 和 sq8 需要
+        
+    Returns:
+        尚未添加向量的索引
+    """
+    if index_type == 'flat':
+        return faiss.IndexFlatL2(dim)
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, HNSW_M)
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+    
+    if train_vectors is None or len(train_vectors) == 0:
+        raise ValueError(f"{index_type} 索引需要训练向量")
+    if index_type == 'sq8':
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit)
+    elif index_type == 'ivfpq':
+        nlist = max(1, int(np.sqrt(len(train_vectors))))
+        m = max(1, dim // PQ_SUBVECTOR_DIM)
+        while dim % m:
+            m -= 1
+        index = faiss.index_factory(dim, f"IVF{nlist},PQ{m}")
+        faiss.ParameterSpace().set_index_parameter(index, "nprobe", IVF_NPROBE)
+        # 多义训练只用于汉明距离预过滤，这里不使用，且会使训练耗时增加数倍
+        index.do_polysemous_training = False
+    else:
+        raise ValueError(f"未知的索引类型: {index_type}，可选: {', '.join(INDEX_TYPES)}")
+    if len(train_vectors) > ANN_TRAIN_SAMPLE:
+        rng = np.random.default_rng(0)
+        train_vectors = train_vectors[rng.choice(len(train_vectors), ANN_TRAIN_SAMPLE, replace=False)]
+    index.train(np.ascontiguousarray(train_vectors, dtype=np.float32))
+    return index
+
 class KnowledgeBase:
     """知识库，使用向量数据库存储和检索知识"""
     
-    def __init__(self, storage_path: str = None, embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2"):
+    def __init__(
+        self,
+        storage_path: str = None,
+        embedding_model: str = DEFAULT_EMBEDDING_MODEL,
+        embeddings = None,
+        index_type: str = 'flat',
+        mmap: bool = False,
+        rerank_model: Optional[str] = None,
+        chunk_tokens: int = CHUNK_TOKENS,
+        chunk_overlap: int = CHUNK_OVERLAP_TOKENS
+    ):
         """初始化知识库
         
         Args:
-            storage_path: 知识库存储路径
-            embedding_model: 用于文本嵌入的模型名称
+            storage_path: 知识库存储路径，条目日志保存在同名的 .jsonl 文件中，
+                旧版的 .json 文件会在首次加载时导入
+            embedding_model: 用于文本嵌入的模型名称，同一进程内的知识库共享该模型的嵌入服务
+            embeddings: 可选的嵌入对象，传入时不使用共享嵌入服务
+            index_type: 向量索引类型，见 INDEX_TYPES；非 flat 类型在段落数达到 ANN_MIN_TRAIN_SIZE 后自动重建
+            mmap: 是否以内存映射方式加载索引快照，多个进程打开同一知识库时共享页缓存；
+                首次写入时会复制一份到进程内存
+            rerank_model: 可选的交叉编码器模型名称，设置后对融合检索结果重排序
+            chunk_tokens: 每个段落的最大 token 数
+            chunk_overlap: 相邻段落重叠的 token 数
         """
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"未知的索引类型: {index_type}，可选: {', '.join(INDEX_TYPES)}")
         self.storage_path = storage_path or "knowledge_base.json"
+        self.log_path = os.path.splitext(self.storage_path)[0] + ".jsonl"
+        self.vector_store_path = os.path.join(os.path.dirname(self.storage_path), "vector_store")
         self.entries = {}
         self.vector_store = None
         self.embedding_model_name = embedding_model
+        self.index_type = index_type
+        self.mmap = mmap
+        self.chunk_tokens = chunk_tokens
+        self.chunk_overlap = chunk_overlap
+        # 当前索引实际使用的类型和训练时的段落数，条目数不足时非 flat 索引先以 flat 运行
+        self._active_index_type = 'flat'
+        self._trained_size = 0
+        # 索引是否为内存映射的只读数据
+        self._mmapped = False
+        # 索引不支持删除向量时，覆盖条目后需要重建
+        self._needs_rebuild = False
+        # 所有条目的段落，键为段落ID（条目ID#序号），由条目内容确定，随索引快照保存
+        self._chunks: Dict[str, Dict] = {}
+        # 每个条目当前的段落数和段落内容的哈希
+        self._chunk_counts: Dict[str, int] = {}
+        self._chunk_hashes: Dict[str, str] = {}
+        # 上次保存段落快照之后重新切分的条目数
+        self._chunk_state_tail = 0
+        # 向量索引中已包含的条目及其段落数，覆盖条目时按此删除旧段落的向量
+        self._indexed_chunks: Dict[str, int] = {}
+        # 向量索引中各条目段落内容的哈希，加载时据此找出快照之后被覆盖的条目
+        self._indexed_hashes: Dict[str, str] = {}
+        # 上次快照之后新增到索引中的条目数
+        self._unsaved_count = 0
+        self._last_snapshot = time.monotonic()
+        # 日志中的记录数，用于判断是否需要压缩
+        self._log_records = 0
+        # 异步接口在线程池中执行，FAISS 索引不支持并发读写
+        self._lock = threading.RLock()
+        # 段落的关键词倒排索引，随条目增删增量更新，与段落一起保存快照
+        self.keyword_index = BM25Index()
+        self.reranker = get_reranker(rerank_model)
+        
+        # 使用进程内共享的嵌入服务：模型只加载一次，并发请求合并成批，重复文本直接取缓存
+        self.embeddings = embeddings or get_embeddings(embedding_model)
         
-        # 初始化嵌入模型
-        self.embeddings = HuggingFaceEmbeddings(model_name=embedding_model)
+        # 加载已有知识库内容，段落快照之后的条目重新切分
+        for entry_id in self._load_entries():
+            self._update_chunks(entry_id, self.entries[entry_id])
         
         # 加载或创建向量存储
         self._load_or_create_vector_store()
-        
-        # 加载已有知识库内容
-        self._load_entries()
+    
+    def _create_vector_store(self):
+        """创建只包含占位文档的空向量存储，FAISS 需要至少一个向量来确定维度"""
+        return FAISS.from_documents(
+            [Document(page_content="初始化文档", metadata={"id": "init"})], 
+            self.embeddings
+        )
+    
+    def _read_faiss_index(self, mmap: bool) -> faiss.Index:
+        """读取索引快照中的 FAISS 索引，内存映射失败时退回普通读取"""
+        index_path = os.path.join(self.vector_store_path, "index.faiss")
+        if mmap:
+            try:
+                index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                self._mmapped = True
+                return index
+            except RuntimeError as e:
+                logger.info(f"该索引类型不支持内存映射，改为读入内存: {e}")
+        self._mmapped = False
+        return faiss.read_index(index_path)
     
     def _load_or_create_vector_store(self):
-        """加载或创建向量存储"""
-        vector_store_path = os.path.dirname(self.storage_path) + "/vector_store"
+        """加载向量索引快照，并为快照之后新增的条目补做嵌入"""
+        ids_path = os.path.join(self.vector_store_path, "indexed_ids.json")
         
         try:
-            if os.path.exists(vector_store_path):
-                print(f"正在加载向量存储: {vector_store_path}")
-                self.vector_store = FAISS.load_local(vector_store_path, self.embeddings)
+            if os.path.exists(ids_path):
+                logger.info(f"正在加载向量存储: {self.vector_store_path}")
+                # 索引快照由本模块生成，可以安全反序列化
+                with open(os.path.join(self.vector_store_path, "index.pkl"), "rb") as f:
+                    docstore, index_to_docstore_id = pickle.load(f)
+                index = self._read_faiss_index(self.mmap)
+                self.vector_store = FAISS(self.embeddings, index, docstore, index_to_docstore_id)
+                with open(ids_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                if isinstance(meta, list) or "chunks" not in meta:
+                    # 早期快照按整个条目建立向量，丢弃后按段落重建
+                    logger.info("索引快照按整个条目建立，改为按段落重新建立索引")
+                    self.vector_store = self._create_vector_store()
+                    self._mmapped = False
+                else:
+                    self._indexed_chunks = dict(meta["chunks"])
+                    self._indexed_hashes = dict(meta.get("hashes") or {})
+                    self._active_index_type = meta.get("index_type", "flat")
+                    self._trained_size = meta.get("trained_size", 0)
             else:
-                print(f"创建新的向量存储")
-                # 初始化空的向量存储
-                self.vector_store = FAISS.from_documents(
-                    [Document(page_content="初始化文档", metadata={"id": "init"})], 
-                    self.embeddings
-                )
-                # 保存向量存储
-                os.makedirs(os.path.dirname(vector_store_path), exist_ok=True)
-                self.vector_store.save_local(vector_store_path)
+                logger.info(f"创建新的向量存储")
+                self.vector_store = self._create_vector_store()
         except Exception as e:
-            print(f"初始化向量存储时出错: {e}")
+            logger.warning(f"初始化向量存储时出错: {e}")
             # 创建备用向量存储
-            self.vector_store = FAISS.from_documents(
-                [Document(page_content="初始化文档", metadata={"id": "init"})], 
-                self.embeddings
-            )
+            self.vector_store = self._create_vector_store()
+            self._indexed_chunks = {}
+            self._indexed_hashes = {}
+            self._active_index_type = 'flat'
+            self._mmapped = False
+        
+        # 未进入快照的条目批量嵌入；快照之后被覆盖的条目替换旧向量
+        outdated = [entry_id for entry_id in self.entries if self._index_outdated(entry_id)]
+        if outdated:
+            logger.info(f"为 {len(outdated)} 条未进入索引快照或快照之后被修改的条目生成向量")
+            self._index_entries(outdated)
+            self.flush()
+    
+    def _index_outdated(self, entry_id: str) -> bool:
+        """条目是否尚未进入向量索引，或索引中的段落与当前内容不同"""
+        if entry_id not in self._indexed_chunks:
+            return True
+        indexed_hash = self._indexed_hashes.get(entry_id)
+        if indexed_hash is None:
+            # 早期快照没有记录段落哈希，只能按段落数判断
+            return self._indexed_chunks[entry_id] != self._chunk_counts.get(entry_id, 0)
+        return indexed_hash != self._chunk_hashes.get(entry_id)
     
-    def _load_entries(self):
-        """加载已有知识库内容"""
-        if os.path.exists(self.storage_path):
+    def _load_entries(self) -> List[str]:
+        """加载已有知识库内容：重放条目日志，没有日志时导入旧版的 JSON 文件
+        
+        段落快照与日志在快照位置的条目一致时恢复段落和关键词索引，只有之后的日志记录需要重新切分
+        
+        Returns:
+            需要重新切分段落的条目ID
+        """
+        self.entries = {}
+        
+        if os.path.exists(self.log_path):
+            state = self._read_chunk_state()
+            offset = state["log_offset"] if state else -1
+            # 快照位置的条目ID，快照位置不在记录边界上时为None
+            snapshot_ids = None
+            changed = set()
+            position = 0
+            with open(self.log_path, "rb") as f:
+                for line in f:
+                    if position == offset:
+                        snapshot_ids = set(self.entries)
+                    position += len(line)
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except (json.JSONDecodeError, UnicodeDecodeError):
+                        # 进程中断可能留下写了一半的最后一行
+                        logger.warning(f"跳过知识库日志中损坏的记录")
+                        continue
+                    self._log_records += 1
+                    if record.get("op") == "clear":
+                        self.entries = {}
+                        if snapshot_ids is not None:
+                            # 快照之后清空过，快照中的段落全部作废
+                            snapshot_ids = set()
+                            state["chunks"], state["chunk_counts"], state["chunk_hashes"] = {}, {}, {}
+                            state["keyword_index"] = BM25Index()
+                            changed.clear()
+                    else:
+                        self.entries[record["id"]] = record["entry"]
+                        if snapshot_ids is not None:
+                            changed.add(record["id"])
+            if position == offset:
+                snapshot_ids = set(self.entries)
+            logger.info(f"已加载 {len(self.entries)} 条知识库条目")
+            
+            if snapshot_ids is not None and snapshot_ids == set(state["chunk_counts"]):
+                self._chunks = state["chunks"]
+                self._chunk_counts = state["chunk_counts"]
+                self._chunk_hashes = state["chunk_hashes"]
+                self.keyword_index = state["keyword_index"]
+                logger.info(f"已从快照恢复 {len(self._chunks)} 个段落，{len(changed)} 条条目需要重新切分")
+                return [entry_id for entry_id in changed if entry_id in self.entries]
+            if state:
+                logger.info("段落快照与条目日志不一致，重新切分全部条目")
+        elif os.path.exists(self.storage_path):
             try:
                 with open(self.storage_path, "r", encoding="utf-8") as f:
                     self.entries = json.load(f)
-                print(f"已加载 {len(self.entries)} 条知识库条目")
+                logger.info(f"已导入 {len(self.entries)} 条旧版知识库条目")
             except Exception as e:
-                print(f"加载知识库时出错: {e}")
+                logger.warning(f"加载知识库时出错: {e}")
                 self.entries = {}
+            self.compact()
         else:
-            print("知识库文件不存在，创建新的知识库")
-            self.entries = {}
+            logger.info("知识库文件不存在，创建新的知识库")
             # 确保目录存在
-            os.makedirs(os.path.dirname(self.storage_path), exist_ok=True)
-            self._save_entries()
+            directory = os.path.dirname(self.log_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        return list(self.entries)
     
-    def _save_entries(self):
-        """保存知识库内容到文件"""
+    def _read_chunk_state(self) -> Optional[Dict]:
+        """读取段落快照，不存在、已损坏或切分参数不同时返回None"""
+        path = os.path.join(self.vector_store_path, CHUNK_STATE_FILE)
+        if not os.path.exists(path):
+            return None
         try:
-            with open(self.storage_path, "w", encoding="utf-8") as f:
-                json.dump(self.entries, f, ensure_ascii=False, indent=2)
+            # 段落快照由本模块生成，可以安全反序列化
+            with open(path, "rb") as f:
+                state = pickle.load(f)
         except Exception as e:
-            print(f"保存知识库时出错: {e}")
+            logger.warning(f"读取段落快照时出错，将重新切分全部条目: {e}")
+            return None
+        if (state.get("version"), state.get("chunk_tokens"), state.get("chunk_overlap")) != (
+                CHUNK_STATE_VERSION, self.chunk_tokens, self.chunk_overlap):
+            return None
+        return state
     
-    def add_entry(self, entry: Dict) -> str:
-        """添加条目到知识库
+    def _save_chunk_state(self):
+        """保存段落和关键词索引的快照，并记录此时条目日志的长度，加载时只需切分之后的日志记录"""
+        path = os.path.join(self.vector_store_path, CHUNK_STATE_FILE)
+        try:
+            with self._lock:
+                state = {
+                    "version": CHUNK_STATE_VERSION,
+                    "chunk_tokens": self.chunk_tokens,
+                    "chunk_overlap": self.chunk_overlap,
+                    "log_offset": os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0,
+                    "chunks": self._chunks,
+                    "chunk_counts": self._chunk_counts,
+                    "chunk_hashes": self._chunk_hashes,
+                    "keyword_index": self.keyword_index
+                }
+                os.makedirs(self.vector_store_path, exist_ok=True)
+                with open(path + ".tmp", "wb") as f:
+                    pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(path + ".tmp", path)
+                self._chunk_state_tail = 0
+        except Exception as e:
+            logger.warning(f"保存段落快照时出错: {e}")
+    
+    def _append_records(self, records: List[Dict]):
+        """把记录追加到条目日志，一次写入一批"""
+        try:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+            self._log_records += len(records)
+        except Exception as e:
+            logger.warning(f"保存知识库时出错: {e}")
+    
+    def compact(self):
+        """重写条目日志，每个有效条目只保留一条记录"""
+        temp_path = self.log_path + ".tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                for entry_id, entry in self.entries.items():
+                    f.write(json.dumps({"op": "add", "id": entry_id, "entry": entry}, ensure_ascii=False) + "\n")
+            os.replace(temp_path, self.log_path)
+            self._log_records = len(self.entries)
+            # 压缩后日志中的位置改变，已有的段落快照需要重新记录
+            if os.path.exists(os.path.join(self.vector_store_path, CHUNK_STATE_FILE)):
+                self._save_chunk_state()
+        except Exception as e:
+            logger.warning(f"压缩知识库日志时出错: {e}")
+    
+    def _ensure_writable(self):
+        """内存映射的索引是只读的，写入前复制一份到进程内存"""
+        if self._mmapped:
+            self.vector_store.index = self._read_faiss_index(mmap=False)
+    
+    def _chunk_ids(self, entry_id: str, count: int) -> List[str]:
+        return [f"{entry_id}#{i}" for i in range(count)]
+    
+    def _update_chunks(self, entry_id: str, entry: Dict):
+        """重新切分条目，替换其旧段落并更新关键词索引"""
+        for chunk_id in self._chunk_ids(entry_id, self._chunk_counts.get(entry_id, 0)):
+            self._chunks.pop(chunk_id, None)
+            self.keyword_index.remove(chunk_id)
+        chunks = chunk_entry(entry_id, entry, self.chunk_tokens, self.chunk_overlap)
+        self._chunk_counts[entry_id] = len(chunks)
+        self._chunk_hashes[entry_id] = hashlib.md5(
+            "\x00".join(chunk["text"] for chunk in chunks).encode("utf-8")
+        ).hexdigest()
+        for chunk in chunks:
+            self._chunks[chunk["id"]] = chunk
+            self.keyword_index.add(chunk["id"], chunk["text"])
+        self._chunk_state_tail += 1
+    
+    def _index_entries(self, entry_ids: List[str]):
+        """把条目的段落批量嵌入并加入向量索引，已在索引中的条目先删除旧段落的向量"""
+        self._ensure_writable()
+        stale = [entry_id for entry_id in entry_ids if entry_id in self._indexed_chunks]
+        if stale:
+            try:
+                if self._active_index_type == 'ivfpq':
+                    # IVF 索引删除向量后其余向量保留原编号，而 FAISS 包装类按位置重排段落ID映射，两者会错位
+                    raise RuntimeError("IVF 索引删除向量后段落ID映射会错位")
+                self.vector_store.delete([
+                    chunk_id for entry_id in stale
+                    for chunk_id in self._chunk_ids(entry_id, self._indexed_chunks[entry_id])
+                ])
+                for entry_id in stale:
+                    del self._indexed_chunks[entry_id]
+                    self._indexed_hashes.pop(entry_id, None)
+            except Exception as e:
+                # HNSW 不支持删除向量，IVF 删除后编号错位：旧向量仍指向原段落ID，下次保存时重建索引
+                logger.warning(f"删除旧向量时出错，将在下次保存时重建索引: {e}")
+                self._needs_rebuild = True
+                entry_ids = [entry_id for entry_id in entry_ids if entry_id not in self._indexed_chunks]
+                if not entry_ids:
+                    return
         
-        Args:
-            entry: 知识库条目
-            
-        Returns:
-            条目ID
-        """
-        # 为条目生成唯一ID
-        entry_id = self._generate_id(entry)
+        chunk_ids = [
+            chunk_id for entry_id in entry_ids
+            for chunk_id in self._chunk_ids(entry_id, self._chunk_counts[entry_id])
+        ]
+        if chunk_ids:
+            texts = [self._chunks[chunk_id]["text"] for chunk_id in chunk_ids]
+            # 只在元数据中保存ID，段落内容从 self._chunks 读取，避免索引快照重复保存
+            metadatas = [{"id": self._chunks[chunk_id]["entry_id"], "chunk_id": chunk_id} for chunk_id in chunk_ids]
+            self.vector_store.add_texts(texts, metadatas=metadatas, ids=chunk_ids)
+        for entry_id in entry_ids:
+            self._indexed_chunks[entry_id] = self._chunk_counts[entry_id]
+            self._indexed_hashes[entry_id] = self._chunk_hashes[entry_id]
+        self._unsaved_count += len(entry_ids)
+    
+    def save_index(self):
+        """保存向量索引快照"""
+        try:
+            os.makedirs(self.vector_store_path, exist_ok=True)
+            # 先写临时文件再替换：其他进程内存映射着旧文件时，替换不会破坏它们已映射的数据
+            self.vector_store.save_local(self.vector_store_path, index_name="index.tmp")
+            for suffix in (".faiss", ".pkl"):
+                os.replace(
+                    os.path.join(self.vector_store_path, "index.tmp" + suffix),
+                    os.path.join(self.vector_store_path, "index" + suffix)
+                )
+            # 最后写入ID列表，快照写到一半中断时启动后会重建索引
+            ids_path = os.path.join(self.vector_store_path, "indexed_ids.json")
+            meta = {
+                "index_type": self._active_index_type,
+                "trained_size": self._trained_size,
+                "chunks": self._indexed_chunks,
+                "hashes": self._indexed_hashes
+            }
+            with open(ids_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(ids_path + ".tmp", ids_path)
+            if self._chunk_state_tail >= CHUNK_STATE_TAIL_RATIO * len(self.entries):
+                self._save_chunk_state()
+            self._unsaved_count = 0
+            self._last_snapshot = time.monotonic()
+        except Exception as e:
+            logger.warning(f"保存向量存储时出错: {e}")
+    
+    def _should_rebuild(self) -> bool:
+        """判断是否需要重建索引：覆盖了不支持删除的索引、段落数首次达到训练阈值，或训练后段落数大幅增长"""
+        if self._needs_rebuild:
+            return True
+        if self.index_type == 'flat' or len(self._chunks) < ANN_MIN_TRAIN_SIZE:
+            return False
+        if self._active_index_type != self.index_type:
+            return True
+        return self.index_type in ('ivfpq', 'sq8') and len(self._chunks) >= ANN_RETRAIN_GROWTH * self._trained_size
+    
+    def rebuild_index(self, index_type: Optional[str] = None):
+        """用全部段落重建向量索引，需要训练的索引类型在此训练
         
-        # 保存条目到知识库
-        self.entries[entry_id] = entry
-        self._save_entries()
+        段落文本的向量来自嵌入服务的缓存，重建时通常不需要重新计算
         
-        # 添加到向量存储
-        try:
-            text_content = self._extract_text_content(entry)
-            document = Document(page_content=text_content, metadata={"id": entry_id, "entry": entry})
-            self.vector_store.add_documents([document])
+        Args:
+            index_type: 新的索引类型，为None时使用当前配置；段落数不足 ANN_MIN_TRAIN_SIZE 时使用 flat
+        """
+        with self._lock:
+            if index_type is not None:
+                if index_type not in INDEX_TYPES:
+                    raise ValueError(f"未知的索引类型: {index_type}，可选: {', '.join(INDEX_TYPES)}")
+                self.index_type = index_type
             
-            # 保存向量存储
-            vector_store_path = os.path.dirname(self.storage_path) + "/vector_store"
-            os.makedirs(vector_store_path, exist_ok=True)
-            self.vector_store.save_local(vector_store_path)
+            chunk_ids = list(self._chunks)
+            texts = [self._chunks[chunk_id]["text"] for chunk_id in chunk_ids]
+            if not texts:
+                self.vector_store = self._create_vector_store()
+                self._indexed_chunks = {}
+                self._indexed_hashes = {}
+                self._active_index_type = 'flat'
+                self._mmapped = False
+                self._needs_rebuild = False
+                self.save_index()
+                return
             
-        except Exception as e:
-            print(f"添加条目到向量存储时出错: {e}")
-        
-        return entry_id
+            vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+            active_type = self.index_type if len(chunk_ids) >= ANN_MIN_TRAIN_SIZE else 'flat'
+            logger.info(f"重建向量索引: {active_type}，{len(chunk_ids)} 个段落")
+            index = build_faiss_index(active_type, vectors.shape[1], vectors)
+            
+            vector_store = FAISS(self.embeddings, index, InMemoryDocstore(), {})
+            vector_store.add_embeddings(
+                list(zip(texts, vectors.tolist())),
+                metadatas=[{"id": self._chunks[chunk_id]["entry_id"], "chunk_id": chunk_id} for chunk_id in chunk_ids],
+                ids=chunk_ids
+            )
+            self.vector_store = vector_store
+            self._indexed_chunks = dict(self._chunk_counts)
+            self._indexed_hashes = dict(self._chunk_hashes)
+            self._active_index_type = active_type
+            self._trained_size = len(chunk_ids)
+            self._mmapped = False
+            self._needs_rebuild = False
+            self.save_index()
     
-    def search(self, query: str, top_k: int = 5) -> List[Dict]:
-        """使用向量搜索查询相关知识
+    def flush(self):
+        """保存尚未写入快照的向量索引（需要时先重建索引），并在日志膨胀时压缩日志"""
+        with self._lock:
+            if self._should_rebuild():
+                self.rebuild_index()
+            elif self._unsaved_count:
+                self.save_index()
+            if self._log_records > max(LOG_COMPACT_MIN_RECORDS, LOG_COMPACT_RATIO * len(self.entries)):
+                self.compact()
+    
+    def bulk_add(self, entries: List[Dict], entry_ids: Optional[List[str]] = None) -> List[str]:
+        """批量添加条目：一次追加日志、一次批量嵌入，索引快照按批次定期保存
         
         Args:
-            query: 搜索查询
-            top_k: 返回的最大结果数
+            entries: 知识库条目列表
+            entry_ids: 可选的条目ID列表，为None时根据条目内容生成
             
         Returns:
-            搜索结果列表
+            条目ID列表，与输入顺序一致
         """
-        if not self.vector_store:
-            return []
+        if entry_ids is None:
+            entry_ids = [self._generate_id(entry) for entry in entries]
         
-        try:
-            # 向量相似度搜索
-            results = self.vector_store.similarity_search_with_score(query, k=top_k)
-            
-            # 格式化结果
-            formatted_results = []
-            for doc, score in results:
-                entry_id = doc.metadata.get("id")
-                if entry_id and entry_id in self.entries:
-                    formatted_results.append({
-                        "id": entry_id,
-                        "content": self.entries[entry_id],
-                        "relevance_score": float(score),
-                        "relevance": "high" if float(score) > 0.8 else "medium"
-                    })
+        with self._lock:
+            # 保存条目到知识库，同一批内ID重复时保留最后一个
+            batch = {}
+            for entry_id, entry in zip(entry_ids, entries):
+                self.entries[entry_id] = entry
+                batch[entry_id] = entry
+            self._append_records([{"op": "add", "id": entry_id, "entry": entry} for entry_id, entry in batch.items()])
+            for entry_id, entry in batch.items():
+                self._update_chunks(entry_id, entry)
             
-            return formatted_results
+            # 添加到向量存储
+            try:
+                self._index_entries(list(batch))
+                if (self._unsaved_count >= INDEX_SNAPSHOT_EVERY
+                        or time.monotonic() - self._last_snapshot > INDEX_SNAPSHOT_SECONDS):
+                    self.flush()
+            except Exception as e:
+                logger.warning(f"添加条目到向量存储时出错: {e}")
         
-        except Exception as e:
-            print(f"向量搜索时出错: {e}")
-            # 回退到关键词搜索
-            return self._fallback_keyword_search(query, top_k)
+        return entry_ids
     
-    def _fallback_keyword_search(self, query: str, top_k: int = 5) -> List[Dict]:
-        """回退到关键词搜索
+    def add_entry(self, entry: Dict, entry_id: Optional[str] = None) -> str:
+        """添加条目到知识库
+        
+        Args:
+            entry: 知识库条目
+            entry_id: 可选的条目ID，为None时根据条目内容生成
+            
+        Returns:
+            条目ID
+        """
+        return self.bulk_add([entry], None if entry_id is None else [entry_id])[0]
+    
+    async def aadd_entry(self, entry: Dict, entry_id: Optional[str] = None) -> str:
+        """异步添加条目，嵌入和写入在线程池中执行，不阻塞事件循环"""
+        return await asyncio.to_thread(self.add_entry, entry, entry_id)
+    
+    async def asearch(self, query: str, top_k: int = 5) -> List[Dict]:
+        """异步混合检索，查询嵌入、索引检索和重排序在线程池中执行，不阻塞事件循环"""
+        return await asyncio.to_thread(self.search, query, top_k)
+    
+    def search(self, query: str, top_k: int = 5) -> List[Dict]:
+        """混合检索段落：向量检索和 BM25 关键词检索各召回一批候选，按倒数排名融合，启用重排序时再由交叉编码器打分
         
         Args:
             query: 搜索查询
-            top_k: 返回的最大结果数
+            top_k: 返回的最大段落数
             
         Returns:
-            搜索结果列表
+            段落列表，每个段落包含 id（段落ID）、entry_id、field、text 以及来源信息 node_id、depth、source_url；
+            文本相同的段落只保留一个。relevance_score 为0-1的相关度：
+            重排序时为交叉编码器得分，否则为融合得分相对满分（各路均排第一）的比例；
+            vector_score 和 keyword_score 为各路的原始得分，未被该路召回时为None
         """
+        candidates = top_k * SEARCH_CANDIDATE_MULTIPLIER
+        vector_scores = self._vector_search(query, candidates)
+        
+        # 关键词检索和候选段落在锁内取快照，避免与并发的写入交错；重排序较慢，在锁外进行
+        with self._lock:
+            keyword_scores = dict(self.keyword_index.search(query, candidates))
+            rankings = [list(vector_scores), list(keyword_scores)]
+            fused = [
+                (chunk_id, score) for chunk_id, score in reciprocal_rank_fusion(rankings)
+                if chunk_id in self._chunks
+            ]
+            if self.reranker:
+                fused = fused[:max(top_k, RERANK_CANDIDATES)]
+            chunks = {chunk_id: dict(self._chunks[chunk_id]) for chunk_id, _ in fused}
+        if not fused:
+            return []
+        
+        scores = None
+        if self.reranker:
+            try:
+                texts = [chunks[chunk_id]["text"] for chunk_id, _ in fused]
+                scores = self.reranker.score(query, texts)
+                fused = sorted(zip([chunk_id for chunk_id, _ in fused], scores), key=lambda item: item[1], reverse=True)
+            except Exception as e:
+                logger.warning(f"重排序时出错，使用融合排序: {e}")
+                scores = None
+        if scores is None:
+            # 每一路都排第一时融合得分最高；某一路没有结果（如向量检索出错）时不计入满分
+            best = sum(1 for ranking in rankings if ranking) / (RRF_K + 1)
+            fused = [(chunk_id, score / best) for chunk_id, score in fused]
+        
         results = []
-        query_lower = query.lower()
+        seen_texts = set()
+        for chunk_id, score in fused:
+            chunk = chunks[chunk_id]
+            # 父节点条目中的子任务结果与子节点条目的解答相同，只保留一份
+            if chunk["text"] in seen_texts:
+                continue
+            seen_texts.add(chunk["text"])
+            results.append({
+                **chunk,
+                "relevance_score": float(score),
+                "relevance": "high" if score > 0.8 else "medium",
+                "vector_score": vector_scores.get(chunk_id),
+                "keyword_score": keyword_scores.get(chunk_id)
+            })
+            if len(results) >= top_k:
+                break
+        return results
+    
+    def _vector_search(self, query: str, k: int) -> Dict[str, float]:
+        """向量相似度检索
         
-        for entry_id, entry in self.entries.items():
-            entry_str = json.dumps(entry, ensure_ascii=False).lower()
-            if query_lower in entry_str:
-                results.append({
-                    "id": entry_id,
-                    "content": entry,
-                    "relevance": "high" if query_lower in entry_str[:100] else "medium"
-                })
+        Returns:
+            按相关度降序排列的 {段落ID: 相关度}，相关度归一化到0-1；出错时返回空字典，只使用关键词检索结果
+        """
+        if not self.vector_store:
+            return {}
+        try:
+            # 多取一个以跳过初始化占位文档
+            with self._lock:
+                results = self.vector_store.similarity_search_with_relevance_scores(query, k=k + 1)
+        except Exception as e:
+            logger.warning(f"向量搜索时出错，只使用关键词检索: {e}")
+            return {}
         
-        # 按相关性排序，返回前top_k个结果
-        results.sort(key=lambda x: 0 if x["relevance"] == "high" else 1)
-        return results[:top_k]
+        scores = {}
+        for doc, score in results:
+            chunk_id = doc.metadata.get("chunk_id")
+            if chunk_id and chunk_id not in scores:
+                scores[chunk_id] = float(score)
+        return scores
     
     def _generate_id(self, entry: Dict) -> str:
         """为知识库条目生成唯一ID
@@ -203,47 +719,6 @@ class KnowledgeBase:
             # 生成随机UUID
             return str(uuid.uuid4())[:12]
     
-    def _extract_text_content(self, entry: Dict) -> str:
-        """从条目中提取文本内容用于向量化
-        
-        Args:
-            entry: 知识库条目
-            
-        Returns:
-            用于向量化的文本内容
-        """
-        # 尝试提取最有意义的内容
-        text_parts = []
-        
-        if isinstance(entry, dict):
-            # 添加任务描述
-            if "task" in entry:
-                text_parts.append(f"任务: {entry['task']}")
-            
-            # 添加解决方案
-            if "solution" in entry:
-                if isinstance(entry["solution"], dict):
-                    solution_text = entry["solution"].get("solution", "")
-                    text_parts.append(f"解决方案: {solution_text}")
-                else:
-                    text_parts.append(f"解决方案: {entry['solution']}")
-            
-            # 添加总结
-            if "summary" in entry:
-                text_parts.append(f"总结: {entry['summary']}")
-                
-            # 处理子任务结果
-            if "results" in entry and isinstance(entry["results"], dict):
-                for task_id, result in entry["results"].items():
-                    if isinstance(result, dict) and "solution" in result:
-                        text_parts.append(f"子任务 {task_id}: {result['solution']}")
-        
-        # 如果没有提取到有意义的内容，使用整个条目作为文本
-        if not text_parts:
-            return json.dumps(entry, ensure_ascii=False)
-        
-        return "\n".join(text_parts)
-
     def get_entry(self, entry_id: str) -> Optional[Dict]:
         """获取指定ID的条目
         
@@ -265,20 +740,37 @@ class KnowledgeBase:
     
     def clear(self) -> None:
         """清空知识库"""
-        self.entries = {}
-        
-        # 如果设置了存储路径，则保存空知识库到本地
-        if self.storage_path:
-            self.save_to_disk()
+        with self._lock:
+            self.entries = {}
+            self._append_records([{"op": "clear"}])
+            self.keyword_index.clear()
+            self._chunks = {}
+            self._chunk_counts = {}
+            self._chunk_hashes = {}
+            
+            # 重建空的向量存储并保存快照
+            self.vector_store = self._create_vector_store()
+            self._indexed_chunks = {}
+            self._indexed_hashes = {}
+            self._active_index_type = 'flat'
+            self._trained_size = 0
+            self._mmapped = False
+            self._needs_rebuild = False
+            self.save_index()
     
     def get_statistics(self) -> Dict:
         """获取知识库统计信息
         
         Returns:
-            统计信息，包括条目数量、最新条目时间等
+            统计信息，包括条目数量、最新条目时间、索引类型等
         """
         stats = {
             "total_entries": len(self.entries),
+            "total_chunks": len(self._chunks),
+            "index_type": self._active_index_type,
+            "configured_index_type": self.index_type,
+            "index_mmapped": self._mmapped,
+            "reranker": self.reranker.model_name if self.reranker else None,
             "latest_timestamp": 0,
             "earliest_timestamp": float('inf') if self.entries else 0,
             "entry_types": {}
@@ -14,14 +14,22 @@ sys.path.append('..')
 
 from deep_research.agent import DeepResearchAgent
 from deep_research.knowledge_base import KnowledgeBase
-from deep_research.output_organizer import OutputOrganizer
+from deep_research.report_writer import (
+    ReportWriter, REPORT_FORMATS, REPORT_MARKDOWN_FILE, REPORT_HTML_FILE, REPORT_CONTENT_FILE
+)
+from deep_research.config import (
+    KB_INDEX_TYPE, KB_INDEX_MMAP, KB_RERANK_MODEL, KB_CHUNK_TOKENS, KB_CHUNK_OVERLAP, PLANNING_MODE
+)
+from LLMapi_service.transport import close_sessions
+from LLMapi_service.logger import configure_logging
 
 async def run_research(
     query: str, 
     model: str = "deepseek-chat", 
     output_dir: str = "output", 
     output_format: str = "markdown",
-    max_depth: int = 3
+    max_depth: int = 3,
+    planning_mode: str = PLANNING_MODE
 ):
     """
     执行深度研究并保存结果
@@ -32,6 +40,7 @@ async def run_research(
         output_dir: 输出目录
         output_format: 输出格式，可选值: markdown, html, json
         max_depth: 最大递归研究深度
+        planning_mode: 研究节点的规划方式（sequential / speculative / merged）
     """
     print(f"开始研究: {query}")
     print(f"使用模型: {model}")
@@ -42,11 +51,18 @@ async def run_research(
     
     # 初始化知识库
     kb_path = os.path.join(output_dir, "knowledge_base.json")
-    kb = KnowledgeBase(storage_path=kb_path)
+    kb = KnowledgeBase(
+        storage_path=kb_path, index_type=KB_INDEX_TYPE, mmap=KB_INDEX_MMAP, rerank_model=KB_RERANK_MODEL,
+        chunk_tokens=KB_CHUNK_TOKENS, chunk_overlap=KB_CHUNK_OVERLAP
+    )
     
     # 创建研究Agent并执行研究
-    agent = DeepResearchAgent(model=model, max_recursion_depth=max_depth)
-    agent.knowledge_base = kb.entries
+    agent = DeepResearchAgent(model=model, max_recursion_depth=max_depth, planning_mode=planning_mode)
+    # 研究节点通过向量索引检索知识库，并把各自的结果写回索引
+    agent.knowledge_base = kb
+    # 报告章节生成后立即写入输出目录，中途出错时已完成的章节仍然保留
+    formats = REPORT_FORMATS if output_format == "all" else (output_format,)
+    agent.set_report_writer(ReportWriter(output_dir, formats))
     
     try:
         # 执行研究
@@ -56,27 +72,23 @@ async def run_research(
         with open(os.path.join(output_dir, "raw_results.json"), "w", encoding="utf-8") as f:
             json.dump(results["raw_results"], f, ensure_ascii=False, indent=2)
         
-        # 使用输出整理器格式化结果
-        organizer = OutputOrganizer(model=model)
+        # 保存研究树的链路追踪（Chrome trace-event 和 OpenTelemetry 格式）
+        trace_paths = agent.tracer.save(output_dir)
+        trace_summary = agent.tracer.summary()
+        print(f"链路追踪已保存至: {trace_paths['chrome']}，总耗时 {trace_summary['wall_ms'] / 1000:.1f}s，"
+              f"LLM 平均并行度 {trace_summary['parallelism']}")
         
-        # 根据输出格式保存结果
-        if output_format == "markdown" or output_format == "all":
-            markdown = organizer.format_as_markdown(results["content"])
-            with open(os.path.join(output_dir, "research_report.md"), "w", encoding="utf-8") as f:
-                f.write(markdown)
-            print(f"Markdown 报告已保存至: {os.path.join(output_dir, 'research_report.md')}")
-        
-        if output_format == "html" or output_format == "all":
-            html = organizer.format_as_html(results["content"])
-            with open(os.path.join(output_dir, "research_report.html"), "w", encoding="utf-8") as f:
-                f.write(html)
-            print(f"HTML 报告已保存至: {os.path.join(output_dir, 'research_report.html')}")
-        
-        if output_format == "json" or output_format == "all":
-            with open(os.path.join(output_dir, "research_content.json"), "w", encoding="utf-8") as f:
-                json.dump(results["content"], f, ensure_ascii=False, indent=2)
-            print(f"JSON 内容已保存至: {os.path.join(output_dir, 'research_content.json')}")
+        # 报告文件已在生成过程中逐章节写出
+        for fmt, filename, label in (
+            ("markdown", REPORT_MARKDOWN_FILE, "Markdown 报告"),
+            ("html", REPORT_HTML_FILE, "HTML 报告"),
+            ("json", REPORT_CONTENT_FILE, "JSON 内容")
+        ):
+            if fmt in formats:
+                print(f"{label}已保存至: {os.path.join(output_dir, filename)}")
         
+        for section in results.get("failed_sections", []):
+            print(f"章节生成失败: {section['title']}（{section['error']}）")
         print("研究完成!")
         return results
     
@@ -93,6 +105,12 @@ async def run_research(
         
         print(f"错误信息已保存至: {error_file}")
         raise
+    
+    finally:
+        # 保存知识库的向量索引快照
+        await asyncio.to_thread(kb.flush)
+        # 关闭LLM连接池
+        await close_sessions()
 
 def main():
     """命令行主函数"""
@@ -105,8 +123,17 @@ def main():
                         help="输出格式")
     parser.add_argument("--max-depth", type=int, default=3, 
                         help="最大递归研究深度，值越大研究越深入但API调用也越多")
+    parser.add_argument("--planning-mode", type=str, default=PLANNING_MODE,
+                        choices=["sequential", "speculative", "merged"],
+                        help="研究节点的规划方式：依次评估和分解（默认）、投机并发分解，或合并为一次调用")
+    parser.add_argument("--log-level", type=str, default=None,
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="日志级别，默认取环境变量 LOG_LEVEL 或 INFO")
+    parser.add_argument("--log-payloads", action="store_true",
+                        help="记录LLM和搜索的请求/响应正文（需配合 --log-level DEBUG）")
     
     args = parser.parse_args()
+    configure_logging(level=args.log_level, payloads=args.log_payloads or None)
     
     # 执行研究
     try:
@@ -115,7 +142,8 @@ def main():
             model=args.model,
             output_dir=args.output_dir,
             output_format=args.output_format,
-            max_depth=args.max_depth
+            max_depth=args.max_depth,
+            planning_mode=args.planning_mode
         ))
     except KeyboardInterrupt:
         print("\n研究被用户中断")
@@ -129,6 +157,7 @@ if __name__ == "__main__":
         main()
     else:
         # 直接运行示例
+        configure_logging()
         try:
             asyncio.run(run_research(
                 query="探索人工智能在医疗领域的最新应用和发展趋势",
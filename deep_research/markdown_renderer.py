@@ -0,0 +1,246 @@
+"""
+深度研究 Agent 报告 Markdown 渲染
+把章节的 Markdown 文本逐行切分为块（标题、段落、列表、表格、代码块、引用、分隔线、参考文献），
+每个块内的行内格式（代码、粗体、斜体、链接、引用标注）用一个预编译的正则做一次扫描，
+整体耗时与文本长度成线性关系；渲染结果按块逐段产出，可以边渲染边写入文件
+"""
+
+import re
+import html
+from typing import List, Iterator, Optional, Tuple
+
+_FENCE = re.compile(r"^\s{0,3}(`{3,}|~{3,})\s*([\w+#.-]*)")
+_HEADING = re.compile(r"^\s{0,3}(#{1,6})\s+(.*?)\s*#*\s*$")
+_RULE = re.compile(r"^\s{0,3}([-*_])(?:\s*\1){2,}\s*$")
+_LIST_ITEM = re.compile(r"^(\s*)(?:([-*+])|(\d{1,9})[.)])\s+(.*)$")
+_QUOTE = re.compile(r"^\s{0,3}>\s?(.*)$")
+_TABLE_SEPARATOR = re.compile(r"^\s*\|?\s*:?-+:?\s*(?:\|\s*:?-+:?\s*)*\|?\s*$")
+_REFERENCE = re.compile(r"^\s*\[(\d{1,4})\]\s+(.+)$")
+# 除表格外能结束段落的各类块的开头（空行、代码块、标题、引用、列表项、分隔线），合并为一个正则只匹配一次
+_BLOCK_START = re.compile(
+    r"\s*$|\s{0,3}(?:`{3}|~{3}|#{1,6}\s|>)|\s*(?:[-*+]|\d{1,9}[.)])\s|\s{0,3}([-*_])(?:\s*\1){2,}\s*$"
+)
+
+# 行内格式，在转义后的文本上匹配；各分支的内容都不能包含自己的起始或结束标记，
+# 匹配失败时最多扫描到下一个同类标记，未闭合的 [ 或 * 很多时也不会对每个标记都重新扫描到行尾
+_INLINE = re.compile(
+    r"`(?P<code>[^`\n]+)`"
+    r"|\*\*(?P<strong>(?:[^*\n]|\*(?!\*))+)\*\*"
+    r"|\*(?P<em>[^*\s](?:[^*\n]*[^*\s])?)\*"
+    r"|\[(?P<link_text>[^\[\]\n]+)\]\((?P<url>[^)\s]+)\)"
+    r"|\[(?P<cite>\d{1,4}(?:\s*[,，、–-]\s*\d{1,4})*)\]"
+    r"|(?P<autolink>https?://(?:[^\s&()（）]|&(?![lg]t;))*[^\s&()（）.,;:!?，。；：！？、])"
+)
+_CITE_NUMBER = re.compile(r"\d+")
+# 链接只允许这些协议或站内地址，避免 javascript: 等链接进入报告
+_SAFE_URL = re.compile(r"^(?:https?://|mailto:|#|/)", re.I)
+
+
+def _escape(text: str) -> str:
+    return html.escape(text, quote=False)
+
+
+def _render_match(match: re.Match) -> str:
+    """渲染一个行内格式，匹配内容已经转义"""
+    kind = match.lastgroup
+    if kind == "code":
+        return f"<code>{match['code']}</code>"
+    if kind == "strong":
+        return f"<strong>{_INLINE.sub(_render_match, match['strong'])}</strong>"
+    if kind == "em":
+        return f"<em>{_INLINE.sub(_render_match, match['em'])}</em>"
+    if kind == "url":
+        url = match["url"]
+        if not _SAFE_URL.match(url):
+            return match.group(0)
+        return f'<a href="{url.replace(chr(34), "&quot;")}">{_INLINE.sub(_render_match, match["link_text"])}</a>'
+    if kind == "cite":
+        links = _CITE_NUMBER.sub(lambda m: f'<a href="#ref-{m.group(0)}">{m.group(0)}</a>', match["cite"])
+        return f'<sup class="citation">[{links}]</sup>'
+    url = match["autolink"]
+    return f'<a href="{url.replace(chr(34), "&quot;")}">{url}</a>'
+
+
+def render_inline(text: str) -> str:
+    """先整体做 HTML 转义，再用一次正则替换渲染全部行内格式；文本中的换行渲染为 <br>"""
+    return _INLINE.sub(_render_match, _escape(text)).replace("\n", "<br>\n")
+
+
+def _split_row(line: str) -> List[str]:
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|") and not line.endswith("\\|"):
+        line = line[:-1]
+    return [cell.strip().replace("\\|", "|") for cell in re.split(r"(?<!\\)\|", line)]
+
+
+def _alignments(separator: str) -> List[Optional[str]]:
+    aligns = []
+    for cell in _split_row(separator):
+        if cell.startswith(":") and cell.endswith(":"):
+            aligns.append("center")
+        elif cell.endswith(":"):
+            aligns.append("right")
+        elif cell.startswith(":"):
+            aligns.append("left")
+        else:
+            aligns.append(None)
+    return aligns
+
+
+def _render_table(header: str, separator: str, rows: List[str]) -> str:
+    aligns = _alignments(separator)
+    columns = len(aligns)
+
+    def cells(line: str, tag: str) -> str:
+        values = (_split_row(line) + [""] * columns)[:columns]
+        return "".join(
+            f'<{tag} style="text-align: {align}">{render_inline(value)}</{tag}>' if align
+            else f"<{tag}>{render_inline(value)}</{tag}>"
+            for value, align in zip(values, aligns)
+        )
+
+    body = "".join(f"<tr>{cells(row, 'td')}</tr>\n" for row in rows)
+    return (
+        f"<table>\n<thead>\n<tr>{cells(header, 'th')}</tr>\n</thead>\n"
+        + (f"<tbody>\n{body}</tbody>\n" if body else "")
+        + "</table>\n"
+    )
+
+
+def _render_list(items: List[Tuple[int, str, Optional[str], List[str]]]) -> str:
+    """渲染列表，按缩进嵌套；items 为 [(缩进, ul/ol, 起始序号, 各行文本)]"""
+    parts = []
+    stack: List[Tuple[int, str]] = []
+    for indent, tag, start, lines in items:
+        while stack and indent < stack[-1][0]:
+            parts.append(f"</li>\n</{stack.pop()[1]}>\n")
+        if stack and indent == stack[-1][0]:
+            if tag == stack[-1][1]:
+                parts.append("</li>\n")
+            else:
+                parts.append(f"</li>\n</{stack.pop()[1]}>\n")
+        if not stack or indent > stack[-1][0]:
+            if stack:
+                # 嵌套列表另起一行
+                parts.append("\n")
+            parts.append(f'<ol start="{start}">\n' if tag == "ol" and start not in (None, "1") else f"<{tag}>\n")
+            stack.append((indent, tag))
+        parts.append("<li>" + render_inline("\n".join(lines)))
+    while stack:
+        parts.append(f"</li>\n</{stack.pop()[1]}>\n")
+    return "".join(parts)
+
+
+def _starts_block(lines: List[str], i: int) -> bool:
+    """该行是否开始一个新的块，用于结束段落"""
+    line = lines[i]
+    return bool(
+        _BLOCK_START.match(line)
+        or ("|" in line and i + 1 < len(lines) and _TABLE_SEPARATOR.match(lines[i + 1]))
+    )
+
+
+def iter_markdown_html(text: str, heading_offset: int = 0) -> Iterator[str]:
+    """把 Markdown 文本渲染为 HTML，逐块产出
+
+    Args:
+        text: Markdown 文本
+        heading_offset: 文本中标题级别的偏移，章节内容中的 # 标题应低于章节标题本身
+
+    Yields:
+        每个块的 HTML
+    """
+    lines = text.splitlines()
+    count = len(lines)
+    i = 0
+    while i < count:
+        line = lines[i]
+        if not line.strip():
+            i += 1
+            continue
+
+        fence = _FENCE.match(line)
+        if fence:
+            marker = fence.group(1)
+            language = fence.group(2)
+            i += 1
+            code = []
+            while i < count and not lines[i].strip().startswith(marker):
+                code.append(lines[i])
+                i += 1
+            i += 1
+            attribute = f' class="language-{html.escape(language)}"' if language else ""
+            yield f"<pre><code{attribute}>{_escape(chr(10).join(code))}</code></pre>\n"
+            continue
+
+        heading = _HEADING.match(line)
+        if heading:
+            level = min(6, len(heading.group(1)) + heading_offset)
+            yield f"<h{level}>{render_inline(heading.group(2))}</h{level}>\n"
+            i += 1
+            continue
+
+        if _RULE.match(line):
+            yield "<hr>\n"
+            i += 1
+            continue
+
+        if "|" in line and i + 1 < count and _TABLE_SEPARATOR.match(lines[i + 1]):
+            header, separator = line, lines[i + 1]
+            i += 2
+            rows = []
+            while i < count and "|" in lines[i] and lines[i].strip():
+                rows.append(lines[i])
+                i += 1
+            yield _render_table(header, separator, rows)
+            continue
+
+        if _QUOTE.match(line):
+            quoted = []
+            # 不以 > 开头的行只作为段落续行归入引用，遇到新的块即结束
+            while i < count and (_QUOTE.match(lines[i]) or (quoted and not _starts_block(lines, i))):
+                match = _QUOTE.match(lines[i])
+                quoted.append(match.group(1) if match else lines[i])
+                i += 1
+            yield "<blockquote>\n" + "".join(iter_markdown_html("\n".join(quoted), heading_offset)) + "</blockquote>\n"
+            continue
+
+        if _LIST_ITEM.match(line):
+            items = []
+            while i < count:
+                match = _LIST_ITEM.match(lines[i])
+                if match:
+                    indent = len(match.group(1).expandtabs(4))
+                    tag = "ul" if match.group(2) else "ol"
+                    items.append((indent, tag, match.group(3), [match.group(4)]))
+                    i += 1
+                elif lines[i].strip() and lines[i][0] in " \t" and not _starts_block(lines, i):
+                    # 缩进的续行属于上一个列表项
+                    items[-1][3].append(lines[i].strip())
+                    i += 1
+                else:
+                    break
+            yield _render_list(items)
+            continue
+
+        paragraph = [line]
+        i += 1
+        while i < count and not _starts_block(lines, i):
+            paragraph.append(lines[i])
+            i += 1
+        references = [_REFERENCE.match(row) for row in paragraph]
+        if all(references):
+            # 每行以 [n] 开头的段落是参考文献列表，为各条目加上引用标注指向的锚点
+            yield "".join(
+                f'<p class="reference" id="ref-{match.group(1)}">[{match.group(1)}] {render_inline(match.group(2))}</p>\n'
+                for match in references
+            )
+        else:
+            yield "<p>" + render_inline("\n".join(row.strip() for row in paragraph)) + "</p>\n"
+
+
+def render_markdown(text: str, heading_offset: int = 0) -> str:
+    """把 Markdown 文本渲染为 HTML"""
+    return "".join(iter_markdown_html(text, heading_offset))
@@ -4,48 +4,146 @@
 """
 
 import json
-import re
-from typing import List, Dict, Any, Optional, Union
+from html import escape
+from typing import List, Dict, Any, Optional, Union, Tuple, Callable, Iterator
 import asyncio
 import sys
 sys.path.append('..')
-from LLMapi_service.gptservice import GPT
+from LLMapi_service.gptservice import GPT, GPT_stream, collect_stream
+from LLMapi_service.metrics import metric_tags
+from LLMapi_service.logger import get_logger
+
+from deep_research.config import (
+    REPORT_CONTINUITY_PASS, REPORT_EMBEDDING_MODEL, REPORT_EVIDENCE_TOP_K,
+    REPORT_EVIDENCE_TOKENS, REPORT_EVIDENCE_CHUNK_TOKENS
+)
+from deep_research.evidence import EvidenceSelector
+from deep_research.markdown_renderer import iter_markdown_html
+from deep_research.report_writer import ReportWriter
+from deep_research.scheduler import ConcurrencyLimiter
+from deep_research.tracing import Tracer
+
+logger = get_logger("deep_research.output_organizer")
+
+# 生成失败的章节在报告中显示的提示，具体错误只记录在章节的 error 字段和任务状态中
+SECTION_FAILED_NOTICE = "本章节生成失败，内容缺失。"
+
+
+def parse_json_content(content: str) -> Any:
+    """解析LLM回答中的JSON，回答可能被包裹在代码块中"""
+    if "```json" in content:
+        content = content.split("```json")[1].split("```")[0]
+    elif "```" in content:
+        content = content.split("```")[1].split("```")[0]
+    return json.loads(content.strip())
+
 
 class OutputOrganizer:
     """输出整理器，将研究结果整理成结构化输出"""
     
-    def __init__(self, model: str = "deepseek-chat"):
+    def __init__(
+        self,
+        model: str = "deepseek-chat",
+        stream_callback = None,
+        limiter: Optional[ConcurrencyLimiter] = None,
+        tracer: Optional[Tracer] = None,
+        continuity_pass: bool = REPORT_CONTINUITY_PASS,
+        progress_callback: Optional[Callable[[int, str, Dict], None]] = None,
+        evidence_selector: Optional[EvidenceSelector] = None,
+        report_writer: Optional[ReportWriter] = None
+    ):
         """初始化输出整理器
         
         Args:
             model: 使用的大语言模型
+            stream_callback: 可选的流式输出回调，章节文本生成时实时推送，
+                参数为 {"id", "label", "delta", "text", "done"}
+            limiter: 并发限制器，并发生成章节时限制同时进行的调用数，可与研究树共享
+            tracer: 链路追踪记录，可与研究树共享
+            continuity_pass: 章节生成后是否再用一次调用补充章节间的过渡句
+            progress_callback: 可选的进度回调，参数为 (进度百分比, 状态信息, 详情)，报告生成占 80-95
+            evidence_selector: 章节证据选择器，默认按 config 中的 REPORT_EVIDENCE_* 配置创建
+            report_writer: 可选的报告写入器，每完成一个章节即写入磁盘
         """
         self.model = model
+        self.stream_callback = stream_callback
+        self.limiter = limiter or ConcurrencyLimiter()
+        self.tracer = tracer or Tracer()
+        self.continuity_pass = continuity_pass
+        self.progress_callback = progress_callback
+        self.evidence_selector = evidence_selector or EvidenceSelector(
+            REPORT_EMBEDDING_MODEL, REPORT_EVIDENCE_TOP_K, REPORT_EVIDENCE_TOKENS, REPORT_EVIDENCE_CHUNK_TOKENS
+        )
+        self.report_writer = report_writer
+    
+    def _update_progress(self, progress: int, message: str, detail: Optional[Dict] = None) -> None:
+        if self.progress_callback:
+            self.progress_callback(progress, message, detail or {})
     
     async def organize(self, query: str, research_results: Dict) -> Dict:
-        """整理研究结果
+        """整理研究结果，生成报告大纲和全部章节内容
+        
+        命令行和 Web 入口都通过 DeepResearchAgent 调用这里，报告只生成一次，入口程序只负责格式化输出
         
         Args:
             query: 原始研究问题
             research_results: 研究结果
             
         Returns:
-            整理后的输出
+            整理后的输出，包括 query、outline、content，以及生成失败的章节 failed_sections（id、title、error）
         """
-        print("正在整理研究结果...")
+        logger.info("正在整理研究结果...")
+        self._fill_missing_results(research_results)
         
         # 创建大纲
-        outline = await self._create_outline(query, research_results)
+        self._update_progress(80, "创建研究报告大纲")
+        with self.tracer.span("outline"):
+            outline = await self._create_outline(query, research_results)
         
         # 生成内容
-        content = await self._generate_content(outline, research_results)
+        sections = len(outline.get("sections", []))
+        self._update_progress(85, "根据大纲生成完整内容", {"sections": sections})
+        
+        failed_sections = []
+        
+        def on_section_done(completed: int, total: int, section: Dict):
+            progress = 85 + int(10 * completed / max(1, total))
+            if section.get("error"):
+                failed_sections.append({"id": section.get("id"), "title": section.get("title", ""), "error": section["error"]})
+                message = f"报告章节生成失败: {section.get('title', '章节')}"
+            else:
+                message = f"已生成报告章节: {section.get('title', '章节')}"
+            self._update_progress(progress, message,
+                                  {"section": completed, "total": total, "failed_sections": len(failed_sections)})
+        
+        with self.tracer.span("content", sections=sections):
+            content = await self.generate_content(outline, research_results, on_section_done)
         
         return {
             "query": query,
             "outline": outline,
-            "content": content
+            "content": content,
+            "failed_sections": failed_sections
         }
     
+    @staticmethod
+    def _fill_missing_results(research_results: Dict) -> None:
+        """为没有结果的子任务（如依赖未完成）补充简化结果，避免报告中缺少对应内容"""
+        if "results" not in research_results or "subtasks" not in research_results:
+            return
+        results = research_results.setdefault("results", {})
+        for task_info in research_results.get("subtasks", []):
+            task_id = task_info.get("id")
+            if task_id in results:
+                continue
+            logger.warning(f"任务 {task_id} 的依赖尚未完成，使用简化处理")
+            description = task_info.get("description", "未知任务")
+            results[task_id] = {
+                "task": description,
+                "is_complex": False,
+                "solution": f"此部分内容基于简化处理生成，因为原始任务 '{description}' 尚未完成。"
+            }
+    
     async def _create_outline(self, query: str, research_results: Dict) -> Dict:
         """创建研究报告大纲
         
@@ -54,82 +152,52 @@ class OutputOrganizer:
             research_results: 研究结果
             
         Returns:
-            大纲结构
+            大纲结构，调用或解析失败时为默认大纲
         """
-        # 构建提示
         messages = [
-            {"role": "system", "content": """你是一个专业的研究报告组织者。
-请为研究结果创建一个详细的大纲结构。大纲应该清晰、有条理，并涵盖所有重要内容。
-
-请输出JSON格式，包含以下结构：
+            {"role": "system", "content": """你是专业的研究人员，需要创建一个实际的研究报告大纲。
+请基于研究问题和研究结果，创建一个结构化的研究报告大纲，这个大纲将用于生成完整的研究报告内容。
+大纲应该清晰、有条理，逻辑连贯，从问题描述到最终结论形成完整的研究报告。
+输出应为JSON格式，包含以下结构：
 {
-    "title": "报告标题",
+    "title": "研究报告实际标题",
     "sections": [
         {
-            "id": "section_id",
-            "title": "章节标题",
-            "content_requirement": "本章节应该包含的内容描述",
-            "subsections": [  // 可选，子章节
-                {
-                    "id": "subsection_id",
-                    "title": "子章节标题",
-                    "content_requirement": "子章节内容描述"
-                },
-                ...
-            ]
+            "id": "section1",
+            "title": "章节实际标题",
+            "content_requirement": "本节实际内容方向的简要描述",
+            "subsections": [...]  // 可选，子章节结构与sections相同
         },
         ...
     ]
 }
-
-确保大纲结构符合研究内容，逻辑连贯，从问题描述到最终结论形成完整的研究报告。
-"""}]
-        
-        # 添加用户提示
-        user_prompt = f"研究问题：{query}\n"
-        
-        # 提取研究摘要或总结
-        if research_results.get("is_complex", False) and "summary" in research_results:
-            user_prompt += f"\n研究总结：{research_results['summary']}"
+重要：这不是写作指南，而是要生成一个会被直接用于生成实际研究报告的大纲。
+"""},
+            {"role": "user", "content": f"研究问题：{query}"}
+        ]
+        
+        # 添加研究总结或解答作为概述
+        if research_results.get("summary"):
+            messages[1]["content"] += f"\n\n研究结果概述：{research_results['summary']}"
         elif "solution" in research_results:
-            if isinstance(research_results["solution"], dict):
-                user_prompt += f"\n研究内容：{research_results['solution'].get('solution', '')}"
-            else:
-                user_prompt += f"\n研究内容：{research_results['solution']}"
-        
-        messages.append({"role": "user", "content": user_prompt})
+            solution = research_results["solution"]
+            if isinstance(solution, dict):
+                solution = solution.get("solution", "")
+            messages[1]["content"] += f"\n\n研究结果概述：{solution}"
         
         try:
-            # 调用LLM创建大纲
-            response = await GPT(messages, selected_model=self.model)
-            
-            # 尝试提取JSON内容
-            content = response["content"]
-            
-            # 如果内容包含在代码块中，提取JSON部分
-            if "```json" in content and "```" in content:
-                json_part = content.split("```json")[1].split("```")[0].strip()
-                content = json_part
-            elif "```" in content and "```" in content:
-                json_part = content.split("```")[1].split("```")[0].strip()
-                content = json_part
-            
-            try:
-                # 解析JSON
-                outline = json.loads(content)
-                
-                # 验证大纲结构
-                if "title" in outline and "sections" in outline and isinstance(outline["sections"], list):
-                    return outline
-            except json.JSONDecodeError:
-                print(f"大纲JSON解析失败，使用默认大纲")
-            
-            # 解析失败，使用默认大纲
-            return self._get_default_outline(query)
+            self._update_progress(82, "分析研究结果，构建报告框架")
+            with metric_tags(phase="outline"), self.tracer.span("llm", phase="outline", model=self.model) as span:
+                response = await GPT(messages, selected_model=self.model, slot=self.limiter.attempt_slot(span))
+            outline = parse_json_content(response["content"])
+            if isinstance(outline, dict) and outline.get("title") and isinstance(outline.get("sections"), list) and outline["sections"]:
+                return outline
+            logger.warning("大纲格式错误，使用默认大纲")
+        except json.JSONDecodeError:
+            logger.warning("大纲JSON解析失败，使用默认大纲")
         except Exception as e:
-            print(f"创建大纲时出错: {e}")
-            # 如果解析失败，使用默认大纲
-            return self._get_default_outline(query)
+            logger.warning(f"创建大纲时出错: {e}")
+        return self._get_default_outline(query)
     
     def _get_default_outline(self, query: str) -> Dict:
         """生成默认大纲
@@ -171,187 +239,321 @@ class OutputOrganizer:
             ]
         }
     
-    async def _generate_content(self, outline: Dict, research_results: Dict) -> Dict:
-        """生成研究报告内容
+    async def generate_content(self, outline: Dict, research_results: Dict, on_section_done=None) -> Dict:
+        """按大纲生成研究报告内容
+
+        先用一次调用为每个章节写出写作要点，按章节要求和写作要点从整棵研究树的叶子解答中为每个章节选出相关段落，
+        再并发生成全部章节和子章节，最后可选地用一次调用补充章节间的过渡句；
+        章节之间不再相互等待，报告生成只有三次调用深
         
         Args:
             outline: 大纲结构
             research_results: 研究结果
+            on_section_done: 可选的回调，每完成一个章节或子章节调用一次，参数为 (已完成数, 总数, 章节内容)，
+                章节生成失败时章节内容带有 error 字段
             
         Returns:
             生成的内容结构
         """
+        sections = outline.get("sections", [])
+        numbered = self._number_sections(sections)
+        logger.info(f"生成报告内容，共 {len(sections)} 个章节，含子章节 {len(numbered)} 个...")
+        
+        if self.report_writer:
+            self.report_writer.start(self, outline["title"], numbered)
+        try:
+            content = await self._generate_sections(outline, sections, numbered, research_results, on_section_done)
+        except BaseException as e:
+            if self.report_writer:
+                self.report_writer.fail("已取消" if isinstance(e, asyncio.CancelledError) else str(e))
+            raise
+        if self.report_writer:
+            self.report_writer.finish(content, rewrite=self.continuity_pass)
+        return content
+    
+    async def _generate_sections(
+        self,
+        outline: Dict,
+        sections: List[Dict],
+        numbered: List[Tuple[str, Dict]],
+        research_results: Dict,
+        on_section_done=None
+    ) -> Dict:
+        """生成写作要点、选择证据并并发生成全部章节，完成的章节立即交给报告写入器"""
+        with self.tracer.span("briefs", sections=len(numbered)):
+            briefs = await self._create_briefs(outline, numbered, research_results)
+        
+        with self.tracer.span("evidence", sections=len(numbered)):
+            evidence = await self.evidence_selector.select(
+                [
+                    (number, f"{section.get('title', '')}\n{section.get('content_requirement', '')}\n{briefs.get(number, '')}")
+                    for number, section in numbered
+                ],
+                research_results
+            )
+        
+        completed = 0
+        
+        async def write_one(section: Dict, number: str, siblings: List[Dict], index: int) -> Dict:
+            nonlocal completed
+            with self.tracer.span("section", section_id=section.get("id"), number=number):
+                section_content = await self._generate_section_content(
+                    section, number, siblings, index, outline, numbered, briefs, evidence.get(number, []), research_results
+                )
+            completed += 1
+            if self.report_writer:
+                self.report_writer.add_section(number, section_content)
+            if on_section_done:
+                on_section_done(completed, len(numbered), section_content)
+            return section_content
+        
+        async def write_tree(section: Dict, number: str, siblings: List[Dict], index: int) -> Dict:
+            """并发生成章节及其全部子章节"""
+            subsections = section.get("subsections") or []
+            results = await asyncio.gather(
+                write_one(section, number, siblings, index),
+                *(write_tree(subsection, f"{number}.{i + 1}", subsections, i) for i, subsection in enumerate(subsections))
+            )
+            section_content = results[0]
+            if subsections:
+                section_content["subsections"] = list(results[1:])
+            return section_content
+        
         content = {
             "title": outline["title"],
-            "sections": []
+            "sections": list(await asyncio.gather(
+                *(write_tree(section, str(i + 1), sections, i) for i, section in enumerate(sections))
+            ))
         }
         
-        print(f"生成报告内容，共 {len(outline['sections'])} 个章节...")
-        
-        # 生成每个章节的内容
-        for i, section in enumerate(outline["sections"]):
-            print(f"正在生成第 {i+1} 章: {section['title']}...")
-            section_content = await self._generate_section_content(
-                section, 
-                outline,
-                research_results,
-                content["sections"],
-                i
-            )
-            content["sections"].append(section_content)
-            
+        if self.continuity_pass and len(content["sections"]) > 1:
+            with self.tracer.span("continuity"):
+                await self._add_transitions(content)
         return content
     
-    async def _generate_section_content(self, section: Dict, full_outline: Dict, research_results: Dict, previous_sections: List, section_index: int) -> Dict:
-        """生成单个章节的内容
+    @staticmethod
+    def _number_sections(sections: List[Dict], prefix: str = "") -> List[Tuple[str, Dict]]:
+        """为章节和子章节编号，如 1、1.2，返回按大纲顺序排列的 (编号, 章节) 列表"""
+        numbered = []
+        for i, section in enumerate(sections):
+            number = f"{prefix}{i + 1}"
+            numbered.append((number, section))
+            numbered.extend(OutputOrganizer._number_sections(section.get("subsections") or [], f"{number}."))
+        return numbered
+    
+    @staticmethod
+    def _research_overview(research_results: Dict, max_chars: int = 2000) -> str:
+        """研究结果的总体结论：复杂任务取总结，简单任务取解答"""
+        overview = research_results.get("summary")
+        if not overview:
+            solution = research_results.get("solution", "")
+            overview = solution.get("solution", "") if isinstance(solution, dict) else solution
+        overview = str(overview or "")
+        return overview[:max_chars] + "..." if len(overview) > max_chars else overview
+    
+    async def _create_briefs(self, outline: Dict, numbered: List[Tuple[str, Dict]], research_results: Dict) -> Dict[str, str]:
+        """用一次调用为每个章节写出写作要点，并发生成章节时以此划分各章节的内容边界
+        
+        Returns:
+            {章节编号: 写作要点}，调用或解析失败时使用大纲中的章节要求
+        """
+        briefs = {number: section.get("content_requirement", "") for number, section in numbered}
+        if not numbered:
+            return briefs
+        
+        outline_text = "\n".join(
+            f"{number} {section.get('title', '')}：{section.get('content_requirement', '')}" for number, section in numbered
+        )
+        messages = [
+            {"role": "system", "content": """你是研究报告的主编，各章节将由不同作者同时撰写。
+请根据大纲和研究结论，为每个章节写出2-3句写作要点：本章节要回答的问题、应使用的关键发现，以及哪些内容留给其他章节，避免章节之间重复或遗漏。
+
+以JSON对象输出，键为章节编号，值为该章节的写作要点，例如：
+{"1": "写作要点...", "1.1": "写作要点..."}
+仅输出JSON，无需额外说明。
+"""},
+            {"role": "user", "content": f"""报告标题：{outline.get('title', '')}
+
+大纲：
+{outline_text}
+
+研究结论：
+{self._research_overview(research_results)}
+"""}
+        ]
+        
+        try:
+            with metric_tags(phase="brief"), self.tracer.span("llm", phase="brief", model=self.model) as span:
+                response = await GPT(messages, selected_model=self.model, slot=self.limiter.attempt_slot(span))
+            planned = parse_json_content(response["content"])
+            if not isinstance(planned, dict):
+                raise ValueError("写作要点应为JSON对象")
+        except Exception as e:
+            logger.warning(f"生成章节写作要点时出错，使用大纲中的章节要求: {e}")
+            return briefs
+        
+        for number, brief in planned.items():
+            if number in briefs and isinstance(brief, str) and brief.strip():
+                briefs[number] = brief.strip()
+        return briefs
+    
+    def _section_evidence(self, number: str, section: Dict, passages: List[Dict], research_results: Dict) -> str:
+        """章节提示中使用的研究结果：每个章节都使用证据选择器为其选出的相关段落
+
+        第一章和结论章需要概括全局，在相关段落之前附上简短的总体结论；
+        研究结果中没有可用段落时只使用总体结论
+        """
+        is_first = number == "1"
+        is_conclusion = section.get("id") == "conclusion" or "结论" in section.get("title", "")
+        parts = []
+        if is_first or is_conclusion or not passages:
+            overview = self._research_overview(research_results, 500 if passages else 1500)
+            if overview:
+                parts.append(f"研究结论: {overview}")
+        if passages:
+            parts.append("相关研究结果（按相关度排序）:\n" + "\n".join(
+                f"- [{passage['task']}] {passage['text']}" for passage in passages
+            ))
+        return "\n\n".join(parts)
+    
+    async def _generate_section_content(
+        self,
+        section: Dict,
+        number: str,
+        siblings: List[Dict],
+        index: int,
+        outline: Dict,
+        numbered: List[Tuple[str, Dict]],
+        briefs: Dict[str, str],
+        passages: List[Dict],
+        research_results: Dict
+    ) -> Dict:
+        """按写作要点生成单个章节的内容，不依赖其他章节的生成结果
         
         Args:
             section: 章节信息
-            full_outline: 完整大纲
+            number: 章节编号
+            siblings: 同级章节列表
+            index: 章节在同级章节中的位置
+            outline: 完整大纲
+            numbered: 全部章节的 (编号, 章节) 列表
+            briefs: 各章节的写作要点
+            passages: 为本章节选出的研究结果段落
             research_results: 研究结果
-            previous_sections: 已生成的前面章节
-            section_index: 章节索引
             
         Returns:
-            生成的章节内容
+            生成的章节内容（不含子章节），生成失败时 content 为空并带有 error 字段
         """
-        # 构建提示
         messages = [
-            {"role": "system", "content": """你是一个专业的研究报告内容生成专家。
-请根据大纲和研究结果，生成指定章节的内容。内容应详细、专业，并且与前面已生成的章节保持连贯性。
-
-注意以下要点：
-1. 内容要符合科学研究的规范，客观中立
-2. 尽量使用事实和数据支持论点
-3. 表达要清晰简洁，避免冗余
-4. 格式应整洁，可使用适当的标题、列表等结构
-5. 不要重复已经在前面章节中详细讨论过的内容
-"""}]
-        
-        # 构建用户提示
+            {"role": "system", "content": """你是专业的研究人员，正在撰写一份研究报告的具体章节内容，其他章节由其他作者同时撰写。
+请生成详实、专业、有深度的研究报告章节内容，包括观点、数据、分析和结论。
+请严格围绕本章节的写作要点，不要展开属于其他章节的内容，也不要包含写作指南或"本章将讨论..."之类的元描述。
+输出应当是可以直接用于研究报告的最终内容。
+"""}
+        ]
+        
+        structure = "\n".join(
+            f"{'→ ' if other is section else '  '}{other_number} {other.get('title', '')}" for other_number, other in numbered
+        )
+        parent = number.rsplit(".", 1)[0] + "." if "." in number else ""
+        neighbours = []
+        for offset, relation in ((-1, "上一节"), (1, "下一节")):
+            if 0 <= index + offset < len(siblings):
+                neighbour_number = f"{parent}{index + offset + 1}"
+                neighbours.append(f"- {relation} {siblings[index + offset].get('title', '')}: {briefs.get(neighbour_number, '')}")
+        
         user_prompt = f"""
-报告标题: {full_outline['title']}
+请撰写以下研究报告章节的实际内容：
+
+报告标题: {outline['title']}
+报告结构:
+{structure}
+
 当前章节: {section['title']}
-章节要求: {section.get('content_requirement', '生成内容')}
-当前是第 {section_index+1} 个章节，共 {len(full_outline['sections'])} 个章节。
+章节要求: {section.get('content_requirement', '详细阐述研究发现')}
+写作要点: {briefs.get(number, '')}
 """
-
-        # 为第一章节（通常是引言）提供更多研究背景
-        if section_index == 0:
-            # 提供完整的研究问题
-            user_prompt += f"\n研究问题: {full_outline.get('title', '')}\n"
-            
-            # 添加研究结果摘要
-            if "summary" in research_results:
-                user_prompt += f"研究摘要: {research_results['summary']}\n"
-            elif "solution" in research_results:
-                if isinstance(research_results["solution"], dict):
-                    user_prompt += f"研究摘要: {research_results['solution'].get('solution', '')}\n"
-                else:
-                    user_prompt += f"研究摘要: {research_results['solution']}\n"
-        
-        # 为分析章节提供更详细的研究结果
-        elif section.get("id") in ["findings", "analysis"] or "发现" in section.get("title", "") or "分析" in section.get("title", ""):
-            # 如果是复杂任务，提供子任务结果
-            if research_results.get("is_complex", False) and "results" in research_results:
-                # 找出最相关的子任务结果
-                relevant_results = {}
-                max_results = 3  # 最多包含3个子任务结果
-                count = 0
-                
-                for task_id, result in research_results["results"].items():
-                    if count >= max_results:
-                        break
-                        
-                    # 查找任务描述
-                    task_desc = None
-                    for subtask in research_results.get("subtasks", []):
-                        if subtask["id"] == task_id:
-                            task_desc = subtask.get("description", "")
-                            break
-                    
-                    # 获取任务结果
-                    if task_desc:
-                        # 尝试获取最合适的结果表示
-                        if "summary" in result:
-                            result_text = result["summary"]
-                        elif "solution" in result:
-                            if isinstance(result["solution"], dict):
-                                result_text = result["solution"].get("solution", "")
-                            else:
-                                result_text = result["solution"]
-                        else:
-                            result_text = json.dumps(result, ensure_ascii=False)
-                            
-                        # 截断过长的结果
-                        if len(result_text) > 500:
-                            result_text = result_text[:500] + "..."
-                            
-                        relevant_results[task_desc] = result_text
-                        count += 1
-                
-                # 添加到提示中
-                if relevant_results:
-                    user_prompt += "\n研究结果:\n"
-                    for desc, res in relevant_results.items():
-                        user_prompt += f"- {desc}: {res}\n"
-            
-            # 如果是简单任务，直接提供解决方案
-            elif "solution" in research_results:
-                if isinstance(research_results["solution"], dict):
-                    user_prompt += f"\n研究结果: {research_results['solution'].get('solution', '')}\n"
-                else:
-                    user_prompt += f"\n研究结果: {research_results['solution']}\n"
-        
-        # 为结论章节提供完整的研究结果摘要
-        elif section.get("id") in ["conclusion"] or "结论" in section.get("title", ""):
-            if "summary" in research_results:
-                user_prompt += f"\n研究总结: {research_results['summary']}\n"
-        
+        if neighbours:
+            user_prompt += "\n相邻章节的写作要点（这些内容由其他章节负责）:\n" + "\n".join(neighbours) + "\n"
+        evidence = self._section_evidence(number, section, passages, research_results)
+        if evidence:
+            user_prompt += f"\n{evidence}\n"
+        user_prompt += "\n请直接输出此章节的完整内容，不要包含任何写作指南、元描述或非研究内容的文本。"
         messages.append({"role": "user", "content": user_prompt})
         
+        section_content = {
+            "id": section.get("id", f"section_{number}"),
+            "title": section.get("title", ""),
+            "content": ""
+        }
         try:
-            # 调用LLM生成内容
-            response = await GPT(messages, selected_model=self.model)
-            
-            section_content = {
-                "id": section["id"],
-                "title": section["title"],
-                "content": response["content"]
-            }
-            
-            # 如果有子章节，递归生成子章节内容
-            if "subsections" in section and section["subsections"]:
-                section_content["subsections"] = []
-                
-                for i, subsection in enumerate(section["subsections"]):
-                    try:
-                        subsection_content = await self._generate_section_content(
-                            subsection,
-                            full_outline,
-                            research_results,
-                            section_content.get("subsections", []),
-                            i
-                        )
-                        section_content["subsections"].append(subsection_content)
-                    except Exception as e:
-                        print(f"生成子章节 '{subsection.get('title', '')}' 时出错: {e}")
-                        # 添加错误信息作为内容
-                        section_content["subsections"].append({
-                            "id": subsection.get("id", f"error_{i}"),
-                            "title": subsection.get("title", "错误"),
-                            "content": f"生成此部分内容时出现错误: {str(e)}"
-                        })
+            response = await self._generate_text(messages, section)
+            section_content["content"] = response["content"]
+        except Exception as e:
+            # 错误信息单独记录，不作为章节内容进入报告，由格式化和报告写入器标记为生成失败
+            logger.warning(f"生成章节 '{section.get('title', '')}' 时出错: {e}")
+            section_content["error"] = str(e)
+        return section_content
+    
+    async def _add_transitions(self, content: Dict) -> None:
+        """连贯性检查：用一次调用为第二章起的每一章写一句承上启下的过渡句，加在章节开头，生成失败的章节不参与"""
+        sections = content["sections"]
+        excerpts = "\n\n".join(
+            f"[{i + 1}] {section['title']}\n开头: {section['content'][:150]}\n结尾: {section['content'][-150:]}"
+            for i, section in enumerate(sections) if not section.get("error")
+        )
+        messages = [
+            {"role": "system", "content": """你是研究报告的主编，各章节由不同作者同时撰写。
+请阅读各章节的开头和结尾，为第2章起的每一章写一句承上启下的过渡句，使其自然衔接上一章。
+以JSON对象输出，键为章节编号，值为过渡句，例如：{"2": "过渡句...", "3": "过渡句..."}
+仅输出JSON，无需额外说明。
+"""},
+            {"role": "user", "content": f"报告标题：{content['title']}\n\n{excerpts}"}
+        ]
+        try:
+            with metric_tags(phase="continuity"), self.tracer.span("llm", phase="continuity", model=self.model) as span:
+                response = await GPT(messages, selected_model=self.model, slot=self.limiter.attempt_slot(span))
+            transitions = parse_json_content(response["content"])
+        except Exception as e:
+            logger.warning(f"生成章节过渡句时出错: {e}")
+            return
+        if not isinstance(transitions, dict):
+            return
+        for i, section in enumerate(sections[1:], start=2):
+            if section.get("error"):
+                continue
+            transition = transitions.get(str(i))
+            if isinstance(transition, str) and transition.strip():
+                section["content"] = f"{transition.strip()}\n\n{section['content']}"
+    
+    async def _generate_text(self, messages: List[Dict], section: Dict) -> Dict:
+        """生成章节文本，设置了流式回调时实时推送增量
+        
+        Args:
+            messages: 提示消息列表
+            section: 章节信息
             
-            return section_content
+        Returns:
+            与 GPT() 相同格式的回复
+        """
+        with metric_tags(phase="section"), self.tracer.span("llm", phase="section", model=self.model) as span:
+            slot = self.limiter.attempt_slot(span)
+            if not self.stream_callback:
+                return await GPT(messages, selected_model=self.model, slot=slot)
+            return await self._stream_text(messages, section, slot)
+    
+    async def _stream_text(self, messages: List[Dict], section: Dict, slot=None) -> Dict:
+        """流式生成章节文本并推送增量"""
+        source_id = f"section:{section['id']}"
+        label = f"章节: {section['title']}"
         
-        except Exception as e:
-            print(f"生成章节 '{section.get('title', '')}' 时出错: {e}")
-            return {
-                "id": section["id"],
-                "title": section["title"],
-                "content": f"生成此章节内容时出错: {str(e)}"
-            }
+        def on_delta(delta: Dict, text: str):
+            self.stream_callback({"id": source_id, "label": label, "delta": delta["content"], "text": text, "done": False})
+        
+        try:
+            return await collect_stream(GPT_stream(messages, selected_model=self.model, slot=slot), on_delta)
+        finally:
+            self.stream_callback({"id": source_id, "label": label, "delta": "", "text": "", "done": True})
     
     def format_as_markdown(self, content: Dict) -> str:
         """将内容格式化为Markdown文本
@@ -362,11 +564,24 @@ class OutputOrganizer:
         Returns:
             Markdown格式的文本
         """
-        markdown = f"# {content['title']}\n\n"
-        
+        parts = [self.markdown_header(content["title"])]
         for section in content["sections"]:
-            markdown += self._format_section_as_markdown(section, 2)
-        
+            parts.append(self._format_section_as_markdown(section, 2))
+        return "".join(parts)
+    
+    @staticmethod
+    def markdown_header(title: str) -> str:
+        """Markdown 报告的标题部分"""
+        return f"# {title}\n\n"
+    
+    @staticmethod
+    def format_section_markdown(section: Dict, level: int) -> str:
+        """将单个章节（不含子章节）格式化为Markdown"""
+        markdown = f"{'#' * level} {section['title']}\n\n"
+        if section.get("error"):
+            markdown += f"> {SECTION_FAILED_NOTICE}\n\n"
+        if section.get("content"):
+            markdown += f"{section['content']}\n\n"
         return markdown
     
     def _format_section_as_markdown(self, section: Dict, level: int) -> str:
@@ -379,13 +594,7 @@ class OutputOrganizer:
         Returns:
             章节的Markdown文本
         """
-        # 创建标题
-        hashes = "#" * level
-        markdown = f"{hashes} {section['title']}\n\n"
-        
-        # 添加内容
-        if "content" in section and section["content"]:
-            markdown += f"{section['content']}\n\n"
+        markdown = self.format_section_markdown(section, level)
         
         # 递归添加子章节
         if "subsections" in section and section["subsections"]:
@@ -403,12 +612,31 @@ class OutputOrganizer:
         Returns:
             HTML格式的文本
         """
-        html = f"""<!DOCTYPE html>
+        return "".join(self.iter_html(content))
+    
+    def iter_html(self, content: Dict) -> Iterator[str]:
+        """将内容逐段格式化为HTML，可直接写入文件而不必先拼出完整文本
+        
+        Args:
+            content: 生成的内容结构
+            
+        Yields:
+            HTML片段：页面头部、各章节标题和内容块、页面尾部
+        """
+        yield self.html_header(content["title"])
+        for section in content["sections"]:
+            yield from self._iter_section_html(section, 2)
+        yield self.html_footer()
+    
+    @staticmethod
+    def html_header(title: str) -> str:
+        """HTML 报告的页面头部和标题"""
+        return f"""<!DOCTYPE html>
 <html>
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{content['title']}</title>
+    <title>{escape(title)}</title>
     <style>
         body {{
             font-family: Arial, sans-serif;
@@ -457,71 +685,72 @@ class OutputOrganizer:
             border-radius: 3px;
             font-family: monospace;
         }}
+        pre {{
+            background-color: #f8f8f8;
+            padding: 10px;
+            border-radius: 3px;
+            overflow-x: auto;
+        }}
+        pre code {{
+            padding: 0;
+        }}
+        table {{
+            border-collapse: collapse;
+            margin-bottom: 15px;
+        }}
+        th, td {{
+            border: 1px solid #ddd;
+            padding: 6px 10px;
+        }}
+        th {{
+            background-color: #f4f6f8;
+        }}
+        .citation {{
+            font-size: 0.75em;
+        }}
+        .reference {{
+            font-size: 0.9em;
+            margin-bottom: 5px;
+        }}
+        .section-error {{
+            color: #c0392b;
+            font-style: italic;
+        }}
     </style>
 </head>
 <body>
-    <h1>{content['title']}</h1>
+    <h1>{escape(title)}</h1>
 """
-        
-        for section in content["sections"]:
-            html += self._format_section_as_html(section, 2)
-        
-        html += """
+    
+    @staticmethod
+    def html_footer() -> str:
+        """HTML 报告的页面尾部"""
+        return """
 </body>
 </html>
 """
-        
-        return html
     
-    def _format_section_as_html(self, section: Dict, level: int) -> str:
+    @staticmethod
+    def iter_section_html(section: Dict, level: int) -> Iterator[str]:
+        """将单个章节（不含子章节）逐块格式化为HTML"""
+        yield f"<h{level}>{escape(section['title'])}</h{level}>\n"
+        if section.get("error"):
+            yield f'<p class="section-error">{SECTION_FAILED_NOTICE}</p>\n'
+        
+        # 章节内容中的标题排在章节标题之下
+        if section.get("content"):
+            yield from iter_markdown_html(section["content"], heading_offset=level)
+    
+    def _iter_section_html(self, section: Dict, level: int) -> Iterator[str]:
         """递归地将章节格式化为HTML
         
         Args:
             section: 章节内容
             level: 标题级别
             
-        Returns:
-            章节的HTML文本
+        Yields:
+            章节标题、内容中各个块以及子章节的HTML
         """
-        # 创建标题
-        html = f"<h{level}>{section['title']}</h{level}>\n"
-        
-        # 添加内容，将Markdown转换为HTML
-        if "content" in section and section["content"]:
-            content_html = section["content"]
-            
-            # 转换Markdown列表为HTML列表
-            if re.search(r'(?m)^- .+$', content_html):
-                # 匹配无序列表
-                content_html = re.sub(r'(?m)^- (.+)$', r'<li>\1</li>', content_html)
-                content_html = re.sub(r'(?s)<li>.*?</li>(\n<li>.*?</li>)*', r'<ul>\g<0></ul>', content_html)
-            
-            if re.search(r'(?m)^\d+\. .+$', content_html):
-                # 匹配有序列表
-                content_html = re.sub(r'(?m)^\d+\. (.+)$', r'<li>\1</li>', content_html)
-                content_html = re.sub(r'(?s)<li>.*?</li>(\n<li>.*?</li>)*', r'<ol>\g<0></ol>', content_html)
-            
-            # 转换粗体
-            content_html = re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', content_html)
-            
-            # 转换斜体
-            content_html = re.sub(r'\*(.+?)\*', r'<em>\1</em>', content_html)
-            
-            # 转换换行和段落
-            paragraphs = re.split(r'\n\n+', content_html)
-            content_html = ""
-            for p in paragraphs:
-                if p.strip():
-                    if not (p.startswith('<ul>') or p.startswith('<ol>') or p.startswith('<li>')):
-                        content_html += f"<p>{p}</p>\n"
-                    else:
-                        content_html += f"{p}\n"
-            
-            html += content_html
-        
-        # 递归添加子章节
-        if "subsections" in section and section["subsections"]:
-            for subsection in section["subsections"]:
-                html += self._format_section_as_html(subsection, level + 1)
-        
-        return html 
\ No newline at end of file
+        yield from self.iter_section_html(section, level)
+        for subsection in section.get("subsections") or []:
+            yield from self._iter_section_html(subsection, level + 1)
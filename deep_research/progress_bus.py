@@ -0,0 +1,195 @@
+"""
+深度研究 Agent 进度总线
+进程内的任务进度发布/订阅，每个任务保留最近事件的环形缓冲区，并对 task_info.json 的写入做合并节流
+"""
+
+import os
+import json
+import time
+import threading
+from collections import deque
+from typing import Dict, Any, Optional, Iterator, List
+
+from LLMapi_service.logger import get_logger
+
+logger = get_logger("deep_research.progress_bus")
+
+# 每个任务保留的最近事件数
+EVENT_BUFFER_SIZE = 500
+# 订阅者等待新事件的最长时间（秒），超时后发送心跳以保持连接
+KEEPALIVE_INTERVAL = 15
+# task_info.json 两次写入之间的最短间隔（秒）
+PERSIST_INTERVAL = 2.0
+# 已结束任务的频道保留时间（秒），之后再订阅只能拿到快照
+CHANNEL_RETENTION = 600
+
+
+class TaskChannel:
+    """单个任务的事件频道"""
+
+    def __init__(self, buffer_size: int = EVENT_BUFFER_SIZE):
+        self.events = deque(maxlen=buffer_size)
+        self.next_id = 1
+        self.closed = False
+        self.closed_at = None
+        self.condition = threading.Condition()
+
+    def events_after(self, last_id: int) -> Optional[List[Dict]]:
+        """返回编号大于 last_id 的事件，所需事件已被挤出缓冲区时返回None，调用前需持有锁"""
+        if self.events and self.events[0]["id"] > last_id + 1:
+            return None
+        return [event for event in self.events if event["id"] > last_id]
+
+
+class ProgressBus:
+    """任务进度总线，研究线程发布事件，网页请求线程订阅事件"""
+
+    def __init__(self, buffer_size: int = EVENT_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._channels: Dict[str, TaskChannel] = {}
+        self._lock = threading.Lock()
+
+    def _get_channel(self, task_id: str) -> TaskChannel:
+        with self._lock:
+            channel = self._channels.get(task_id)
+            if channel is None:
+                self._purge_closed()
+                channel = TaskChannel(self.buffer_size)
+                self._channels[task_id] = channel
+            return channel
+
+    def _purge_closed(self) -> None:
+        """清理结束已久的频道，调用前需持有锁"""
+        now = time.monotonic()
+        for task_id, channel in list(self._channels.items()):
+            if channel.closed and now - channel.closed_at > CHANNEL_RETENTION:
+                del self._channels[task_id]
+
+    def publish(self, task_id: str, event_type: str, data: Dict[str, Any]) -> int:
+        """发布事件
+
+        Args:
+            task_id: 任务ID
+            event_type: 事件类型，如 status、stream
+            data: 事件数据，发布后不应再修改
+
+        Returns:
+            事件编号
+        """
+        channel = self._get_channel(task_id)
+        with channel.condition:
+            event = {"id": channel.next_id, "type": event_type, "data": data}
+            channel.next_id += 1
+            channel.events.append(event)
+            channel.condition.notify_all()
+            return event["id"]
+
+    def close(self, task_id: str) -> None:
+        """标记任务结束，唤醒所有订阅者"""
+        channel = self._get_channel(task_id)
+        with channel.condition:
+            channel.closed = True
+            channel.closed_at = time.monotonic()
+            channel.condition.notify_all()
+
+    def latest_id(self, task_id: str) -> int:
+        """任务最近一个事件的编号，没有事件时为0"""
+        with self._lock:
+            channel = self._channels.get(task_id)
+        if channel is None:
+            return 0
+        with channel.condition:
+            return channel.next_id - 1
+
+    def subscribe(self, task_id: str, last_id: int = 0, keepalive: float = KEEPALIVE_INTERVAL) -> Iterator[Optional[Dict]]:
+        """订阅任务事件
+
+        Args:
+            task_id: 任务ID
+            last_id: 已收到的最后一个事件编号，从其后开始推送
+            keepalive: 无新事件时的最长等待时间（秒）
+
+        Yields:
+            事件字典；等待超时时产出None，用于发送心跳；
+            所需事件已被挤出缓冲区时产出 {"type": "reset"}，订阅者应重新获取完整状态
+        """
+        channel = self._get_channel(task_id)
+        while True:
+            with channel.condition:
+                events = channel.events_after(last_id)
+                if events == [] and not channel.closed:
+                    channel.condition.wait(timeout=keepalive)
+                    events = channel.events_after(last_id)
+                closed = channel.closed
+                latest_id = channel.next_id - 1
+
+            if events is None:
+                last_id = latest_id
+                yield {"id": latest_id, "type": "reset", "data": {}}
+                continue
+            if not events:
+                if closed:
+                    return
+                yield None
+                continue
+            for event in events:
+                last_id = event["id"]
+                yield event
+
+
+class DebouncedWriter:
+    """合并短时间内的多次写入，最多每 interval 秒写一次 JSON 文件"""
+
+    def __init__(self, path: str, interval: float = PERSIST_INTERVAL):
+        """初始化写入器
+
+        Args:
+            path: 目标文件路径
+            interval: 两次写入之间的最短间隔（秒）
+        """
+        self.path = path
+        self.interval = interval
+        self._pending = None
+        self._last_write = 0.0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def write(self, data: Dict[str, Any]) -> None:
+        """提交一次写入，距上次写入不足 interval 时延后并与后续写入合并
+
+        Args:
+            data: 要写入的数据，会立即复制一份
+        """
+        with self._lock:
+            self._pending = dict(data)
+            delay = self._last_write + self.interval - time.monotonic()
+            if delay > 0:
+                if self._timer is None:
+                    self._timer = threading.Timer(delay, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+        self.flush()
+
+    def flush(self) -> None:
+        """立即写入尚未落盘的数据"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            data, self._pending = self._pending, None
+            if data is None:
+                return
+            self._last_write = time.monotonic()
+            # 先写临时文件再替换，避免读取方看到写了一半的文件
+            temp_path = f"{self.path}.tmp"
+            try:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                logger.warning(f"保存任务状态失败: {e}")
+
+
+# 全局进度总线
+progress_bus = ProgressBus()
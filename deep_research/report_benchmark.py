@@ -0,0 +1,150 @@
+"""
+报告 HTML 渲染性能基准
+比较 markdown_renderer 的逐块单遍渲染与旧版逐章节多次 re.sub 的转换在长报告上的耗时，
+分别测试按章节组织的报告（每页一个章节）、全部内容位于同一章节的报告，
+以及大量未闭合的 [ 和 *（行内正则的最坏情况，耗时应与长度成线性关系）
+
+用法:
+    python -m deep_research.report_benchmark --pages 100
+    python -m deep_research.report_benchmark --pages 100 500 --repeat 5
+"""
+
+import re
+import time
+import argparse
+from typing import List, Dict, Any, Callable
+
+from deep_research.markdown_renderer import render_markdown
+
+# 每页包含的段落组数，每组约 600 字
+PAGE_BLOCKS = 3
+# 最坏情况每页的未闭合标记数
+PAGE_UNCLOSED_MARKS = 2000
+# 报告的组织方式：每页一个章节、全部内容在同一章节、同一行中大量未闭合的标记
+LAYOUTS = ("sections", "single", "unclosed")
+
+
+def make_page(page: int) -> str:
+    """生成一页模拟的报告章节内容，包括段落、列表、表格、代码块和引用标注"""
+    blocks = []
+    for block in range(PAGE_BLOCKS):
+        n = page * PAGE_BLOCKS + block
+        blocks.append(
+            f"第 {n} 段研究结论：**大语言模型**在教育领域的应用持续扩展，*个性化学习*与自动评测是主要方向[{n % 20 + 1}]。"
+            * 4
+        )
+        blocks.append("\n".join(f"- 要点 {i}：相关研究表明效果显著[{i + 1}, {i + 2}]" for i in range(5)))
+        blocks.append("\n".join(f"{i + 1}. 步骤 {i}：参见 https://example.com/paper/{n}/{i}" for i in range(4)))
+    blocks.append(
+        "| 指标 | 数值 | 说明 |\n|:---|---:|:---:|\n"
+        + "\n".join(f"| 指标 {i} | {i * 3.5} | **第 {page} 页** |" for i in range(5))
+    )
+    blocks.append(f"```python\ndef score(x):\n    return x * {page}  # 示例\n```")
+    return "\n\n".join(blocks)
+
+
+def make_report(pages: int, layout: str) -> Dict[str, Any]:
+    """生成模拟报告，layout 取值见 LAYOUTS"""
+    if layout == "unclosed":
+        content = "[a *b " * (pages * PAGE_UNCLOSED_MARKS // 2)
+        return {"title": "基准报告", "sections": [{"id": "unclosed", "title": "未闭合标记", "content": content}]}
+    contents = [make_page(page) for page in range(pages)]
+    if layout == "single":
+        return {"title": "基准报告", "sections": [{"id": "all", "title": "全部内容", "content": "\n\n".join(contents)}]}
+    return {
+        "title": "基准报告",
+        "sections": [
+            {"id": f"section_{page}", "title": f"第 {page + 1} 章", "content": content}
+            for page, content in enumerate(contents)
+        ]
+    }
+
+
+def legacy_section_html(content: str) -> str:
+    """旧版 _format_section_as_html 的内容转换：对整个章节依次执行多次正则替换"""
+    if re.search(r'(?m)^- .+$', content):
+        content = re.sub(r'(?m)^- (.+)$', r'<li>\1</li>', content)
+        content = re.sub(r'(?s)<li>.*?</li>(\n<li>.*?</li>)*', r'<ul>\g<0></ul>', content)
+    if re.search(r'(?m)^\d+\. .+$', content):
+        content = re.sub(r'(?m)^\d+\. (.+)$', r'<li>\1</li>', content)
+        content = re.sub(r'(?s)<li>.*?</li>(\n<li>.*?</li>)*', r'<ol>\g<0></ol>', content)
+    content = re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', content)
+    content = re.sub(r'\*(.+?)\*', r'<em>\1</em>', content)
+    html = ""
+    for p in re.split(r'\n\n+', content):
+        if p.strip():
+            if not (p.startswith('<ul>') or p.startswith('<ol>') or p.startswith('<li>')):
+                html += f"<p>{p}</p>\n"
+            else:
+                html += f"{p}\n"
+    return html
+
+
+def legacy_html(report: Dict[str, Any]) -> str:
+    """旧版的整份报告拼接方式：逐章节转换后用字符串累加"""
+    html = f"<h1>{report['title']}</h1>\n"
+    for section in report["sections"]:
+        html += f"<h2>{section['title']}</h2>\n"
+        html += legacy_section_html(section["content"])
+    return html
+
+
+def compiled_html(report: Dict[str, Any]) -> str:
+    """新版渲染：逐块渲染，片段最后一次拼接"""
+    parts = [f"<h1>{report['title']}</h1>\n"]
+    for section in report["sections"]:
+        parts.append(f"<h2>{section['title']}</h2>\n")
+        parts.append(render_markdown(section["content"], heading_offset=2))
+    return "".join(parts)
+
+
+def bench(render: Callable[[Dict[str, Any]], str], report: Dict[str, Any], repeat: int) -> float:
+    """多次渲染取最短耗时（秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render(report)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(pages_list: List[int], repeat: int) -> List[Dict[str, Any]]:
+    results = []
+    for pages in pages_list:
+        for layout in LAYOUTS:
+            report = make_report(pages, layout)
+            chars = sum(len(section["content"]) for section in report["sections"])
+            legacy = bench(legacy_html, report, repeat)
+            compiled = bench(compiled_html, report, repeat)
+            result = {
+                "pages": pages,
+                "layout": layout,
+                "chars": chars,
+                "legacy_ms": round(legacy * 1000, 1),
+                "compiled_ms": round(compiled * 1000, 1),
+                "speedup": round(legacy / compiled, 2) if compiled else None
+            }
+            print(result)
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="报告 HTML 渲染性能基准")
+    parser.add_argument("--pages", type=int, nargs="+", default=[100], help="模拟报告的页数")
+    parser.add_argument("--repeat", type=int, default=3, help="每项测试的重复次数，取最短耗时")
+    args = parser.parse_args()
+
+    results = run(args.pages, args.repeat)
+
+    print("\n==================== 结果汇总 ====================")
+    print(f"{'页数':>6}{'章节组织':>10}{'字符数':>12}{'旧版(ms)':>12}{'新版(ms)':>12}{'加速比':>10}")
+    for result in results:
+        print(
+            f"{result['pages']:>6}{result['layout']:>10}{result['chars']:>12}"
+            f"{result['legacy_ms']:>12}{result['compiled_ms']:>12}{result['speedup']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+深度研究 Agent 报告增量写入
+报告章节并发生成，每完成一个章节立即追加到章节记录文件（JSONL），并更新报告索引；
+Markdown 和 HTML 报告按大纲顺序追加，前面的章节全部完成后即写出，只有尚未轮到的章节暂存在内存中。
+报告生成中途失败时，已完成的章节仍保留在磁盘上，结果页可以根据索引显示部分报告
+"""
+
+import os
+import json
+import time
+import threading
+from typing import List, Dict, Any, Optional, Tuple, Iterable
+
+from LLMapi_service.logger import get_logger
+
+logger = get_logger("deep_research.report_writer")
+
+# 报告文件名
+REPORT_MARKDOWN_FILE = "research_report.md"
+REPORT_HTML_FILE = "research_report.html"
+REPORT_CONTENT_FILE = "research_content.json"
+# 每行一个已完成章节，按完成顺序追加
+REPORT_SECTIONS_FILE = "report_sections.jsonl"
+# 报告标题、大纲中的全部章节及其完成情况
+REPORT_INDEX_FILE = "report_index.json"
+# 可选的输出格式，章节记录和索引总是写出
+REPORT_FORMATS = ("markdown", "html", "json")
+
+
+def section_level(number: str) -> int:
+    """章节编号对应的标题级别：1 为二级标题，1.2 为三级标题"""
+    return number.count(".") + 2
+
+
+def _section_record(number: str, section: Dict) -> Dict:
+    """章节记录文件中的一行，生成失败的章节带有 error 字段"""
+    record = {"number": number, "id": section.get("id"), "title": section.get("title", ""),
+              "content": section.get("content", "")}
+    if section.get("error"):
+        record["error"] = section["error"]
+    return record
+
+
+def _write_json(path: str, data: Any) -> None:
+    """先写临时文件再替换，避免读取方看到写了一半的文件"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+class ReportWriter:
+    """报告增量写入器，一个写入器对应一次报告生成"""
+
+    def __init__(self, output_dir: str, formats: Iterable[str] = REPORT_FORMATS):
+        """
+        Args:
+            output_dir: 输出目录
+            formats: 要写出的报告格式，取值见 REPORT_FORMATS
+        """
+        self.output_dir = output_dir
+        self.formats = set(formats)
+        self.formatter = None
+        self._lock = threading.Lock()
+        self._index: Dict[str, Any] = {}
+        self._order: List[str] = []
+        self._positions: Dict[str, int] = {}
+        # 已完成但前面还有章节未完成、尚未写入 Markdown/HTML 的章节
+        self._pending: Dict[str, Dict] = {}
+        self._flushed = 0
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.output_dir, filename)
+
+    def _save_index(self) -> None:
+        self._index["updated"] = time.time()
+        _write_json(self._path(REPORT_INDEX_FILE), self._index)
+
+    def start(self, formatter, title: str, numbered: List[Tuple[str, Dict]]) -> None:
+        """开始写入报告，清空上一次的输出并写出报告头部和索引
+
+        Args:
+            formatter: 提供章节格式化的输出整理器（OutputOrganizer）
+            title: 报告标题
+            numbered: 按大纲顺序排列的 (章节编号, 章节)
+        """
+        with self._lock:
+            self.formatter = formatter
+            self._order = [number for number, _ in numbered]
+            self._positions = {number: i for i, number in enumerate(self._order)}
+            self._pending = {}
+            self._flushed = 0
+            self._index = {
+                "title": title,
+                "status": "generating",
+                "sections": [
+                    {
+                        "number": number,
+                        "id": section.get("id", f"section_{number}"),
+                        "title": section.get("title", ""),
+                        "level": section_level(number),
+                        "done": False
+                    }
+                    for number, section in numbered
+                ],
+                "completed": 0,
+                "failed": 0,
+                "flushed": 0,
+                "error": None
+            }
+            with open(self._path(REPORT_SECTIONS_FILE), "w", encoding="utf-8"):
+                pass
+            if "markdown" in self.formats:
+                with open(self._path(REPORT_MARKDOWN_FILE), "w", encoding="utf-8") as f:
+                    f.write(formatter.markdown_header(title))
+            if "html" in self.formats:
+                with open(self._path(REPORT_HTML_FILE), "w", encoding="utf-8") as f:
+                    f.write(formatter.html_header(title))
+            self._save_index()
+
+    def add_section(self, number: str, section: Dict) -> None:
+        """记录一个已完成的章节（不含子章节），并按大纲顺序写出所有已可写出的章节
+
+        Args:
+            number: 章节编号
+            section: 章节内容，包括 id、title、content，生成失败时带有 error
+        """
+        with self._lock:
+            if number not in self._positions:
+                return
+            record = _section_record(number, section)
+            with open(self._path(REPORT_SECTIONS_FILE), "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._pending[number] = record
+            entry = self._index["sections"][self._positions[number]]
+            entry["done"] = True
+            self._index["completed"] += 1
+            if record.get("error"):
+                # 生成失败的章节同样算作已完成，以免阻塞后面章节的写出
+                entry["failed"] = True
+                self._index["failed"] += 1
+            self._flush_ready()
+            self._save_index()
+
+    def _flush_ready(self) -> None:
+        """把大纲顺序上已连续完成的章节追加到 Markdown/HTML，之后不再保留其内容"""
+        markdown_parts = []
+        html_parts = []
+        while self._flushed < len(self._order) and self._order[self._flushed] in self._pending:
+            number = self._order[self._flushed]
+            record = self._pending.pop(number)
+            level = section_level(number)
+            if "markdown" in self.formats:
+                markdown_parts.append(self.formatter.format_section_markdown(record, level))
+            if "html" in self.formats:
+                html_parts.extend(self.formatter.iter_section_html(record, level))
+            self._flushed += 1
+        if markdown_parts:
+            with open(self._path(REPORT_MARKDOWN_FILE), "a", encoding="utf-8") as f:
+                f.writelines(markdown_parts)
+        if html_parts:
+            with open(self._path(REPORT_HTML_FILE), "a", encoding="utf-8") as f:
+                f.writelines(html_parts)
+        self._index["flushed"] = self._flushed
+
+    def finish(self, content: Dict, rewrite: bool = False) -> None:
+        """报告生成完成，写出 HTML 尾部和完整内容
+
+        Args:
+            content: 完整的报告内容
+            rewrite: 章节内容在写入后又被修改过（如补充了过渡句）时，按完整内容重新写出各文件
+        """
+        with self._lock:
+            if rewrite:
+                self._rewrite(content)
+            elif "html" in self.formats:
+                with open(self._path(REPORT_HTML_FILE), "a", encoding="utf-8") as f:
+                    f.write(self.formatter.html_footer())
+            if "json" in self.formats:
+                _write_json(self._path(REPORT_CONTENT_FILE), content)
+            self._index["status"] = "completed"
+            self._save_index()
+        logger.info(f"报告已写入 {self.output_dir}，共 {self._index['completed']} 个章节")
+        if self._index["failed"]:
+            logger.warning(f"报告中有 {self._index['failed']} 个章节生成失败")
+
+    def _rewrite(self, content: Dict) -> None:
+        """按完整内容重新写出 Markdown、HTML 和章节记录，调用前需持有锁"""
+        if "markdown" in self.formats:
+            with open(self._path(REPORT_MARKDOWN_FILE), "w", encoding="utf-8") as f:
+                f.write(self.formatter.format_as_markdown(content))
+        if "html" in self.formats:
+            with open(self._path(REPORT_HTML_FILE), "w", encoding="utf-8") as f:
+                f.writelines(self.formatter.iter_html(content))
+        with open(self._path(REPORT_SECTIONS_FILE), "w", encoding="utf-8") as f:
+
+            def write(sections: List[Dict], prefix: str):
+                for i, section in enumerate(sections):
+                    number = f"{prefix}{i + 1}"
+                    record = _section_record(number, section)
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    write(section.get("subsections") or [], number + ".")
+
+            write(content.get("sections", []), "")
+
+    def fail(self, error: str) -> None:
+        """报告生成中止，已写出的章节保留，索引中记录失败原因"""
+        with self._lock:
+            if not self._index:
+                return
+            self._index["status"] = "failed"
+            self._index["error"] = error
+            self._save_index()
+        logger.warning(f"报告生成中止，已保存 {self._index['completed']} 个章节: {error}")
+
+
+def load_report(output_dir: str) -> Optional[Dict[str, Any]]:
+    """根据报告索引和章节记录读取报告，报告未完成时只包含已完成的章节
+
+    Args:
+        output_dir: 输出目录
+
+    Returns:
+        与 research_content.json 结构相同的报告内容，另含 status、completed、failed（生成失败的章节数）、
+        total、report_error（中止原因）；没有报告索引时返回None
+    """
+    try:
+        with open(os.path.join(output_dir, REPORT_INDEX_FILE), "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    records = {}
+    try:
+        with open(os.path.join(output_dir, REPORT_SECTIONS_FILE), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 写到一半的最后一行
+                    continue
+                records[record["number"]] = record
+    except OSError:
+        pass
+
+    # 按编号重建章节树，未完成的章节内容为空并标记 pending
+    roots: List[Dict] = []
+    by_number: Dict[str, Dict] = {}
+    for entry in index.get("sections", []):
+        number = entry["number"]
+        record = records.get(number, {})
+        section = {"id": entry["id"], "title": entry["title"], "content": record.get("content", "")}
+        if number not in records:
+            section["pending"] = True
+        elif record.get("error"):
+            section["error"] = record["error"]
+        by_number[number] = section
+        parent = by_number.get(number.rsplit(".", 1)[0]) if "." in number else None
+        if parent is not None:
+            parent.setdefault("subsections", []).append(section)
+        else:
+            roots.append(section)
+
+    return {
+        "title": index.get("title", ""),
+        "sections": roots,
+        "status": index.get("status"),
+        "completed": len(records),
+        "failed": sum(1 for record in records.values() if record.get("error")),
+        "total": len(index.get("sections", [])),
+        "report_error": index.get("error")
+    }
@@ -0,0 +1,117 @@
+"""
+深度研究 Agent 调度模块
+负责子任务的并发调度和LLM调用的并发限制
+"""
+
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional, Callable, Awaitable
+import sys
+sys.path.append('..')
+from LLMapi_service.gptservice import get_provider
+from LLMapi_service.logger import get_logger
+
+from deep_research.config import MAX_CONCURRENT_LLM_CALLS, MAX_CONCURRENT_CALLS_PER_PROVIDER
+from deep_research.decomposer import TaskDependencyResolver
+
+logger = get_logger("deep_research.scheduler")
+
+class ConcurrencyLimiter:
+    """并发限制器，同时限制全局和每个模型提供方的并发LLM调用数"""
+
+    def __init__(self, global_limit: int = MAX_CONCURRENT_LLM_CALLS, provider_limits: Dict[str, int] = None):
+        """初始化并发限制器
+
+        Args:
+            global_limit: 全局最大并发调用数
+            provider_limits: 每个提供方的最大并发调用数
+        """
+        self.global_limit = global_limit
+        self.provider_limits = provider_limits if provider_limits is not None else MAX_CONCURRENT_CALLS_PER_PROVIDER
+        self._global_semaphore = asyncio.Semaphore(global_limit)
+        self._provider_semaphores = {}
+
+    def _get_provider_semaphore(self, provider: str) -> asyncio.Semaphore:
+        """获取提供方对应的信号量"""
+        if provider not in self._provider_semaphores:
+            limit = self.provider_limits.get(provider, self.global_limit)
+            self._provider_semaphores[provider] = asyncio.Semaphore(limit)
+        return self._provider_semaphores[provider]
+
+    @asynccontextmanager
+    async def slot(self, model: str):
+        """占用一个LLM调用槽位
+
+        只应包裹单次请求，不能包裹子任务的递归处理，否则父节点会占着槽位等待子节点而死锁；
+        调用 GPT() 时应通过 attempt_slot() 传入，而不是包裹整个调用
+
+        Args:
+            model: 本次调用使用的模型
+        """
+        async with self._get_provider_semaphore(get_provider(model)):
+            async with self._global_semaphore:
+                yield
+
+    def attempt_slot(self, span=None) -> Callable:
+        """返回供 GPT(slot=...) 使用的槽位函数
+
+        每次请求尝试各自占用槽位：重试的退避等待不占用，降级模型计入其自身提供方的限制
+
+        Args:
+            span: 可选的链路追踪 span，等待槽位的累计时间记为其 queue_wait_ms 属性
+        """
+        @asynccontextmanager
+        async def slot(model: str):
+            queued_at = time.perf_counter()
+            async with self.slot(model):
+                if span is not None:
+                    waited = (time.perf_counter() - queued_at) * 1000
+                    span.set(queue_wait_ms=round(span.attributes.get("queue_wait_ms", 0) + waited, 3))
+                yield
+        return slot
+
+class SubtaskScheduler:
+    """子任务调度器，按依赖关系并发执行兄弟子任务"""
+
+    async def run(
+        self,
+        subtasks: List[Dict],
+        runner: Callable[[int, Dict, Dict[str, Any]], Awaitable[Any]]
+    ) -> Dict[str, Any]:
+        """并发执行子任务，每个子任务在其依赖完成后立即开始
+
+        子任务ID应互不相同（见 TaskDependencyResolver.deduplicate_ids），重复时依赖指向第一个同ID的子任务
+
+        Args:
+            subtasks: 子任务列表
+            runner: 执行单个子任务的协程函数，参数为子任务在列表中的位置、子任务和其依赖任务的结果
+
+        Returns:
+            按子任务原始顺序排列的结果字典，键为子任务ID
+        """
+        dependency_graph = TaskDependencyResolver.build_dependency_graph(subtasks)
+        if TaskDependencyResolver.has_cycle(subtasks):
+            logger.warning("子任务依赖存在环，忽略依赖关系并发执行")
+            dependency_graph = {task_id: set() for task_id in dependency_graph}
+
+        # 依赖图中的ID均为字符串，映射到第一个同ID子任务的位置
+        positions = {}
+        for index, subtask in enumerate(subtasks):
+            positions.setdefault(TaskDependencyResolver.task_id(subtask), index)
+        futures = [None] * len(subtasks)
+
+        async def run_one(index: int, subtask: Dict) -> Any:
+            # 等待所有依赖任务完成
+            dependency_results = {}
+            for dep_id in dependency_graph.get(TaskDependencyResolver.task_id(subtask), ()):
+                dependency_results[dep_id] = await futures[positions[dep_id]]
+            return await runner(index, subtask, dependency_results)
+
+        # 按拓扑顺序创建任务，保证依赖任务的 future 先于使用者存在
+        for index in TaskDependencyResolver.resolve_execution_positions(subtasks):
+            futures[index] = asyncio.ensure_future(run_one(index, subtasks[index]))
+
+        await asyncio.gather(*futures)
+
+        return {subtask["id"]: future.result() for subtask, future in zip(subtasks, futures)}
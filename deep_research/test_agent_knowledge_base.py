@@ -0,0 +1,100 @@
+"""
+测试研究节点与向量知识库的交互：结果立即写入知识库供兄弟节点检索，
+检索结果只带段落和来源、过滤掉节点自身的条目，启用重排序时取更少的段落
+
+用法:
+    python -m unittest deep_research.test_agent_knowledge_base
+"""
+
+import os
+import asyncio
+import tempfile
+import unittest
+from unittest import mock
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deep_research.agent import DeepResearchNode
+from deep_research.config import KB_SEARCH_TOP_K, KB_SEARCH_TOP_K_RERANKED
+from deep_research.knowledge_base import KnowledgeBase
+from deep_research.test_knowledge_base import CharEmbeddings
+
+QUANTUM = {
+    "solution": "表面码是目前最主流的量子纠错方案",
+    "context": {"web_search": [
+        {"title": "量子纠错综述", "snippet": "表面码的纠错阈值约为百分之一", "url": "https://example.com/qec"}
+    ]}
+}
+OPTIMIZER = {"solution": "Adam 优化器结合了动量和自适应学习率"}
+
+
+class AgentKnowledgeBaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.path = os.path.join(self.temp_dir.name, "knowledge_base.json")
+        self.kb = KnowledgeBase(self.path, embeddings=CharEmbeddings())
+        self.quantum_node = self.make_node("root_1")
+        self.optimizer_node = self.make_node("root_2")
+
+        async def store():
+            await self.quantum_node._store_in_knowledge_base("量子计算的纠错码", "simple", None, QUANTUM)
+            await self.optimizer_node._store_in_knowledge_base("深度学习的优化器", "simple", None, OPTIMIZER)
+
+        asyncio.run(store())
+
+    def make_node(self, node_id):
+        return DeepResearchNode(tools=[object()], node_id=node_id, knowledge_base=self.kb, depth=1)
+
+    def test_store_writes_through(self):
+        self.assertEqual(set(self.kb.entries), {"root_1", "root_2"})
+        self.assertEqual(self.kb.entries["root_1"]["task_type"], "simple")
+        self.assertEqual(self.kb.entries["root_1"]["depth"], 1)
+        # 未保存快照时兄弟节点也能立即检索到
+        self.assertIn("root_1", {result["entry_id"] for result in self.kb.search("量子纠错 表面码")})
+        # 条目已追加到日志，重新打开知识库即可读到
+        reopened = KnowledgeBase(self.path, embeddings=CharEmbeddings())
+        self.assertEqual(reopened.entries["root_2"]["results"], OPTIMIZER)
+
+    def test_search_returns_passages_with_sources(self):
+        results = asyncio.run(self.optimizer_node._knowledge_base_search("量子纠错 表面码"))
+        self.assertTrue(results)
+        self.assertLessEqual(len(results), KB_SEARCH_TOP_K)
+        for result in results:
+            self.assertEqual(set(result), {"passage", "node_id", "source_url", "relevance_score"})
+            self.assertGreater(result["relevance_score"], 0)
+            self.assertLessEqual(result["relevance_score"], 1)
+        self.assertEqual(results[0]["node_id"], "root_1")
+        self.assertIn("表面码", results[0]["passage"])
+        # 网络搜索结果的段落带有链接，其他段落没有
+        web_passage = "量子纠错综述\n表面码的纠错阈值约为百分之一"
+        by_passage = {result["passage"]: result["source_url"] for result in results}
+        self.assertEqual(by_passage.pop(web_passage), "https://example.com/qec")
+        self.assertTrue(by_passage)
+        self.assertEqual(set(by_passage.values()), {None})
+
+    def test_own_entry_filtered(self):
+        query = "量子纠错码和 Adam 优化器"
+        self.assertEqual({result["entry_id"] for result in self.kb.search(query, KB_SEARCH_TOP_K)}, {"root_1", "root_2"})
+        results = asyncio.run(self.quantum_node._knowledge_base_search(query))
+        self.assertTrue(results)
+        self.assertEqual({result["node_id"] for result in results}, {"root_2"})
+
+    def test_top_k_depends_on_reranker(self):
+        with mock.patch.object(self.kb, "asearch", mock.AsyncMock(return_value=[])) as asearch:
+            asyncio.run(self.quantum_node._knowledge_base_search("量子"))
+            asearch.assert_awaited_once_with("量子", top_k=KB_SEARCH_TOP_K)
+
+            asearch.reset_mock()
+            with mock.patch.object(self.kb, "reranker", object()):
+                asyncio.run(self.quantum_node._knowledge_base_search("量子"))
+            asearch.assert_awaited_once_with("量子", top_k=KB_SEARCH_TOP_K_RERANKED)
+
+    def test_search_error_returns_empty(self):
+        with mock.patch.object(self.kb, "asearch", mock.AsyncMock(side_effect=RuntimeError("索引损坏"))):
+            self.assertEqual(asyncio.run(self.quantum_node._knowledge_base_search("量子")), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
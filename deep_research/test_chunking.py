@@ -0,0 +1,95 @@
+"""
+测试知识库条目的分块：token 估算、按句子切分与重叠、条目字段和来源信息
+
+用法:
+    python -m unittest deep_research.test_chunking
+"""
+
+import os
+import unittest
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deep_research.chunking import count_tokens, split_text, chunk_entry
+
+
+class SplitTextTest(unittest.TestCase):
+
+    def test_count_tokens(self):
+        self.assertEqual(count_tokens("深度研究"), 4)
+        self.assertEqual(count_tokens("abcdefgh"), 2)
+        self.assertEqual(count_tokens("研究abcd"), 3)
+        self.assertEqual(count_tokens(""), 0)
+
+    def test_short_text_is_one_chunk(self):
+        self.assertEqual(split_text("第一句。第二句。", 100, 10), ["第一句。第二句。"])
+
+    def test_chunks_respect_limit_and_sentence_boundaries(self):
+        sentences = [f"这是第{i}个句子。" for i in range(20)]
+        chunks = split_text("".join(sentences), 20, 0)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(count_tokens(chunk), 20)
+            self.assertTrue(chunk.endswith("。"))
+        self.assertEqual("".join(chunks), "".join(sentences))
+
+    def test_overlap_repeats_previous_sentence(self):
+        chunks = split_text("一二三四五。六七八九十。甲乙丙丁戊。", 12, 6)
+        self.assertEqual(chunks, ["一二三四五。六七八九十。", "六七八九十。甲乙丙丁戊。"])
+
+    def test_long_sentence_is_hard_split(self):
+        chunks = split_text("字" * 50, 20, 0)
+        self.assertEqual([len(chunk) for chunk in chunks], [20, 20, 10])
+
+    def test_blank_text(self):
+        self.assertEqual(split_text("  \n\n ", 20, 0), [])
+
+
+class ChunkEntryTest(unittest.TestCase):
+
+    def test_simple_task_entry(self):
+        entry = {
+            "task": "大语言模型在教育中的应用",
+            "node_id": "root_1",
+            "depth": 1,
+            "results": {
+                "solution": "个性化学习和自动评测是主要方向。",
+                "context": {"web_search": [
+                    {"title": "论文标题", "snippet": "论文摘要", "url": "https://example.com/a"}
+                ]}
+            }
+        }
+        chunks = chunk_entry("e1", entry)
+        self.assertEqual([chunk["field"] for chunk in chunks], ["task", "solution", "web"])
+        self.assertEqual([chunk["id"] for chunk in chunks], ["e1#0", "e1#1", "e1#2"])
+        self.assertTrue(all(chunk["entry_id"] == "e1" and chunk["node_id"] == "root_1" for chunk in chunks))
+        self.assertEqual(chunks[2]["text"], "论文标题\n论文摘要")
+        self.assertEqual(chunks[2]["source_url"], "https://example.com/a")
+        self.assertIsNone(chunks[1]["source_url"])
+
+    def test_complex_task_entry_attributes_subtasks(self):
+        entry = {
+            "task": "总任务",
+            "node_id": "root",
+            "depth": 0,
+            "results": {
+                "a": {"solution": {"solution": "子任务一的解答"}},
+                "b": {"summary": "子任务二的总结"}
+            }
+        }
+        chunks = chunk_entry("e2", entry)
+        subtasks = {chunk["field"]: chunk for chunk in chunks if chunk["field"].startswith("subtask:")}
+        self.assertEqual(subtasks["subtask:a"]["text"], "子任务一的解答")
+        self.assertEqual(subtasks["subtask:a"]["node_id"], "root_a")
+        self.assertEqual(subtasks["subtask:a"]["depth"], 1)
+        self.assertEqual(subtasks["subtask:b"]["text"], "子任务二的总结")
+
+    def test_entry_without_known_fields(self):
+        chunks = chunk_entry("e3", {"note": "其他内容"})
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(chunks[0]["field"], "entry")
+        self.assertIn("其他内容", chunks[0]["text"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+测试提示上下文构建：token 预算、截断、检索结果去重和按相关度排序、祖先节点只保留任务描述
+
+用法:
+    python -m unittest deep_research.test_context_builder
+"""
+
+import os
+import unittest
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deep_research.chunking import count_tokens
+from deep_research.context_builder import build_context, truncate_to_tokens, MIN_ITEM_TOKENS
+
+ROOT = {
+    "task": "量子计算的应用",
+    "web_search": [
+        {"title": "量子计算简介", "url": "https://a.example", "snippet": "量子计算利用叠加和纠缠。"},
+        {"title": "天气预报", "url": "https://b.example", "snippet": "明天多云。"},
+    ],
+}
+
+CHILD = {
+    "task": "量子计算在药物研发中的应用",
+    "parent_context": ROOT,
+    # 与父节点重复的检索结果只保留一份
+    "web_search": [ROOT["web_search"][0]],
+    "kb_search": [{"passage": "药物研发中的分子模拟需要大量计算。", "node_id": "root_task1", "relevance_score": 0.9}],
+    "dependency_results": {"task1": "量子计算已用于小分子模拟。"},
+}
+
+
+class TruncateTest(unittest.TestCase):
+
+    def test_short_text_unchanged(self):
+        self.assertEqual(truncate_to_tokens("短文本", 100), "短文本")
+
+    def test_long_text_within_budget(self):
+        text = "量子计算的研究进展。" * 200
+        truncated = truncate_to_tokens(text, 50)
+        self.assertTrue(truncated.endswith("…"))
+        self.assertLessEqual(count_tokens(truncated), 50)
+
+
+class BuildContextTest(unittest.TestCase):
+
+    def test_sections_and_ordering(self):
+        text, stats = build_context(CHILD, CHILD["task"], 2000)
+        self.assertIn("研究路径：\n1. 量子计算的应用", text)
+        self.assertIn("[task1] 量子计算已用于小分子模拟。", text)
+        # 祖先节点只保留任务描述，不再序列化整个父上下文
+        self.assertNotIn("parent_context", text)
+        self.assertEqual(stats["items"], 3)
+        self.assertEqual(text.count("https://a.example"), 1)
+        # 知识库段落的检索相关度最高，排在最前；与任务无关的网页排在最后
+        self.assertLess(text.index("分子模拟需要"), text.index("https://a.example"))
+        self.assertLess(text.index("https://a.example"), text.index("https://b.example"))
+
+    def test_budget(self):
+        context = dict(CHILD, kb_search=[
+            {"passage": f"药物研发段落{i}。" + "分子模拟的细节。" * 40, "node_id": f"n{i}"} for i in range(10)
+        ])
+        text, stats = build_context(context, CHILD["task"], 300)
+        self.assertLessEqual(stats["tokens"], 300 + 5)
+        self.assertLess(stats["items_used"], stats["items"])
+        self.assertGreaterEqual(stats["items_truncated"], 1)
+
+    def test_tiny_remaining_budget_drops_items(self):
+        _, stats = build_context(dict(CHILD, dependency_results={}), CHILD["task"], MIN_ITEM_TOKENS // 2)
+        self.assertEqual(stats["items_used"], 0)
+
+    def test_empty_context(self):
+        text, stats = build_context({}, "任务", 100)
+        self.assertEqual(text, "（无）")
+        self.assertEqual(stats["items"], 0)
+
+    def test_raw_tokens_only_when_measured(self):
+        _, stats = build_context(CHILD, CHILD["task"], 2000)
+        self.assertNotIn("raw_tokens", stats)
+        _, stats = build_context(CHILD, CHILD["task"], 2000, measure_raw=True)
+        self.assertGreater(stats["raw_tokens"], stats["tokens"])
+
+
+if __name__ == "__main__":
+    unittest.main()
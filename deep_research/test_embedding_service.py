@@ -0,0 +1,95 @@
+"""
+测试共享嵌入服务的批处理线程：调用方取消请求或模型出错时，其余请求仍能得到结果，后台线程继续工作
+使用假的嵌入模型，不需要下载模型
+
+用法:
+    python -m unittest deep_research.test_embedding_service
+"""
+
+import os
+import asyncio
+import threading
+import unittest
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deep_research.embedding_service import EmbeddingService
+
+
+class FakeModel:
+    """按文本长度生成向量；gate 未打开时阻塞，用于让后台线程停在一次计算中"""
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.gate.set()
+        self.entered = threading.Event()
+        self.fail = False
+
+    def embed_documents(self, texts):
+        self.entered.set()
+        self.gate.wait(5)
+        if self.fail:
+            raise ValueError("模型出错")
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+class EmbeddingServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.model = FakeModel()
+        self.service = EmbeddingService("fake", cache=None, batch_wait=0, model=self.model)
+
+    def block_worker(self):
+        """提交一个请求并让后台线程停在该请求的计算中"""
+        self.model.gate.clear()
+        self.model.entered.clear()
+        blocker = self.service.submit(["阻塞"])
+        self.assertTrue(self.model.entered.wait(5))
+        return blocker
+
+    def test_embed(self):
+        self.assertEqual(self.service.embed(["ab", "abc"]), [[2.0, 1.0], [3.0, 1.0]])
+
+    def test_cancelled_request_does_not_stop_worker(self):
+        blocker = self.block_worker()
+        cancelled = self.service.submit(["已取消"])
+        waiting = self.service.submit(["等待中"])
+        self.assertTrue(cancelled.cancel())
+        self.model.gate.set()
+
+        self.assertEqual(blocker.result(5), [[2.0, 1.0]])
+        self.assertEqual(waiting.result(5), [[3.0, 1.0]])
+        self.assertTrue(cancelled.cancelled())
+        # 后台线程仍在工作
+        self.assertEqual(self.service.embed(["abcd"]), [[4.0, 1.0]])
+
+    def test_cancelled_aembed(self):
+        async def run():
+            blocker = self.block_worker()
+            task = asyncio.ensure_future(self.service.aembed(["被取消的调用"]))
+            await asyncio.sleep(0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.model.gate.set()
+            await asyncio.wrap_future(blocker)
+            return await self.service.aembed(["abc"])
+
+        self.assertEqual(asyncio.run(run()), [[3.0, 1.0]])
+
+    def test_model_error_resolves_whole_batch(self):
+        self.model.fail = True
+        blocker = self.block_worker()
+        other = self.service.submit(["同一批次"])
+        self.model.gate.set()
+        with self.assertRaises(ValueError):
+            blocker.result(5)
+        with self.assertRaises(ValueError):
+            other.result(5)
+
+        self.model.fail = False
+        self.assertEqual(self.service.embed(["ab"]), [[2.0, 1.0]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+"""
+测试报告证据选择：沿研究树收集叶子解答，为各章节按相关度在 token 预算内选择段落
+嵌入服务替换为抛出异常的函数，使用词项重合度作为相似度，不需要下载模型
+
+用法:
+    python -m unittest deep_research.test_evidence
+"""
+
+import os
+import asyncio
+import unittest
+from unittest import mock
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deep_research import evidence
+from deep_research.evidence import EvidenceSelector, collect_passages
+from deep_research.chunking import count_tokens
+
+RESEARCH_RESULTS = {
+    "task": "大语言模型在教育中的应用",
+    "is_complex": True,
+    "subtasks": [
+        {"id": "1", "description": "个性化学习"},
+        {"id": "2", "description": "自动评测"},
+    ],
+    "results": {
+        "1": {"solution": {"solution": "自适应学习系统根据学生水平推荐学习内容。"}},
+        "2": {
+            "is_complex": True,
+            "subtasks": [{"id": "2.1", "description": "作文评分"}],
+            "results": {"2.1": {"solution": "自动作文评分与人工评分高度一致。"}},
+        },
+    },
+}
+
+
+def unavailable(model_name):
+    raise RuntimeError("嵌入模型不可用")
+
+
+class CollectPassagesTest(unittest.TestCase):
+
+    def test_collects_leaves_with_their_tasks(self):
+        passages = collect_passages(RESEARCH_RESULTS, 200)
+        self.assertEqual(passages, [
+            {"task": "个性化学习", "text": "自适应学习系统根据学生水平推荐学习内容。"},
+            {"task": "作文评分", "text": "自动作文评分与人工评分高度一致。"},
+        ])
+
+    def test_simple_root(self):
+        passages = collect_passages({"task": "问题", "solution": "解答。"}, 200)
+        self.assertEqual(passages, [{"task": "问题", "text": "解答。"}])
+
+
+@mock.patch.object(evidence, "get_embedding_service", unavailable)
+class EvidenceSelectorTest(unittest.TestCase):
+
+    def select(self, queries, top_k=2, budget=200):
+        selector = EvidenceSelector("fake", top_k=top_k, budget=budget, chunk_tokens=200)
+        return asyncio.run(selector.select(queries, RESEARCH_RESULTS))
+
+    def test_selects_most_relevant_passage(self):
+        selected = self.select([("1", "作文评分 自动评分"), ("2", "个性化 学习内容推荐")])
+        self.assertEqual(selected["1"][0]["task"], "作文评分")
+        self.assertEqual(selected["2"][0]["task"], "个性化学习")
+        scores = [item["score"] for item in selected["1"]]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_top_k(self):
+        selected = self.select([("1", "学习 评分")], top_k=1)
+        self.assertEqual(len(selected["1"]), 1)
+
+    def test_budget(self):
+        # 第一个段落放入预算后剩余不足 MIN_ITEM_TOKENS，不再截断放入后面的段落
+        selected = self.select([("1", "作文评分")], budget=30)
+        self.assertEqual([item["task"] for item in selected["1"]], ["作文评分"])
+        self.assertLessEqual(sum(count_tokens(item["text"]) for item in selected["1"]), 30)
+
+    def test_no_passages(self):
+        selector = EvidenceSelector("fake", top_k=2, budget=200, chunk_tokens=200)
+        selected = asyncio.run(selector.select([("1", "问题")], {"task": "问题", "solution": ""}))
+        self.assertEqual(selected, {"1": []})
+
+
+if __name__ == "__main__":
+    unittest.main()
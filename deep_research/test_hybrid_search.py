@@ -0,0 +1,127 @@
+"""
+测试混合检索：中英文分词、BM25 索引的增删与排序、倒数排名融合，以及重排序得分的范围和排序
+
+用法:
+    python -m unittest deep_research.test_hybrid_search
+"""
+
+import os
+import tempfile
+import unittest
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deep_research.hybrid_search import (
+    tokenize, BM25Index, reciprocal_rank_fusion, get_reranker, CrossEncoderReranker, RRF_K
+)
+from deep_research.knowledge_base import KnowledgeBase
+from deep_research.context_builder import build_context
+from deep_research.test_knowledge_base import CharEmbeddings
+
+
+class TokenizeTest(unittest.TestCase):
+
+    def test_mixed_text(self):
+        self.assertEqual(tokenize("GPT-4 模型评测"), ["gpt", "4", "模型", "型评", "评测"])
+
+    def test_single_cjk_character(self):
+        self.assertEqual(tokenize("书 Book"), ["书", "book"])
+
+
+class BM25IndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = BM25Index()
+        self.index.add_many([
+            ("a", "大语言模型在教育领域的应用"),
+            ("b", "强化学习在机器人控制中的应用"),
+            ("c", "大语言模型的推理能力评测，大语言模型的局限"),
+        ])
+
+    def test_ranking(self):
+        results = self.index.search("大语言模型", top_k=10)
+        self.assertEqual([doc_id for doc_id, _ in results][:2], ["c", "a"])
+        self.assertNotIn("b", [doc_id for doc_id, _ in results])
+        self.assertGreater(results[0][1], results[1][1])
+
+    def test_top_k(self):
+        self.assertEqual(len(self.index.search("应用", top_k=1)), 1)
+
+    def test_replace_and_remove(self):
+        self.index.add("b", "大语言模型辅助机器人控制")
+        self.assertIn("b", [doc_id for doc_id, _ in self.index.search("大语言模型")])
+        self.index.remove("b")
+        self.index.remove("不存在的文档")
+        self.assertEqual(len(self.index), 2)
+        self.assertNotIn("b", [doc_id for doc_id, _ in self.index.search("机器人")])
+
+    def test_empty_query_and_clear(self):
+        self.assertEqual(self.index.search("，。"), [])
+        self.index.clear()
+        self.assertEqual(len(self.index), 0)
+        self.assertEqual(self.index.search("大语言模型"), [])
+
+
+class FusionTest(unittest.TestCase):
+
+    def test_reciprocal_rank_fusion(self):
+        fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d"]])
+        self.assertEqual([doc_id for doc_id, _ in fused], ["b", "a", "d", "c"])
+        scores = dict(fused)
+        self.assertAlmostEqual(scores["b"], 1 / (RRF_K + 2) + 1 / (RRF_K + 1))
+        self.assertAlmostEqual(scores["c"], 1 / (RRF_K + 3))
+
+    def test_no_reranker_without_model(self):
+        self.assertIsNone(get_reranker(None))
+
+
+class FakeCrossEncoder:
+    """与 CrossEncoder.predict() 一样返回已经过 sigmoid 的得分：文本含查询时得分高"""
+
+    def predict(self, pairs, batch_size=None, show_progress_bar=None):
+        return [0.95 if query in text else 0.02 for query, text in pairs]
+
+
+class RerankerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.reranker = CrossEncoderReranker("fake-cross-encoder")
+        self.reranker._model = FakeCrossEncoder()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.kb = KnowledgeBase(os.path.join(self.temp_dir.name, "knowledge_base.json"), embeddings=CharEmbeddings())
+        self.kb.reranker = self.reranker
+        self.kb.bulk_add([
+            {"task": "海洋", "solution": "海洋覆盖地球表面的大部分"},
+            {"task": "大语言模型", "solution": "大语言模型的推理能力"},
+            {"task": "机器人", "solution": "强化学习用于机器人控制"},
+        ], ["e1", "e2", "e3"])
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_scores_not_squashed_again(self):
+        self.assertEqual(self.reranker.score("模型", ["大语言模型", "海洋"]), [0.95, 0.02])
+        self.assertEqual(self.reranker.score("模型", []), [])
+
+    def test_search_orders_by_reranker_score(self):
+        results = self.kb.search("推理能力", top_k=3)
+        self.assertEqual(results[0]["text"], "大语言模型的推理能力")
+        self.assertEqual(results[0]["relevance"], "high")
+        self.assertAlmostEqual(results[0]["relevance_score"], 0.95)
+        scores = [result["relevance_score"] for result in results]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        # 不相关的段落得分接近0，而不是被二次 sigmoid 抬到0.5以上
+        self.assertTrue(all(0 <= score <= 1 for score in scores))
+        self.assertLess(scores[-1], 0.5)
+        self.assertEqual(results[-1]["relevance"], "medium")
+
+    def test_irrelevant_passage_ranked_last_in_context(self):
+        results = self.kb.search("推理能力", top_k=3)
+        context = {"kb_search": [{"passage": result["text"], "relevance_score": result["relevance_score"]}
+                                 for result in reversed(results)]}
+        text, _ = build_context(context, "推理能力", 2000)
+        self.assertLess(text.index("大语言模型的推理能力"), text.index(results[-1]["text"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+测试研究任务队列：优先级、按用户公平调度、排队上限和取消
+
+用法:
+    python -m unittest deep_research.test_job_queue
+"""
+
+import os
+import time
+import asyncio
+import threading
+import unittest
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deep_research.job_queue import JobQueue, QueueFullError
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class JobQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = JobQueue(workers=1, max_queued=5)
+        self.release = threading.Event()
+        self.started = []
+
+    def tearDown(self):
+        self.release.set()
+
+    def job(self, name):
+        """返回任务工厂：记录开始顺序，等待 release 后结束"""
+        async def run():
+            self.started.append(name)
+            while not self.release.is_set():
+                await asyncio.sleep(0.01)
+        return run
+
+    def block_worker(self):
+        self.queue.submit("blocker", self.job("blocker"), user="x")
+        self.assertTrue(wait_until(lambda: self.started == ["blocker"]))
+
+    def test_priority_then_fair_share(self):
+        self.block_worker()
+        self.queue.submit("a1", self.job("a1"), user="a")
+        self.queue.submit("a2", self.job("a2"), user="a")
+        self.queue.submit("a3", self.job("a3"), user="a")
+        self.queue.submit("b1", self.job("b1"), user="b")
+        self.queue.submit("c1", self.job("c1"), user="c", priority=1)
+
+        positions = self.queue.positions()
+        self.assertEqual(sorted(positions, key=positions.get), ["c1", "a1", "b1", "a2", "a3"])
+        self.assertEqual(self.queue.position("b1"), 3)
+
+        self.release.set()
+        self.assertTrue(wait_until(lambda: len(self.started) == 6))
+        self.assertEqual(self.started, ["blocker", "c1", "a1", "b1", "a2", "a3"])
+        self.assertTrue(wait_until(lambda: self.queue.get_statistics()["running"] == 0))
+
+    def test_queue_limit(self):
+        self.block_worker()
+        for i in range(5):
+            self.queue.submit(f"job{i}", self.job(f"job{i}"))
+        with self.assertRaises(QueueFullError):
+            self.queue.submit("overflow", self.job("overflow"))
+
+    def test_cancel_queued_and_running(self):
+        self.block_worker()
+        self.queue.submit("queued", self.job("queued"))
+        self.assertTrue(self.queue.cancel("queued"))
+        self.assertIsNone(self.queue.status("queued"))
+        self.assertIsNone(self.queue.position("queued"))
+
+        self.assertEqual(self.queue.status("blocker"), "running")
+        self.assertTrue(self.queue.cancel("blocker"))
+        self.assertTrue(wait_until(lambda: self.queue.status("blocker") is None))
+        self.assertFalse(self.queue.cancel("blocker"))
+        self.assertEqual(self.started, ["blocker"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,240 @@
+"""
+测试知识库的持久化：重放条目日志时，快照之后被覆盖的条目重新嵌入，未变化的条目不重复计算，
+段落和关键词索引从快照恢复，只为快照之后的日志记录重新切分；
+各类向量索引（flat、hnsw、ivfpq、sq8）的构建、覆盖条目、重建和以内存映射方式重新加载
+使用按字符计数的假嵌入模型，不需要下载模型
+
+用法:
+    python -m unittest deep_research.test_knowledge_base
+"""
+
+import os
+import json
+import zlib
+import tempfile
+import unittest
+from unittest import mock
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.embeddings import Embeddings
+
+from deep_research import knowledge_base
+from deep_research.knowledge_base import KnowledgeBase, INDEX_TYPES
+
+
+class CharEmbeddings(Embeddings):
+    """按字符哈希计数的向量，文本相同则向量相同"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def _vector(self, text):
+        vector = [0.0] * 32
+        for char in text:
+            vector[zlib.crc32(char.encode("utf-8")) % 32] += 1.0
+        norm = sum(x * x for x in vector) ** 0.5 or 1.0
+        return [x / norm for x in vector]
+
+    def embed_documents(self, texts):
+        self.calls += len(texts)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+class KnowledgeBaseReloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "knowledge_base.json")
+        kb = KnowledgeBase(self.path, embeddings=CharEmbeddings())
+        kb.add_entry({"task": "苹果", "solution": "苹果是一种水果"}, "e1")
+        kb.add_entry({"task": "海洋", "solution": "海洋覆盖地球表面的大部分"}, "e2")
+        kb.save_index()
+        self.log_path = kb.log_path
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def indexed_texts(self, kb):
+        docs = kb.vector_store.docstore._dict.values()
+        return sorted(doc.page_content for doc in docs if doc.metadata.get("chunk_id"))
+
+    def test_clean_reload_does_not_reembed(self):
+        embeddings = CharEmbeddings()
+        kb = KnowledgeBase(self.path, embeddings=embeddings)
+        self.assertEqual(embeddings.calls, 0)
+        self.assertEqual(len(self.indexed_texts(kb)), 4)
+
+    def test_entry_overwritten_after_snapshot_is_reindexed(self):
+        # 覆盖条目只写入了日志，索引快照中仍是旧内容的向量
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            record = {"op": "add", "id": "e1", "entry": {"task": "汽车", "solution": "汽车是一种交通工具"}}
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        kb = KnowledgeBase(self.path, embeddings=CharEmbeddings())
+        texts = self.indexed_texts(kb)
+        self.assertIn("汽车是一种交通工具", texts)
+        self.assertNotIn("苹果是一种水果", texts)
+        self.assertIn("海洋覆盖地球表面的大部分", texts)
+        self.assertEqual(kb.search("交通工具", top_k=1)[0]["text"], "汽车是一种交通工具")
+
+        # 重新嵌入后保存了快照，再次加载不需要计算
+        embeddings = CharEmbeddings()
+        KnowledgeBase(self.path, embeddings=embeddings)
+        self.assertEqual(embeddings.calls, 0)
+
+    def load_counting_chunks(self, **kwargs):
+        """重新加载知识库，返回知识库和被重新切分的条目ID"""
+        with mock.patch.object(knowledge_base, "chunk_entry", wraps=knowledge_base.chunk_entry) as chunk_entry:
+            kb = KnowledgeBase(self.path, embeddings=CharEmbeddings(), **kwargs)
+        return kb, sorted(call.args[0] for call in chunk_entry.call_args_list)
+
+    def test_chunks_restored_from_snapshot(self):
+        kb, chunked = self.load_counting_chunks()
+        self.assertEqual(chunked, [])
+        self.assertEqual(len(kb.keyword_index), 4)
+        result = kb.search("海洋", top_k=1)[0]
+        self.assertEqual(result["entry_id"], "e2")
+        self.assertIsNotNone(result["keyword_score"])
+
+    def test_only_log_tail_rechunked(self):
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            for entry_id, task in (("e1", "汽车"), ("e3", "森林")):
+                record = {"op": "add", "id": entry_id, "entry": {"task": task, "solution": f"{task}的说明"}}
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        kb, chunked = self.load_counting_chunks()
+        self.assertEqual(chunked, ["e1", "e3"])
+        self.assertEqual(len(kb.keyword_index), 6)
+        self.assertEqual(kb.search("苹果 汽车", top_k=1)[0]["text"], "汽车")
+        self.assertNotIn("苹果", [chunk["text"] for chunk in kb._chunks.values()])
+
+    def test_clear_after_snapshot(self):
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"op": "clear"}) + "\n")
+            record = {"op": "add", "id": "e3", "entry": {"task": "森林", "solution": "森林的说明"}}
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        kb, chunked = self.load_counting_chunks()
+        self.assertEqual(chunked, ["e3"])
+        self.assertEqual(set(kb._chunk_counts), {"e3"})
+        self.assertEqual(len(kb.keyword_index), 2)
+
+    def test_snapshot_ignored_when_inconsistent(self):
+        # 切分参数不同
+        _, chunked = self.load_counting_chunks(chunk_tokens=64)
+        self.assertEqual(chunked, ["e1", "e2"])
+
+        # 日志被其他方式改写，快照位置上的条目与快照不一致
+        with open(self.log_path, "w", encoding="utf-8") as f:
+            record = {"op": "add", "id": "e9", "entry": {"task": "沙漠", "solution": "沙漠的说明" * 10}}
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        kb, chunked = self.load_counting_chunks()
+        self.assertEqual(chunked, ["e9"])
+        self.assertEqual(set(kb._chunk_counts), {"e9"})
+
+    @mock.patch.object(knowledge_base, "CHUNK_STATE_TAIL_RATIO", 0.5)
+    def test_snapshot_rewritten_when_tail_grows(self):
+        kb = KnowledgeBase(self.path, embeddings=CharEmbeddings())
+        kb.add_entry({"task": "森林", "solution": "森林的说明"}, "e3")
+        kb.save_index()
+        # 新切分的条目不足总数的一半，段落快照保持不变，加载时只切分 e3
+        _, chunked = self.load_counting_chunks()
+        self.assertEqual(chunked, ["e3"])
+
+        kb.add_entry({"task": "沙漠", "solution": "沙漠的说明"}, "e4")
+        kb.save_index()
+        _, chunked = self.load_counting_chunks()
+        self.assertEqual(chunked, [])
+
+    def test_compaction_updates_snapshot(self):
+        kb = KnowledgeBase(self.path, embeddings=CharEmbeddings())
+        kb.add_entry({"task": "苹果", "solution": "苹果是一种水果"}, "e1")
+        kb.compact()
+        _, chunked = self.load_counting_chunks()
+        self.assertEqual(chunked, [])
+
+
+def distinct_text(i):
+    """每个条目使用不同的汉字组合，按字符计数的向量和关键词都能区分"""
+    return "".join(chr(0x4e00 + (i * 13 + j * 7) % 3000) for j in range(10))
+
+
+@mock.patch.object(knowledge_base, "ANN_MIN_TRAIN_SIZE", 100)
+class IndexTypeTest(unittest.TestCase):
+    """每个条目切分为任务和解答两个段落，150个条目足够训练 ivfpq 的 256 个聚类中心"""
+
+    ENTRIES = 150
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "knowledge_base.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def build(self, index_type):
+        kb = KnowledgeBase(self.path, embeddings=CharEmbeddings(), index_type=index_type)
+        kb.bulk_add(
+            [{"task": f"任务{i}", "solution": distinct_text(i)} for i in range(self.ENTRIES)],
+            [f"e{i}" for i in range(self.ENTRIES)]
+        )
+        kb.flush()
+        return kb
+
+    def top_entry(self, kb, query):
+        return kb.search(query, top_k=1)[0]["entry_id"]
+
+    def test_round_trip(self):
+        for index_type in INDEX_TYPES:
+            with self.subTest(index_type=index_type), tempfile.TemporaryDirectory() as temp_dir:
+                self.path = os.path.join(temp_dir, "knowledge_base.json")
+                self.check_round_trip(index_type)
+
+    def check_round_trip(self, index_type):
+        kb = self.build(index_type)
+        self.assertEqual(kb.get_statistics()["index_type"], index_type)
+        self.assertEqual(self.top_entry(kb, distinct_text(42)), "e42")
+
+        # 覆盖条目：不能删除向量的索引（hnsw、ivfpq）在 flush 时重建
+        kb.add_entry({"task": "任务7", "solution": "量子计算的纠错码"}, "e7")
+        kb.flush()
+        self.assertEqual(self.top_entry(kb, "量子计算的纠错码"), "e7")
+        self.assertNotIn(distinct_text(7), [result["text"] for result in kb.search(distinct_text(7), top_k=5)])
+
+        # 以内存映射方式重新加载，不重新计算向量
+        embeddings = CharEmbeddings()
+        reloaded = KnowledgeBase(self.path, embeddings=embeddings, index_type=index_type, mmap=True)
+        self.assertEqual(embeddings.calls, 0)
+        self.assertEqual(reloaded.get_statistics()["index_type"], index_type)
+        self.assertEqual(self.top_entry(reloaded, "量子计算的纠错码"), "e7")
+        self.assertEqual(self.top_entry(reloaded, distinct_text(42)), "e42")
+
+        # 内存映射的索引在首次写入时复制到进程内存
+        reloaded.add_entry({"task": "任务200", "solution": "深海热液喷口的生态"}, "e200")
+        self.assertFalse(reloaded.get_statistics()["index_mmapped"])
+        self.assertEqual(self.top_entry(reloaded, "深海热液喷口的生态"), "e200")
+
+        # 切换索引类型重建
+        reloaded.rebuild_index("flat")
+        self.assertEqual(reloaded.get_statistics()["index_type"], "flat")
+        self.assertEqual(self.top_entry(reloaded, distinct_text(42)), "e42")
+        self.assertEqual(len(reloaded.vector_store.index_to_docstore_id), 2 * (self.ENTRIES + 1))
+
+    def test_small_knowledge_base_stays_flat(self):
+        kb = KnowledgeBase(self.path, embeddings=CharEmbeddings(), index_type="hnsw")
+        kb.add_entry({"task": "任务", "solution": "解答"}, "e1")
+        kb.flush()
+        self.assertEqual(kb.get_statistics()["index_type"], "flat")
+        self.assertEqual(kb.get_statistics()["configured_index_type"], "hnsw")
+
+    def test_unknown_index_type(self):
+        with self.assertRaises(ValueError):
+            KnowledgeBase(self.path, embeddings=CharEmbeddings(), index_type="lsh")
+
+
+if __name__ == "__main__":
+    unittest.main()
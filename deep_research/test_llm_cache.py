@@ -0,0 +1,128 @@
+"""
+测试 LLM 响应缓存：缓存键、内存 LRU 淘汰、磁盘缓存的持久化、过期和容量淘汰
+
+用法:
+    python -m unittest deep_research.test_llm_cache
+"""
+
+import os
+import time
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLMapi_service import llm_cache
+from LLMapi_service.llm_cache import LLMCache, make_cache_key
+
+MESSAGES = [{"role": "user", "content": "什么是深度研究？"}]
+
+
+class CacheKeyTest(unittest.TestCase):
+
+    def test_key_depends_on_model_messages_and_params(self):
+        key = make_cache_key("model-a", MESSAGES)
+        self.assertEqual(key, make_cache_key("model-a", [dict(MESSAGES[0])]))
+        self.assertNotEqual(key, make_cache_key("model-b", MESSAGES))
+        self.assertNotEqual(key, make_cache_key("model-a", [{"role": "user", "content": "别的问题"}]))
+        self.assertNotEqual(key, make_cache_key("model-a", MESSAGES, {"temperature": 0.5}))
+        # 参数顺序不影响缓存键
+        self.assertEqual(
+            make_cache_key("model-a", MESSAGES, {"a": 1, "b": 2}),
+            make_cache_key("model-a", MESSAGES, {"b": 2, "a": 1})
+        )
+
+
+class MemoryCacheTest(unittest.TestCase):
+
+    def test_hit_and_miss(self):
+        cache = LLMCache(db_path=None)
+        self.assertIsNone(cache.get("k"))
+        cache.set("k", "model", {"content": "回答"})
+        self.assertEqual(cache.get("k"), {"content": "回答"})
+        stats = cache.get_statistics()
+        self.assertEqual((stats["memory_hits"], stats["misses"], stats["stores"]), (1, 1, 1))
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_returned_response_is_a_copy(self):
+        cache = LLMCache(db_path=None)
+        cache.set("k", "model", {"content": "回答"})
+        cache.get("k")["content"] = "被修改"
+        self.assertEqual(cache.get("k"), {"content": "回答"})
+
+    def test_lru_eviction(self):
+        cache = LLMCache(db_path=None, max_memory_entries=2)
+        cache.set("a", "model", {"content": "a"})
+        cache.set("b", "model", {"content": "b"})
+        cache.get("a")
+        cache.set("c", "model", {"content": "c"})
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertEqual(cache.get_statistics()["evictions"], 1)
+
+    def test_ttl(self):
+        cache = LLMCache(db_path=None, ttl=0.05)
+        cache.set("k", "model", {"content": "回答"})
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("k"))
+
+
+class DiskCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, "cache", "llm_cache.sqlite")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_persists_across_instances(self):
+        LLMCache(db_path=self.db_path).set("k", "model", {"content": "回答"})
+        cache = LLMCache(db_path=self.db_path)
+        self.assertEqual(cache.get("k"), {"content": "回答"})
+        # 磁盘命中后提升到内存
+        cache.get("k")
+        stats = cache.get_statistics()
+        self.assertEqual((stats["disk_hits"], stats["memory_hits"]), (1, 1))
+
+    def test_disk_size_limit(self):
+        content = "x" * 1000
+        cache = LLMCache(db_path=self.db_path, max_memory_entries=1, max_disk_bytes=2500)
+        for key in ("a", "b", "c"):
+            cache.set(key, "model", {"content": content})
+            time.sleep(0.01)
+        fresh = LLMCache(db_path=self.db_path)
+        self.assertIsNone(fresh.get("a"))
+        self.assertIsNotNone(fresh.get("c"))
+
+    def test_connections_are_closed(self):
+        connections = []
+        connect = sqlite3.connect
+
+        def tracking_connect(*args, **kwargs):
+            connections.append(connect(*args, **kwargs))
+            return connections[-1]
+
+        with mock.patch.object(llm_cache.sqlite3, "connect", tracking_connect):
+            cache = LLMCache(db_path=self.db_path, max_memory_entries=1)
+            cache.set("k", "model", {"content": "回答"})
+            cache.set("other", "model", {"content": "回答"})
+            self.assertEqual(cache.get("k"), {"content": "回答"})
+        self.assertGreaterEqual(len(connections), 3)
+        for conn in connections:
+            # 已关闭的连接不能再执行语句
+            with self.assertRaises(sqlite3.ProgrammingError):
+                conn.execute("SELECT 1")
+
+    def test_clear(self):
+        cache = LLMCache(db_path=self.db_path)
+        cache.set("k", "model", {"content": "回答"})
+        cache.clear()
+        self.assertIsNone(cache.get("k"))
+        self.assertIsNone(LLMCache(db_path=self.db_path).get("k"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,233 @@
+"""
+测试日志模块：按前缀采样、队列满时丢弃并计数、标签附加与 JSON 格式、正文日志开关，以及日志配置和关闭
+
+用法:
+    python -m unittest deep_research.test_logger
+"""
+
+import os
+import json
+import time
+import queue
+import logging
+import tempfile
+import unittest
+import subprocess
+from unittest import mock
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLMapi_service import logger as logger_module
+from LLMapi_service.logger import (
+    SamplingFilter, TagFilter, JsonFormatter, NonBlockingQueueHandler, ROOT_LOGGERS, PAYLOAD_MAX_CHARS,
+    configure_logging, shutdown_logging, dropped_records, payload_logging_enabled, log_payload, get_logger
+)
+from LLMapi_service.metrics import metric_tags
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_record(name="deep_research.test", level=logging.INFO, msg="消息", exc_info=None):
+    return logging.LogRecord(name, level, __file__, 1, msg, None, exc_info)
+
+
+class ListHandler(logging.Handler):
+    """把日志记录收集到列表中"""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class SamplingFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.filter = SamplingFilter({
+            "deep_research.progress": 0.1,
+            "deep_research": 0.5,
+            "llmapi.muted": 0,
+            "llmapi.full": 1,
+        })
+
+    def kept(self, name, count=100, level=logging.INFO):
+        return sum(self.filter.filter(make_record(name, level)) for _ in range(count))
+
+    def test_rates_respected(self):
+        self.assertEqual(self.kept("deep_research.progress"), 10)
+        # 较长的前缀优先，子日志器与前缀共用计数
+        self.assertEqual(self.kept("deep_research.progress.node"), 10)
+        self.assertEqual(self.kept("deep_research.agent"), 50)
+        self.assertEqual(self.kept("llmapi.muted"), 0)
+        self.assertEqual(self.kept("llmapi.full"), 100)
+        self.assertEqual(self.kept("llmapi.other"), 100)
+
+    def test_prefix_matches_whole_segments(self):
+        # deep_research.progressive 不属于 deep_research.progress，按 deep_research 的比例采样
+        self.assertEqual(self.kept("deep_research.progressive"), 50)
+
+    def test_warnings_never_sampled(self):
+        self.assertEqual(self.kept("llmapi.muted", level=logging.WARNING), 100)
+        self.assertEqual(self.kept("deep_research.progress", level=logging.ERROR), 100)
+
+
+class NonBlockingQueueHandlerTest(unittest.TestCase):
+
+    def test_full_queue_drops_without_blocking(self):
+        handler = NonBlockingQueueHandler(queue.Queue(2))
+        started = time.monotonic()
+        for i in range(5):
+            handler.handle(make_record(msg=f"第{i}条"))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(handler.queue.qsize(), 2)
+        self.assertEqual(handler.dropped, 3)
+        # 保留的是先到的记录
+        self.assertEqual(handler.queue.get_nowait().getMessage(), "第0条")
+
+        with mock.patch.object(logger_module, "_handler", handler):
+            self.assertEqual(dropped_records(), 3)
+        with mock.patch.object(logger_module, "_handler", None):
+            self.assertEqual(dropped_records(), 0)
+
+
+class FormatTest(unittest.TestCase):
+
+    def test_tag_filter(self):
+        record = make_record()
+        with metric_tags(task_id="t1", phase="report"):
+            self.assertTrue(TagFilter().filter(record))
+        self.assertEqual(record.tags, " [task_id=t1 phase=report]")
+        self.assertEqual(record.tag_values, {"task_id": "t1", "phase": "report"})
+
+        record = make_record()
+        TagFilter().filter(record)
+        self.assertEqual((record.tags, record.tag_values), ("", {}))
+
+    def test_json_formatter(self):
+        try:
+            raise ValueError("出错了")
+        except ValueError:
+            record = make_record(level=logging.ERROR, msg="失败", exc_info=sys.exc_info())
+        with metric_tags(task_id="t1", node_id="root_1"):
+            TagFilter().filter(record)
+
+        data = json.loads(JsonFormatter().format(record))
+        self.assertEqual(data["level"], "ERROR")
+        self.assertEqual(data["logger"], "deep_research.test")
+        self.assertEqual(data["message"], "失败")
+        self.assertEqual((data["task_id"], data["node_id"]), ("t1", "root_1"))
+        self.assertIn("ValueError: 出错了", data["exception"])
+        self.assertIn("time", data)
+
+
+class PayloadLoggingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger("llmapi.test_payload")
+        self.handler = ListHandler()
+        self.logger.addHandler(self.handler)
+        self.logger.setLevel(logging.DEBUG)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+
+    def test_disabled_skips_serialization(self):
+        class Unserializable:
+            def __str__(self):
+                raise AssertionError("未开启正文日志时不应序列化")
+
+        with mock.patch.object(logger_module, "_payloads_enabled", False):
+            self.assertFalse(payload_logging_enabled(self.logger))
+            log_payload(self.logger, "响应", {"body": Unserializable()})
+        self.assertEqual(self.handler.records, [])
+
+    def test_enabled_requires_debug_level(self):
+        with mock.patch.object(logger_module, "_payloads_enabled", True):
+            self.logger.setLevel(logging.INFO)
+            log_payload(self.logger, "响应", {"content": "你好"})
+            self.assertEqual(self.handler.records, [])
+
+            self.logger.setLevel(logging.DEBUG)
+            log_payload(self.logger, "响应", {"content": "你好"})
+            log_payload(self.logger, "请求", "x" * (PAYLOAD_MAX_CHARS + 10))
+
+        messages = [record.getMessage() for record in self.handler.records]
+        self.assertEqual(messages[0], '响应: {"content": "你好"}')
+        self.assertTrue(messages[1].endswith(f"…（共 {PAYLOAD_MAX_CHARS + 10} 字符）"))
+        self.assertEqual(self.handler.records[1].levelno, logging.DEBUG)
+
+    def test_env_variable(self):
+        # LOG_PAYLOADS 在导入时读取，在子进程中分别验证设置与未设置的情况
+        script = (
+            "from LLMapi_service.logger import configure_logging, shutdown_logging, get_logger, log_payload\n"
+            "configure_logging(level='DEBUG')\n"
+            "log_payload(get_logger('llmapi.env_test'), '响应', {'content': 'payload-marker'})\n"
+            "shutdown_logging()\n"
+        )
+
+        def run(value):
+            env = {key: val for key, val in os.environ.items() if key != "LOG_PAYLOADS"}
+            if value is not None:
+                env["LOG_PAYLOADS"] = value
+            result = subprocess.run(
+                [sys.executable, "-c", script], cwd=ROOT, env=env, capture_output=True, text=True, timeout=60
+            )
+            self.assertEqual(result.returncode, 0, result.stderr)
+            return result.stdout
+
+        self.assertIn("payload-marker", run("1"))
+        self.assertNotIn("payload-marker", run(None))
+        self.assertNotIn("payload-marker", run("0"))
+
+
+class ConfigureLoggingTest(unittest.TestCase):
+
+    def setUp(self):
+        roots = [logging.getLogger(name) for name in ROOT_LOGGERS]
+        saved = [(root, root.handlers, root.level, root.propagate) for root in roots]
+
+        def restore():
+            shutdown_logging()
+            for root, handlers, level, propagate in saved:
+                root.handlers, root.propagate = handlers, propagate
+                root.setLevel(level)
+
+        self.addCleanup(restore)
+
+    def test_configure_and_shutdown(self):
+        with tempfile.TemporaryDirectory() as directory:
+            log_file = os.path.join(directory, "logs", "run.log")
+            with mock.patch("sys.stdout"):
+                configure_logging(level="DEBUG", log_file=log_file, json_format=True,
+                                  sample_rates={"deep_research.noisy": 0}, force=True)
+                handler = logger_module._handler
+                for name in ROOT_LOGGERS:
+                    root = logging.getLogger(name)
+                    self.assertEqual(root.handlers, [handler])
+                    self.assertEqual(root.level, logging.DEBUG)
+                    self.assertFalse(root.propagate)
+
+                # 已配置时重复调用不做任何事
+                configure_logging(level="INFO")
+                self.assertIs(logger_module._handler, handler)
+                self.assertEqual(logging.getLogger("llmapi").level, logging.DEBUG)
+
+                with metric_tags(task_id="t9"):
+                    get_logger("deep_research.agent").debug("写入文件")
+                get_logger("deep_research.noisy").info("被采样丢弃")
+                get_logger("llmapi.gptservice").warning("警告")
+                # 关闭时写出队列中剩余的日志
+                shutdown_logging()
+                self.assertIsNone(logger_module._handler)
+                self.assertEqual(dropped_records(), 0)
+
+            with open(log_file, "r", encoding="utf-8") as f:
+                lines = [json.loads(line) for line in f]
+
+        self.assertEqual([line["message"] for line in lines], ["写入文件", "警告"])
+        self.assertEqual(lines[0]["task_id"], "t9")
+        self.assertEqual(lines[1]["logger"], "llmapi.gptservice")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+测试报告 Markdown 渲染：表格、列表、HTML 转义、链接协议过滤，以及未闭合标记很多时的耗时
+
+用法:
+    python -m unittest deep_research.test_markdown_renderer
+"""
+
+import os
+import time
+import unittest
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deep_research.markdown_renderer import render_markdown, render_inline
+
+
+class InlineTest(unittest.TestCase):
+
+    def test_formats(self):
+        self.assertEqual(
+            render_inline("**粗体** *斜体* `a*b*`"),
+            "<strong>粗体</strong> <em>斜体</em> <code>a*b*</code>"
+        )
+
+    def test_link_and_citation(self):
+        self.assertEqual(
+            render_inline("[论文](https://example.com/a) 见[1, 2]"),
+            '<a href="https://example.com/a">论文</a> 见<sup class="citation">'
+            '[<a href="#ref-1">1</a>, <a href="#ref-2">2</a>]</sup>'
+        )
+
+    def test_nested_bracket_before_link(self):
+        self.assertEqual(render_inline("[[a](http://b)"), '[<a href="http://b">a</a>')
+
+    def test_html_is_escaped(self):
+        html = render_inline('<script>alert("x")</script> & <b>')
+        self.assertNotIn("<script>", html)
+        self.assertNotIn("<b>", html)
+        self.assertIn("&lt;script&gt;", html)
+        self.assertIn("&amp;", html)
+
+    def test_unsafe_link_is_not_rendered(self):
+        html = render_inline("[点击](javascript:alert(1))")
+        self.assertNotIn("<a", html)
+        self.assertNotIn('href="javascript', html)
+
+    def test_link_url_cannot_break_attribute(self):
+        html = render_inline('[x](http://a.com/"onmouseover=alert(1))')
+        self.assertNotIn('"onmouseover', html)
+
+    def test_unclosed_marks_are_linear(self):
+        # 每个未闭合的标记若都重新扫描到行尾，20000 个标记需要数秒
+        for text in ("[a " * 20000, "*a " * 20000, "[1 " * 20000, "[a](b " * 10000):
+            start = time.perf_counter()
+            html = render_inline(text)
+            self.assertLess(time.perf_counter() - start, 0.5, text[:6])
+            self.assertEqual(len(html), len(text))
+
+
+class BlockTest(unittest.TestCase):
+
+    def test_table_alignment(self):
+        html = render_markdown("| 指标 | 数值 | 说明 |\n|:---|---:|:---:|\n| a | 1 | **x** |")
+        self.assertIn('<th style="text-align: left">指标</th>', html)
+        self.assertIn('<td style="text-align: right">1</td>', html)
+        self.assertIn('<td style="text-align: center"><strong>x</strong></td>', html)
+
+    def test_table_short_separator(self):
+        html = render_markdown("|a|b|\n|---|:-:|\n|1|2|")
+        self.assertIn("<table>", html)
+        self.assertIn('<th style="text-align: center">b</th>', html)
+        self.assertIn("<td>1</td>", html)
+
+    def test_table_escaped_pipe(self):
+        html = render_markdown("| a | b |\n|-|-|\n| x \\| y | z |")
+        self.assertIn("<td>x | y</td>", html)
+
+    def test_lists(self):
+        html = render_markdown("- 一\n  - 一.一\n- 二\n\n3. 三\n4. 四")
+        self.assertEqual(
+            html,
+            "<ul>\n<li>一\n<ul>\n<li>一.一</li>\n</ul>\n</li>\n<li>二</li>\n</ul>\n"
+            '<ol start="3">\n<li>三</li>\n<li>四</li>\n</ol>\n'
+        )
+
+    def test_heading_offset(self):
+        self.assertEqual(render_markdown("# 标题", heading_offset=2), "<h3>标题</h3>\n")
+
+    def test_code_block_is_escaped(self):
+        html = render_markdown("```html\n<b>**x**</b>\n```")
+        self.assertEqual(html, '<pre><code class="language-html">&lt;b&gt;**x**&lt;/b&gt;</code></pre>\n')
+
+    def test_blockquote_ends_at_new_block(self):
+        html = render_markdown("> 引用\n续行\n- 列表")
+        self.assertEqual(html, "<blockquote>\n<p>引用<br>\n续行</p>\n</blockquote>\n<ul>\n<li>列表</li>\n</ul>\n")
+
+    def test_references(self):
+        html = render_markdown("[1] 第一篇\n[2] 第二篇")
+        self.assertIn('<p class="reference" id="ref-1">[1] 第一篇</p>', html)
+        self.assertIn('<p class="reference" id="ref-2">[2] 第二篇</p>', html)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+"""
+测试 LLM 调用指标：标签的嵌套与传递、按任务/阶段/模型汇总、费用计算，以及 Prometheus 文本导出
+
+用法:
+    python -m unittest deep_research.test_metrics
+"""
+
+import os
+import asyncio
+import unittest
+from unittest import mock
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLMapi_service import metrics as metrics_module
+from LLMapi_service.metrics import MetricsRegistry, metric_tags, set_metric_tags, current_tags, call_cost
+
+PRICES = {"deepseek-chat": (1.0, 2.0)}
+
+
+@mock.patch.dict(metrics_module.MODEL_PRICES, PRICES)
+class MetricsRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_tags_nest_and_restore(self):
+        with metric_tags(task_id="t1", phase="planning"):
+            with metric_tags(phase="report", node_id=None):
+                self.assertEqual(current_tags(), {"task_id": "t1", "phase": "report"})
+            self.assertEqual(current_tags(), {"task_id": "t1", "phase": "planning"})
+        self.assertEqual(current_tags(), {})
+
+    def test_tags_follow_asyncio_tasks(self):
+        async def child():
+            with metric_tags(phase="search"):
+                return current_tags()
+
+        async def run():
+            set_metric_tags(task_id="t2")
+            return await asyncio.gather(child(), asyncio.to_thread(current_tags))
+
+        self.assertEqual(asyncio.run(run()), [{"task_id": "t2", "phase": "search"}, {"task_id": "t2"}])
+        self.assertEqual(current_tags(), {})
+
+    def test_call_cost(self):
+        self.assertAlmostEqual(call_cost("deepseek-chat", 1_000_000, 500_000), 2.0)
+        self.assertIsNone(call_cost("unknown-model", 100, 100))
+
+    def test_task_summary(self):
+        with metric_tags(task_id="t1", phase="planning"):
+            self.registry.record("deepseek-chat", prompt_tokens=1000, completion_tokens=500, latency=1.5)
+            # 降级时按实际提供结果的模型统计
+            self.registry.record("gemini-2.0-flash", served_model="deepseek-chat", prompt_tokens=100, latency=0.5)
+        with metric_tags(task_id="t1", phase="report"):
+            self.registry.record("deepseek-chat", prompt_tokens=1000, completion_tokens=500, cache="hit")
+            self.registry.record("gemini-2.0-flash", latency=3.0, status="LLMServerError")
+        self.registry.record("deepseek-chat", prompt_tokens=7)
+
+        summary = self.registry.task_summary("t1")
+        total = summary["total"]
+        self.assertEqual((total["calls"], total["errors"], total["cache_hits"]), (4, 1, 1))
+        self.assertEqual((total["prompt_tokens"], total["completion_tokens"]), (2100, 1000))
+        self.assertAlmostEqual(total["latency"], 5.0)
+        # 缓存命中不计费用
+        self.assertAlmostEqual(total["cost_usd"], (1000 * 1 + 500 * 2 + 100 * 1) / 1_000_000)
+        self.assertEqual(summary["by_phase"]["planning"]["calls"], 2)
+        self.assertEqual(summary["by_model"]["deepseek-chat"]["calls"], 3)
+        self.assertEqual(summary["by_model"]["gemini-2.0-flash"]["errors"], 1)
+
+        # 返回的是副本
+        summary["total"]["calls"] = 0
+        self.assertEqual(self.registry.task_summary("t1")["total"]["calls"], 4)
+        self.registry.forget_task("t1")
+        self.assertIsNone(self.registry.task_summary("t1"))
+        self.assertEqual(len(self.registry.recent), 5)
+
+    def test_render_prometheus(self):
+        with metric_tags(phase="report"):
+            self.registry.record("deepseek-chat", provider="deepseek", key_index=1,
+                                 prompt_tokens=10, completion_tokens=20, latency=1.5)
+            self.registry.record("deepseek-chat", provider="deepseek", key_index=1, latency=100.0)
+            self.registry.record("deepseek-chat", latency=0.0, cache="hit")
+
+        lines = self.registry.render_prometheus().splitlines()
+        self.assertIn("# TYPE llm_calls_total counter", lines)
+        self.assertIn('llm_calls_total{model="deepseek-chat",phase="report",cache="miss",status="ok"} 2', lines)
+        self.assertIn('llm_calls_total{model="deepseek-chat",phase="report",cache="hit",status="ok"} 1', lines)
+        self.assertIn('llm_prompt_tokens_total{model="deepseek-chat",phase="report"} 10', lines)
+        self.assertIn('llm_completion_tokens_total{model="deepseek-chat",phase="report"} 20', lines)
+        self.assertIn('llm_cost_usd_total{model="deepseek-chat",phase="report"} 5e-05', lines)
+        # 直方图分桶是累积的，缓存命中不计入耗时
+        self.assertIn('llm_call_latency_seconds_bucket{model="deepseek-chat",phase="report",le="1"} 0', lines)
+        self.assertIn('llm_call_latency_seconds_bucket{model="deepseek-chat",phase="report",le="2"} 1', lines)
+        self.assertIn('llm_call_latency_seconds_bucket{model="deepseek-chat",phase="report",le="160"} 2', lines)
+        self.assertIn('llm_call_latency_seconds_bucket{model="deepseek-chat",phase="report",le="+Inf"} 2', lines)
+        self.assertIn('llm_call_latency_seconds_sum{model="deepseek-chat",phase="report"} 101.5', lines)
+        self.assertIn('llm_call_latency_seconds_count{model="deepseek-chat",phase="report"} 2', lines)
+        self.assertIn('llm_key_calls_total{provider="deepseek",key_index="1"} 2', lines)
+
+    def test_label_values_escaped(self):
+        with metric_tags(phase='say "hi"\\n'):
+            self.registry.record('model\\"x\ny')
+
+        lines = self.registry.render_prometheus().splitlines()
+        self.assertIn(
+            'llm_calls_total{model="model\\\\\\"x\\ny",phase="say \\"hi\\"\\\\n",cache="miss",status="ok"} 1',
+            lines
+        )
+
+    def test_render_empty(self):
+        output = MetricsRegistry().render_prometheus()
+        self.assertTrue(output.endswith("\n"))
+        self.assertNotIn("{", output)
+
+
+if __name__ == "__main__":
+    unittest.main()
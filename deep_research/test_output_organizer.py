@@ -0,0 +1,148 @@
+"""
+测试报告生成引擎：章节并发生成、每个章节使用选出的证据、失败章节的标记与写出，以及过渡句只加在生成成功的章节上
+LLM 调用替换为按提示内容返回结果的假函数，嵌入服务替换为抛出异常的函数，不发送任何网络请求
+
+用法:
+    python -m unittest deep_research.test_output_organizer
+"""
+
+import os
+import json
+import asyncio
+import tempfile
+import unittest
+from unittest import mock
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLMapi_service.resilience import LLMServerError
+from deep_research import evidence, output_organizer
+from deep_research.output_organizer import OutputOrganizer, SECTION_FAILED_NOTICE
+from deep_research.report_writer import ReportWriter, load_report, REPORT_MARKDOWN_FILE
+
+OUTLINE = {
+    "title": "报告",
+    "sections": [
+        {"id": "intro", "title": "引言", "content_requirement": "背景"},
+        {"id": "method", "title": "方法", "content_requirement": "方法",
+         "subsections": [{"id": "data", "title": "数据", "content_requirement": "数据来源"}]},
+        {"id": "conclusion", "title": "结论", "content_requirement": "总结"},
+    ]
+}
+
+RESEARCH_RESULTS = {
+    "task": "问题",
+    "is_complex": True,
+    "summary": "总体结论",
+    "subtasks": [{"id": "1", "description": "方法研究"}],
+    "results": {"1": {"solution": "方法研究的解答。"}},
+}
+
+
+def unavailable(model_name):
+    raise RuntimeError("嵌入模型不可用")
+
+
+class FakeLLM:
+    """按提示内容返回大纲、写作要点、章节内容和过渡句，记录章节调用的最大并发数"""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.active = 0
+        self.max_active = 0
+        self.section_calls = []
+        self.section_prompts = {}
+
+    async def __call__(self, messages, selected_model=None, use_cache=True, slot=None):
+        system, user = messages[0]["content"], messages[-1]["content"]
+        if user.startswith("研究问题："):
+            return {"content": json.dumps(OUTLINE, ensure_ascii=False)}
+        if "过渡句" in system:
+            return {"content": json.dumps({"2": "承上启下。", "3": "综上所述。"}, ensure_ascii=False)}
+        if "写作要点" in system and "当前章节" not in user:
+            return {"content": "{}"}
+        title = user.split("当前章节: ")[1].split("\n")[0]
+        self.section_calls.append(title)
+        self.section_prompts[title] = user
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            self.active -= 1
+        if title in self.failing:
+            raise LLMServerError("503 Service Unavailable")
+        return {"content": f"{title}的内容"}
+
+
+@mock.patch.object(evidence, "get_embedding_service", unavailable)
+class OutputOrganizerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.progress = []
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def organize(self, llm, **kwargs):
+        organizer = OutputOrganizer(
+            model="deepseek-chat",
+            progress_callback=lambda progress, message, detail: self.progress.append((progress, message, detail)),
+            **kwargs
+        )
+        with mock.patch.object(output_organizer, "GPT", llm):
+            return organizer, asyncio.run(organizer.organize("问题", RESEARCH_RESULTS))
+
+    def test_sections_generated_concurrently_in_outline_order(self):
+        llm = FakeLLM()
+        _, output = self.organize(llm, continuity_pass=False)
+
+        self.assertEqual(sorted(llm.section_calls), ["引言", "数据", "方法", "结论"])
+        # 全部章节和子章节同时生成，互不等待
+        self.assertEqual(llm.max_active, 4)
+        sections = output["content"]["sections"]
+        self.assertEqual([section["title"] for section in sections], ["引言", "方法", "结论"])
+        self.assertEqual(sections[1]["subsections"][0]["content"], "数据的内容")
+        self.assertEqual(output["failed_sections"], [])
+        self.assertEqual(self.progress[-1][0], 95)
+
+    def test_every_section_uses_selected_evidence(self):
+        llm = FakeLLM()
+        self.organize(llm, continuity_pass=False)
+
+        for title in ("引言", "方法", "数据", "结论"):
+            self.assertIn("相关研究结果（按相关度排序）:\n- [方法研究]", llm.section_prompts[title])
+        # 第一章和结论章另附总体结论
+        self.assertIn("研究结论: 总体结论", llm.section_prompts["引言"])
+        self.assertIn("研究结论: 总体结论", llm.section_prompts["结论"])
+        self.assertNotIn("研究结论:", llm.section_prompts["方法"])
+
+    def test_failed_section_is_marked_not_written_as_content(self):
+        llm = FakeLLM(failing={"方法"})
+        writer = ReportWriter(self.temp_dir.name)
+        organizer, output = self.organize(llm, report_writer=writer, continuity_pass=True)
+
+        method = output["content"]["sections"][1]
+        self.assertEqual(method["content"], "")
+        self.assertIn("503", method["error"])
+        self.assertEqual(output["failed_sections"], [{"id": "method", "title": "方法", "error": method["error"]}])
+        self.assertTrue(any("生成失败" in message for _, message, _ in self.progress))
+        # 过渡句不加在生成失败的章节上
+        self.assertEqual(output["content"]["sections"][2]["content"], "综上所述。\n\n结论的内容")
+
+        markdown = organizer.format_as_markdown(output["content"])
+        self.assertIn(f"## 方法\n\n> {SECTION_FAILED_NOTICE}", markdown)
+        self.assertNotIn("503", markdown)
+        self.assertIn('class="section-error"', organizer.format_as_html(output["content"]))
+
+        with open(os.path.join(self.temp_dir.name, REPORT_MARKDOWN_FILE), "r", encoding="utf-8") as f:
+            self.assertNotIn("503", f.read())
+        report = load_report(self.temp_dir.name)
+        self.assertEqual((report["completed"], report["failed"], report["status"]), (4, 1, "completed"))
+        self.assertIn("error", report["sections"][1])
+        self.assertNotIn("error", report["sections"][0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+"""
+测试研究节点的规划方式：投机分解在简单任务时被取消，合并调用的结果解析和出错时的退回
+
+用法:
+    python -m unittest deep_research.test_planning
+"""
+
+import os
+import json
+import asyncio
+import unittest
+from unittest import mock
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLMapi_service.resilience import LLMServerError
+from deep_research import agent
+from deep_research.agent import DeepResearchNode
+from deep_research.config import PLANNING_MODE
+
+SUBTASKS = [
+    {"id": "task1", "description": "背景", "requires": []},
+    {"id": "task2", "description": "现状", "requires": ["task1"]},
+]
+
+
+def make_node(planning_mode):
+    return DeepResearchNode(tools=[object()], node_id="root", planning_mode=planning_mode, max_recursion_depth=3)
+
+
+def fake_gpt(*replies):
+    """按顺序返回预设回复，异常则抛出；收到的提示记录在 prompts 中"""
+    replies = list(replies)
+    prompts = []
+
+    async def gpt(messages, selected_model=None, use_cache=True, slot=None):
+        prompts.append(messages[0]["content"])
+        reply = replies.pop(0)
+        if isinstance(reply, BaseException):
+            raise reply
+        return {"content": reply if isinstance(reply, str) else json.dumps(reply, ensure_ascii=False)}
+
+    gpt.prompts = prompts
+    return gpt
+
+
+class PlanningModeTest(unittest.TestCase):
+
+    def test_sequential_is_default(self):
+        self.assertEqual(PLANNING_MODE, "sequential")
+        self.assertEqual(DeepResearchNode(tools=[object()]).planning_mode, "sequential")
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            make_node("parallel")
+
+
+class SpeculativePlanTest(unittest.TestCase):
+
+    def run_plan(self, is_complex):
+        node = make_node("speculative")
+        state = {"cancelled": False}
+
+        async def assess(task, context):
+            await asyncio.sleep(0.01)
+            return {"is_complex": is_complex, "complexity_score": 0.9 if is_complex else 0.2}
+
+        async def decompose(task, context):
+            try:
+                await asyncio.sleep(0.05 if is_complex else 10)
+            except asyncio.CancelledError:
+                state["cancelled"] = True
+                raise
+            return SUBTASKS
+
+        node._assess_complexity = assess
+        node._decompose_task = decompose
+        result = asyncio.run(asyncio.wait_for(node._speculative_plan("任务", {}), timeout=2))
+        return result, state["cancelled"], node
+
+    def test_simple_task_cancels_decomposition(self):
+        (assessment, subtasks), cancelled, _ = self.run_plan(is_complex=False)
+        self.assertFalse(assessment["is_complex"])
+        self.assertIsNone(subtasks)
+        self.assertTrue(cancelled)
+
+    def test_complex_task_uses_decomposition(self):
+        (assessment, subtasks), cancelled, node = self.run_plan(is_complex=True)
+        self.assertTrue(assessment["is_complex"])
+        self.assertEqual(subtasks, SUBTASKS)
+        self.assertFalse(cancelled)
+        spans = {span.name: span for span in node.tracer.spans}
+        self.assertTrue(spans["decomposition"].attributes["speculative"])
+
+
+class MergedPlanTest(unittest.TestCase):
+
+    def plan(self, *replies):
+        node = make_node("merged")
+        gpt = fake_gpt(*replies)
+        with mock.patch.object(agent, "GPT", gpt):
+            return asyncio.run(node._assess_and_decompose("任务", {})), gpt.prompts
+
+    def test_complex_with_subtasks(self):
+        (assessment, subtasks), prompts = self.plan(
+            {"is_complex": True, "complexity_score": 0.8, "reasoning": "多方面", "subtasks": SUBTASKS}
+        )
+        self.assertTrue(assessment["is_complex"])
+        self.assertNotIn("subtasks", assessment)
+        self.assertEqual(subtasks, SUBTASKS)
+        self.assertEqual(len(prompts), 1)
+
+    def test_low_score_is_simple(self):
+        (assessment, subtasks), _ = self.plan({"is_complex": True, "complexity_score": 0.3, "subtasks": SUBTASKS})
+        self.assertFalse(assessment["is_complex"])
+        self.assertIsNone(subtasks)
+
+    def test_malformed_json_falls_back_to_assessment(self):
+        (assessment, subtasks), prompts = self.plan(
+            "这不是JSON",
+            {"is_complex": False, "complexity_score": 0.2, "reasoning": "简单"}
+        )
+        self.assertEqual(assessment["reasoning"], "简单")
+        self.assertIsNone(subtasks)
+        # 第二次调用是单独的复杂度评估
+        self.assertEqual(len(prompts), 2)
+        self.assertIn("任务复杂度评估专家", prompts[1])
+
+    def test_missing_field_falls_back_to_assessment(self):
+        (assessment, subtasks), prompts = self.plan(
+            {"subtasks": SUBTASKS},
+            {"is_complex": True, "complexity_score": 0.9}
+        )
+        self.assertTrue(assessment["is_complex"])
+        self.assertIsNone(subtasks)
+        self.assertEqual(len(prompts), 2)
+
+    def test_llm_error_falls_back_to_assessment(self):
+        (assessment, subtasks), prompts = self.plan(
+            LLMServerError("503"),
+            {"is_complex": False, "complexity_score": 0.1}
+        )
+        self.assertFalse(assessment["is_complex"])
+        self.assertEqual(len(prompts), 2)
+
+    def test_invalid_subtasks_left_for_separate_decomposition(self):
+        (assessment, subtasks), _ = self.plan({"is_complex": True, "complexity_score": 0.9, "subtasks": [{"id": "x"}]})
+        self.assertTrue(assessment["is_complex"])
+        self.assertIsNone(subtasks)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+"""
+测试任务进度总线：事件编号与断点续传、缓冲区溢出时的重置、心跳、
+task_info.json 的合并写入，以及 SSE 端点的消息格式
+
+用法:
+    python -m unittest deep_research.test_progress_bus
+"""
+
+import os
+import json
+import time
+import tempfile
+import unittest
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deep_research.progress_bus import ProgressBus, DebouncedWriter
+from deep_research import web_app
+from deep_research.web_app import format_sse
+
+
+class ProgressBusTest(unittest.TestCase):
+
+    def test_subscribe_resumes_after_last_id(self):
+        bus = ProgressBus()
+        for i in range(3):
+            bus.publish("t", "stream", {"i": i})
+        bus.close("t")
+
+        self.assertEqual(bus.latest_id("t"), 3)
+        self.assertEqual([event["id"] for event in bus.subscribe("t")], [1, 2, 3])
+        self.assertEqual([event["data"] for event in bus.subscribe("t", last_id=2)], [{"i": 2}])
+
+    def test_reset_when_events_evicted(self):
+        bus = ProgressBus(buffer_size=2)
+        for i in range(5):
+            bus.publish("t", "stream", {"i": i})
+        bus.close("t")
+
+        events = list(bus.subscribe("t", last_id=1))
+        self.assertEqual(events, [{"id": 5, "type": "reset", "data": {}}])
+
+    def test_keepalive_when_idle(self):
+        bus = ProgressBus()
+        subscription = bus.subscribe("t", keepalive=0.01)
+        self.assertIsNone(next(subscription))
+        bus.publish("t", "status", {"progress": 10})
+        self.assertEqual(next(subscription)["data"], {"progress": 10})
+        bus.close("t")
+        self.assertEqual(list(subscription), [])
+
+    def test_unknown_task(self):
+        self.assertEqual(ProgressBus().latest_id("missing"), 0)
+
+
+class DebouncedWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "task_info.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def read(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def test_writes_coalesced_within_interval(self):
+        writer = DebouncedWriter(self.path, interval=60)
+        writer.write({"progress": 1})
+        self.assertEqual(self.read(), {"progress": 1})
+
+        data = {"progress": 2}
+        writer.write(data)
+        # 写入时复制了数据，之后的修改不影响待写入内容
+        data["progress"] = 99
+        writer.write({"progress": 3})
+        self.assertEqual(self.read(), {"progress": 1})
+
+        writer.flush()
+        self.assertEqual(self.read(), {"progress": 3})
+        self.assertFalse(os.path.exists(f"{self.path}.tmp"))
+
+    def test_deferred_write_happens_after_interval(self):
+        writer = DebouncedWriter(self.path, interval=0.05)
+        writer.write({"progress": 1})
+        writer.write({"progress": 2})
+        time.sleep(0.2)
+        self.assertEqual(self.read(), {"progress": 2})
+
+
+class SSEFormatTest(unittest.TestCase):
+
+    def test_format_sse(self):
+        self.assertEqual(format_sse("status", {"message": "完成"}), 'event: status\ndata: {"message": "完成"}\n\n')
+        self.assertEqual(format_sse("stream", {"text": "a\nb"}, 7), 'id: 7\nevent: stream\ndata: {"text": "a\\nb"}\n\n')
+
+    def test_endpoint_replays_missed_events(self):
+        task_id = "test-progress-bus-task"
+        web_app.research_tasks[task_id] = {"status": "running", "progress": 50}
+        web_app.progress_bus.publish(task_id, "status", {"progress": 40})
+        web_app.progress_bus.publish(task_id, "stream", {"text": "片段"})
+        web_app.progress_bus.close(task_id)
+        try:
+            client = web_app.app.test_client()
+            response = client.get(f"/api/task_events/{task_id}", headers={"Last-Event-ID": "1"})
+            body = response.get_data(as_text=True)
+            fresh = client.get(f"/api/task_events/{task_id}").get_data(as_text=True)
+        finally:
+            del web_app.research_tasks[task_id]
+
+        self.assertEqual(response.mimetype, "text/event-stream")
+        self.assertEqual(body, 'id: 2\nevent: stream\ndata: {"text": "片段"}\n\n')
+        # 首次连接先收到完整状态，编号为当前最新事件
+        self.assertEqual(fresh, 'id: 2\nevent: status\ndata: {"status": "running", "progress": 50}\n\n')
+
+    def test_endpoint_unknown_task(self):
+        response = web_app.app.test_client().get("/api/task_events/no-such-task")
+        self.assertEqual(response.status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
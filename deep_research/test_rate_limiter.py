@@ -0,0 +1,138 @@
+"""
+测试 LLM 服务限流：令牌桶、AIMD 并发控制、密钥选择、429 冷却和流式请求的延迟判断
+
+用法:
+    python -m unittest deep_research.test_rate_limiter
+"""
+
+import os
+import time
+import asyncio
+import unittest
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLMapi_service.rate_limiter import (
+    TokenBucket, AdaptiveConcurrency, ProviderLimiter, LATENCY_TARGET, DEFAULT_CONCURRENCY, MAX_CONCURRENCY
+)
+
+
+class RateLimited(Exception):
+    status = 429
+    headers = {"Retry-After": "30"}
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_consume_and_refill(self):
+        bucket = TokenBucket(10, window=1.0)
+        self.assertEqual(bucket.time_until(5), 0.0)
+        bucket.consume(10)
+        self.assertGreater(bucket.time_until(5), 0.4)
+        time.sleep(0.2)
+        self.assertGreater(bucket.available(), 1.5)
+
+    def test_adjust_never_exceeds_capacity(self):
+        bucket = TokenBucket(10)
+        bucket.adjust(-100)
+        self.assertEqual(bucket.available(), 10)
+
+
+class AdaptiveConcurrencyTest(unittest.TestCase):
+
+    def test_aimd(self):
+        concurrency = AdaptiveConcurrency(initial=2, max_limit=4)
+        concurrency.on_success(1.0)
+        self.assertEqual(concurrency.limit, 2.5)
+        concurrency.on_success(LATENCY_TARGET + 1)
+        self.assertEqual(concurrency.limit, 2.0)
+        concurrency.on_rate_limited()
+        self.assertEqual(concurrency.limit, 1.0)
+        concurrency.on_rate_limited()
+        self.assertEqual(concurrency.allowed, 1)
+        for _ in range(100):
+            concurrency.on_success(1.0)
+        self.assertEqual(concurrency.limit, 4)
+
+
+class ProviderLimiterTest(unittest.TestCase):
+
+    def test_prefers_key_with_most_budget(self):
+        limiter = ProviderLimiter("test", ["key-a", "key-b"], rpm=10)
+        lease, _ = limiter._try_acquire(0)
+        limiter.release(lease)
+        second, _ = limiter._try_acquire(0)
+        self.assertNotEqual(second.key, lease.key)
+
+    def test_rate_limited_key_cools_down(self):
+        async def run():
+            limiter = ProviderLimiter("test", ["key-a", "key-b"])
+            with self.assertRaises(RateLimited):
+                async with limiter.lease() as lease:
+                    first = lease.key
+                    raise RateLimited()
+            # 冷却中的密钥不会被选中
+            for _ in range(3):
+                async with limiter.lease() as lease:
+                    self.assertNotEqual(lease.key, first)
+            return limiter.get_statistics()
+
+        stats = asyncio.run(run())
+        self.assertEqual(sum(key["rate_limited"] for key in stats["keys"]), 1)
+
+    def test_stream_latency_uses_first_chunk(self):
+        limiter = ProviderLimiter("test", ["key"])
+        state = limiter.keys[0]
+        before = state.concurrency.limit
+
+        # 长回复的流式请求：首包很快，总时长超过延迟阈值，不应被视为拥塞
+        lease, _ = limiter._try_acquire(0)
+        lease.started_at -= LATENCY_TARGET * 2
+        lease.first_chunk_at = lease.started_at + 1.0
+        limiter.release(lease)
+        self.assertGreater(state.concurrency.limit, before)
+
+        # 非流式请求按整个请求的耗时判断
+        limit = state.concurrency.limit
+        lease, _ = limiter._try_acquire(0)
+        lease.started_at -= LATENCY_TARGET * 2
+        limiter.release(lease)
+        self.assertLess(state.concurrency.limit, limit)
+
+    def test_initial_concurrency_split_across_keys(self):
+        # 单个密钥时从提供方的并发数开始，不会压低调用方放行的并发
+        limiter = ProviderLimiter("test", ["key"], concurrency=6)
+        self.assertEqual(limiter.keys[0].concurrency.limit, 6)
+        limiter = ProviderLimiter("test", ["key-a", "key-b", "key-c", "key-d"], concurrency=6)
+        self.assertEqual([state.concurrency.limit for state in limiter.keys], [2, 2, 2, 2])
+        self.assertEqual(ProviderLimiter("test", []).keys[0].concurrency.limit, DEFAULT_CONCURRENCY)
+        self.assertEqual(ProviderLimiter("test", ["key"], concurrency=100).keys[0].concurrency.limit, MAX_CONCURRENCY)
+
+    def test_single_key_admits_configured_concurrency(self):
+        async def run():
+            limiter = ProviderLimiter("test", ["key"], concurrency=6)
+            peak = 0
+
+            async def call():
+                nonlocal peak
+                async with limiter.lease():
+                    peak = max(peak, limiter.keys[0].in_flight)
+                    await asyncio.sleep(0.05)
+
+            await asyncio.gather(*(call() for _ in range(6)))
+            return peak
+
+        self.assertEqual(asyncio.run(run()), 6)
+
+    def test_record_first_chunk_keeps_first(self):
+        limiter = ProviderLimiter("test", ["key"])
+        lease, _ = limiter._try_acquire(0)
+        lease.record_first_chunk()
+        first = lease.first_chunk_at
+        time.sleep(0.01)
+        lease.record_first_chunk()
+        self.assertEqual(lease.first_chunk_at, first)
+
+
+if __name__ == "__main__":
+    unittest.main()
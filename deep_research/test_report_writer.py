@@ -0,0 +1,145 @@
+"""
+测试报告增量写入：章节乱序完成时按大纲顺序写出，生成中止后可以从索引和章节记录读取部分报告
+
+用法:
+    python -m unittest deep_research.test_report_writer
+"""
+
+import os
+import json
+import tempfile
+import unittest
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deep_research.report_writer import (
+    ReportWriter, load_report, section_level,
+    REPORT_MARKDOWN_FILE, REPORT_HTML_FILE, REPORT_CONTENT_FILE, REPORT_SECTIONS_FILE
+)
+
+
+class StubFormatter:
+    """只输出章节标题的格式化器，便于检查写出顺序"""
+
+    @staticmethod
+    def markdown_header(title):
+        return f"# {title}\n"
+
+    @staticmethod
+    def html_header(title):
+        return f"<h1>{title}</h1>\n"
+
+    @staticmethod
+    def html_footer():
+        return "<end>\n"
+
+    @staticmethod
+    def format_section_markdown(section, level):
+        return f"{'#' * level} {section['title']}\n"
+
+    @staticmethod
+    def iter_section_html(section, level):
+        yield f"<h{level}>{section['title']}</h{level}>\n"
+
+    def format_as_markdown(self, content):
+        return self.markdown_header(content["title"]) + "".join(
+            self.format_section_markdown(section, 2) for section in content["sections"]
+        )
+
+    def iter_html(self, content):
+        yield self.html_header(content["title"])
+        for section in content["sections"]:
+            yield from self.iter_section_html(section, 2)
+        yield self.html_footer()
+
+
+SECTIONS = [
+    ("1", {"id": "intro", "title": "引言"}),
+    ("1.1", {"id": "background", "title": "背景"}),
+    ("2", {"id": "method", "title": "方法"}),
+    ("3", {"id": "summary", "title": "总结"}),
+]
+
+
+def section(number):
+    data = dict(dict(SECTIONS)[number])
+    data["content"] = f"{data['title']}的内容"
+    return data
+
+
+class ReportWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.output_dir = self.temp_dir.name
+        self.writer = ReportWriter(self.output_dir)
+        self.writer.start(StubFormatter(), "报告", SECTIONS)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def read(self, filename):
+        with open(os.path.join(self.output_dir, filename), "r", encoding="utf-8") as f:
+            return f.read()
+
+    def test_section_level(self):
+        self.assertEqual(section_level("1"), 2)
+        self.assertEqual(section_level("2.3.1"), 4)
+
+    def test_sections_flushed_in_outline_order(self):
+        self.writer.add_section("2", section("2"))
+        # 第 1 章尚未完成，后面的章节暂不写出
+        self.assertEqual(self.read(REPORT_MARKDOWN_FILE), "# 报告\n")
+
+        self.writer.add_section("1", section("1"))
+        self.assertEqual(self.read(REPORT_MARKDOWN_FILE), "# 报告\n## 引言\n")
+
+        self.writer.add_section("1.1", section("1.1"))
+        self.assertEqual(self.read(REPORT_MARKDOWN_FILE), "# 报告\n## 引言\n### 背景\n## 方法\n")
+        self.assertEqual(self.read(REPORT_HTML_FILE), "<h1>报告</h1>\n<h2>引言</h2>\n<h3>背景</h3>\n<h2>方法</h2>\n")
+
+    def test_unknown_section_is_ignored(self):
+        self.writer.add_section("9", {"id": "x", "title": "不在大纲中"})
+        self.assertEqual(self.read(REPORT_SECTIONS_FILE), "")
+
+    def test_finish(self):
+        for number, _ in SECTIONS:
+            self.writer.add_section(number, section(number))
+        content = {"title": "报告", "sections": [section("1"), section("2"), section("3")]}
+        self.writer.finish(content)
+
+        self.assertTrue(self.read(REPORT_HTML_FILE).endswith("<end>\n"))
+        self.assertEqual(json.loads(self.read(REPORT_CONTENT_FILE)), content)
+        report = load_report(self.output_dir)
+        self.assertEqual(report["status"], "completed")
+        self.assertEqual(report["completed"], report["total"])
+
+    def test_load_partial_report_after_failure(self):
+        self.writer.add_section("1.1", section("1.1"))
+        self.writer.add_section("3", section("3"))
+        self.writer.fail("模型调用失败")
+        # 模拟进程中断时写了一半的最后一行
+        with open(os.path.join(self.output_dir, REPORT_SECTIONS_FILE), "a", encoding="utf-8") as f:
+            f.write('{"number": "2", "cont')
+
+        report = load_report(self.output_dir)
+        self.assertEqual(report["status"], "failed")
+        self.assertEqual(report["report_error"], "模型调用失败")
+        self.assertEqual((report["completed"], report["total"]), (2, 4))
+
+        intro, method, summary = report["sections"]
+        self.assertTrue(intro["pending"])
+        self.assertEqual(intro["content"], "")
+        background = intro["subsections"][0]
+        self.assertEqual(background["content"], "背景的内容")
+        self.assertNotIn("pending", background)
+        self.assertTrue(method["pending"])
+        self.assertEqual(summary["content"], "总结的内容")
+
+    def test_load_without_index(self):
+        with tempfile.TemporaryDirectory() as empty_dir:
+            self.assertIsNone(load_report(empty_dir))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+"""
+测试 LLM 容错：错误分类、退避重试、对冲请求、降级链，以及请求错误不降级
+调用替换为按模型返回预设结果的假函数，不发送任何网络请求
+
+用法:
+    python -m unittest deep_research.test_resilience
+"""
+
+import os
+import asyncio
+import unittest
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiohttp
+
+from LLMapi_service import resilience
+from LLMapi_service.resilience import (
+    LLMError, LLMRateLimitError, LLMServerError, LLMTimeoutError, LLMRequestError,
+    LLMFallbackExhaustedError, classify_error, configure_resilience,
+    call_with_resilience, stream_with_resilience
+)
+
+PRIMARY = "gemini-2.0-flash"
+FALLBACK = "deepseek-chat"
+
+
+def fake_call(outcomes):
+    """返回调用函数：按模型依次取出预设结果，异常则抛出；调用记录在 calls 中"""
+    calls = []
+
+    async def call(model):
+        calls.append(model)
+        outcome = outcomes[model].pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        if isinstance(outcome, (int, float)):
+            await asyncio.sleep(outcome)
+            return {"content": f"{model} after {outcome}"}
+        return {"content": outcome}
+
+    call.calls = calls
+    return call
+
+
+def fake_stream(outcomes):
+    """返回流式调用函数：预设结果为增量列表或异常"""
+    calls = []
+
+    async def open_stream(model):
+        calls.append(model)
+        outcome = outcomes[model].pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        for text in outcome:
+            yield {"content": text, "reasoning_content": ""}
+
+    open_stream.calls = calls
+    return open_stream
+
+
+async def collect(stream):
+    return [delta async for delta in stream]
+
+
+class ClassifyErrorTest(unittest.TestCase):
+
+    def response_error(self, status, headers=None):
+        return aiohttp.ClientResponseError(None, (), status=status, message="error", headers=headers)
+
+    def test_http_status(self):
+        error = classify_error(self.response_error(429, {"Retry-After": "7"}), PRIMARY)
+        self.assertIsInstance(error, LLMRateLimitError)
+        self.assertEqual(error.retry_after, 7.0)
+        self.assertIsInstance(classify_error(self.response_error(503), PRIMARY), LLMServerError)
+        self.assertIsInstance(classify_error(self.response_error(401), PRIMARY), LLMRequestError)
+        self.assertFalse(classify_error(self.response_error(400), PRIMARY).retryable)
+
+    def test_timeout_and_passthrough(self):
+        self.assertIsInstance(classify_error(asyncio.TimeoutError(), PRIMARY), LLMTimeoutError)
+        error = LLMRequestError("bad")
+        self.assertIs(classify_error(error, PRIMARY), error)
+        self.assertEqual(error.model, PRIMARY)
+
+
+class ResilienceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = resilience.policy
+        configure_resilience(base_delay=0, max_delay=0, fallback_chains={PRIMARY: [FALLBACK]})
+
+    def tearDown(self):
+        resilience.policy = self.policy
+
+    def test_retries_then_succeeds(self):
+        call = fake_call({PRIMARY: [LLMServerError("503"), asyncio.TimeoutError(), "ok"]})
+        response = asyncio.run(call_with_resilience(call, PRIMARY))
+        self.assertEqual(response, {"content": "ok", "model": PRIMARY})
+        self.assertEqual(call.calls, [PRIMARY] * 3)
+
+    def test_falls_back_after_retryable_errors(self):
+        call = fake_call({PRIMARY: [LLMRateLimitError("429")] * 3, FALLBACK: ["fallback"]})
+        response = asyncio.run(call_with_resilience(call, PRIMARY))
+        self.assertEqual(response["model"], FALLBACK)
+        self.assertEqual(call.calls, [PRIMARY] * 3 + [FALLBACK])
+
+    def test_request_error_is_not_retried_or_fallen_back(self):
+        call = fake_call({PRIMARY: [LLMRequestError("401 invalid key", status=401)], FALLBACK: ["fallback"]})
+        with self.assertRaises(LLMRequestError):
+            asyncio.run(call_with_resilience(call, PRIMARY))
+        self.assertEqual(call.calls, [PRIMARY])
+
+    def test_all_models_fail(self):
+        call = fake_call({PRIMARY: [LLMServerError("500")] * 3, FALLBACK: [LLMServerError("502")] * 3})
+        with self.assertRaises(LLMFallbackExhaustedError) as raised:
+            asyncio.run(call_with_resilience(call, PRIMARY))
+        self.assertEqual([error.model for error in raised.exception.errors], [PRIMARY, FALLBACK])
+
+    def test_empty_response_is_retried(self):
+        call = fake_call({PRIMARY: ["", "ok"]})
+        self.assertEqual(asyncio.run(call_with_resilience(call, PRIMARY))["content"], "ok")
+
+    def test_backoff_honours_retry_after(self):
+        policy = configure_resilience(base_delay=1.0, max_delay=30.0)
+        self.assertGreaterEqual(policy.backoff(0, LLMRateLimitError("429", retry_after=5)), 5)
+        self.assertLessEqual(policy.backoff(10, LLMServerError("500")), 30.0)
+        self.assertLessEqual(policy.backoff(0, LLMRateLimitError("429", retry_after=100)), 30.0)
+
+    def test_hedge_returns_first_result_and_cancels_the_other(self):
+        policy = configure_resilience(hedge_enabled=True, hedge_min_samples=1)
+        policy.latency.record(PRIMARY, 0.01)
+        call = fake_call({PRIMARY: [1.0, 0.0]})
+
+        async def run():
+            response = await call_with_resilience(call, PRIMARY)
+            # 被取消的首个请求不会再记录延迟样本
+            await asyncio.sleep(0)
+            return response
+
+        response = asyncio.run(asyncio.wait_for(run(), timeout=0.5))
+        self.assertEqual(response["content"], f"{PRIMARY} after 0.0")
+        self.assertEqual(call.calls, [PRIMARY, PRIMARY])
+        self.assertEqual(policy.latency.percentile(PRIMARY, 1.0, 3), None)
+
+    def test_stream_falls_back_before_first_delta(self):
+        open_stream = fake_stream({PRIMARY: [LLMServerError("500")] * 3, FALLBACK: [["a", "b"]]})
+        deltas = asyncio.run(collect(stream_with_resilience(open_stream, PRIMARY)))
+        self.assertEqual([delta["content"] for delta in deltas], ["a", "b"])
+        self.assertEqual({delta["model"] for delta in deltas}, {FALLBACK})
+
+    def test_stream_request_error_is_raised(self):
+        open_stream = fake_stream({PRIMARY: [LLMRequestError("403", status=403)], FALLBACK: [["a"]]})
+        with self.assertRaises(LLMRequestError):
+            asyncio.run(collect(stream_with_resilience(open_stream, PRIMARY)))
+        self.assertEqual(open_stream.calls, [PRIMARY])
+
+    def test_stream_error_after_output_is_not_retried(self):
+        async def open_stream(model):
+            yield {"content": "partial", "reasoning_content": ""}
+            raise LLMServerError("connection reset")
+
+        async def run():
+            received = []
+            with self.assertRaises(LLMError):
+                async for delta in stream_with_resilience(open_stream, PRIMARY):
+                    received.append(delta["content"])
+            return received
+
+        self.assertEqual(asyncio.run(run()), ["partial"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+"""
+测试子任务调度：依赖顺序、结果和子节点按子任务顺序排列、重复的子任务ID
+
+用法:
+    python -m unittest deep_research.test_scheduler
+"""
+
+import os
+import asyncio
+import unittest
+from unittest import mock
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLMapi_service import resilience
+from LLMapi_service.resilience import LLMServerError, call_with_resilience, configure_resilience
+from deep_research.scheduler import ConcurrencyLimiter, SubtaskScheduler
+from deep_research.tracing import Tracer
+from deep_research.decomposer import TaskDependencyResolver
+from deep_research.agent import DeepResearchNode
+
+
+class SubtaskSchedulerTest(unittest.TestCase):
+
+    def test_dependencies_and_result_order(self):
+        subtasks = [
+            {"id": "a", "description": "A", "requires": ["b"]},
+            {"id": "b", "description": "B"},
+            {"id": "c", "description": "C"},
+        ]
+        finished = []
+        calls = []
+
+        async def runner(index, subtask, dependency_results):
+            calls.append((index, subtask["id"], dict(dependency_results)))
+            # b 最慢，a 必须等 b 完成
+            await asyncio.sleep({"a": 0.01, "b": 0.05, "c": 0.0}[subtask["id"]])
+            finished.append(subtask["id"])
+            return subtask["id"].upper()
+
+        results = asyncio.run(SubtaskScheduler().run(subtasks, runner))
+
+        self.assertEqual(list(results.items()), [("a", "A"), ("b", "B"), ("c", "C")])
+        self.assertEqual(finished, ["c", "b", "a"])
+        self.assertIn((0, "a", {"b": "B"}), calls)
+
+    def test_index_is_position_for_equal_subtasks(self):
+        # 内容相同的子任务，list.index() 会都返回第一个的位置
+        subtasks = [{"description": "same", "id": "x"}, {"description": "same", "id": "x"}]
+        subtasks = TaskDependencyResolver.deduplicate_ids(subtasks)
+        seen = []
+
+        async def runner(index, subtask, dependency_results):
+            seen.append((index, subtask["id"]))
+
+        asyncio.run(SubtaskScheduler().run(subtasks, runner))
+        self.assertEqual(sorted(seen), [(0, "x"), (1, "x_2")])
+
+
+class DuplicateIdTest(unittest.TestCase):
+
+    def test_execution_order_keeps_duplicates(self):
+        tasks = [{"id": "t", "description": "1"}, {"id": "t", "description": "2"}]
+        self.assertEqual(TaskDependencyResolver.resolve_execution_order(tasks), tasks)
+
+    def test_deduplicate_ids(self):
+        tasks = [
+            {"id": "t", "description": "1"},
+            {"id": "t", "description": "2"},
+            {"id": "t_2", "description": "3"},
+        ]
+        result = TaskDependencyResolver.deduplicate_ids(tasks)
+        self.assertEqual([task["id"] for task in result], ["t", "t_3", "t_2"])
+        self.assertEqual(tasks[1]["id"], "t")
+
+
+class ChildNodeOrderTest(unittest.TestCase):
+
+    def test_child_nodes_follow_subtask_order(self):
+        node = DeepResearchNode(tools=[object()], node_id="root")
+        delays = {"1": 0.05, "2": 0.0, "3": 0.02}
+
+        async def fake_process_task(child, task, context=None):
+            await asyncio.sleep(delays[child.node_id.rsplit("_", 1)[1]])
+            return {"task": task, "is_complex": False, "solution": task}
+
+        subtasks = [{"id": task_id, "description": f"task {task_id}"} for task_id in delays]
+        with mock.patch.object(DeepResearchNode, "process_task", fake_process_task):
+            results = asyncio.run(node._process_subtasks(subtasks, {}))
+
+        self.assertEqual([child.node_id for child in node.child_nodes], ["root_1", "root_2", "root_3"])
+        self.assertEqual(list(results), ["1", "2", "3"])
+
+
+class AttemptSlotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = resilience.policy
+        configure_resilience(max_attempts=2, base_delay=0, fallback_chains={"gemini-2.0-flash": ["deepseek-chat"]})
+
+    def tearDown(self):
+        resilience.policy = self.policy
+
+    def test_slot_taken_per_attempt_and_model(self):
+        limiter = ConcurrencyLimiter(global_limit=1, provider_limits={})
+        attempts = []
+        held_during_backoff = []
+        real_sleep = asyncio.sleep
+
+        async def call(model):
+            attempts.append((model, limiter._global_semaphore.locked(), sorted(limiter._provider_semaphores)))
+            if model.startswith("gemini"):
+                raise LLMServerError("unavailable", model, 503)
+            return {"content": "ok"}
+
+        async def backoff_sleep(delay):
+            held_during_backoff.append(limiter._global_semaphore.locked())
+            await real_sleep(0)
+
+        async def run():
+            with Tracer().span("llm") as span:
+                response = await call_with_resilience(call, "gemini-2.0-flash", limiter.attempt_slot(span))
+            return response, span
+
+        with mock.patch.object(resilience.asyncio, "sleep", backoff_sleep):
+            response, span = asyncio.run(run())
+
+        self.assertEqual(response["model"], "deepseek-chat")
+        self.assertEqual(attempts, [
+            ("gemini-2.0-flash", True, ["gemini"]),
+            ("gemini-2.0-flash", True, ["gemini"]),
+            ("deepseek-chat", True, ["deepseek", "gemini"]),
+        ])
+        self.assertEqual(held_during_backoff, [False])
+        self.assertIn("queue_wait_ms", span.attributes)
+
+
+if __name__ == "__main__":
+    unittest.main()
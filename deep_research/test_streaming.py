@@ -0,0 +1,217 @@
+"""
+测试 LLM 流式调用：在本地 aiohttp 服务上模拟 OpenAI 兼容接口和 Gemini alt=sse 接口，
+覆盖 data: 分帧、[DONE] 结束、跳过格式错误的行、include_usage 的用量尾包，以及 collect_stream 对 on_delta 的调用
+
+用法:
+    python -m unittest deep_research.test_streaming
+"""
+
+import os
+import asyncio
+import unittest
+from unittest import mock
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from LLMapi_service import gptservice
+from LLMapi_service.gptservice import GPT_stream, collect_stream, stream_gemini_api, _stream_openai_compatible
+from LLMapi_service.transport import stream_sse, close_sessions
+from LLMapi_service.metrics import metrics
+
+# OpenAI 兼容接口的流式响应：夹杂注释、其他事件和格式错误的行，[DONE] 之后的内容应被忽略
+OPENAI_EVENTS = (
+    ": keep-alive\n\n"
+    'data: {"choices":[{"delta":{"role":"assistant"}}]}\n\n'
+    'data: {"choices":[{"delta":{"reasoning_content":"先想一想"}}]}\n\n'
+    "data: {not json}\n\n"
+    "event: ping\n\n"
+    'data: {"choices":[{"delta":{"content":"你好"}}]}\n\n'
+    'data:{"choices":[{"delta":{"content":"世界"}}]}\n\n'
+    'data: {"choices":[],"usage":{"prompt_tokens":12,"completion_tokens":5,"total_tokens":17}}\n\n'
+    "data: [DONE]\n\n"
+    'data: {"choices":[{"delta":{"content":"不应出现"}}]}\n\n'
+)
+
+# Gemini alt=sse 响应：没有 [DONE]，连接关闭即结束；每个事件带累计用量，思考片段带 thought 标记
+GEMINI_EVENTS = (
+    'data: {"candidates":[{"content":{"parts":[{"text":"思考中","thought":true}]}}],'
+    '"usageMetadata":{"promptTokenCount":7,"totalTokenCount":9}}\r\n\r\n'
+    'data: {"candidates":[{"content":{"parts":[{"text":"答案"},{"text":""}]}}],'
+    '"usageMetadata":{"promptTokenCount":7,"candidatesTokenCount":3,"thoughtsTokenCount":2,"totalTokenCount":12}}\r\n\r\n'
+)
+
+MESSAGES = [{"role": "user", "content": "你好"}]
+
+
+class FakeLLMServer:
+    """按路径返回固定 SSE 正文的本地服务，并记录收到的请求"""
+
+    def __init__(self, body: str, status: int = 200):
+        self.body = body
+        self.status = status
+        self.requests = []
+        app = web.Application()
+        app.router.add_post("/{tail:.*}", self.handle)
+        self.server = TestServer(app)
+
+    async def handle(self, request):
+        self.requests.append({
+            "path": request.path,
+            "query": dict(request.query),
+            "headers": dict(request.headers),
+            "json": await request.json()
+        })
+        if self.status != 200:
+            return web.Response(status=self.status)
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        # 逐行写出，模拟分多次到达的数据
+        for line in self.body.splitlines(keepends=True):
+            await response.write(line.encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    def url(self, path: str = "") -> str:
+        """服务地址，用作 BaseUrl 时去掉末尾的斜杠"""
+        return str(self.server.make_url(path)).rstrip("/")
+
+
+def run_with_server(body, scenario, status=200):
+    """启动本地服务，执行 scenario(server)，结束后关闭服务和连接池"""
+    async def run():
+        server = FakeLLMServer(body, status)
+        await server.server.start_server()
+        try:
+            return server, await scenario(server)
+        finally:
+            await close_sessions()
+            await server.server.close()
+
+    return asyncio.run(run())
+
+
+async def consume(stream):
+    return [item async for item in stream]
+
+
+class StreamSseTest(unittest.TestCase):
+
+    def test_data_framing_and_done(self):
+        server, events = run_with_server(
+            OPENAI_EVENTS,
+            lambda server: consume(stream_sse("test", server.url("/v1/chat/completions"), {"stream": True}))
+        )
+        # 只产出 data 事件，格式错误的行被跳过，[DONE] 后停止
+        self.assertEqual(len(events), 5)
+        self.assertEqual(events[2]["choices"][0]["delta"]["content"], "你好")
+        self.assertEqual(events[3]["choices"][0]["delta"]["content"], "世界")
+        self.assertEqual(events[-1]["usage"]["total_tokens"], 17)
+        self.assertEqual(server.requests[0]["json"], {"stream": True})
+
+    def test_http_error_raised(self):
+        async def scenario(server):
+            with self.assertRaises(aiohttp.ClientResponseError) as context:
+                await consume(stream_sse("test", server.url("/v1/chat/completions"), {}))
+            return context.exception.status
+
+        _, status = run_with_server("", scenario, status=503)
+        self.assertEqual(status, 503)
+
+
+@mock.patch.object(gptservice, "get_proxy", mock.AsyncMock(return_value=None))
+class ProviderStreamTest(unittest.TestCase):
+
+    def test_openai_compatible_deltas_and_usage(self):
+        call_info = {}
+
+        async def scenario(server):
+            # 限流器按提供方缓存，这里用单独的提供方名以使用指定的密钥
+            return await consume(_stream_openai_compatible(
+                "stream-test", server.url("/v1/chat/completions"), ["key-a"], MESSAGES, "deepseek-chat", call_info
+            ))
+
+        server, deltas = run_with_server(OPENAI_EVENTS, scenario)
+        # 只有 role 的增量和用量尾包不产出内容
+        self.assertEqual(deltas, [
+            {"content": "", "reasoning_content": "先想一想"},
+            {"content": "你好", "reasoning_content": ""},
+            {"content": "世界", "reasoning_content": ""},
+        ])
+        self.assertEqual(call_info["provider"], "stream-test")
+        self.assertEqual((call_info["prompt_tokens"], call_info["completion_tokens"]), (12, 5))
+
+        request = server.requests[0]
+        self.assertEqual(request["headers"]["Authorization"], "Bearer key-a")
+        self.assertTrue(request["json"]["stream"])
+        self.assertEqual(request["json"]["stream_options"], {"include_usage": True})
+        self.assertEqual(request["json"]["messages"], MESSAGES)
+
+    def test_gemini_sse_chunks(self):
+        call_info = {}
+
+        async def scenario(server):
+            with mock.patch.object(gptservice, "gemini_keys", ["gemini-key"]), \
+                    mock.patch.object(gptservice, "GeminiBaseUrl", server.url("/v1beta")):
+                return await consume(stream_gemini_api(MESSAGES, "gemini-2.0-flash", call_info))
+
+        server, deltas = run_with_server(GEMINI_EVENTS, scenario)
+        self.assertEqual(deltas, [
+            {"content": "", "reasoning_content": "思考中"},
+            {"content": "答案", "reasoning_content": ""},
+        ])
+        # 用量取最后一个事件的累计值，思考令牌计入输出
+        self.assertEqual((call_info["prompt_tokens"], call_info["completion_tokens"]), (7, 5))
+
+        request = server.requests[0]
+        self.assertEqual(request["path"], "/v1beta/models/gemini-2.0-flash:streamGenerateContent")
+        self.assertEqual(request["query"]["alt"], "sse")
+        self.assertEqual(request["query"]["key"], "gemini-key")
+        self.assertEqual(request["json"]["contents"], [{"role": "user", "parts": [{"text": "你好"}]}])
+
+
+@mock.patch.object(gptservice, "get_proxy", mock.AsyncMock(return_value=None))
+class GPTStreamTest(unittest.TestCase):
+
+    def test_collect_stream_calls_on_delta(self):
+        calls = []
+
+        async def scenario(server):
+            with mock.patch.object(gptservice, "DeepseekBaseUrl", server.url("")):
+                stream = GPT_stream(MESSAGES, "deepseek-chat", use_cache=False)
+                return await collect_stream(stream, lambda delta, content: calls.append((dict(delta), content)))
+
+        server, response = run_with_server(OPENAI_EVENTS, scenario)
+        self.assertEqual(response, {
+            "role": "assistant",
+            "content": "你好世界",
+            "model": "deepseek-chat",
+            "reasoning_content": "先想一想",
+        })
+        self.assertEqual(server.requests[0]["path"], "/v1/chat/completions")
+        # 每个增量调用一次，参数为增量本身和目前为止拼接的正文
+        self.assertEqual([content for _, content in calls], ["", "你好", "你好世界"])
+        self.assertEqual([delta["content"] for delta, _ in calls], ["", "你好", "世界"])
+        self.assertTrue(all(delta["model"] == "deepseek-chat" for delta, _ in calls))
+
+        # 调用指标使用尾包中的实际用量
+        record = metrics.recent[-1]
+        self.assertEqual((record["model"], record["stream"], record["status"]), ("deepseek-chat", True, "ok"))
+        self.assertEqual((record["prompt_tokens"], record["completion_tokens"]), (12, 5))
+        self.assertFalse(record["estimated"])
+
+    def test_collect_stream_without_reasoning(self):
+        async def deltas():
+            yield {"content": "a", "reasoning_content": "", "model": "m"}
+            yield {"content": "b", "reasoning_content": ""}
+
+        response = asyncio.run(collect_stream(deltas()))
+        # 后续增量没有 model 时沿用之前的值，没有推理内容时不带该字段
+        self.assertEqual(response, {"role": "assistant", "content": "ab", "model": "m"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+"""
+测试链路追踪：span 随 asyncio 任务嵌套、异常状态、关键路径与汇总，以及 Chrome trace-event 和 OTLP 导出
+
+用法:
+    python -m unittest deep_research.test_tracing
+"""
+
+import os
+import json
+import asyncio
+import tempfile
+import unittest
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deep_research.tracing import Tracer, CHROME_TRACE_FILE, OTLP_TRACE_FILE
+
+
+def build_trace() -> Tracer:
+    """根节点下两个并发子节点，子节点 root_2 较慢，位于关键路径上"""
+    tracer = Tracer()
+
+    async def child(node_id, delay):
+        with tracer.span("node", node_id=node_id):
+            with tracer.span("llm", phase="solve", attempt=1, cached=False, score=0.5):
+                await asyncio.sleep(delay)
+
+    async def run():
+        with tracer.span("node", node_id="root", depth=0):
+            with tracer.span("children"):
+                await asyncio.gather(child("root_1", 0.03), child("root_2", 0.05))
+
+    asyncio.run(run())
+    return tracer
+
+
+class TracerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tracer = build_trace()
+        self.by_node = {span.attributes.get("node_id"): span for span in self.tracer.spans}
+
+    def test_spans_nest_across_tasks(self):
+        self.assertEqual(len(self.tracer.spans), 6)
+        children = next(span for span in self.tracer.spans if span.name == "children")
+        self.assertIsNone(self.by_node["root"].parent_id)
+        self.assertEqual(children.parent_id, self.by_node["root"].span_id)
+        self.assertEqual(self.by_node["root_1"].parent_id, children.span_id)
+        self.assertEqual(self.by_node["root_2"].parent_id, children.span_id)
+
+    def test_error_status(self):
+        tracer = Tracer()
+        with self.assertRaises(ValueError):
+            with tracer.span("node"):
+                raise ValueError("失败")
+        self.assertEqual(tracer.spans[0].status, "ValueError")
+        self.assertIsNotNone(tracer.spans[0].end)
+
+    def test_critical_path_and_summary(self):
+        path = self.tracer.critical_path()
+        self.assertEqual([step["name"] for step in path], ["node", "children", "node", "llm"])
+        # 阶段 span 沿用所在节点的 node_id
+        self.assertEqual([step["node_id"] for step in path], ["root", "root", "root_2", "root_2"])
+        self.assertEqual(path[-1]["phase"], "solve")
+
+        summary = self.tracer.summary()
+        self.assertEqual(summary["spans"], 6)
+        self.assertEqual(summary["by_name"]["llm"]["count"], 2)
+        self.assertGreaterEqual(summary["llm_busy_ms"], 80)
+        # 两个 LLM 调用重叠，平均并行度大于 1
+        self.assertGreater(summary["parallelism"], 1.0)
+        self.assertEqual(summary["critical_path"], path)
+
+    def test_empty_summary(self):
+        self.assertEqual(Tracer().summary()["spans"], 0)
+        self.assertEqual(Tracer().critical_path(), [])
+
+    def test_chrome_trace(self):
+        trace = self.tracer.to_chrome_trace()
+        events = trace["traceEvents"]
+        self.assertEqual(events[0]["args"]["name"], "deep_research")
+        lanes = {event["args"]["name"]: event["tid"] for event in events if event["name"] == "thread_name"}
+        self.assertEqual(set(lanes), {"root", "root_1", "root_2"})
+
+        spans = [event for event in events if event["ph"] == "X"]
+        self.assertEqual(len(spans), 6)
+        children = next(event for event in spans if event["name"] == "children")
+        self.assertEqual(children["tid"], lanes["root"])
+        llm = [event for event in spans if event["name"] == "llm"]
+        self.assertEqual({event["tid"] for event in llm}, {lanes["root_1"], lanes["root_2"]})
+        self.assertEqual({event["cat"] for event in llm}, {"solve"})
+        self.assertTrue(all(event["dur"] > 0 for event in spans))
+        self.assertEqual(trace["otherData"]["trace_id"], self.tracer.trace_id)
+
+    def test_otlp(self):
+        otlp = self.tracer.to_otlp()
+        resource = otlp["resourceSpans"][0]
+        self.assertEqual(resource["resource"]["attributes"][0]["value"], {"stringValue": "deep_research"})
+        spans = resource["scopeSpans"][0]["spans"]
+        self.assertEqual({span["traceId"] for span in spans}, {self.tracer.trace_id})
+
+        root = next(span for span in spans if span["spanId"] == self.by_node["root"].span_id)
+        self.assertNotIn("parentSpanId", root)
+        self.assertEqual(root["status"], {"code": 1})
+        self.assertLess(int(root["startTimeUnixNano"]), int(root["endTimeUnixNano"]))
+
+        llm = next(span for span in spans if span["name"] == "llm")
+        attributes = {attribute["key"]: attribute["value"] for attribute in llm["attributes"]}
+        self.assertEqual(attributes, {
+            "phase": {"stringValue": "solve"},
+            "attempt": {"intValue": "1"},
+            "cached": {"boolValue": False},
+            "score": {"doubleValue": 0.5},
+        })
+        self.assertIn("parentSpanId", llm)
+
+    def test_save(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            paths = self.tracer.save(output_dir)
+            self.assertEqual(paths["chrome"], os.path.join(output_dir, CHROME_TRACE_FILE))
+            self.assertEqual(paths["otlp"], os.path.join(output_dir, OTLP_TRACE_FILE))
+            with open(paths["chrome"], "r", encoding="utf-8") as f:
+                self.assertIn("traceEvents", json.load(f))
+            with open(paths["otlp"], "r", encoding="utf-8") as f:
+                self.assertIn("resourceSpans", json.load(f))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+"""
+测试 LLM 传输层：连接池按 (提供方, 事件循环) 复用，事件循环结束前关闭会话；
+代理检测结果按 TTL 缓存，并发请求共享同一次检测，过期后在后台刷新
+
+用法:
+    python -m unittest deep_research.test_transport
+"""
+
+import os
+import time
+import asyncio
+import unittest
+from unittest import mock
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLMapi_service import transport
+from LLMapi_service.transport import get_session, close_sessions, ProxyConfig, probe_proxy
+
+
+class SessionPoolTest(unittest.TestCase):
+
+    def test_session_reused_within_loop(self):
+        async def run():
+            first = get_session("deepseek")
+            same = get_session("deepseek")
+            other = get_session("gemini")
+            await close_sessions()
+            return first, same, other
+
+        first, same, other = asyncio.run(run())
+        self.assertIs(first, same)
+        self.assertIsNot(first, other)
+        self.assertTrue(first.closed and other.closed)
+
+    def test_new_session_per_loop(self):
+        async def run():
+            session = get_session("deepseek")
+            await close_sessions()
+            return session
+
+        first = asyncio.run(run())
+        second = asyncio.run(run())
+        self.assertIsNot(first, second)
+        self.assertEqual(transport._sessions, {})
+
+    def test_closed_session_is_replaced(self):
+        async def run():
+            session = get_session("deepseek")
+            await session.close()
+            replacement = get_session("deepseek")
+            await close_sessions()
+            return session, replacement
+
+        session, replacement = asyncio.run(run())
+        self.assertIsNot(session, replacement)
+
+    def test_sessions_of_closed_loops_are_purged(self):
+        # 事件循环结束时没有关闭会话，下次创建会话时清理遗留记录
+        loop = asyncio.new_event_loop()
+        stale = loop.run_until_complete(self._open("deepseek"))
+        loop.close()
+        self.assertEqual(len(transport._sessions), 1)
+
+        async def run():
+            get_session("gemini")
+            keys = [provider for provider, _ in transport._sessions]
+            await close_sessions()
+            return keys
+
+        self.assertEqual(asyncio.run(run()), ["gemini"])
+        self.assertFalse(stale.closed)
+
+    @staticmethod
+    async def _open(provider):
+        return get_session(provider)
+
+
+class FakeProbe:
+    """替代 probe_proxy：按顺序返回预设结果并记录检测次数"""
+
+    def __init__(self, *results, delay=0.0):
+        self.results = list(results)
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self, proxy_url, timeout=None):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self.results.pop(0)
+
+
+class ProxyConfigTest(unittest.TestCase):
+
+    def get_proxies(self, config, probe, rounds):
+        async def run():
+            proxies = []
+            for concurrent in rounds:
+                proxies.append(await asyncio.gather(*(config.get_proxy() for _ in range(concurrent))))
+                # 让后台检测任务有机会完成
+                await asyncio.sleep(0.01)
+            return proxies
+
+        with mock.patch.object(transport, "probe_proxy", probe):
+            return asyncio.run(run())
+
+    def test_fixed_modes_do_not_probe(self):
+        probe = FakeProbe()
+        on = ProxyConfig(url="http://proxy:1", mode="on")
+        off = ProxyConfig(url="http://proxy:1", mode="OFF")
+        self.assertEqual(self.get_proxies(on, probe, [1]), [["http://proxy:1"]])
+        self.assertEqual(self.get_proxies(off, probe, [1]), [[None]])
+        self.assertEqual(probe.calls, 0)
+
+    def test_concurrent_first_requests_share_one_probe(self):
+        probe = FakeProbe(True, delay=0.01)
+        config = ProxyConfig(url="http://proxy:1", mode="auto", ttl=300)
+        proxies = self.get_proxies(config, probe, [5, 5])
+        self.assertEqual(proxies, [["http://proxy:1"] * 5] * 2)
+        self.assertEqual(probe.calls, 1)
+
+    def test_expired_result_refreshed_in_background(self):
+        probe = FakeProbe(True, False, False)
+        config = ProxyConfig(url="http://proxy:1", mode="auto", ttl=0)
+        proxies = self.get_proxies(config, probe, [1, 1, 1])
+        # 过期时先沿用旧结果，后台检测完成后改为直连
+        self.assertEqual(proxies, [["http://proxy:1"], ["http://proxy:1"], [None]])
+        self.assertEqual(probe.calls, 3)
+
+    def test_result_cached_within_ttl(self):
+        probe = FakeProbe(False)
+        config = ProxyConfig(url="http://proxy:1", mode="auto", ttl=300)
+        self.assertEqual(self.get_proxies(config, probe, [1, 1, 1]), [[None]] * 3)
+        self.assertEqual(probe.calls, 1)
+        self.assertLessEqual(config._checked_at, time.monotonic())
+
+    def test_env_overrides(self):
+        env = {"LLM_PROXY_URL": "http://env:2", "LLM_PROXY_MODE": "On", "LLM_PROXY_TTL": "12"}
+        with mock.patch.dict(os.environ, env):
+            config = ProxyConfig()
+        self.assertEqual((config.url, config.mode, config.ttl), ("http://env:2", "on", 12.0))
+
+    def test_probe_unreachable_port(self):
+        async def run():
+            server = await asyncio.start_server(lambda reader, writer: writer.close(), "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            up = await probe_proxy(f"http://127.0.0.1:{port}")
+            server.close()
+            await server.wait_closed()
+            down = await probe_proxy(f"http://127.0.0.1:{port}", timeout=0.5)
+            return up, down
+
+        self.assertEqual(asyncio.run(run()), (True, False))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -14,9 +14,13 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 from langchain_core.tools import BaseTool
 from langchain.tools import Tool
 from LLMapi_service.gptservice import GPT, is_deepseek_model
+from LLMapi_service.metrics import metric_tags
+from LLMapi_service.logger import get_logger, log_payload
 
 from deep_research.config import DEFAULT_MODEL
 
+logger = get_logger("deep_research.tools")
+
 
 class WebSearchTool_deepseek(BaseTool):
     """网络搜索工具，使用gpt-4o-mini-search-preview模型进行实际网络搜索"""
@@ -25,9 +29,9 @@ class WebSearchTool_deepseek(BaseTool):
     description: str = "执行网络搜索以找到有关特定查询的信息。使用GPT-4o mini搜索模型获取实时网络数据。"
     model: str = DEFAULT_MODEL # "gpt-4o-mini-search-preview"  # 使用带有网络搜索能力的模型
     
-    async def _arun(self, query: str) -> str:
-        """异步执行搜索"""
-        results = await self.perform_search(query)
+    async def _arun(self, query: str, slot=None) -> str:
+        """异步执行搜索，slot 为每次请求尝试占用的调用槽位，见 GPT()"""
+        results = await self.perform_search(query, slot)
         return json.dumps(results, ensure_ascii=False)
     
     def _run(self, query: str) -> str:
@@ -36,17 +40,18 @@ class WebSearchTool_deepseek(BaseTool):
         results = loop.run_until_complete(self.perform_search(query))
         return json.dumps(results, ensure_ascii=False)
     
-    async def perform_search(self, query: str) -> List[Dict]:
+    async def perform_search(self, query: str, slot=None) -> List[Dict]:
         """使用gpt-4o-mini-search-preview模型执行实际网络搜索
         
         参数:
             query: 搜索查询
+            slot: 可选，每次请求尝试占用的调用槽位
             
         返回:
             搜索结果列表
         """
         try:
-            print(f"正在搜索: {query}")
+            logger.info(f"正在搜索: {query}")
             
             # 构建搜索指令和消息
             messages = [
@@ -55,7 +60,9 @@ class WebSearchTool_deepseek(BaseTool):
             ]
             
             # 调用GPT-4o mini搜索模型
-            response = await GPT(messages, selected_model=self.model)
+            # 搜索需要实时结果，不使用LLM缓存
+            with metric_tags(phase="search"):
+                response = await GPT(messages, selected_model=self.model, use_cache=False, slot=slot)
             
             if not response or not isinstance(response, dict) or "content" not in response:
                 return [{"error": "搜索响应无效", "query": query}]
@@ -105,11 +112,12 @@ class WebSearchTool_deepseek(BaseTool):
                 return standardized_results
             except json.JSONDecodeError:
                 # 如果JSON解析失败，返回原始内容
-                print(f"JSON解析失败，原始内容: {content}")
+                logger.warning("搜索结果JSON解析失败，返回原始内容")
+                log_payload(logger, "原始内容", content)
                 return [{"title": "搜索结果", "url": "", "snippet": content}]
             
         except Exception as e:
-            print(f"搜索时出错: {str(e)}")
+            logger.warning(f"搜索时出错: {str(e)}")
             return [{"error": str(e), "query": query}]
 
 #Gemini """使用 Gemini API 进行搜索并格式化结果，调用 google_search 工具。"""
@@ -120,9 +128,9 @@ class WebSearchTool(BaseTool):
     description: str = "执行网络搜索以找到有关特定查询的信息。使用GPT-4o mini搜索模型获取实时网络数据。"
     model: str = DEFAULT_MODEL 
     
-    async def _arun(self, query: str) -> str:
-        """异步执行搜索"""
-        results = await self.perform_search(query)
+    async def _arun(self, query: str, slot=None) -> str:
+        """异步执行搜索，slot 为每次请求尝试占用的调用槽位，见 GPT()"""
+        results = await self.perform_search(query, slot)
         return json.dumps(results, ensure_ascii=False)
     
     def _run(self, query: str) -> str:
@@ -131,17 +139,18 @@ class WebSearchTool(BaseTool):
         results = loop.run_until_complete(self.perform_search(query))
         return json.dumps(results, ensure_ascii=False)
     
-    async def perform_search(self, query: str) -> List[Dict]:
+    async def perform_search(self, query: str, slot=None) -> List[Dict]:
         """使用gemini-2.5-pro-exp-03-25模型执行实际网络搜索
         
         参数:
             query: 搜索查询
+            slot: 可选，每次请求尝试占用的调用槽位
             
         返回:
             搜索结果列表
         """
         try:
-            print(f"正在搜索: {query}")
+            logger.info(f"正在搜索: {query}")
             
             # 构建搜索指令和消息
             messages = [
@@ -150,7 +159,9 @@ class WebSearchTool(BaseTool):
             ]
             
             # 调用GPT-4o mini搜索模型
-            response = await GPT(messages, selected_model=self.model)
+            # 搜索需要实时结果，不使用LLM缓存
+            with metric_tags(phase="search"):
+                response = await GPT(messages, selected_model=self.model, use_cache=False, slot=slot)
             
             if not response or not isinstance(response, dict) or "content" not in response:
                 return [{"error": "搜索响应无效", "query": query}]
@@ -200,11 +211,12 @@ class WebSearchTool(BaseTool):
                 return standardized_results
             except json.JSONDecodeError:
                 # 如果JSON解析失败，返回原始内容
-                print(f"JSON解析失败，原始内容: {content}")
+                logger.warning("搜索结果JSON解析失败，返回原始内容")
+                log_payload(logger, "原始内容", content)
                 return [{"title": "搜索结果", "url": "", "snippet": content}]
             
         except Exception as e:
-            print(f"搜索时出错: {str(e)}")
+            logger.warning(f"搜索时出错: {str(e)}")
             return [{"error": str(e), "query": query}]
 
 
@@ -236,7 +248,7 @@ class KnowledgeBaseSearchTool(BaseTool):
         return json.dumps(results, ensure_ascii=False)
     
     async def search_knowledge_base(self, query: str, top_k: int = 5) -> List[Dict]:
-        """在知识库中执行向量搜索
+        """在知识库中执行检索（向量与关键词混合检索）
         
         Args:
             query: 搜索查询
@@ -247,21 +259,20 @@ class KnowledgeBaseSearchTool(BaseTool):
         """
         # 如果知识库为空，返回空结果
         if not hasattr(self.knowledge_base, 'search'):
-            print("警告: 知识库对象没有search方法，使用传统的字典搜索")
+            logger.warning("知识库对象没有search方法，使用传统的字典搜索")
             return self._fallback_search(query, top_k)
         
         try:
-            # 调用知识库的向量搜索方法
-            results = self.knowledge_base.search(query, top_k=top_k)
+            # 调用知识库的检索方法，支持异步接口时在线程池中执行，不阻塞事件循环
+            if hasattr(self.knowledge_base, 'asearch'):
+                results = await self.knowledge_base.asearch(query, top_k=top_k)
+            else:
+                results = self.knowledge_base.search(query, top_k=top_k)
             
-            if not results and hasattr(self.knowledge_base, '_fallback_keyword_search'):
-                # 如果向量搜索没有结果，尝试关键词搜索
-                results = self.knowledge_base._fallback_keyword_search(query, top_k)
-                
             return results
             
         except Exception as e:
-            print(f"知识库搜索时出错: {e}")
+            logger.warning(f"知识库搜索时出错: {e}")
             return self._fallback_search(query, top_k)
     
     def _fallback_search(self, query: str, top_k: int = 5) -> List[Dict]:
@@ -343,6 +354,11 @@ class KnowledgeBaseStorageTool(BaseTool):
         Returns:
             存储结果消息
         """
+        # 向量知识库：写入日志并加入索引
+        if hasattr(self.knowledge_base, 'aadd_entry'):
+            entry_id = await self.knowledge_base.aadd_entry(entry, entry_id=entry.get("id"))
+            return f"成功存储条目，ID: {entry_id}"
+        
         if not entry.get("id"):
             entry["id"] = f"entry_{len(self.knowledge_base) + 1}"
         
@@ -0,0 +1,264 @@
+"""
+深度研究 Agent 链路追踪
+为研究树的每个节点及其各阶段（检索、复杂度评估、任务分解、子任务、总结等）记录嵌套的时间区间（span），
+span 的父子关系与研究树一致，可导出为 Chrome trace-event 格式（chrome://tracing、Perfetto 可直接打开）
+和 OpenTelemetry（OTLP/JSON）格式，并给出关键路径和各阶段耗时汇总
+"""
+
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional
+
+# Chrome trace-event 文件名
+CHROME_TRACE_FILE = "trace.json"
+# OpenTelemetry（OTLP/JSON）文件名
+OTLP_TRACE_FILE = "trace_otlp.json"
+# 汇总并行度时统计的 span 名称，即实际占用 LLM 调用的区间
+BUSY_SPAN_NAME = "llm"
+
+# 当前正在执行的 span，随 asyncio 任务自动向下传递，子任务创建时所在的 span 即为其父 span
+_current_span: contextvars.ContextVar = contextvars.ContextVar("research_trace_span", default=None)
+
+
+class Span:
+    """一个时间区间，时间以 time.perf_counter() 记录"""
+
+    def __init__(self, tracer: "Tracer", name: str, span_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        # ok 或异常类型名
+        self.status = "ok"
+
+    @property
+    def duration(self) -> float:
+        """耗时（秒），未结束的 span 计算到当前时刻"""
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def set(self, **attributes) -> None:
+        """补充属性"""
+        self.attributes.update(attributes)
+
+
+class Tracer:
+    """一次研究的链路追踪记录，整棵研究树共享同一个 Tracer"""
+
+    def __init__(self, service_name: str = "deep_research"):
+        self.service_name = service_name
+        self.trace_id = uuid.uuid4().hex
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+        # 把 perf_counter 换算为墙钟时间的基准
+        self._wall_start = time.time()
+        self._perf_start = time.perf_counter()
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """记录一个 span，嵌套在当前 span 之下
+
+        Args:
+            name: span 名称，如 node、retrieval、complexity、decomposition、children、summarize、solve
+            **attributes: 属性，如 node_id、depth、phase
+
+        Yields:
+            Span 对象，可在区间内用 set() 补充属性
+        """
+        parent = _current_span.get()
+        # 当前 span 属于其他 Tracer（如嵌套的另一次研究）时不作为父 span
+        parent_id = parent.span_id if parent is not None and parent.tracer is self else None
+        span = Span(self, name, uuid.uuid4().hex[:16], parent_id, dict(attributes))
+        with self._lock:
+            self.spans.append(span)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = type(e).__name__
+            raise
+        finally:
+            span.end = time.perf_counter()
+            _current_span.reset(token)
+
+    def _finished_spans(self) -> List[Span]:
+        with self._lock:
+            return [span for span in self.spans if span.end is not None]
+
+    def _unix_nanos(self, perf: float) -> int:
+        return int((self._wall_start + perf - self._perf_start) * 1e9)
+
+    def critical_path(self) -> List[Dict[str, Any]]:
+        """关键路径：从最晚结束的根 span 开始，逐层选择最晚结束的子 span，这条链决定了整次研究的总耗时
+
+        Returns:
+            由外到内的 span 列表，每项包括 name、node_id、phase、duration_ms、start_ms（相对追踪开始）
+        """
+        spans = self._finished_spans()
+        children = defaultdict(list)
+        ids = {span.span_id for span in spans}
+        roots = []
+        for span in spans:
+            if span.parent_id in ids:
+                children[span.parent_id].append(span)
+            else:
+                roots.append(span)
+        if not roots:
+            return []
+
+        path = []
+        node_id = None
+        current = max(roots, key=lambda span: span.end)
+        while current is not None:
+            # 阶段 span 没有 node_id 属性，沿用所在节点的 node_id
+            node_id = current.attributes.get("node_id", node_id)
+            path.append({
+                "name": current.name,
+                "node_id": node_id,
+                "phase": current.attributes.get("phase"),
+                "duration_ms": round(current.duration * 1000, 3),
+                "start_ms": round((current.start - self._perf_start) * 1000, 3)
+            })
+            candidates = children.get(current.span_id)
+            current = max(candidates, key=lambda span: span.end) if candidates else None
+        return path
+
+    def summary(self) -> Dict[str, Any]:
+        """追踪汇总
+
+        Returns:
+            包括 wall_ms（从第一个 span 开始到最后一个 span 结束）、spans（span 数）、
+            by_name（各名称 span 的次数和累计耗时）、llm_busy_ms（LLM 调用区间的累计耗时）、
+            parallelism（llm_busy_ms / wall_ms，即平均同时进行的 LLM 调用数）、critical_path
+        """
+        spans = self._finished_spans()
+        if not spans:
+            return {"wall_ms": 0.0, "spans": 0, "by_name": {}, "llm_busy_ms": 0.0, "parallelism": 0.0, "critical_path": []}
+
+        wall = max(span.end for span in spans) - min(span.start for span in spans)
+        by_name: Dict[str, Dict[str, Any]] = {}
+        for span in spans:
+            entry = by_name.setdefault(span.name, {"count": 0, "total_ms": 0.0})
+            entry["count"] += 1
+            entry["total_ms"] += span.duration * 1000
+        for entry in by_name.values():
+            entry["total_ms"] = round(entry["total_ms"], 3)
+        busy = sum(span.duration for span in spans if span.name == BUSY_SPAN_NAME)
+        return {
+            "wall_ms": round(wall * 1000, 3),
+            "spans": len(spans),
+            "by_name": by_name,
+            "llm_busy_ms": round(busy * 1000, 3),
+            "parallelism": round(busy / wall, 3) if wall > 0 else 0.0,
+            "critical_path": self.critical_path()
+        }
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """导出为 Chrome trace-event 格式
+
+        每个研究节点占一条时间线（tid），节点内的阶段依次嵌套，并发的子节点显示在各自的时间线上
+        """
+        spans = self._finished_spans()
+        by_id = {span.span_id: span for span in spans}
+        lanes: Dict[str, int] = {}
+        events = []
+
+        def lane_of(span: Span) -> str:
+            """span 所属的时间线：最近一个带 node_id 的祖先节点，没有时归入 agent"""
+            current = span
+            while current is not None:
+                node_id = current.attributes.get("node_id")
+                if node_id:
+                    return node_id
+                current = by_id.get(current.parent_id)
+            return "agent"
+
+        for span in sorted(spans, key=lambda span: span.start):
+            lane = lane_of(span)
+            if lane not in lanes:
+                lanes[lane] = len(lanes) + 1
+                events.append({
+                    "name": "thread_name", "ph": "M", "pid": 1, "tid": lanes[lane], "args": {"name": lane}
+                })
+            args = dict(span.attributes)
+            if span.status != "ok":
+                args["status"] = span.status
+            events.append({
+                "name": span.name,
+                "cat": args.get("phase") or span.name,
+                "ph": "X",
+                "pid": 1,
+                "tid": lanes[lane],
+                "ts": round((span.start - self._perf_start) * 1e6, 3),
+                "dur": round(span.duration * 1e6, 3),
+                "args": {"span_id": span.span_id, "parent_id": span.parent_id, **args}
+            })
+        events.insert(0, {"name": "process_name", "ph": "M", "pid": 1, "tid": 0, "args": {"name": self.service_name}})
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {"trace_id": self.trace_id, "summary": self.summary()}
+        }
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """导出为 OpenTelemetry OTLP/JSON 格式，可直接提交给 OTLP/HTTP 接收端（如 Jaeger、Tempo）"""
+
+        def attribute(key: str, value: Any) -> Dict[str, Any]:
+            if isinstance(value, bool):
+                return {"key": key, "value": {"boolValue": value}}
+            if isinstance(value, int):
+                return {"key": key, "value": {"intValue": str(value)}}
+            if isinstance(value, float):
+                return {"key": key, "value": {"doubleValue": value}}
+            return {"key": key, "value": {"stringValue": str(value)}}
+
+        otlp_spans = []
+        for span in self._finished_spans():
+            otlp_span = {
+                "traceId": self.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                # SPAN_KIND_INTERNAL
+                "kind": 1,
+                "startTimeUnixNano": str(self._unix_nanos(span.start)),
+                "endTimeUnixNano": str(self._unix_nanos(span.end)),
+                "attributes": [attribute(key, value) for key, value in span.attributes.items()],
+                # STATUS_CODE_OK / STATUS_CODE_ERROR
+                "status": {"code": 1} if span.status == "ok" else {"code": 2, "message": span.status}
+            }
+            if span.parent_id:
+                otlp_span["parentSpanId"] = span.parent_id
+            otlp_spans.append(otlp_span)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [attribute("service.name", self.service_name)]},
+                "scopeSpans": [{"scope": {"name": "deep_research.tracing"}, "spans": otlp_spans}]
+            }]
+        }
+
+    def save(self, output_dir: str) -> Dict[str, str]:
+        """把追踪结果保存到输出目录
+
+        Args:
+            output_dir: 输出目录，与 raw_results.json 相同
+
+        Returns:
+            {格式: 文件路径}
+        """
+        paths = {
+            "chrome": os.path.join(output_dir, CHROME_TRACE_FILE),
+            "otlp": os.path.join(output_dir, OTLP_TRACE_FILE)
+        }
+        with open(paths["chrome"], "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome_trace(), f, ensure_ascii=False)
+        with open(paths["otlp"], "w", encoding="utf-8") as f:
+            json.dump(self.to_otlp(), f, ensure_ascii=False)
+        return paths
@@ -25,47 +25,59 @@ document.addEventListener('DOMContentLoaded', function() {
     if (statusContainer && statusContainer.getAttribute('data-auto-update') === 'true') {
         const taskId = statusContainer.getAttribute('data-task-id');
         
-        // 定期更新状态
-        function updateStatus() {
-            fetch(`/api/task_status/${taskId}`)
-                .then(response => response.json())
-                .then(data => {
-                    // 更新进度条
-                    const progressBar = document.querySelector('.progress-bar');
-                    if (progressBar) {
-                        progressBar.style.width = `${data.progress || 0}%`;
-                        const progressText = progressBar.querySelector('.progress-text');
-                        if (progressText) {
-                            progressText.textContent = `${data.progress || 0}%`;
-                        }
-                    }
-                    
-                    // 更新状态消息
-                    const statusMessage = document.querySelector('.status-message');
-                    if (statusMessage) {
-                        statusMessage.textContent = data.message || '正在研究...';
-                    }
-                    
-                    // 更新状态文本
-                    const statusText = document.querySelector('.status-text');
-                    if (statusText) {
-                        statusText.textContent = data.status || '运行中';
-                    }
-                    
-                    // 如果状态变为完成或失败，刷新页面
-                    if (data.status === 'completed') {
-                        window.location.href = `/result/${taskId}`;
-                    } else if (data.status === 'failed') {
-                        window.location.reload();
-                    }
-                })
-                .catch(error => {
-                    console.error('更新状态时出错:', error);
-                });
+        // 根据状态数据更新页面
+        function renderStatus(data) {
+            // 更新进度条
+            const progressBar = document.querySelector('.progress-bar');
+            if (progressBar) {
+                progressBar.style.width = `${data.progress || 0}%`;
+                const progressText = progressBar.querySelector('.progress-text');
+                if (progressText) {
+                    progressText.textContent = `${data.progress || 0}%`;
+                }
+            }
+            
+            // 更新状态消息
+            const statusMessage = document.querySelector('.status-message');
+            if (statusMessage) {
+                statusMessage.textContent = data.message || '正在研究...';
+            }
+            
+            // 更新状态文本
+            const statusText = document.querySelector('.status-text');
+            if (statusText) {
+                statusText.textContent = data.status || '运行中';
+            }
+            
+            // 如果状态变为完成、失败或取消，刷新页面
+            if (data.status === 'completed') {
+                window.location.href = `/result/${taskId}`;
+            } else if (data.status === 'failed' || data.status === 'cancelled') {
+                window.location.reload();
+            }
         }
         
-        // 每5秒更新一次状态
-        setInterval(updateStatus, 5000);
+        if (window.EventSource) {
+            // 订阅任务事件流，由服务端推送状态更新
+            const events = new EventSource(`/api/task_events/${taskId}`);
+            events.addEventListener('status', function(e) {
+                const data = JSON.parse(e.data);
+                if (['completed', 'failed', 'cancelled'].includes(data.status)) {
+                    events.close();
+                }
+                renderStatus(data);
+            });
+        } else {
+            // 不支持事件流时每5秒轮询一次状态
+            setInterval(function() {
+                fetch(`/api/task_status/${taskId}`)
+                    .then(response => response.json())
+                    .then(renderStatus)
+                    .catch(error => {
+                        console.error('更新状态时出错:', error);
+                    });
+            }, 5000);
+        }
     }
     
     // 研究结果页面 TOC 滚动处理
@@ -10,16 +10,28 @@ import uuid
 import traceback
 from datetime import datetime
 import sys
-import threading
 sys.path.append('..')
 
-from flask import Flask, render_template, request, redirect, url_for, jsonify, send_from_directory
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify, send_from_directory, stream_with_context
 from werkzeug.utils import secure_filename
 
 # 导入深度研究模块
 from deep_research.agent import DeepResearchAgent
-from deep_research.knowledge_base import KnowledgeBase
-from deep_research.output_organizer import OutputOrganizer
+from deep_research.knowledge_base import KnowledgeBase, DEFAULT_EMBEDDING_MODEL
+from deep_research.config import KB_INDEX_TYPE, KB_INDEX_MMAP, KB_RERANK_MODEL, KB_CHUNK_TOKENS, KB_CHUNK_OVERLAP
+from deep_research.progress_bus import progress_bus, DebouncedWriter
+from deep_research.report_writer import (
+    ReportWriter, load_report, REPORT_MARKDOWN_FILE, REPORT_HTML_FILE, REPORT_CONTENT_FILE
+)
+from deep_research.job_queue import job_queue, QueueFullError
+from deep_research.embedding_service import configure_embedding_cache, get_embedding_service
+from LLMapi_service.llm_cache import configure_cache, get_cache
+from LLMapi_service.metrics import metrics, set_metric_tags
+from LLMapi_service.logger import get_logger, configure_logging
+
+logger = get_logger("deep_research.web_app")
+# 进度更新日志量大，按 LOG_SAMPLE_RATES 采样输出
+progress_logger = get_logger("deep_research.progress")
 
 # 初始化Flask应用
 app = Flask(__name__, 
@@ -38,6 +50,83 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 限制上传文件大小
 
 # 存储后台运行的研究任务
 research_tasks = {}
+# 状态页为每个实时输出保留的最大字符数
+LIVE_OUTPUT_CHARS = 2000
+# 每个运行中任务的 task_info.json 合并写入器
+task_writers = {}
+
+def save_task_info(task_id, task_info, final=False):
+    """发布任务状态到进度总线，并合并写入 task_info.json
+    
+    Args:
+        task_id: 任务ID
+        task_info: 任务状态
+        final: 是否为最终状态，最终状态立即落盘并关闭事件频道
+    """
+    # 附上该任务的LLM调用汇总（调用数、令牌数、耗时，按阶段和模型细分）
+    usage = metrics.task_summary(task_id)
+    if usage:
+        task_info['llm_usage'] = usage
+    snapshot = dict(task_info)
+    progress_bus.publish(task_id, 'status', snapshot)
+    
+    writer = task_writers.get(task_id)
+    if writer is None:
+        writer = task_writers.setdefault(
+            task_id, DebouncedWriter(os.path.join(task_info['output_dir'], 'task_info.json'))
+        )
+    # 实时输出只在内存中保留，不写入文件
+    writer.write({key: value for key, value in snapshot.items() if key != 'streams'})
+    
+    if final:
+        writer.flush()
+        task_writers.pop(task_id, None)
+        progress_bus.close(task_id)
+        metrics.forget_task(task_id)
+
+def load_task_info(task_id):
+    """获取任务状态，内存中没有时从结果目录的 task_info.json 加载
+    
+    Returns:
+        任务状态，找不到时返回空字典
+    """
+    task_info = research_tasks.get(task_id, {})
+    if task_info:
+        return task_info
+    
+    try:
+        # 查找可能的结果目录
+        for dirname in os.listdir(app.config['RESULTS_FOLDER']):
+            if dirname.startswith(task_id):
+                task_info_path = os.path.join(app.config['RESULTS_FOLDER'], dirname, 'task_info.json')
+                if os.path.exists(task_info_path):
+                    with open(task_info_path, 'r', encoding='utf-8') as f:
+                        task_info = json.load(f)
+                    # 将任务信息加入内存中
+                    research_tasks[task_id] = task_info
+                    break
+    except Exception as e:
+        logger.warning(f"读取任务信息文件失败: {e}")
+    
+    return task_info
+
+def update_queue_positions(positions):
+    """任务队列变化时更新排队任务的位置并推送给状态页"""
+    for task_id, position in positions.items():
+        task_info = research_tasks.get(task_id)
+        if task_info and task_info.get('status') == 'queued' and task_info.get('queue_position') != position:
+            task_info['queue_position'] = position
+            task_info['message'] = f'排队中，前面还有 {position - 1} 个任务'
+            save_task_info(task_id, task_info)
+
+job_queue.add_listener(update_queue_positions)
+
+def format_sse(event_type, data, event_id=None):
+    """格式化一条 Server-Sent Events 消息"""
+    message = f"event: {event_type}\n"
+    if event_id is not None:
+        message = f"id: {event_id}\n" + message
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 @app.route('/')
 def index():
@@ -64,6 +153,9 @@ def submit_query():
     query = request.form.get('query', '')
     model = request.form.get('model', 'deepseek-chat')
     max_depth = int(request.form.get('max_depth', '3'))  # 获取用户设置的研究深度
+    # 提交者标识，用于在多个用户之间公平调度；由服务端根据来源地址确定，不接受表单传入，
+    # 网页提交的任务都使用默认优先级，避免客户端自行抬高优先级或冒充其他用户
+    user = request.remote_addr or ''
     
     if not query:
         return render_template('index.html', error="请输入研究查询")
@@ -83,35 +175,32 @@ def submit_query():
         'model': model,
         'max_depth': max_depth,  # 存储研究深度
         'output_dir': output_dir,
-        'status': 'running',
+        'status': 'queued',
         'start_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         'progress': 0,
-        'message': '正在初始化研究...',
-        'detail': {'stage': 'initialization'}
+        'message': '排队中...',
+        'detail': {'stage': 'initialization'},
+        'queue_position': None
     }
     
     # 保存到全局研究任务字典
     research_tasks[task_id] = task_info
     
-    # 保存初始任务信息到文件
-    with open(os.path.join(output_dir, 'task_info.json'), 'w', encoding='utf-8') as f:
-        json.dump(task_info, f, ensure_ascii=False, indent=2)
-    
-    print(f"创建新任务: {task_id}, 查询: {query}, 模型: {model}, 深度: {max_depth}")
+    # 加入任务队列，由共享的后台事件循环按优先级和用户公平调度执行
+    try:
+        job_queue.submit(
+            task_id,
+            lambda: start_research_task(task_id, query, model, output_dir, max_depth),
+            user=user
+        )
+    except QueueFullError as e:
+        research_tasks.pop(task_id, None)
+        return render_template('index.html', error=str(e))
     
-    # 在新线程中运行异步任务
-    def run_async_task():
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            loop.run_until_complete(start_research_task(task_id, query, model, output_dir, max_depth))
-        finally:
-            loop.close()
+    # 保存初始任务信息到文件
+    save_task_info(task_id, task_info)
     
-    # 启动线程
-    thread = threading.Thread(target=run_async_task)
-    thread.daemon = True
-    thread.start()
+    logger.info(f"创建新任务: {task_id}, 查询: {query}, 模型: {model}, 深度: {max_depth}, 排队位置: {task_info['queue_position']}")
     
     # 重定向到研究状态页面
     return redirect(url_for('research_status', task_id=task_id))
@@ -124,72 +213,146 @@ def research_status(task_id):
 
 @app.route('/api/task_status/<task_id>', methods=['GET'])
 def get_task_status(task_id):
-    """API端点，返回任务状态的JSON数据"""
-    # 先从全局字典获取
-    task_info = research_tasks.get(task_id, {})
-    
-    # 如果没有找到，尝试从文件加载
-    if not task_info:
-        try:
-            # 查找可能的结果目录
-            for dirname in os.listdir(app.config['RESULTS_FOLDER']):
-                if dirname.startswith(task_id):
-                    output_dir = os.path.join(app.config['RESULTS_FOLDER'], dirname)
-                    task_info_path = os.path.join(output_dir, 'task_info.json')
-                    if os.path.exists(task_info_path):
-                        with open(task_info_path, 'r', encoding='utf-8') as f:
-                            task_info = json.load(f)
-                            # 将任务信息加入内存中
-                            research_tasks[task_id] = task_info
-                            break
-        except Exception as e:
-            print(f"读取任务信息文件失败: {e}")
-            pass
+    """API端点，返回任务状态的JSON数据，不支持事件流的客户端使用该端点轮询"""
+    task_info = load_task_info(task_id)
     
     # 如果仍未找到，返回空状态
     if not task_info:
-        print(f"警告: 未找到任务 {task_id} 的状态信息")
+        logger.warning(f"未找到任务 {task_id} 的状态信息")
         return jsonify({"status": "unknown", "error": "找不到任务信息"})
     
-    print(f"返回任务 {task_id} 的状态: {task_info.get('status')}, 进度: {task_info.get('progress')}%")
+    if task_info.get('status') == 'queued':
+        task_info = dict(task_info, queue_position=job_queue.position(task_id))
     return jsonify(task_info)
 
+@app.route('/api/cancel/<task_id>', methods=['POST'])
+def cancel_task(task_id):
+    """API端点，取消排队中或运行中的研究任务"""
+    task_info = research_tasks.get(task_id)
+    if not task_info or not job_queue.cancel(task_id):
+        return jsonify({"cancelled": False, "error": "任务不存在或已结束"}), 404
+    
+    # 排队中的任务直接标记为已取消，运行中的任务在收到 CancelledError 后自行更新状态
+    if task_info.get('status') == 'queued':
+        task_info['status'] = 'cancelled'
+        task_info['message'] = '研究已取消'
+        task_info['queue_position'] = None
+        save_task_info(task_id, task_info, final=True)
+    return jsonify({"cancelled": True})
+
+@app.route('/api/embedding_stats', methods=['GET'])
+def get_embedding_stats():
+    """API端点，返回共享嵌入服务的批处理和缓存统计"""
+    return jsonify(get_embedding_service(DEFAULT_EMBEDDING_MODEL).get_statistics())
+
+@app.route('/api/queue_stats', methods=['GET'])
+def get_queue_stats():
+    """API端点，返回研究任务队列的统计信息"""
+    return jsonify(job_queue.get_statistics())
+
+@app.route('/api/task_events/<task_id>', methods=['GET'])
+def get_task_events(task_id):
+    """SSE端点，推送任务的状态更新和实时输出
+    
+    连接时先发送一次完整状态（status 事件），之后推送进度总线上的新事件；
+    断线重连时浏览器会带上 Last-Event-ID，从环形缓冲区补发错过的事件
+    """
+    task_info = load_task_info(task_id)
+    if not task_info:
+        return jsonify({"status": "unknown", "error": "找不到任务信息"}), 404
+    
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    
+    def generate():
+        last_id = last_event_id
+        finished = task_info.get('status') in ('completed', 'failed', 'cancelled')
+        if last_id is None or finished:
+            # 先记录编号再取快照，快照之后的事件都不会漏掉
+            last_id = progress_bus.latest_id(task_id)
+            yield format_sse('status', dict(research_tasks.get(task_id, task_info)), last_id)
+        if finished:
+            return
+        
+        for event in progress_bus.subscribe(task_id, last_id):
+            if event is None:
+                # 心跳，防止代理或浏览器断开空闲连接
+                yield ": keepalive\n\n"
+            elif event['type'] == 'reset':
+                # 错过的事件已被挤出缓冲区，重新发送完整状态
+                yield format_sse('status', dict(research_tasks.get(task_id, task_info)), event['id'])
+            else:
+                yield format_sse(event['type'], event['data'], event['id'])
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/cache_stats', methods=['GET'])
+def get_cache_stats():
+    """API端点，返回LLM响应缓存的命中统计"""
+    cache = get_cache()
+    if cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **cache.get_statistics()})
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 格式的LLM调用指标：按模型和阶段统计的调用数、令牌数、费用和耗时分布"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/result/<task_id>')
 def show_result(task_id):
     """显示研究结果页面"""
     task_info = research_tasks.get(task_id, {})
-    
-    if not task_info or task_info.get('status') != 'completed':
+    if not task_info:
         return redirect(url_for('research_status', task_id=task_id))
     
-    # 读取研究结果
+    # 根据报告索引和章节记录读取报告；任务未完成时只要已有章节完成，就显示部分报告
     output_dir = task_info.get('output_dir', '')
-    result_path = os.path.join(output_dir, 'research_content.json')
-    
-    try:
-        with open(result_path, 'r', encoding='utf-8') as f:
-            result = json.load(f)
-    except Exception as e:
-        result = {"error": f"读取结果失败: {str(e)}"}
+    result = load_report(output_dir)
+    partial = task_info.get('status') != 'completed'
+    if partial and (result is None or not result.get('completed')):
+        return redirect(url_for('research_status', task_id=task_id))
+    if result is None:
+        # 没有报告索引的早期结果只有完整内容文件
+        try:
+            with open(os.path.join(output_dir, REPORT_CONTENT_FILE), 'r', encoding='utf-8') as f:
+                result = json.load(f)
+        except Exception as e:
+            result = {"error": f"读取结果失败: {str(e)}"}
     
     # 获取HTML报告路径
-    html_report_path = os.path.join(output_dir, 'research_report.html')
+    html_report_path = os.path.join(output_dir, REPORT_HTML_FILE)
     html_report_url = None
     if os.path.exists(html_report_path):
-        html_report_url = f"/download/{task_id}/research_report.html"
+        html_report_url = f"/download/{task_id}/{REPORT_HTML_FILE}"
     
     # 获取Markdown报告路径
-    md_report_path = os.path.join(output_dir, 'research_report.md')
+    md_report_path = os.path.join(output_dir, REPORT_MARKDOWN_FILE)
     md_report_url = None
     if os.path.exists(md_report_path):
-        md_report_url = f"/download/{task_id}/research_report.md"
+        md_report_url = f"/download/{task_id}/{REPORT_MARKDOWN_FILE}"
     
     return render_template('result.html', 
                          task_id=task_id, 
                          task_info=task_info,
                          result=result,
                          html_report_url=html_report_url,
-                         md_report_url=md_report_url)
+                         md_report_url=md_report_url,
+                         partial=partial)
+
+@app.route('/api/report/<task_id>', methods=['GET'])
+def get_report(task_id):
+    """API端点，返回已生成的报告内容，报告生成过程中只包含已完成的章节"""
+    task_info = research_tasks.get(task_id, {})
+    if not task_info:
+        return jsonify({"error": "任务不存在"}), 404
+    report = load_report(task_info.get('output_dir', ''))
+    if report is None:
+        return jsonify({"error": "报告尚未开始生成"}), 404
+    return jsonify(report)
 
 @app.route('/download/<task_id>/<filename>')
 def download_file(task_id, filename):
@@ -206,30 +369,38 @@ async def start_research_task(task_id, query, model, output_dir, max_depth=3):
     # 获取已初始化的任务信息
     task_info = research_tasks.get(task_id, {})
     if not task_info:
-        print(f"错误: 任务 {task_id} 不存在")
+        logger.error(f"任务 {task_id} 不存在")
         return
     
-    print(f"开始后台研究任务: {task_id}")
-    print(f"研究深度: {max_depth}")
+    logger.info(f"开始后台研究任务: {task_id}")
+    logger.info(f"研究深度: {max_depth}")
+    # 该任务中的所有LLM调用都记到这个任务下，标签随子任务和线程池调用向下传递
+    set_metric_tags(task_id=task_id)
     
     # 更新任务状态
     task_info['status'] = 'running'
+    task_info['queue_position'] = None
     task_info['message'] = '正在准备研究环境...'
     task_info['progress'] = 5
     task_info['detail'] = {'stage': 'preparation'}
     
     # 保存任务状态
-    with open(os.path.join(output_dir, 'task_info.json'), 'w', encoding='utf-8') as f:
-        json.dump(task_info, f, ensure_ascii=False, indent=2)
+    save_task_info(task_id, task_info)
     
+    kb = None
     try:
         # 初始化知识库
         kb_path = os.path.join(output_dir, "knowledge_base.json")
-        kb = KnowledgeBase(storage_path=kb_path)
+        # 加载向量存储（首次使用时还要加载嵌入模型）较慢，放到线程池中执行，避免阻塞共享事件循环中的其他任务
+        kb = await asyncio.to_thread(
+            KnowledgeBase, storage_path=kb_path, index_type=KB_INDEX_TYPE, mmap=KB_INDEX_MMAP,
+            rerank_model=KB_RERANK_MODEL, chunk_tokens=KB_CHUNK_TOKENS, chunk_overlap=KB_CHUNK_OVERLAP
+        )
         
         # 创建研究Agent并设置进度回调
         agent = DeepResearchAgent(model=model, max_recursion_depth=max_depth)
-        agent.knowledge_base = kb.entries
+        # 研究节点通过向量索引检索知识库，并把各自的结果写回索引
+        agent.knowledge_base = kb
         
         # 设置进度回调函数
         def update_progress(progress_data):
@@ -240,74 +411,122 @@ async def start_research_task(task_id, query, model, output_dir, max_depth=3):
             if 'detail' in progress_data:
                 task_info['detail'] = progress_data.get('detail', {})
             
-            # 保存任务状态
-            with open(os.path.join(output_dir, 'task_info.json'), 'w', encoding='utf-8') as f:
-                json.dump(task_info, f, ensure_ascii=False, indent=2)
+            # 推送并保存任务状态，文件写入会被合并
+            save_task_info(task_id, task_info)
             
-            print(f"任务 {task_id} 进度更新: {task_info['progress']}%, {task_info['message']}")
+            progress_logger.info(f"任务 {task_id} 进度更新: {task_info['progress']}%, {task_info['message']}")
         
         agent.set_progress_callback(update_progress)
         
+        # 设置流式输出回调：增量推送到进度总线，内存中的任务状态保留每个输出的末尾部分，
+        # 供新连接的状态页和轮询客户端使用
+        def update_stream(event):
+            streams = dict(task_info.get('streams', {}))
+            if event['done']:
+                streams.pop(event['id'], None)
+            else:
+                streams[event['id']] = {'label': event['label'], 'text': event['text'][-LIVE_OUTPUT_CHARS:]}
+            # 整体替换字典，避免请求线程序列化时字典被修改
+            task_info['streams'] = streams
+            progress_bus.publish(task_id, 'stream', {
+                'id': event['id'],
+                'label': event['label'],
+                'delta': event['delta'],
+                'done': event['done']
+            })
+        
+        agent.set_stream_callback(update_stream)
+        # 报告章节生成后立即写入输出目录，结果页可以显示未完成或中途失败的报告
+        agent.set_report_writer(ReportWriter(output_dir))
+        
         # 执行研究
         results = await agent.research(query)
         
+        # 所有任务共享同一个事件循环，文件写入放到线程池中执行，避免阻塞其他任务的流式输出和进度推送
         # 保存原始研究结果
-        with open(os.path.join(output_dir, "raw_results.json"), "w", encoding="utf-8") as f:
-            json.dump(results["raw_results"], f, ensure_ascii=False, indent=2)
-        
-        # 使用输出整理器格式化结果
-        organizer = OutputOrganizer(model=model)
+        await asyncio.to_thread(save_raw_results, output_dir, results["raw_results"])
         
-        # 保存不同格式的结果
-        # Markdown
-        markdown = organizer.format_as_markdown(results["content"])
-        with open(os.path.join(output_dir, "research_report.md"), "w", encoding="utf-8") as f:
-            f.write(markdown)
+        # 保存研究树的链路追踪（Chrome trace-event 和 OpenTelemetry 格式）
+        trace_paths = await asyncio.to_thread(agent.tracer.save, output_dir)
+        trace_summary = agent.tracer.summary()
+        logger.info(f"链路追踪已保存至: {trace_paths['chrome']}，总耗时 {trace_summary['wall_ms'] / 1000:.1f}s，"
+              f"LLM 平均并行度 {trace_summary['parallelism']}")
         
-        # HTML
-        html = organizer.format_as_html(results["content"])
-        with open(os.path.join(output_dir, "research_report.html"), "w", encoding="utf-8") as f:
-            f.write(html)
+        # Markdown、HTML 和 JSON 报告已在生成过程中逐章节写出
         
-        # JSON
-        with open(os.path.join(output_dir, "research_content.json"), "w", encoding="utf-8") as f:
-            json.dump(results["content"], f, ensure_ascii=False, indent=2)
-        
-        # 更新任务状态为完成
+        # 更新任务状态为完成，生成失败的章节在状态中单独列出
+        failed_sections = results.get("failed_sections", [])
         task_info['status'] = 'completed'
         task_info['progress'] = 100
-        task_info['message'] = '研究完成'
-        task_info['detail'] = {'stage': 'completed'}
+        task_info['message'] = f'研究完成，{len(failed_sections)} 个章节生成失败' if failed_sections else '研究完成'
+        task_info['detail'] = {'stage': 'completed', 'failed_sections': failed_sections}
+        task_info['streams'] = {}
         task_info['completion_time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
         # 保存最终任务状态
-        with open(os.path.join(output_dir, 'task_info.json'), 'w', encoding='utf-8') as f:
-            json.dump(task_info, f, ensure_ascii=False, indent=2)
+        save_task_info(task_id, task_info, final=True)
+        
+        logger.info(f"研究任务 {task_id} 已完成")
         
-        print(f"研究任务 {task_id} 已完成")
+    except asyncio.CancelledError:
+        # 用户取消了任务
+        task_info['status'] = 'cancelled'
+        task_info['message'] = '研究已取消'
+        task_info['streams'] = {}
+        save_task_info(task_id, task_info, final=True)
+        logger.info(f"研究任务 {task_id} 已取消")
+        raise
         
     except Exception as e:
         # 更新任务状态为失败
         task_info['status'] = 'failed'
         task_info['message'] = f'研究失败: {str(e)}'
         task_info['detail'] = {'stage': 'error', 'error': str(e)}
+        task_info['streams'] = {}
         
-        # 保存错误信息
-        error_file = os.path.join(output_dir, "error_log.txt")
-        with open(error_file, "w", encoding="utf-8") as f:
-            f.write(f"研究问题: {query}\n")
-            f.write(f"错误信息: {str(e)}\n")
-            f.write(f"详细堆栈:\n{traceback.format_exc()}")
+        # 保存错误信息，堆栈需在 except 块中取得
+        await asyncio.to_thread(save_error_log, output_dir, query, e, traceback.format_exc())
         
         # 保存任务状态
-        with open(os.path.join(output_dir, 'task_info.json'), 'w', encoding='utf-8') as f:
-            json.dump(task_info, f, ensure_ascii=False, indent=2)
+        save_task_info(task_id, task_info, final=True)
         
-        print(f"研究任务 {task_id} 失败: {e}")
-        traceback.print_exc()
+        logger.exception(f"研究任务 {task_id} 失败: {e}")
+    
+    finally:
+        # 保存知识库的向量索引快照，任务失败或取消时同样保留已写入的条目
+        if kb is not None:
+            try:
+                await asyncio.to_thread(kb.flush)
+            except Exception as e:
+                logger.warning(f"保存知识库快照失败: {e}")
+
+def save_raw_results(output_dir, raw_results):
+    """保存原始研究结果"""
+    with open(os.path.join(output_dir, "raw_results.json"), "w", encoding="utf-8") as f:
+        json.dump(raw_results, f, ensure_ascii=False, indent=2)
+
+def save_error_log(output_dir, query, error, stack):
+    """保存研究任务的错误信息和堆栈"""
+    with open(os.path.join(output_dir, "error_log.txt"), "w", encoding="utf-8") as f:
+        f.write(f"研究问题: {query}\n")
+        f.write(f"错误信息: {str(error)}\n")
+        f.write(f"详细堆栈:\n{stack}")
+
+def configure_caches():
+    """启用磁盘缓存，在应用启动时调用，导入本模块（如测试）不会创建缓存文件"""
+    # 启用LLM响应缓存，重复或相近的研究可直接复用已有的模型输出
+    if get_cache() is None:
+        configure_cache(db_path=os.path.join(RESULTS_FOLDER, 'llm_cache.sqlite'))
+    
+    # 启用向量缓存，所有任务共享，同一段文本只嵌入一次
+    if not os.environ.get('EMBEDDING_CACHE_PATH'):
+        configure_embedding_cache(db_path=os.path.join(RESULTS_FOLDER, 'embedding_cache.sqlite'))
 
 def run_app(host='0.0.0.0', port=5000, debug=True):
     """运行Flask应用"""
+    # 已由启动脚本配置日志时不重复配置
+    configure_logging()
+    configure_caches()
     # 禁用重载器以避免Windows上的套接字问题
     app.run(host=host, port=port, debug=debug, use_reloader=False)
 
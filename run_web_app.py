@@ -4,25 +4,20 @@
 
 import os
 import sys
-import logging
 import traceback
 from datetime import datetime
 
+from LLMapi_service.logger import configure_logging, get_logger
+
 # 配置日志
 log_dir = "logs"
 os.makedirs(log_dir, exist_ok=True)
 log_file = os.path.join(log_dir, f"webapp_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file, encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+# 日志经队列由后台线程写入控制台和文件，级别由环境变量 LOG_LEVEL 设置
+configure_logging(log_file=log_file)
 
-logger = logging.getLogger("deep_research")
+logger = get_logger("deep_research")
 
 if __name__ == "__main__":
     try: